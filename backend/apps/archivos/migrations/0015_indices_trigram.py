@@ -0,0 +1,45 @@
+"""
+Índices GIN con pg_trgm para la búsqueda tradicional de envíos y productos.
+
+Los filtros de búsqueda (BaseRepository._filtro_busqueda: columna ILIKE '%termino%'
+sobre la columna sin transformar) y el ordenamiento por similitud usan estos índices
+en lugar de un recorrido secuencial. Solo PostgreSQL.
+"""
+
+from django.db import migrations
+
+
+INDICES_TRIGRAM = [
+    ('envio_hawb_trgm', 'envio', 'hawb'),
+    ('envio_estado_trgm', 'envio', 'estado'),
+    ('producto_descripcion_trgm', 'producto', 'descripcion'),
+    ('producto_categoria_trgm', 'producto', 'categoria'),
+]
+
+
+def crear_indices_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    for nombre, tabla, columna in INDICES_TRIGRAM:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} USING gin ({columna} gin_trgm_ops);"
+        )
+
+
+def eliminar_indices_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre, _, _ in INDICES_TRIGRAM:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {nombre};")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0014_add_softdelete_to_envio'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_trigram, eliminar_indices_trigram),
+    ]
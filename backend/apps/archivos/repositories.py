@@ -3,7 +3,8 @@ Repositorios para la app de archivos
 Implementa el patrón Repository para acceso a datos de envíos, productos y tarifas
 """
 from typing import Optional, List, Dict, Any
-from django.db.models import QuerySet, Q, Sum, Count
+from django.db.models import QuerySet, Sum, Count
+from django.db.models.functions import Upper
 from django.db import models
 from datetime import datetime
 
@@ -34,6 +35,10 @@ class EnvioRepository(BaseRepository):
     def prefetch_related_fields(self) -> List[str]:
         return ['productos']
     
+    @property
+    def campos_busqueda(self) -> List[str]:
+        return ['hawb', 'comprador__nombre', 'estado']
+    
     # ==================== CONSULTAS ESPECÍFICAS ====================
     
     def obtener_por_id(self, id: int) -> Envio:
@@ -144,6 +149,17 @@ class EnvioRepository(BaseRepository):
     
     # ==================== VALIDACIONES ====================
     
+    def ids_con_hawb(self, envios_ids: List[int], hawbs: List[str]) -> set:
+        """IDs de envios_ids cuyo HAWB es exactamente uno de hawbs (sin distinguir mayúsculas)"""
+        if not envios_ids or not hawbs:
+            return set()
+        return set(
+            self.model.objects
+            .annotate(hawb_mayusculas=Upper('hawb'))
+            .filter(id__in=envios_ids, hawb_mayusculas__in=[hawb.upper() for hawb in hawbs])
+            .values_list('id', flat=True)
+        )
+    
     def existe_hawb(self, hawb: str, excluir_id: int = None) -> bool:
         """Verifica si existe un envío con ese HAWB"""
         queryset = self.model.objects.filter(hawb=hawb)
@@ -161,11 +177,7 @@ class EnvioRepository(BaseRepository):
             termino: Término de búsqueda
             usuario: Usuario para filtrar por permisos
         """
-        queryset = self._get_optimized_queryset().filter(
-            Q(hawb__icontains=termino) |
-            Q(comprador__nombre__icontains=termino) |
-            Q(estado__icontains=termino)
-        )
+        queryset = self._get_optimized_queryset().filter(self._filtro_busqueda(termino))
         
         if usuario and usuario.es_comprador:
             queryset = queryset.filter(comprador=usuario)
@@ -247,6 +259,10 @@ class ProductoRepository(BaseRepository):
     def select_related_fields(self) -> List[str]:
         return ['envio', 'envio__comprador']
     
+    @property
+    def campos_busqueda(self) -> List[str]:
+        return ['descripcion', 'categoria', 'envio__hawb']
+    
     # ==================== CONSULTAS ESPECÍFICAS ====================
     
     def obtener_por_id(self, id: int) -> Producto:
@@ -294,11 +310,7 @@ class ProductoRepository(BaseRepository):
     
     def buscar(self, termino: str, usuario=None) -> QuerySet:
         """Busca productos por descripción, categoría o HAWB del envío"""
-        queryset = self._get_optimized_queryset().filter(
-            Q(descripcion__icontains=termino) |
-            Q(categoria__icontains=termino) |
-            Q(envio__hawb__icontains=termino)
-        )
+        queryset = self._get_optimized_queryset().filter(self._filtro_busqueda(termino))
         
         if usuario and usuario.es_comprador:
             queryset = queryset.filter(envio__comprador=usuario)
@@ -239,13 +239,8 @@ class EnvioService(BaseService):
             daemon=True
         ).start()
         
-        # Generar o actualizar embedding cuando cambia el estado
-        # Forzar regeneración para asegurar que el embedding refleje el estado actual del envío
-        threading.Thread(
-            target=EnvioService._generar_embedding_async,
-            args=(envio_id, True),  # forzar_regeneracion=True
-            daemon=True
-        ).start()
+        # El estado no forma parte del texto indexado (se filtra en la búsqueda),
+        # por lo que el embedding no se regenera al cambiar de estado
         
         # Logging asíncrono (fuera de la transacción)
         threading.Thread(
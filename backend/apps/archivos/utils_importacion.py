@@ -1091,34 +1091,32 @@ class ProcesadorExcel:
     
     def _generar_embeddings_batch(self, envios: List[Envio]):
         """
-        Genera embeddings para múltiples envíos de forma más eficiente.
-        Esto es más rápido que generar uno por uno porque permite mejor manejo de errores
-        y no bloquea el proceso principal.
+        Genera embeddings para múltiples envíos enviando varios textos por
+        solicitud a OpenAI y guardando cada lote con bulk_create/bulk_update.
         """
-        from apps.busqueda.utils_embeddings import generar_embedding_envio
+        from apps.busqueda.semantic.embedding_service import EmbeddingService
         
         total = len(envios)
-        exitosos = 0
-        errores = 0
-        
         logger.info(f"Generando embeddings para {total} envíos...")
         
-        for i, envio in enumerate(envios, 1):
-            try:
-                generar_embedding_envio(envio)
-                exitosos += 1
-                
-                # Mostrar progreso cada 10 envíos
-                if i % 10 == 0:
-                    logger.info(f"Progreso embeddings: {i}/{total} ({exitosos} exitosos, {errores} errores)")
-                    
-            except Exception as e:
-                errores += 1
-                logger.error(f"Error generando embedding para envío {envio.hawb}: {str(e)}")
-                # Continuar con el siguiente envío
-                continue
+        try:
+            resultado = EmbeddingService.generar_embeddings_envios_lote(
+                envios,
+                tipo_proceso='masivo',
+                callback_progreso=lambda e: logger.info(
+                    f"Progreso embeddings: {e['procesados'] + e['errores'] + e['omitidos']}/{total} "
+                    f"({e['procesados']} exitosos, {e['errores']} errores)"
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error generando embeddings de la importación: {str(e)}")
+            return
         
-        logger.info(f"Embeddings generados: {exitosos} exitosos, {errores} errores de {total} total")
+        logger.info(
+            f"Embeddings generados: {resultado['procesados']} exitosos, "
+            f"{resultado['errores']} errores de {total} total "
+            f"en {resultado['solicitudes']} solicitudes"
+        )
     
     def _generar_hawb_secuencial(self) -> str:
         """Genera el próximo HAWB en secuencia basado en la base de datos"""
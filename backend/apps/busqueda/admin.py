@@ -3,7 +3,8 @@ from .models import (
     BusquedaTradicional,
     EmbeddingBusqueda,
     HistorialSemantica,
-    EnvioEmbedding
+    EnvioEmbedding,
+    EnvioEmbeddingGrande
 )
 
 
@@ -117,3 +118,8 @@ class EnvioEmbeddingAdmin(admin.ModelAdmin):
             'description': 'Vector de embedding serializado (JSON)'
         }),
     )
+
+
+@admin.register(EnvioEmbeddingGrande)
+class EnvioEmbeddingGrandeAdmin(EnvioEmbeddingAdmin):
+    """Admin para embeddings de 3072 dimensiones (text-embedding-3-large)"""
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BusquedaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.busqueda'
+
+    def ready(self):
+        """Importa signals cuando la app está lista"""
+        import apps.busqueda.signals  # noqa
@@ -0,0 +1,123 @@
+"""
+Comando para calcular EnvioEmbedding.cosine_similarity_avg (similitud coseno promedio
+de cada embedding con los demás del mismo modelo).
+No construye la matriz n×n: dos pasadas por bloques sobre los vectores normalizados
+(ver semantic/similitud_promedio.py) y un bulk_update por bloque.
+Uso:
+  python manage.py calcular_similitud_promedio
+  python manage.py calcular_similitud_promedio --bloque 8192
+  python manage.py calcular_similitud_promedio --verificar 200
+"""
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.busqueda.repositories import embedding_repository
+from apps.busqueda.semantic import EmbeddingService
+from apps.busqueda.semantic.similitud_promedio import (
+    FILAS_POR_BLOQUE,
+    bloques_normalizados,
+    acumular_suma,
+    similitud_promedio,
+    similitud_promedio_exacta,
+)
+
+
+class Command(BaseCommand):
+    help = 'Calcula cosine_similarity_avg de los embeddings de envíos por bloques (sin matriz n×n)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding. Por defecto el configurado en settings.'
+        )
+        parser.add_argument(
+            '--bloque',
+            type=int,
+            default=FILAS_POR_BLOQUE,
+            help=f'Filas por bloque; acota la memoria usada (default: {FILAS_POR_BLOQUE})'
+        )
+        parser.add_argument(
+            '--verificar',
+            type=int,
+            default=0,
+            metavar='N',
+            help='Comparar N filas al azar con el promedio por fuerza bruta (producto matriz-matriz por bloques)'
+        )
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=42,
+            help='Semilla de la muestra de --verificar (default: 42)'
+        )
+
+    def handle(self, *args, **options):
+        modelo = EmbeddingService.validar_modelo(options['modelo']) if options['modelo'] else EmbeddingService.get_modelo_default()
+        if not embedding_repository.soporta_similitud_promedio(modelo):
+            raise CommandError(f'La tabla de embeddings de {modelo} no tiene cosine_similarity_avg')
+        bloque = max(1, options['bloque'])
+
+        tiempo_inicio = time.perf_counter()
+        suma, total = acumular_suma(
+            bloques_normalizados(embedding_repository.iterar_vectores(modelo), bloque)
+        )
+        if not total:
+            raise CommandError(
+                f"No hay embeddings para {modelo}. Ejecute 'python manage.py generar_embeddings --modelo {modelo}'."
+            )
+
+        ids, valores = [], []
+        for ids_bloque, matriz in bloques_normalizados(
+            embedding_repository.iterar_vectores(modelo, campo_id='id'), bloque
+        ):
+            promedios = similitud_promedio(matriz, suma, total)
+            embedding_repository.guardar_similitud_promedio(modelo, zip(ids_bloque.tolist(), promedios.tolist()))
+            ids.append(ids_bloque)
+            valores.append(promedios)
+        ids, valores = np.concatenate(ids), np.concatenate(valores)
+        tiempo_ms = (time.perf_counter() - tiempo_inicio) * 1000
+
+        self._imprimir_resumen(modelo, valores, tiempo_ms)
+        if options['verificar']:
+            self._verificar(modelo, ids, valores, total, options)
+
+    def _imprimir_resumen(self, modelo, valores, tiempo_ms):
+        media, desviacion = float(valores.mean()), float(valores.std())
+        p1, p5, p50, p95, p99 = np.percentile(valores, [1, 5, 50, 95, 99])
+        self.stdout.write(self.style.SUCCESS(
+            f'{modelo}: {len(valores)} embeddings actualizados en {tiempo_ms:.0f}ms'
+        ))
+        self.stdout.write(
+            f'cosine_similarity_avg: media {media:.4f}, desviación {desviacion:.4f} | '
+            f'p1 {p1:.4f}, p5 {p5:.4f}, p50 {p50:.4f}, p95 {p95:.4f}, p99 {p99:.4f}'
+        )
+        # Señal de calidad de datos: muy por debajo de la media, textos atípicos;
+        # muy por encima, textos genéricos o casi duplicados
+        self.stdout.write(
+            f'Atípicos (< media - 3σ): {int((valores < media - 3 * desviacion).sum())} | '
+            f'Genéricos (> media + 3σ): {int((valores > media + 3 * desviacion).sum())}'
+        )
+
+    def _verificar(self, modelo, ids, valores, total, options):
+        rng = np.random.default_rng(options['semilla'])
+        posiciones = rng.choice(len(ids), min(options['verificar'], len(ids)), replace=False)
+        elegidos = set(ids[posiciones].tolist())
+        vectores = {
+            pk: vector for pk, vector in embedding_repository.iterar_vectores(modelo, campo_id='id')
+            if pk in elegidos
+        }
+        _, muestra = next(bloques_normalizados(
+            ((pk, vectores[pk]) for pk in ids[posiciones].tolist()), len(posiciones)
+        ))
+        exactos = similitud_promedio_exacta(
+            muestra,
+            bloques_normalizados(embedding_repository.iterar_vectores(modelo), max(1, options['bloque'])),
+            total
+        )
+        error = float(np.abs(exactos - valores[posiciones]).max())
+        estilo = self.style.SUCCESS if error < 1e-4 else self.style.ERROR
+        self.stdout.write(estilo(
+            f'Verificado con {len(posiciones)} filas por fuerza bruta: error absoluto máximo {error:.2e}'
+        ))
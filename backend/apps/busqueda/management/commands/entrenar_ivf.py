@@ -0,0 +1,164 @@
+"""
+Comando para entrenar los centroides IVF del índice vectorial en memoria.
+Entrena k-means sobre los embeddings de envíos activos y guarda los centroides en
+SEMANTIC_IVF_DIR/ivf_<modelo>.npz; los workers los cargan en su próxima sincronización.
+Uso:
+  python manage.py entrenar_ivf
+  python manage.py entrenar_ivf --listas 256 --muestra 50000
+  python manage.py entrenar_ivf --incremental
+  python manage.py entrenar_ivf --evaluar
+"""
+from datetime import datetime
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+try:
+    import sklearn  # noqa: F401
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+from apps.busqueda.repositories import embedding_repository
+from apps.busqueda.semantic import EmbeddingService
+from apps.busqueda.semantic.ivf import (
+    cargar_centroides,
+    guardar_centroides,
+    entrenar_centroides,
+    actualizar_centroides,
+)
+from apps.busqueda.semantic.registro_modelos import RegistroModelos
+from apps.busqueda.semantic.vector_index import IndiceVectorial
+
+
+class Command(BaseCommand):
+    help = 'Entrena (o actualiza incrementalmente) los centroides IVF del índice vectorial'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding. Por defecto el configurado en settings.'
+        )
+        parser.add_argument(
+            '--listas',
+            type=int,
+            default=None,
+            help='Cantidad de listas (centroides). Por defecto 4 * raíz cuadrada de los envíos.'
+        )
+        parser.add_argument(
+            '--muestra',
+            type=int,
+            default=100000,
+            help='Máximo de vectores usados para entrenar k-means (default: 100000)'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Actualizar los centroides existentes con los embeddings generados desde el último entrenamiento'
+        )
+        parser.add_argument(
+            '--evaluar',
+            action='store_true',
+            help='Mostrar recall@10 y latencia para distintos valores de nprobe'
+        )
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=42,
+            help='Semilla de k-means y de la muestra (default: 42)'
+        )
+
+    def handle(self, *args, **options):
+        modelo = EmbeddingService.validar_modelo(options['modelo']) if options['modelo'] else EmbeddingService.get_modelo_default()
+        self.stdout.write(self.style.SUCCESS(f'Usando modelo: {modelo}'))
+        inicio = timezone.now()
+
+        if options['incremental']:
+            centroides, conteos, nuevos = self._incremental(modelo)
+            self.stdout.write(f'Vectores nuevos incorporados: {nuevos}')
+        else:
+            centroides, conteos = self._entrenar(modelo, options)
+
+        ruta = guardar_centroides(modelo, centroides, conteos, fecha_entrenamiento=inicio)
+        self.stdout.write(self.style.SUCCESS(f'Centroides guardados en {ruta}'))
+        self.stdout.write(
+            f'Listas: {len(conteos)} | envíos por lista: mín {int(conteos.min())}, '
+            f'media {conteos.mean():.1f}, máx {int(conteos.max())} | vacías: {int((conteos == 0).sum())}'
+        )
+
+        if options['evaluar']:
+            self._evaluar(modelo, centroides, options['semilla'])
+
+    def _entrenar(self, modelo, options):
+        if not SKLEARN_AVAILABLE:
+            raise CommandError('scikit-learn no está instalado. Instálalo con: pip install scikit-learn')
+
+        vectores = self._vectores(modelo)
+        listas = options['listas'] or max(1, int(4 * np.sqrt(vectores.shape[0])))
+        if vectores.shape[0] < listas:
+            raise CommandError(f'Hay {vectores.shape[0]} embeddings de {modelo}: se necesitan al menos {listas}')
+
+        self.stdout.write(self.style.NOTICE(
+            f'Entrenando k-means: {vectores.shape[0]} vectores, {listas} listas, muestra {options["muestra"]}...'
+        ))
+        tiempo_inicio = time.perf_counter()
+        centroides, conteos = entrenar_centroides(
+            vectores, listas, muestra=options['muestra'], semilla=options['semilla']
+        )
+        self.stdout.write(f'Entrenamiento: {time.perf_counter() - tiempo_inicio:.1f}s')
+        return centroides, conteos
+
+    def _incremental(self, modelo):
+        datos = cargar_centroides(modelo)
+        if datos is None:
+            raise CommandError(f'No hay centroides para {modelo}. Entrene primero sin --incremental.')
+
+        desde = datetime.fromisoformat(datos['fecha_entrenamiento'])
+        vectores = self._vectores(modelo, desde=desde, requeridos=False)
+        centroides, conteos = actualizar_centroides(datos['centroides'], datos['conteos'], vectores)
+        return centroides, conteos, len(vectores)
+
+    @staticmethod
+    def _vectores(modelo, desde=None, requeridos=True) -> np.ndarray:
+        vectores = [vector for _, vector in embedding_repository.iterar_vectores(modelo, desde=desde)]
+        if not vectores:
+            if requeridos:
+                raise CommandError(
+                    f"No hay embeddings para {modelo}. Ejecute 'python manage.py generar_embeddings --modelo {modelo}'."
+                )
+            return np.empty((0, RegistroModelos.dimensiones(modelo)), dtype=np.float32)
+        return np.stack([np.asarray(vector, dtype=np.float32) for vector in vectores])
+
+    def _evaluar(self, modelo, centroides, semilla, consultas=50, k=10):
+        """Recall@k frente a la búsqueda exhaustiva, usando envíos del corpus como consultas"""
+        pares = list(embedding_repository.iterar_vectores(modelo))
+        indice = IndiceVectorial(modelo, RegistroModelos.dimensiones(modelo))
+        indice.construir(pares, total=len(pares))
+        rng = np.random.default_rng(semilla)
+        muestra = [pares[i][1] for i in rng.choice(len(pares), min(consultas, len(pares)), replace=False)]
+        exactos = [{e for e, _ in indice.buscar(v, k=k)} for v in muestra]
+
+        indice.configurar_ivf(centroides)
+        listas = centroides.shape[0]
+        self.stdout.write('\n' + '-' * 60)
+        self.stdout.write(f"{'nprobe':<10} {'Recall@10':<12} {'Media ms':<12} {'% filas':<10}")
+        self.stdout.write('-' * 60)
+        nprobe = 1
+        while True:
+            nprobe = min(nprobe, listas)
+            recalls = []
+            tiempo_inicio = time.perf_counter()
+            for vector, exacto in zip(muestra, exactos):
+                encontrados = {e for e, _ in indice.buscar(vector, k=k, nprobe=nprobe)}
+                recalls.append(len(encontrados & exacto) / len(exacto))
+            media_ms = (time.perf_counter() - tiempo_inicio) * 1000 / len(muestra)
+            self.stdout.write(
+                f'{nprobe:<10} {np.mean(recalls):<12.4f} {media_ms:<12.3f} {nprobe / listas * 100:<10.1f}'
+            )
+            if nprobe == listas:
+                break
+            nprobe *= 2
+        self.stdout.write('-' * 60)
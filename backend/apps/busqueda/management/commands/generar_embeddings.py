@@ -6,7 +6,6 @@ Uso: python manage.py generar_embeddings [--regenerar] [--limite N] [--modelo MO
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from apps.archivos.models import Envio
-from apps.busqueda.models import EnvioEmbedding
 from apps.busqueda.semantic.embedding_service import EmbeddingService
 from apps.busqueda.repositories import embedding_repository
 import time
@@ -62,12 +61,12 @@ class Command(BaseCommand):
                 self.style.WARNING('Modo regenerar activado: se recrearán todos los embeddings')
             )
             # Eliminar embeddings existentes para este modelo
-            EnvioEmbedding.objects.filter(modelo_usado=modelo).delete()
+            embedding_repository.tabla(modelo).objects.filter(modelo_usado=modelo).delete()
             self.stdout.write(self.style.SUCCESS(f'Embeddings existentes para {modelo} eliminados'))
             envios = Envio.objects.all()
         else:
             # Solo procesar envíos sin embedding para este modelo específico
-            envios_con_embedding = EnvioEmbedding.objects.filter(
+            envios_con_embedding = embedding_repository.tabla(modelo).objects.filter(
                 modelo_usado=modelo
             ).values_list('envio_id', flat=True)
             envios = Envio.objects.exclude(id__in=envios_con_embedding)
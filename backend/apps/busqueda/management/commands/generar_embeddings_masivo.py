@@ -2,10 +2,9 @@
 Comando para generar embeddings de todos los envíos existentes de forma masiva
 """
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import Count
 from apps.archivos.models import Envio
-from apps.busqueda.models import EnvioEmbedding
-from apps.busqueda.utils_embeddings import generar_embedding_envio
+from apps.busqueda.repositories import embedding_repository
+from apps.busqueda.semantic.embedding_service import EmbeddingService
 from django.conf import settings
 import time
 
@@ -40,14 +39,21 @@ class Command(BaseCommand):
         parser.add_argument(
             '--batch-size',
             type=int,
-            default=50,
-            help='Tamaño de lote para procesamiento (por defecto 50)',
+            default=None,
+            help='Máximo de envíos por solicitud a OpenAI (por defecto EMBEDDING_BATCH_MAX_INPUTS)',
         )
         parser.add_argument(
-            '--delay',
-            type=float,
-            default=0.1,
-            help='Retraso en segundos entre cada embedding (para evitar rate limits)',
+            '--max-tokens',
+            type=int,
+            default=None,
+            help='Presupuesto de tokens por solicitud (por defecto EMBEDDING_BATCH_MAX_TOKENS)',
+        )
+        parser.add_argument(
+            '--concurrencia',
+            type=int,
+            default=None,
+            help='Solicitudes simultáneas a OpenAI (por defecto EMBEDDING_CONCURRENCIA); '
+                 'el ritmo lo regulan OPENAI_EMBEDDING_RPM y OPENAI_EMBEDDING_TPM',
         )
 
     def handle(self, *args, **options):
@@ -55,29 +61,29 @@ class Command(BaseCommand):
         modelo = options['modelo'] or getattr(settings, 'OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
         limite = options['limite']
         hawb_especifico = options['hawb']
-        batch_size = options['batch_size']
-        delay = options['delay']
+        batch_size = options['batch_size'] or getattr(settings, 'EMBEDDING_BATCH_MAX_INPUTS', 500)
+        max_tokens = options['max_tokens'] or getattr(settings, 'EMBEDDING_BATCH_MAX_TOKENS', 100000)
+        concurrencia = options['concurrencia'] or getattr(settings, 'EMBEDDING_CONCURRENCIA', 4)
 
         self.stdout.write(self.style.SUCCESS(f'=== Generación de Embeddings ==='))
         self.stdout.write(f'Modelo: {modelo}')
         self.stdout.write(f'Forzar regeneración: {"Sí" if forzar else "No"}')
-        self.stdout.write(f'Batch size: {batch_size}')
-        self.stdout.write(f'Delay: {delay}s')
+        self.stdout.write(f'Envíos por solicitud: {batch_size} (máx. {max_tokens} tokens)')
+        self.stdout.write(f'Concurrencia: {concurrencia} solicitudes')
         self.stdout.write('')
 
         # Obtener envíos a procesar
         if hawb_especifico:
-            try:
-                envios = Envio.objects.filter(hawb=hawb_especifico).select_related('comprador').prefetch_related('productos')
-                self.stdout.write(f'Procesando envío específico: {hawb_especifico}')
-            except Envio.DoesNotExist:
+            envios = Envio.objects.filter(hawb=hawb_especifico)
+            if not envios.exists():
                 raise CommandError(f'No se encontró el envío con HAWB: {hawb_especifico}')
+            self.stdout.write(f'Procesando envío específico: {hawb_especifico}')
         else:
-            envios = Envio.objects.all().select_related('comprador').prefetch_related('productos')
+            envios = Envio.objects.all()
             
             if not forzar:
                 # Excluir envíos que ya tienen embedding con este modelo
-                envios_con_embedding = EnvioEmbedding.objects.filter(
+                envios_con_embedding = embedding_repository.tabla(modelo).objects.filter(
                     modelo_usado=modelo
                 ).values_list('envio_id', flat=True)
                 envios = envios.exclude(id__in=envios_con_embedding)
@@ -93,54 +99,33 @@ class Command(BaseCommand):
 
         self.stdout.write(f'Total de envíos a procesar: {total_envios}\n')
 
-        # Estadísticas
-        exitosos = 0
-        errores = 0
-        omitidos = 0
-        costo_total = 0.0
         tiempo_inicio = time.time()
 
-        # Procesar en lotes
-        for i, envio in enumerate(envios, 1):
-            try:
-                # Verificar si ya existe (solo si no se fuerza)
-                if not forzar:
-                    if EnvioEmbedding.objects.filter(envio=envio, modelo_usado=modelo).exists():
-                        omitidos += 1
-                        self.stdout.write(f'  [{i}/{total_envios}] [OMITIDO] {envio.hawb} (ya existe)')
-                        continue
-
-                # Generar embedding
-                envio_embedding = generar_embedding_envio(envio, modelo=modelo, forzar_regeneracion=forzar)
-                
-                exitosos += 1
-                self.stdout.write(
-                    self.style.SUCCESS(f'  [{i}/{total_envios}] [OK] Generado: {envio.hawb}')
-                )
-
-                # Pausa para evitar rate limits de OpenAI
-                if delay > 0 and i < total_envios:
-                    time.sleep(delay)
-
-                # Mostrar progreso cada batch_size envíos
-                if i % batch_size == 0:
-                    tiempo_transcurrido = time.time() - tiempo_inicio
-                    promedio_por_envio = tiempo_transcurrido / i
-                    tiempo_restante = promedio_por_envio * (total_envios - i)
-                    
-                    self.stdout.write(
-                        f'\n[PROGRESO] {i}/{total_envios} ({(i/total_envios)*100:.1f}%)'
-                    )
-                    self.stdout.write(
-                        f'   Tiempo restante estimado: {tiempo_restante/60:.1f} minutos\n'
-                    )
-
-            except Exception as e:
-                errores += 1
-                self.stdout.write(
-                    self.style.ERROR(f'  [{i}/{total_envios}] [ERROR] {envio.hawb}: {str(e)}')
-                )
-                # Continuar con el siguiente envío
+        def mostrar_progreso(estadisticas):
+            completados = estadisticas['procesados'] + estadisticas['errores'] + estadisticas['omitidos']
+            tiempo_transcurrido = time.time() - tiempo_inicio
+            tiempo_restante = tiempo_transcurrido / completados * (total_envios - completados) if completados else 0
+            self.stdout.write(
+                f'[PROGRESO] {completados}/{total_envios} ({(completados/total_envios)*100:.1f}%) - '
+                f'{estadisticas["envios_por_segundo"]} envíos/s, '
+                f'{estadisticas["tokens_por_segundo"]} tokens/s, '
+                f'${estadisticas["costo_acumulado"]:.6f}, '
+                f'errores: {estadisticas["errores"]}, 429: {estadisticas["reintentos_429"]}, '
+                f'restante estimado: {tiempo_restante/60:.1f} min'
+            )
+
+        # Varios envíos por solicitud y varias solicitudes en vuelo;
+        # cada lote se guarda con bulk_create/bulk_update
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            envios,
+            modelo=modelo,
+            forzar_regeneracion=forzar,
+            tipo_proceso='manual',
+            max_tokens=max_tokens,
+            max_inputs=batch_size,
+            concurrencia=concurrencia,
+            callback_progreso=mostrar_progreso
+        )
 
         # Resumen final
         tiempo_total = time.time() - tiempo_inicio
@@ -148,16 +133,23 @@ class Command(BaseCommand):
         self.stdout.write('\n' + '='*60)
         self.stdout.write(self.style.SUCCESS('=== Resumen de Generación ==='))
         self.stdout.write(f'Total procesados: {total_envios}')
-        self.stdout.write(self.style.SUCCESS(f'[OK] Exitosos: {exitosos}'))
-        if omitidos > 0:
-            self.stdout.write(self.style.WARNING(f'[OMITIDOS] {omitidos}'))
-        if errores > 0:
-            self.stdout.write(self.style.ERROR(f'[ERRORES] {errores}'))
+        self.stdout.write(self.style.SUCCESS(f'[OK] Exitosos: {resultado["procesados"]}'))
+        if resultado['omitidos'] > 0:
+            self.stdout.write(self.style.WARNING(f'[OMITIDOS] {resultado["omitidos"]} (sin cambios de contenido)'))
+        if resultado['reutilizados'] > 0:
+            self.stdout.write(f'[REUTILIZADOS] {resultado["reutilizados"]} (vector de un texto idéntico)')
+        if resultado['errores'] > 0:
+            self.stdout.write(self.style.ERROR(f'[ERRORES] {resultado["errores"]}'))
+        self.stdout.write(
+            f'Solicitudes a OpenAI: {resultado["solicitudes"]} (reintentos por 429: {resultado["reintentos_429"]}, '
+            f'por fallas transitorias: {resultado["reintentos_transitorios"]})'
+        )
+        self.stdout.write(f'Throughput: {resultado["envios_por_segundo"]} envíos/s, {resultado["tokens_por_segundo"]} tokens/s')
+        self.stdout.write(f'Tokens: {resultado["tokens_total"]} (costo: ${resultado["costo_total"]:.6f})')
         self.stdout.write(f'Tiempo total: {tiempo_total/60:.2f} minutos')
-        self.stdout.write(f'Promedio por envio: {tiempo_total/total_envios:.2f} segundos')
+        self.stdout.write(f'Promedio por envio: {tiempo_total/total_envios:.3f} segundos')
         
         # Mostrar estadísticas finales
-        total_embeddings = EnvioEmbedding.objects.filter(modelo_usado=modelo).count()
+        total_embeddings = embedding_repository.contar_embeddings(modelo)
         self.stdout.write(f'\nTotal de embeddings en BD (modelo {modelo}): {total_embeddings}')
         self.stdout.write('='*60)
-
@@ -0,0 +1,80 @@
+"""
+Comando para crear (o quitar) el índice HNSW sobre embedding_vector::halfvec de un modelo.
+El índice guarda los vectores en float16: ocupa la mitad de memoria que el HNSW float32
+y la búsqueda ANN pasa a ordenar por esa expresión; el re-ranking sigue en float32.
+Requiere PostgreSQL con pgvector >= 0.7.0.
+Uso:
+  python manage.py indice_ann_halfvec
+  python manage.py indice_ann_halfvec --eliminar-float32
+  python manage.py indice_ann_halfvec --revertir
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.busqueda.semantic import EmbeddingService
+from apps.busqueda.semantic.registro_modelos import RegistroModelos
+
+
+class Command(BaseCommand):
+    help = 'Crea el índice HNSW halfvec (float16) de la tabla de embeddings de un modelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding. Por defecto el configurado en settings.'
+        )
+        parser.add_argument(
+            '--eliminar-float32',
+            action='store_true',
+            help='Eliminar los índices ANN float32 de la tabla después de crear el halfvec'
+        )
+        parser.add_argument(
+            '--revertir',
+            action='store_true',
+            help='Eliminar el índice halfvec (la búsqueda ANN vuelve al índice float32 si existe)'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('El índice halfvec requiere PostgreSQL con pgvector')
+
+        modelo = EmbeddingService.validar_modelo(options['modelo']) if options['modelo'] else EmbeddingService.get_modelo_default()
+        info = RegistroModelos.info(modelo)
+        if info['halfvec']:
+            self.stdout.write(self.style.SUCCESS(f'{modelo} ya usa un índice halfvec (migración 0016)'))
+            return
+
+        tabla = info['tabla']._meta.db_table
+        indice = info['indice_halfvec']
+
+        with connection.cursor() as cursor:
+            if options['revertir']:
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {indice}')
+                RegistroModelos.invalidar()
+                self.stdout.write(self.style.SUCCESS(f'Índice {indice} eliminado'))
+                return
+
+            cursor.execute("SELECT 1 FROM pg_type WHERE typname = 'halfvec'")
+            if cursor.fetchone() is None:
+                raise CommandError('pgvector no soporta halfvec (se requiere >= 0.7.0)')
+
+            self.stdout.write(self.style.NOTICE(f'Creando {indice} sobre {tabla}...'))
+            cursor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {indice} ON {tabla} '
+                f'USING hnsw ((embedding_vector::halfvec({info["dimensiones"]})) halfvec_cosine_ops) '
+                f'WITH (m = 16, ef_construction = 64)'
+            )
+
+            if options['eliminar_float32']:
+                for nombre in info['indices_ann']:
+                    if nombre != indice:
+                        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {nombre}')
+                self.stdout.write(self.style.WARNING('Índices ANN float32 eliminados'))
+
+            cursor.execute('SELECT pg_size_pretty(pg_relation_size(%s::regclass))', [indice])
+            tamano = cursor.fetchone()[0]
+
+        RegistroModelos.invalidar()
+        self.stdout.write(self.style.SUCCESS(f'Índice {indice} listo ({tamano})'))
@@ -0,0 +1,150 @@
+"""
+Comando para medir la memoria (RSS, PSS, USS) del maestro y los workers de gunicorn.
+PSS reparte cada página compartida entre los procesos que la usan: la suma de PSS es
+la memoria real del servidor, mientras que la suma de RSS cuenta varias veces las
+páginas compartidas copy-on-write (índice precargado con SEMANTIC_PRELOAD o snapshot mapeado).
+Uso:
+  python manage.py memoria_workers --guardar sin_precarga.json
+  (reiniciar gunicorn con SEMANTIC_PRELOAD=True)
+  python manage.py memoria_workers --comparar sin_precarga.json
+  python manage.py memoria_workers --pid 1234
+"""
+import json
+import os
+import sys
+import psutil
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = 'Mide RSS/PSS/USS del maestro y los workers de gunicorn (antes y después de la precarga)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pid',
+            type=int,
+            default=None,
+            help='PID del maestro de gunicorn. Por defecto se busca el proceso gunicorn sin padre gunicorn.'
+        )
+        parser.add_argument(
+            '--guardar',
+            type=str,
+            metavar='ARCHIVO',
+            help='Guardar la medición en JSON (para compararla después)'
+        )
+        parser.add_argument(
+            '--comparar',
+            type=str,
+            metavar='ARCHIVO',
+            help='Comparar con una medición guardada con --guardar'
+        )
+
+    def handle(self, *args, **options):
+        if not sys.platform.startswith('linux'):
+            raise CommandError('PSS y USS solo están disponibles en Linux (/proc/<pid>/smaps)')
+
+        maestro = psutil.Process(options['pid']) if options['pid'] else self._buscar_maestro()
+        medicion = {
+            'fecha': timezone.now().isoformat(),
+            'precarga': self._precarga(maestro),
+            'procesos': [self._medir(maestro, 'maestro')] + [
+                self._medir(worker, 'worker') for worker in maestro.children()
+            ],
+        }
+        medicion['totales'] = self._totales(medicion['procesos'])
+        self._imprimir(medicion)
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as f:
+                self._imprimir_comparacion(json.load(f), medicion)
+
+        if options['guardar']:
+            with open(options['guardar'], 'w', encoding='utf-8') as f:
+                json.dump(medicion, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"\nMedición guardada en: {options['guardar']}"))
+
+    @staticmethod
+    def _buscar_maestro() -> psutil.Process:
+        for proceso in psutil.process_iter(['pid', 'cmdline']):
+            cmdline = ' '.join(proceso.info['cmdline'] or [])
+            if 'gunicorn' not in cmdline:
+                continue
+            padre = proceso.parent()
+            if padre is None or 'gunicorn' not in ' '.join(padre.cmdline()):
+                return proceso
+        raise CommandError('No se encontró un proceso gunicorn. Indique el PID del maestro con --pid.')
+
+    @staticmethod
+    def _precarga(maestro: psutil.Process) -> bool:
+        """SEMANTIC_PRELOAD del entorno del maestro (o del propio si no se puede leer)"""
+        try:
+            entorno = maestro.environ()
+        except psutil.AccessDenied:
+            entorno = os.environ
+        return entorno.get('SEMANTIC_PRELOAD', 'False').lower() == 'true'
+
+    @staticmethod
+    def _medir(proceso: psutil.Process, rol: str) -> dict:
+        try:
+            memoria = proceso.memory_full_info()
+        except psutil.AccessDenied:
+            raise CommandError(f'Sin permisos para leer la memoria del proceso {proceso.pid} (ejecute como su usuario)')
+        return {
+            'pid': proceso.pid,
+            'rol': rol,
+            'rss_mb': round(memoria.rss / MB, 1),
+            'pss_mb': round(memoria.pss / MB, 1),
+            'uss_mb': round(memoria.uss / MB, 1),
+            'compartida_mb': round((memoria.rss - memoria.uss) / MB, 1),
+        }
+
+    @staticmethod
+    def _totales(procesos) -> dict:
+        workers = [p for p in procesos if p['rol'] == 'worker']
+        return {
+            'workers': len(workers),
+            'pss_medio_worker_mb': round(sum(p['pss_mb'] for p in workers) / len(workers), 1) if workers else 0,
+            **{
+                clave: round(sum(p[clave] for p in procesos), 1)
+                for clave in ('rss_mb', 'pss_mb', 'uss_mb')
+            },
+        }
+
+    def _imprimir(self, medicion):
+        self.stdout.write('\n' + '=' * 80)
+        self.stdout.write(self.style.SUCCESS(
+            f"  MEMORIA DE GUNICORN ({'con' if medicion['precarga'] else 'sin'} SEMANTIC_PRELOAD)"
+        ))
+        self.stdout.write('  RSS cuenta las páginas compartidas en cada proceso; PSS las reparte; USS es solo privada')
+        self.stdout.write('=' * 80 + '\n')
+        self.stdout.write(f"{'PID':<10} {'Rol':<10} {'RSS MB':<10} {'PSS MB':<10} {'USS MB':<10} {'Compartida MB':<14}")
+        self.stdout.write('-' * 80)
+        for p in medicion['procesos']:
+            self.stdout.write(
+                f"{p['pid']:<10} {p['rol']:<10} {p['rss_mb']:<10} {p['pss_mb']:<10} "
+                f"{p['uss_mb']:<10} {p['compartida_mb']:<14}"
+            )
+        totales = medicion['totales']
+        self.stdout.write('-' * 80)
+        self.stdout.write(
+            f"{'Total':<10} {totales['workers']:<10} {totales['rss_mb']:<10} "
+            f"{totales['pss_mb']:<10} {totales['uss_mb']:<10}"
+        )
+        self.stdout.write('=' * 80)
+
+    def _imprimir_comparacion(self, antes, despues):
+        self.stdout.write('\n' + self.style.NOTICE(
+            f"Comparación con {antes['fecha']} ({'con' if antes['precarga'] else 'sin'} precarga):"
+        ))
+        for clave, etiqueta in (('rss_mb', 'RSS'), ('pss_mb', 'PSS'), ('uss_mb', 'USS')):
+            diferencia = despues['totales'][clave] - antes['totales'][clave]
+            self.stdout.write(
+                f"  {etiqueta} total: {antes['totales'][clave]} -> {despues['totales'][clave]} MB ({diferencia:+.1f})"
+            )
+        self.stdout.write(
+            f"  PSS medio por worker: {antes['totales']['pss_medio_worker_mb']} -> "
+            f"{despues['totales']['pss_medio_worker_mb']} MB"
+        )
@@ -161,18 +161,20 @@ class Command(BaseCommand):
             
             # Realizar búsqueda con límite mayor para tener más datos para comparar
             limite_busqueda = limite * 2 if comparar else limite
-            resultado = BusquedaSemanticaService.buscar(
-                consulta=consulta,
+            # Búsqueda por lotes (sin caché de rankings ni historial), como las demás suites
+            lote = BusquedaSemanticaService.buscar_lote(
+                consultas=[consulta],
                 usuario=usuario,
                 limite=limite_busqueda,
                 modelo_embedding='text-embedding-3-small',
                 metrica_ordenamiento=metrica_servicio
             )
+            resultado = lote['resultados'][0]
             
             resultados_raw = resultado.get('resultados', [])
             total_encontrados = resultado.get('totalEncontrados', 0)
-            tiempo_respuesta = resultado.get('tiempoRespuesta', 0)
-            costo_consulta = resultado.get('costoConsulta', 0)
+            tiempo_respuesta = lote.get('tiempoRespuesta', 0)
+            costo_consulta = lote.get('costoConsulta', 0)
             
             # Mostrar información general
             self.stdout.write(self.style.SUCCESS(f'[OK] Busqueda completada'))
@@ -1,6 +1,7 @@
 """
 Comando para probar las 10 consultas de ejemplo del usuario
-Verifica que el sistema de búsqueda semántica responda correctamente
+Verifica que el sistema de búsqueda semántica responda correctamente.
+Las consultas se ejecutan juntas con la búsqueda por lotes (buscar_lote).
 """
 
 from django.core.management.base import BaseCommand
@@ -86,9 +87,23 @@ class Command(BaseCommand):
         self.stdout.write('='*80 + '\n')
         
         resultados_totales = []
-        tiempo_total = 0
         
-        for i, consulta in enumerate(self.CONSULTAS_PRUEBA, 1):
+        # Todas las consultas en una búsqueda por lotes: embeddings en una llamada a
+        # OpenAI y ranking matriz-matriz; el tiempo por consulta es el del lote repartido
+        try:
+            tiempo_inicio = time.time()
+            lote = BusquedaSemanticaService.buscar_lote(
+                consultas=self.CONSULTAS_PRUEBA,
+                usuario=usuario,
+                limite=limite
+            )
+            tiempo_total = (time.time() - tiempo_inicio) * 1000
+            resultados_lote = lote['resultados']
+            error_lote = None
+        except Exception as e:
+            lote, tiempo_total, resultados_lote, error_lote = None, 0, [None] * len(self.CONSULTAS_PRUEBA), e
+        
+        for i, (consulta, resultado) in enumerate(zip(self.CONSULTAS_PRUEBA, resultados_lote), 1):
             self.stdout.write(f'\n{"-"*80}')
             self.stdout.write(self.style.WARNING(f'📝 CONSULTA {i}/9'))
             self.stdout.write(f'{"-"*80}')
@@ -107,21 +122,15 @@ class Command(BaseCommand):
                     self.stdout.write(f'  • Contexto: {", ".join(expansion["contexto_adicional"])}')
                 self.stdout.write('')
             
-            # Ejecutar búsqueda
+            # Resultado de la consulta en el lote
             try:
-                tiempo_inicio = time.time()
-                resultado = BusquedaSemanticaService.buscar(
-                    consulta=consulta,
-                    usuario=usuario,
-                    limite=limite
-                )
-                tiempo_busqueda = (time.time() - tiempo_inicio) * 1000
-                tiempo_total += tiempo_busqueda
+                if error_lote is not None:
+                    raise error_lote
+                tiempo_busqueda = tiempo_total / len(self.CONSULTAS_PRUEBA)
                 
                 # Mostrar resumen
                 total_encontrados = resultado['totalEncontrados']
-                modelo = resultado['modeloUtilizado']
-                costo = resultado['costoConsulta']
+                modelo = lote['modeloUtilizado']
                 
                 if total_encontrados > 0:
                     self.stdout.write(
@@ -132,9 +141,8 @@ class Command(BaseCommand):
                         self.style.ERROR(f'❌ Sin resultados')
                     )
                 
-                self.stdout.write(f'⏱️  Tiempo: {tiempo_busqueda:.2f}ms')
+                self.stdout.write(f'⏱️  Tiempo (promedio del lote): {tiempo_busqueda:.2f}ms')
                 self.stdout.write(f'🤖 Modelo: {modelo}')
-                self.stdout.write(f'💰 Costo: ${costo:.6f}')
                 
                 # Mostrar resultados
                 if total_encontrados > 0:
@@ -195,6 +203,8 @@ class Command(BaseCommand):
         self.stdout.write(f'📊 Total de resultados encontrados: {total_resultados}')
         self.stdout.write(f'⏱️  Tiempo promedio por consulta: {tiempo_promedio:.2f}ms')
         self.stdout.write(f'⏱️  Tiempo total: {tiempo_total:.2f}ms')
+        if lote is not None:
+            self.stdout.write(f'💰 Costo del lote: ${lote["costoConsulta"]:.6f}')
         
         # Tabla detallada
         self.stdout.write(f'\n{"Consulta":<60} {"Resultados":>10} {"Tiempo (ms)":>12}')
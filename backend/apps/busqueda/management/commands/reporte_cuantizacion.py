@@ -0,0 +1,178 @@
+"""
+Comando para comparar memoria y calidad del índice en memoria según su precisión
+(float32, float16, int8 con escala por fila). Usa las pruebas controladas activas:
+nDCG@10 con las etiquetas de relevancia, antes y después de re-puntuar los candidatos
+con los vectores float32 (como hace la búsqueda semántica).
+Uso:
+  python manage.py reporte_cuantizacion
+  python manage.py reporte_cuantizacion --candidatos 200 --exportar cuantizacion.csv
+"""
+import csv
+import io
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core.exceptions import OpenAINotConfiguredError
+from apps.busqueda.repositories import embedding_repository
+from apps.busqueda.semantic import EmbeddingService, TextProcessor, QueryExpander
+from apps.busqueda.semantic.registro_modelos import RegistroModelos
+from apps.busqueda.semantic.vector_index import IndiceVectorial
+from apps.busqueda.services import CacheEmbeddingsConsulta
+from apps.metricas.repositories import prueba_controlada_repository
+from apps.metricas.utils import calcular_ndcg_k
+
+
+class Command(BaseCommand):
+    help = 'Compara memoria y nDCG@10 del índice en memoria en float32, float16 e int8'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding. Por defecto el configurado en settings.'
+        )
+        parser.add_argument(
+            '--candidatos',
+            type=int,
+            default=200,
+            help='Candidatos del índice que se re-puntúan en float32 (default: 200)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Repeticiones por consulta para medir latencia (default: 5)'
+        )
+        parser.add_argument(
+            '--exportar',
+            type=str,
+            metavar='ARCHIVO',
+            help='Exportar el reporte a CSV'
+        )
+
+    def handle(self, *args, **options):
+        modelo = EmbeddingService.validar_modelo(options['modelo']) if options['modelo'] else EmbeddingService.get_modelo_default()
+
+        pruebas = list(prueba_controlada_repository.obtener_activas())
+        if not pruebas:
+            self.stdout.write(self.style.WARNING('No hay pruebas controladas activas. Cree algunas en el dashboard.'))
+            return
+
+        pares = list(embedding_repository.iterar_vectores(modelo))
+        if not pares:
+            raise CommandError(
+                f"No hay embeddings para {modelo}. Ejecute 'python manage.py generar_embeddings --modelo {modelo}'."
+            )
+
+        try:
+            consultas = [(prueba, self._embedding_consulta(prueba.consulta, modelo)) for prueba in pruebas]
+        except OpenAINotConfiguredError as e:
+            raise CommandError(str(e))
+
+        # Vectores float32 normalizados para el re-ranking exacto
+        vectores = {
+            envio_id: np.asarray(vector, dtype=np.float32) / np.linalg.norm(vector)
+            for envio_id, vector in pares
+            if np.linalg.norm(vector) > 0
+        }
+
+        self.stdout.write(self.style.NOTICE(
+            f'Modelo: {modelo} | envíos indexados: {len(vectores)} | pruebas: {len(consultas)}'
+        ))
+
+        filas = []
+        referencia = None
+        for cuantizacion in IndiceVectorial.CUANTIZACIONES:
+            indice = IndiceVectorial(modelo, RegistroModelos.dimensiones(modelo), cuantizacion=cuantizacion)
+            indice.construir(pares, total=len(pares))
+            fila = self._evaluar(indice, consultas, vectores, options, referencia)
+            if referencia is None:
+                referencia = fila['_tops']
+            filas.append(fila)
+
+        self._imprimir_tabla(filas)
+
+        if options.get('exportar'):
+            self._exportar_csv(filas, options['exportar'])
+            self.stdout.write(self.style.SUCCESS(f"\nReporte exportado a: {options['exportar']}"))
+
+    @staticmethod
+    def _embedding_consulta(consulta: str, modelo: str):
+        """Mismo preprocesamiento que BusquedaSemanticaService (expansión + limpieza)"""
+        expandida = QueryExpander.expandir_consulta(consulta, incluir_filtros_temporales=True)['consulta_expandida']
+        return CacheEmbeddingsConsulta.obtener_embedding(TextProcessor.procesar_texto(expandida), modelo)['embedding']
+
+    @staticmethod
+    def _evaluar(indice, consultas, vectores, options, tops_referencia):
+        """nDCG@10 sin y con re-puntuación float32, recall frente a float32 y latencia"""
+        k = 10
+        latencias = []
+        ndcg_aproximado = []
+        ndcg_reescorado = []
+        recalls = []
+        tops = []
+
+        for i, (prueba, embedding) in enumerate(consultas):
+            for _ in range(max(1, options['repeticiones'])):
+                inicio = time.perf_counter()
+                candidatos = indice.buscar(embedding, k=max(options['candidatos'], k))
+                latencias.append((time.perf_counter() - inicio) * 1000)
+
+            consulta = np.asarray(embedding, dtype=np.float32)
+            consulta = consulta / np.linalg.norm(consulta)
+            ids = np.array([envio_id for envio_id, _ in candidatos], dtype=np.int64)
+            exactos = np.stack([vectores[envio_id] for envio_id in ids]) @ consulta if ids.size else np.empty(0)
+            reescorados = ids[np.argsort(-exactos)][:k].tolist()
+
+            relevantes = prueba.resultados_relevantes or []
+            ndcg_aproximado.append(calcular_ndcg_k([{'envio_id': e} for e in ids[:k].tolist()], relevantes, k=k))
+            ndcg_reescorado.append(calcular_ndcg_k([{'envio_id': e} for e in reescorados], relevantes, k=k))
+            tops.append(reescorados)
+            if tops_referencia is not None and tops_referencia[i]:
+                recalls.append(len(set(reescorados) & set(tops_referencia[i])) / len(tops_referencia[i]))
+
+        return {
+            'cuantizacion': indice.cuantizacion,
+            'memoria_mb': round(indice.memoria_bytes / 1024 / 1024, 2),
+            'bytes_fila': indice.dimensiones * np.dtype(indice.CUANTIZACIONES[indice.cuantizacion]).itemsize,
+            'ndcg_aproximado': float(np.mean(ndcg_aproximado)),
+            'ndcg_reescorado': float(np.mean(ndcg_reescorado)),
+            'recall_vs_float32': float(np.mean(recalls)) if recalls else 1.0,
+            'latencia_media_ms': float(np.mean(latencias)),
+            '_tops': tops,
+        }
+
+    def _imprimir_tabla(self, filas):
+        self.stdout.write('\n' + '=' * 100)
+        self.stdout.write(self.style.SUCCESS('  REPORTE DE CUANTIZACIÓN - MEMORIA VS. nDCG@10'))
+        self.stdout.write('  nDCG@10 con las etiquetas de las pruebas; re-puntuado = candidatos ordenados con vectores float32')
+        self.stdout.write('=' * 100 + '\n')
+        self.stdout.write(
+            f"{'Precisión':<10} {'Memoria MB':<11} {'Bytes/fila':<11} {'nDCG@10':<9} "
+            f"{'nDCG@10 re-puntuado':<20} {'Recall@10':<10} {'Media ms':<10}"
+        )
+        self.stdout.write('-' * 100)
+        for fila in filas:
+            self.stdout.write(
+                f"{fila['cuantizacion']:<10} {fila['memoria_mb']:<11} {fila['bytes_fila']:<11} "
+                f"{fila['ndcg_aproximado']:<9.4f} {fila['ndcg_reescorado']:<20.4f} "
+                f"{fila['recall_vs_float32']:<10.4f} {fila['latencia_media_ms']:<10.3f}"
+            )
+        self.stdout.write('=' * 100 + '\n')
+
+    @staticmethod
+    def _exportar_csv(filas, path):
+        with io.open(path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow([
+                'Precisión', 'Memoria (MB)', 'Bytes por fila', 'nDCG@10', 'nDCG@10 re-puntuado',
+                'Recall@10 vs float32', 'Latencia media (ms)'
+            ])
+            for fila in filas:
+                w.writerow([
+                    fila['cuantizacion'], fila['memoria_mb'], fila['bytes_fila'],
+                    round(fila['ndcg_aproximado'], 4), round(fila['ndcg_reescorado'], 4),
+                    round(fila['recall_vs_float32'], 4), round(fila['latencia_media_ms'], 3)
+                ])
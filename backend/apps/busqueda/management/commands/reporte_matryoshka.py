@@ -0,0 +1,197 @@
+"""
+Comando para medir recall vs. latencia de la búsqueda en dos etapas (Matryoshka).
+Usa las etiquetas de relevancia de las pruebas controladas activas (PruebaControladaSemantica)
+y compara cada configuración (dimensiones reducidas x candidatos re-rankeados) con la
+búsqueda exacta sobre los vectores completos del índice en memoria.
+Uso:
+  python manage.py reporte_matryoshka
+  python manage.py reporte_matryoshka --dimensiones 128,256 --candidatos 200,400 --k 10
+  python manage.py reporte_matryoshka --exportar matryoshka.csv
+"""
+import csv
+import io
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core.exceptions import OpenAINotConfiguredError
+from apps.busqueda.repositories import embedding_repository
+from apps.busqueda.semantic import EmbeddingService, TextProcessor, QueryExpander
+from apps.busqueda.semantic.registro_modelos import RegistroModelos
+from apps.busqueda.semantic.vector_index import IndiceVectorial
+from apps.busqueda.services import CacheEmbeddingsConsulta
+from apps.metricas.repositories import prueba_controlada_repository
+from apps.metricas.utils import calcular_mrr, calcular_ndcg_k
+
+
+def _lista_enteros(valor: str):
+    return [int(v) for v in valor.split(',') if v.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Reporte de recall vs. latencia de la búsqueda en dos etapas (Matryoshka) con las pruebas controladas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding (text-embedding-3-small o text-embedding-3-large). Por defecto el configurado.'
+        )
+        parser.add_argument(
+            '--dimensiones',
+            type=_lista_enteros,
+            default=[64, 128, 256, 512],
+            help='Dimensiones de la pasada gruesa, separadas por coma (default: 64,128,256,512)'
+        )
+        parser.add_argument(
+            '--candidatos',
+            type=_lista_enteros,
+            default=[100, 200, 400],
+            help='Candidatos re-rankeados con el vector completo, separados por coma (default: 100,200,400)'
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=10,
+            help='Resultados por consulta (default: 10)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Repeticiones por consulta para medir latencia (default: 5)'
+        )
+        parser.add_argument(
+            '--exportar',
+            type=str,
+            metavar='ARCHIVO',
+            help='Exportar el reporte a CSV'
+        )
+
+    def handle(self, *args, **options):
+        modelo = EmbeddingService.validar_modelo(options['modelo']) if options['modelo'] else EmbeddingService.get_modelo_default()
+        if not RegistroModelos.info(modelo)['matryoshka']:
+            raise CommandError(f'El modelo {modelo} no admite vectores truncados (Matryoshka)')
+
+        pruebas = list(prueba_controlada_repository.obtener_activas())
+        if not pruebas:
+            self.stdout.write(self.style.WARNING('No hay pruebas controladas activas. Cree algunas en el dashboard.'))
+            return
+
+        pares = list(embedding_repository.iterar_vectores(modelo))
+        if not pares:
+            raise CommandError(
+                f"No hay embeddings para {modelo}. Ejecute 'python manage.py generar_embeddings --modelo {modelo}'."
+            )
+
+        try:
+            consultas = [(prueba, self._embedding_consulta(prueba.consulta, modelo)) for prueba in pruebas]
+        except OpenAINotConfiguredError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.NOTICE(
+            f'Modelo: {modelo} | envíos indexados: {len(pares)} | pruebas: {len(consultas)} | k: {options["k"]}'
+        ))
+
+        dimensiones = RegistroModelos.dimensiones(modelo)
+        exacto = self._construir_indice(modelo, dimensiones, 0, pares)
+        referencia = self._evaluar(exacto, consultas, options, None, None)
+        filas = [referencia]
+
+        for dimensiones_reducidas in options['dimensiones']:
+            if not 0 < dimensiones_reducidas < dimensiones:
+                continue
+            indice = self._construir_indice(modelo, dimensiones, dimensiones_reducidas, pares)
+            for candidatos in options['candidatos']:
+                filas.append(self._evaluar(indice, consultas, options, candidatos, referencia['_tops']))
+
+        self._imprimir_tabla(filas, dimensiones)
+
+        if options.get('exportar'):
+            self._exportar_csv(filas, options['exportar'])
+            self.stdout.write(self.style.SUCCESS(f"\nReporte exportado a: {options['exportar']}"))
+
+    @staticmethod
+    def _embedding_consulta(consulta: str, modelo: str):
+        """Mismo preprocesamiento que BusquedaSemanticaService (expansión + limpieza)"""
+        expandida = QueryExpander.expandir_consulta(consulta, incluir_filtros_temporales=True)['consulta_expandida']
+        return CacheEmbeddingsConsulta.obtener_embedding(TextProcessor.procesar_texto(expandida), modelo)['embedding']
+
+    @staticmethod
+    def _construir_indice(modelo, dimensiones, dimensiones_reducidas, pares) -> IndiceVectorial:
+        indice = IndiceVectorial(modelo, dimensiones, dimensiones_reducidas=dimensiones_reducidas)
+        indice.construir(pares, total=len(pares))
+        return indice
+
+    @staticmethod
+    def _evaluar(indice, consultas, options, candidatos, tops_exactos):
+        """Métricas de una configuración; candidatos=None es la búsqueda exacta"""
+        k = options['k']
+        repeticiones = max(1, options['repeticiones'])
+        latencias = []
+        recalls = []
+        mrrs = []
+        ndcgs = []
+        tops = []
+
+        for i, (prueba, embedding) in enumerate(consultas):
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                resultados = indice.buscar(embedding, k=k, candidatos_reducidos=candidatos)
+                latencias.append((time.perf_counter() - inicio) * 1000)
+
+            ids = [envio_id for envio_id, _ in resultados]
+            tops.append(ids)
+            rankeados = [{'envio_id': envio_id} for envio_id in ids]
+            relevantes = prueba.resultados_relevantes or []
+            mrrs.append(calcular_mrr(rankeados, relevantes))
+            ndcgs.append(calcular_ndcg_k(rankeados, relevantes, k=k))
+            if tops_exactos is not None and tops_exactos[i]:
+                recalls.append(len(set(ids) & set(tops_exactos[i])) / len(tops_exactos[i]))
+
+        return {
+            'configuracion': 'exacta' if candidatos is None else f'{indice.dimensiones_reducidas}d x {candidatos}',
+            'dimensiones_reducidas': indice.dimensiones_reducidas or indice.dimensiones,
+            'candidatos': candidatos,
+            'recall_vs_exacta': float(np.mean(recalls)) if recalls else 1.0,
+            'mrr': float(np.mean(mrrs)),
+            'ndcg': float(np.mean(ndcgs)),
+            'latencia_media_ms': float(np.mean(latencias)),
+            'latencia_p95_ms': float(np.percentile(latencias, 95)),
+            'memoria_mb': round(indice.memoria_bytes / 1024 / 1024, 2),
+            '_tops': tops,
+        }
+
+    def _imprimir_tabla(self, filas, dimensiones):
+        self.stdout.write('\n' + '=' * 100)
+        self.stdout.write(self.style.SUCCESS('  REPORTE MATRYOSHKA - RECALL VS. LATENCIA'))
+        self.stdout.write(f'  Recall respecto a la búsqueda exacta con {dimensiones} dimensiones; MRR y nDCG con las etiquetas de las pruebas')
+        self.stdout.write('=' * 100 + '\n')
+        self.stdout.write(
+            f"{'Configuración':<16} {'Recall@k':<10} {'MRR':<8} {'nDCG@k':<8} "
+            f"{'Media ms':<10} {'P95 ms':<10} {'Bytes/fila':<11} {'Memoria MB':<10}"
+        )
+        self.stdout.write('-' * 100)
+        for fila in filas:
+            self.stdout.write(
+                f"{fila['configuracion']:<16} {fila['recall_vs_exacta']:<10.4f} {fila['mrr']:<8.4f} "
+                f"{fila['ndcg']:<8.4f} {fila['latencia_media_ms']:<10.3f} {fila['latencia_p95_ms']:<10.3f} "
+                f"{fila['dimensiones_reducidas'] * 4:<11} {fila['memoria_mb']:<10}"
+            )
+        self.stdout.write('=' * 100 + '\n')
+
+    @staticmethod
+    def _exportar_csv(filas, path):
+        with io.open(path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow([
+                'Configuración', 'Dimensiones pasada gruesa', 'Candidatos', 'Recall vs exacta',
+                'MRR', 'nDCG@k', 'Latencia media (ms)', 'Latencia P95 (ms)', 'Memoria (MB)'
+            ])
+            for fila in filas:
+                w.writerow([
+                    fila['configuracion'], fila['dimensiones_reducidas'], fila['candidatos'],
+                    round(fila['recall_vs_exacta'], 4), round(fila['mrr'], 4), round(fila['ndcg'], 4),
+                    round(fila['latencia_media_ms'], 3), round(fila['latencia_p95_ms'], 3), fila['memoria_mb']
+                ])
@@ -0,0 +1,145 @@
+"""
+Comando para escribir el snapshot en disco del índice vectorial en memoria.
+Los workers de gunicorn mapean el snapshot (np.memmap, páginas compartidas) en lugar
+de recorrer la tabla de embeddings, y solo reaplican los cambios posteriores a su marca.
+Con --incremental parte del snapshot vigente más los cambios posteriores a su marca
+(sin recorrer la tabla de embeddings) y con --cada se repite en segundo plano, de modo
+que los cambios a reaplicar por cada worker quedan acotados al intervalo.
+Uso:
+  python manage.py snapshot_indice
+  python manage.py snapshot_indice --todos
+  python manage.py snapshot_indice --holgura 0.2 --verificar
+  python manage.py snapshot_indice --todos --incremental --cada 900
+"""
+import os
+import time
+import logging
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.busqueda.semantic import EmbeddingService
+from apps.busqueda.semantic.registro_modelos import RegistroModelos
+from apps.busqueda.semantic.snapshot import guardar_snapshot, cargar_snapshot, directorio_snapshot
+from apps.busqueda.semantic.vector_index import crear_indice, cargar_indice
+
+logger = logging.getLogger('apps.busqueda.semantic')
+
+
+class Command(BaseCommand):
+    help = 'Escribe el snapshot en disco (np.memmap) del índice vectorial de un modelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            type=str,
+            default=None,
+            help='Modelo de embedding. Por defecto el configurado en settings.'
+        )
+        parser.add_argument(
+            '--todos',
+            action='store_true',
+            help='Escribir el snapshot de todos los modelos con embeddings'
+        )
+        parser.add_argument(
+            '--holgura',
+            type=float,
+            default=None,
+            help='Fracción de filas libres para altas posteriores (default: SEMANTIC_SNAPSHOT_HOLGURA)'
+        )
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Cargar el snapshot escrito, comparar con el índice construido desde la BD y medir el arranque'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Partir del snapshot vigente más los cambios posteriores a su marca (desde la BD si no hay uno compatible)'
+        )
+        parser.add_argument(
+            '--cada',
+            type=int,
+            default=None,
+            metavar='SEGUNDOS',
+            help='Repetir indefinidamente con esa pausa entre pasadas (proceso en segundo plano)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['cada']:
+            self._pasada(options)
+            return
+
+        while True:
+            try:
+                self._pasada(options)
+            except Exception as e:
+                # Un fallo puntual (BD o disco) no detiene el refresco periódico
+                logger.warning(f"Snapshot periódico del índice falló: {e}")
+                self.stderr.write(self.style.ERROR(f'Snapshot fallido: {e}'))
+            close_old_connections()
+            time.sleep(options['cada'])
+
+    def _pasada(self, options):
+        if options['todos']:
+            modelos = [modelo for modelo in RegistroModelos.modelos() if RegistroModelos.disponible(modelo)]
+        elif options['modelo']:
+            modelos = [EmbeddingService.validar_modelo(options['modelo'])]
+        else:
+            modelos = [EmbeddingService.get_modelo_default()]
+
+        if not modelos:
+            raise CommandError("No hay embeddings. Ejecute 'python manage.py generar_embeddings'.")
+
+        for modelo in modelos:
+            self._snapshot(modelo, options)
+
+    def _snapshot(self, modelo, options):
+        origen = 'el snapshot vigente y los cambios posteriores' if options['incremental'] else 'la BD'
+        self.stdout.write(self.style.NOTICE(f'Construyendo el índice de {modelo} desde {origen}...'))
+        tiempo_inicio = time.perf_counter()
+        indice = crear_indice(modelo)
+        # Sin snapshot compatible, cargar_indice recorre la tabla completa
+        cargar_indice(indice, usar_snapshot=options['incremental'])
+        tiempo_bd_ms = (time.perf_counter() - tiempo_inicio) * 1000
+        if indice.total_activos == 0:
+            self.stdout.write(self.style.WARNING(f'{modelo}: sin embeddings, no se escribe snapshot'))
+            return
+
+        cabecera = guardar_snapshot(indice, indice.marca_sincronizacion, holgura=options['holgura'])
+        directorio = directorio_snapshot(modelo)
+        tamano = sum(
+            os.path.getsize(os.path.join(directorio, archivo)) for archivo in cabecera['archivos'].values()
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{modelo}: {cabecera['filas']} filas (capacidad {cabecera['capacidad']}), "
+            f"{tamano / 1024 / 1024:.1f}MB en {directorio} | marca {cabecera['marca']}"
+        ))
+
+        if options['verificar']:
+            self._verificar(indice, tiempo_bd_ms)
+
+    def _verificar(self, indice, tiempo_bd_ms, consultas=20, k=10):
+        """Mismo top-k que el índice construido desde la BD y tiempo de arranque de cada camino"""
+        tiempo_inicio = time.perf_counter()
+        restaurado = crear_indice(indice.modelo)
+        if cargar_snapshot(restaurado) is None:
+            raise CommandError('No se pudo cargar el snapshot recién escrito')
+        tiempo_snapshot_ms = (time.perf_counter() - tiempo_inicio) * 1000
+
+        if restaurado.total_activos != indice.total_activos:
+            raise CommandError(
+                f'El snapshot tiene {restaurado.total_activos} filas y el índice {indice.total_activos}'
+            )
+        rng = np.random.default_rng(0)
+        for _ in range(consultas):
+            consulta = rng.standard_normal(indice.dimensiones).astype(np.float32)
+            esperados = [envio_id for envio_id, _ in indice.buscar(consulta, k=k)]
+            obtenidos = [envio_id for envio_id, _ in restaurado.buscar(consulta, k=k)]
+            if esperados != obtenidos:
+                raise CommandError('El top-k del snapshot no coincide con el del índice construido desde la BD')
+
+        self.stdout.write(
+            f'Verificado: {consultas} consultas con el mismo top-{k} | arranque desde la BD {tiempo_bd_ms:.0f}ms, '
+            f'desde el snapshot {tiempo_snapshot_ms:.1f}ms (sin reaplicar cambios)'
+        )
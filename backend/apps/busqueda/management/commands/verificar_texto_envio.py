@@ -309,16 +309,12 @@ class Command(BaseCommand):
             return TextProcessor.procesar_texto(str(valor))
         
         hawb_normalizado = normalizar_para_busqueda(envio.hawb)
-        estado_normalizado = normalizar_para_busqueda(envio.get_estado_display())
         comprador_normalizado = normalizar_para_busqueda(envio.comprador.nombre)
         
+        # Estado, fecha, peso y valor no forman parte del texto: se aplican como filtros
         verificaciones = {
             'HAWB': hawb_normalizado in texto_generado if hawb_normalizado else False,
-            'Estado': estado_normalizado in texto_generado if estado_normalizado else False,
             'Comprador': comprador_normalizado in texto_generado if comprador_normalizado else False,
-            'Peso Total': normalizar_para_busqueda(envio.peso_total) in texto_generado,
-            'Valor Total': normalizar_para_busqueda(envio.valor_total) in texto_generado,
-            'Costo Servicio': normalizar_para_busqueda(envio.costo_servicio) in texto_generado,
             'Cantidad Productos': normalizar_para_busqueda(envio.cantidad_total) in texto_generado,
         }
         
@@ -194,7 +194,7 @@ class Command(BaseCommand):
             
             for emb in queryset:
                 vector = emb.get_vector()
-                if vector and len(vector) > 0:
+                if len(vector) > 0:
                     embeddings_data.append({
                         'vector': vector,
                         'label': f"Envío {emb.envio.hawb}",
@@ -215,7 +215,7 @@ class Command(BaseCommand):
             
             for emb in queryset:
                 vector = emb.get_vector()
-                if vector and len(vector) > 0:
+                if len(vector) > 0:
                     embeddings_data.append({
                         'vector': vector,
                         'label': f"Búsqueda: {emb.consulta[:30]}...",
@@ -0,0 +1,46 @@
+"""
+Índice ANN (approximate nearest neighbor) sobre embedding_envio.embedding_vector.
+
+Permite que la búsqueda semántica ordene por distancia coseno (<=>) directamente
+en PostgreSQL y recorra todo el corpus en lugar de los 1000 envíos más recientes.
+Usa HNSW si la versión de pgvector lo soporta (>= 0.5.0); si no, IVFFlat.
+"""
+
+from django.db import migrations
+
+
+def crear_indice_ann(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_am WHERE amname = 'hnsw') THEN
+                CREATE INDEX IF NOT EXISTS embedding_envio_vector_hnsw_idx
+                ON embedding_envio USING hnsw (embedding_vector vector_cosine_ops)
+                WITH (m = 16, ef_construction = 64);
+            ELSE
+                CREATE INDEX IF NOT EXISTS embedding_envio_vector_ivfflat_idx
+                ON embedding_envio USING ivfflat (embedding_vector vector_cosine_ops)
+                WITH (lists = 100);
+            END IF;
+        END $$;
+    """)
+
+
+def eliminar_indice_ann(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS embedding_envio_vector_hnsw_idx;")
+    schema_editor.execute("DROP INDEX IF EXISTS embedding_envio_vector_ivfflat_idx;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busqueda', '0012_fix_rename_historial_semantica'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice_ann, eliminar_indice_ann),
+    ]
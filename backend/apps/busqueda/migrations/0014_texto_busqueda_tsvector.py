@@ -0,0 +1,69 @@
+"""
+Columna tsvector generada sobre embedding_envio.texto_indexado con índice GIN.
+
+Permite recuperar candidatos léxicos (HAWB, cédulas, nombres de productos) en toda la
+tabla para la búsqueda híbrida (fusión RRF con el top-k vectorial). Usa la configuración
+'spanish' sobre el texto sin tildes: unaccent no es IMMUTABLE, por lo que se envuelve en
+busqueda_unaccent(); si la extensión no está disponible la función devuelve el texto tal cual
+(los textos generados por TextProcessor ya vienen sin tildes).
+"""
+
+from django.db import migrations
+
+
+def crear_texto_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("""
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS unaccent;
+            EXCEPTION WHEN OTHERS THEN
+                RAISE NOTICE 'Extensión unaccent no disponible: %', SQLERRM;
+            END;
+
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'unaccent') THEN
+                EXECUTE $f$
+                    CREATE OR REPLACE FUNCTION busqueda_unaccent(texto text) RETURNS text
+                    AS $b$ SELECT unaccent('unaccent'::regdictionary, texto) $b$
+                    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+                $f$;
+            ELSE
+                EXECUTE $f$
+                    CREATE OR REPLACE FUNCTION busqueda_unaccent(texto text) RETURNS text
+                    AS $b$ SELECT texto $b$
+                    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+                $f$;
+            END IF;
+        END $$;
+    """)
+    schema_editor.execute("""
+        ALTER TABLE embedding_envio ADD COLUMN IF NOT EXISTS texto_busqueda tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('spanish', busqueda_unaccent(coalesce(texto_indexado, '')))
+        ) STORED;
+    """)
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS embedding_envio_texto_busqueda_gin "
+        "ON embedding_envio USING gin (texto_busqueda);"
+    )
+
+
+def eliminar_texto_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS embedding_envio_texto_busqueda_gin;")
+    schema_editor.execute("ALTER TABLE embedding_envio DROP COLUMN IF EXISTS texto_busqueda;")
+    schema_editor.execute("DROP FUNCTION IF EXISTS busqueda_unaccent(text);")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busqueda', '0013_indice_ann_embedding_envio'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_texto_busqueda, eliminar_texto_busqueda),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 13:06
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def calcular_hashes(apps, schema_editor):
+    """Completa hash_contenido de los embeddings existentes a partir de texto_indexado"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE embedding_envio "
+            "SET hash_contenido = encode(sha256(convert_to(texto_indexado, 'UTF8')), 'hex') "
+            "WHERE hash_contenido = '';"
+        )
+        return
+    EnvioEmbedding = apps.get_model('busqueda', 'EnvioEmbedding')
+    pendientes = EnvioEmbedding.objects.filter(hash_contenido='').only('id', 'texto_indexado')
+    for embedding in pendientes.iterator(chunk_size=2000):
+        EnvioEmbedding.objects.filter(id=embedding.id).update(
+            hash_contenido=hashlib.sha256(embedding.texto_indexado.encode('utf-8')).hexdigest()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0015_indices_trigram'),
+        ('busqueda', '0014_texto_busqueda_tsvector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envioembedding',
+            name='hash_contenido',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 del texto indexado', max_length=64, verbose_name='Hash del Contenido'),
+        ),
+        migrations.AddField(
+            model_name='envioembedding',
+            name='version_plantilla',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Versión de TextProcessor.generar_texto_envio usada', verbose_name='Versión de Plantilla'),
+        ),
+        migrations.AddIndex(
+            model_name='envioembedding',
+            index=models.Index(fields=['hash_contenido', 'modelo_usado'], name='embedding_e_hash_co_78ef94_idx'),
+        ),
+        migrations.RunPython(calcular_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-17 13:18
+
+import django.db.models.deletion
+import pgvector.django
+from django.db import migrations, models
+
+
+def crear_indice_ann_grande(apps, schema_editor):
+    """
+    HNSW sobre embedding_vector::halfvec(3072): pgvector no indexa columnas vector de
+    más de 2000 dimensiones, pero sí halfvec hasta 4000 (pgvector >= 0.7.0).
+    Sin soporte de halfvec la tabla queda sin índice ANN y el registro de modelos lo refleja.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'halfvec')
+               AND EXISTS (SELECT 1 FROM pg_am WHERE amname = 'hnsw') THEN
+                CREATE INDEX IF NOT EXISTS embedding_envio_grande_vector_hnsw_idx
+                ON embedding_envio_grande
+                USING hnsw ((embedding_vector::halfvec(3072)) halfvec_cosine_ops)
+                WITH (m = 16, ef_construction = 64);
+            END IF;
+        END $$;
+    """)
+
+
+def eliminar_indice_ann_grande(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS embedding_envio_grande_vector_hnsw_idx;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archivos', '0015_indices_trigram'),
+        ('busqueda', '0015_hash_contenido_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embeddingbusqueda',
+            name='embedding_vector_grande',
+            field=pgvector.django.VectorField(blank=True, dimensions=3072, null=True, verbose_name='Vector de Embedding de la Consulta (3072 dimensiones)'),
+        ),
+        migrations.CreateModel(
+            name='EnvioEmbeddingGrande',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('texto_indexado', models.TextField(help_text='Texto que fue usado para generar el embedding', verbose_name='Texto Indexado')),
+                ('fecha_generacion', models.DateTimeField(auto_now=True)),
+                ('hash_contenido', models.CharField(blank=True, default='', help_text='SHA-256 del texto indexado', max_length=64, verbose_name='Hash del Contenido')),
+                ('version_plantilla', models.PositiveSmallIntegerField(default=1, help_text='Versión de TextProcessor.generar_texto_envio usada', verbose_name='Versión de Plantilla')),
+                ('modelo_usado', models.CharField(default='text-embedding-3-large', max_length=100)),
+                ('embedding_vector', pgvector.django.VectorField(blank=True, dimensions=3072, help_text='Vector de embedding nativo de pgvector', null=True, verbose_name='Vector de Embedding')),
+                ('envio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding_grande', to='archivos.envio', verbose_name='Envío')),
+            ],
+            options={
+                'verbose_name': 'Embedding de Envío (3072 dimensiones)',
+                'verbose_name_plural': 'Embeddings de Envíos (3072 dimensiones)',
+                'db_table': 'embedding_envio_grande',
+                'ordering': ['-fecha_generacion'],
+                'indexes': [models.Index(fields=['modelo_usado'], name='embedding_g_modelo_idx'), models.Index(fields=['fecha_generacion'], name='embedding_g_fecha_idx'), models.Index(fields=['hash_contenido', 'modelo_usado'], name='embedding_g_hash_idx')],
+            },
+        ),
+        migrations.RunPython(crear_indice_ann_grande, eliminar_indice_ann_grande),
+    ]
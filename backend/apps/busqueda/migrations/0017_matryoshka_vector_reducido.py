@@ -0,0 +1,100 @@
+# Generated by Django 5.2.4 on 2026-10-17 13:25
+
+import numpy as np
+import pgvector.django
+from django.db import migrations
+
+DIMENSIONES_REDUCIDAS = 256
+MODELOS_MATRYOSHKA = ['text-embedding-3-small', 'text-embedding-3-large']
+TABLAS = [
+    ('envioembedding', 'embedding_envio', 'embedding_envio_reducido_hnsw_idx'),
+    ('envioembeddinggrande', 'embedding_envio_grande', 'embedding_envio_grande_reducido_hnsw_idx'),
+]
+
+
+def _tiene_funciones_subvector(schema_editor) -> bool:
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(DISTINCT proname) FROM pg_proc WHERE proname IN ('subvector', 'l2_normalize')"
+        )
+        return cursor.fetchone()[0] == 2
+
+
+def poblar_vector_reducido(apps, schema_editor):
+    """
+    Copia reducida de los vectores existentes: primeras 256 componentes renormalizadas.
+    En SQL con subvector/l2_normalize (pgvector >= 0.7.0); si no, en Python por lotes.
+    """
+    if schema_editor.connection.vendor == 'postgresql' and _tiene_funciones_subvector(schema_editor):
+        for _, db_table, _ in TABLAS:
+            schema_editor.execute(
+                f"UPDATE {db_table} "
+                f"SET embedding_vector_reducido = l2_normalize(subvector(embedding_vector, 1, {DIMENSIONES_REDUCIDAS})) "
+                f"WHERE embedding_vector IS NOT NULL AND modelo_usado = ANY(%s)",
+                [MODELOS_MATRYOSHKA]
+            )
+        return
+
+    for nombre_modelo, _, _ in TABLAS:
+        modelo = apps.get_model('busqueda', nombre_modelo)
+        lote = []
+        for embedding in modelo.objects.filter(
+            embedding_vector__isnull=False, modelo_usado__in=MODELOS_MATRYOSHKA
+        ).only('id', 'embedding_vector').iterator(chunk_size=500):
+            prefijo = np.asarray(embedding.embedding_vector, dtype=np.float32)[:DIMENSIONES_REDUCIDAS]
+            norma = np.linalg.norm(prefijo)
+            if norma == 0:
+                continue
+            embedding.embedding_vector_reducido = prefijo / norma
+            lote.append(embedding)
+            if len(lote) >= 500:
+                modelo.objects.bulk_update(lote, ['embedding_vector_reducido'])
+                lote = []
+        if lote:
+            modelo.objects.bulk_update(lote, ['embedding_vector_reducido'])
+
+
+def crear_indices_reducidos(apps, schema_editor):
+    """HNSW de 256 dimensiones para la pasada gruesa de la búsqueda en dos etapas"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, db_table, indice in TABLAS:
+        schema_editor.execute(f"""
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_am WHERE amname = 'hnsw') THEN
+                    CREATE INDEX IF NOT EXISTS {indice}
+                    ON {db_table} USING hnsw (embedding_vector_reducido vector_cosine_ops)
+                    WITH (m = 16, ef_construction = 64);
+                END IF;
+            END $$;
+        """)
+
+
+def eliminar_indices_reducidos(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, indice in TABLAS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {indice};")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busqueda', '0016_embedding_grande'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='envioembedding',
+            name='embedding_vector_reducido',
+            field=pgvector.django.VectorField(blank=True, dimensions=256, help_text='Copia Matryoshka normalizada del vector de embedding', null=True, verbose_name='Vector Reducido'),
+        ),
+        migrations.AddField(
+            model_name='envioembeddinggrande',
+            name='embedding_vector_reducido',
+            field=pgvector.django.VectorField(blank=True, dimensions=256, help_text='Copia Matryoshka normalizada del vector de embedding', null=True, verbose_name='Vector Reducido'),
+        ),
+        migrations.RunPython(poblar_vector_reducido, migrations.RunPython.noop),
+        migrations.RunPython(crear_indices_reducidos, eliminar_indices_reducidos),
+    ]
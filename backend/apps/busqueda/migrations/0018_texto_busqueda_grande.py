@@ -0,0 +1,42 @@
+"""
+Columna tsvector generada e índice GIN sobre embedding_envio_grande.texto_indexado.
+
+Igual que la 0014 para embedding_envio: la búsqueda híbrida con text-embedding-3-large
+toma los candidatos léxicos de la tabla del propio modelo, sin depender de que el envío
+también tenga fila en embedding_envio. Usa busqueda_unaccent() creada en la 0014.
+"""
+
+from django.db import migrations
+
+
+def crear_texto_busqueda_grande(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("""
+        ALTER TABLE embedding_envio_grande ADD COLUMN IF NOT EXISTS texto_busqueda tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('spanish', busqueda_unaccent(coalesce(texto_indexado, '')))
+        ) STORED;
+    """)
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS embedding_envio_grande_texto_busqueda_gin "
+        "ON embedding_envio_grande USING gin (texto_busqueda);"
+    )
+
+
+def eliminar_texto_busqueda_grande(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS embedding_envio_grande_texto_busqueda_gin;")
+    schema_editor.execute("ALTER TABLE embedding_envio_grande DROP COLUMN IF EXISTS texto_busqueda;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busqueda', '0017_matryoshka_vector_reducido'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_texto_busqueda_grande, eliminar_texto_busqueda_grande),
+    ]
@@ -2,10 +2,15 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from pgvector.django import VectorField
+import hashlib
 import json
+import numpy as np
 
 Usuario = get_user_model()
 
+# Dimensiones de la copia reducida (Matryoshka) de los vectores de text-embedding-3
+DIMENSIONES_REDUCIDAS = 256
+
 class BusquedaTradicional(models.Model):
     """Modelo para almacenar historial de búsquedas tradicionales"""
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
@@ -30,7 +35,90 @@ class BusquedaTradicional(models.Model):
         return f"{self.usuario.username} - {self.termino_busqueda}"
 
 
-class EnvioEmbedding(models.Model):
+class EmbeddingEnvioBase(models.Model):
+    """Campos y métodos comunes a las tablas de embeddings de envíos"""
+    texto_indexado = models.TextField(
+        verbose_name="Texto Indexado",
+        help_text="Texto que fue usado para generar el embedding"
+    )
+    fecha_generacion = models.DateTimeField(auto_now=True)
+    modelo_usado = models.CharField(max_length=100, default='text-embedding-3-small')
+    
+    # Huella del texto indexado: evita regenerar si el contenido no cambió y permite
+    # reutilizar el vector de otro envío con el mismo texto y modelo
+    hash_contenido = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name="Hash del Contenido",
+        help_text="SHA-256 del texto indexado"
+    )
+    version_plantilla = models.PositiveSmallIntegerField(
+        default=1,
+        verbose_name="Versión de Plantilla",
+        help_text="Versión de TextProcessor.generar_texto_envio usada"
+    )
+    # Primeras DIMENSIONES_REDUCIDAS componentes del vector, renormalizadas: equivale a
+    # pedir dimensions=256 a los modelos text-embedding-3 (pasada gruesa de la búsqueda)
+    embedding_vector_reducido = VectorField(
+        dimensions=DIMENSIONES_REDUCIDAS,
+        verbose_name="Vector Reducido",
+        help_text="Copia Matryoshka normalizada del vector de embedding",
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"Embedding: {self.envio.hawb}"
+
+    @staticmethod
+    def calcular_hash(texto_indexado: str) -> str:
+        """SHA-256 hexadecimal del texto indexado"""
+        return hashlib.sha256(texto_indexado.encode('utf-8')).hexdigest()
+
+    def contenido_vigente(self, hash_contenido: str, modelo: str) -> bool:
+        """True si el vector guardado corresponde a ese texto y modelo"""
+        return (
+            self.embedding_vector is not None
+            and self.hash_contenido == hash_contenido
+            and self.modelo_usado == modelo
+        )
+
+    @staticmethod
+    def reducir_vector(vector, dimensiones: int = DIMENSIONES_REDUCIDAS):
+        """
+        Trunca el vector a sus primeras dimensiones y lo renormaliza (np.ndarray float32).
+        Retorna None si el vector es más corto o su prefijo es nulo.
+        """
+        if vector is None:
+            return None
+        reducido = np.asarray(vector, dtype=np.float32)[:dimensiones]
+        norma = np.linalg.norm(reducido)
+        if reducido.shape[0] != dimensiones or norma == 0:
+            return None
+        return reducido / norma
+
+    def set_vector(self, vector_list):
+        """Guarda el vector (compatible con pgvector) y su copia reducida si el modelo la admite"""
+        from apps.busqueda.semantic.registro_modelos import RegistroModelos
+        self.embedding_vector = vector_list
+        self.embedding_vector_reducido = (
+            self.reducir_vector(vector_list)
+            if RegistroModelos.info(self.modelo_usado)['matryoshka'] else None
+        )
+
+    def get_vector(self):
+        """Obtiene el vector como np.ndarray float32 (vacío si no hay vector)"""
+        if self.embedding_vector is None:
+            return np.empty(0, dtype=np.float32)
+        # pgvector ya devuelve un ndarray float32: asarray no copia
+        return np.asarray(self.embedding_vector, dtype=np.float32)
+
+
+class EnvioEmbedding(EmbeddingEnvioBase):
     """Modelo para almacenar embeddings de envíos generados con OpenAI"""
     envio = models.OneToOneField(
         'archivos.Envio',
@@ -46,12 +134,6 @@ class EnvioEmbedding(models.Model):
         null=True,
         blank=True
     )
-    texto_indexado = models.TextField(
-        verbose_name="Texto Indexado",
-        help_text="Texto que fue usado para generar el embedding"
-    )
-    fecha_generacion = models.DateTimeField(auto_now=True)
-    modelo_usado = models.CharField(max_length=100, default='text-embedding-3-small')
     
     # Métricas de similitud precalculadas
     cosine_similarity_avg = models.FloatField(
@@ -68,21 +150,41 @@ class EnvioEmbedding(models.Model):
         indexes = [
             models.Index(fields=['modelo_usado']),
             models.Index(fields=['fecha_generacion']),
+            models.Index(fields=['hash_contenido', 'modelo_usado']),
         ]
 
-    def __str__(self):
-        return f"Embedding: {self.envio.hawb}"
 
-    def set_vector(self, vector_list):
-        """Guarda el vector (compatible con pgvector)"""
-        self.embedding_vector = vector_list
+class EnvioEmbeddingGrande(EmbeddingEnvioBase):
+    """
+    Embeddings de modelos de 3072 dimensiones (text-embedding-3-large).
+    Tabla propia para que convivan con los de 1536 dimensiones, cada uno con su
+    índice ANN (HNSW sobre halfvec: pgvector no indexa vector de más de 2000 dimensiones).
+    """
+    envio = models.OneToOneField(
+        'archivos.Envio',
+        on_delete=models.CASCADE,
+        related_name='embedding_grande',
+        verbose_name="Envío"
+    )
+    modelo_usado = models.CharField(max_length=100, default='text-embedding-3-large')
+    embedding_vector = VectorField(
+        dimensions=3072,
+        verbose_name="Vector de Embedding",
+        help_text="Vector de embedding nativo de pgvector",
+        null=True,
+        blank=True
+    )
 
-    def get_vector(self):
-        """Obtiene el vector como lista de Python"""
-        if self.embedding_vector is None:
-            return []
-        # pgvector devuelve el vector directamente como lista
-        return list(self.embedding_vector) if hasattr(self.embedding_vector, '__iter__') else []
+    class Meta:
+        db_table = 'embedding_envio_grande'
+        verbose_name = 'Embedding de Envío (3072 dimensiones)'
+        verbose_name_plural = 'Embeddings de Envíos (3072 dimensiones)'
+        ordering = ['-fecha_generacion']
+        indexes = [
+            models.Index(fields=['modelo_usado'], name='embedding_g_modelo_idx'),
+            models.Index(fields=['fecha_generacion'], name='embedding_g_fecha_idx'),
+            models.Index(fields=['hash_contenido', 'modelo_usado'], name='embedding_g_hash_idx'),
+        ]
 
 
 class EmbeddingBusqueda(models.Model):
@@ -98,6 +200,13 @@ class EmbeddingBusqueda(models.Model):
         null=True,
         blank=True
     )
+    # Consultas con modelos de 3072 dimensiones (text-embedding-3-large)
+    embedding_vector_grande = VectorField(
+        dimensions=3072,
+        verbose_name="Vector de Embedding de la Consulta (3072 dimensiones)",
+        null=True,
+        blank=True
+    )
     
     resultados_encontrados = models.PositiveIntegerField(default=0)
     tiempo_respuesta = models.IntegerField(
@@ -147,14 +256,19 @@ class EmbeddingBusqueda(models.Model):
         return f"{self.usuario.username} - {self.consulta[:50]}"
     
     def set_vector(self, vector_list):
-        """Guarda el vector de embedding de la consulta"""
-        self.embedding_vector = vector_list
+        """Guarda el vector de embedding de la consulta en la columna de su dimensión"""
+        if vector_list is not None and len(vector_list) == 3072:
+            self.embedding_vector, self.embedding_vector_grande = None, vector_list
+        else:
+            self.embedding_vector, self.embedding_vector_grande = vector_list, None
 
     def get_vector(self):
-        """Obtiene el vector como lista de Python"""
-        if self.embedding_vector is None:
-            return []
-        return list(self.embedding_vector) if hasattr(self.embedding_vector, '__iter__') else []
+        """Obtiene el vector como np.ndarray float32 (vacío si no hay vector)"""
+        vector = self.embedding_vector if self.embedding_vector is not None else self.embedding_vector_grande
+        if vector is None:
+            return np.empty(0, dtype=np.float32)
+        # pgvector ya devuelve un ndarray float32: asarray no copia
+        return np.asarray(vector, dtype=np.float32)
 
 
 class HistorialSemantica(models.Model):
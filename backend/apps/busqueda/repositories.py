@@ -2,9 +2,15 @@
 Repositorios para la app de búsqueda
 Implementa el patrón Repository para acceso a datos de búsqueda y embeddings
 """
-from typing import Optional, List, Dict, Any
-from django.db.models import QuerySet, Q, Avg, Count
-from django.db import models
+from typing import Optional, List, Dict, Any, Tuple, Iterable
+import re
+from django.conf import settings
+from django.utils import timezone
+from django.db.models import QuerySet, Q, Avg, Count, BooleanField, FloatField
+from django.db.models.expressions import Func, RawSQL
+from django.db import models, connection, transaction
+from pgvector.django import CosineDistance
+from pgvector.utils import from_db_binary, to_db
 
 from apps.core.base.base_repository import BaseRepository
 from apps.core.exceptions import EmbeddingNoEncontradoError
@@ -16,6 +22,25 @@ from .models import (
 )
 
 
+class _CampoVectorBinario(models.BinaryField):
+    """Decodifica el formato binario de pgvector directamente a un np.ndarray float32"""
+    
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return from_db_binary(bytes(value))
+
+
+class VectorBinario(Func):
+    """
+    vector_send(columna): el servidor envía el vector en binario (uint16 dimensión,
+    uint16 reservado, float32 big-endian) en lugar de texto. Evita parsear 1536 cadenas
+    por fila; psycopg2 no soporta resultados binarios, por eso se pide vía SQL.
+    """
+    function = 'vector_send'
+    output_field = _CampoVectorBinario()
+
+
 class BusquedaTradicionalRepository(BaseRepository):
     """
     Repositorio para operaciones de BusquedaTradicional.
@@ -123,6 +148,22 @@ class EnvioEmbeddingRepository(BaseRepository):
     def model(self):
         return EnvioEmbedding
     
+    @staticmethod
+    def tabla(modelo: str = None):
+        """Tabla de vectores del modelo de embedding según el registro de modelos"""
+        from .semantic.registro_modelos import RegistroModelos
+        return RegistroModelos.tabla(modelo)
+    
+    @staticmethod
+    def _columna_vector():
+        """
+        Columna del vector para values_list: en PostgreSQL se lee en binario
+        (np.ndarray float32 sin pasar por texto ni listas de Python).
+        """
+        if connection.vendor == 'postgresql':
+            return VectorBinario('embedding_vector')
+        return 'embedding_vector'
+    
     @property
     def select_related_fields(self) -> List[str]:
         return ['envio', 'envio__comprador']
@@ -145,7 +186,7 @@ class EnvioEmbeddingRepository(BaseRepository):
         if modelo:
             filtros['modelo_usado'] = modelo
         
-        return self.model.objects.filter(**filtros).first()
+        return self.tabla(modelo).objects.filter(**filtros).first()
     
     def obtener_por_envio_o_error(
         self,
@@ -165,14 +206,15 @@ class EnvioEmbeddingRepository(BaseRepository):
     
     # ==================== OPERACIONES DE EMBEDDINGS ====================
     
-    def obtener_embeddings_para_busqueda(
+    def obtener_vectores_para_busqueda(
         self,
         envios_queryset,
         modelo: str = None,
         limite: int = 500
-    ) -> List[tuple]:
+    ) -> List[Tuple[int, Any]]:
         """
-        Obtiene embeddings para búsqueda vectorial.
+        Obtiene vectores para búsqueda vectorial sin instanciar Envio ni sus relaciones.
+        Los envíos se cargan después, solo para el top-k final.
         
         Args:
             envios_queryset: QuerySet de envíos
@@ -180,39 +222,369 @@ class EnvioEmbeddingRepository(BaseRepository):
             limite: Máximo de embeddings a retornar
             
         Returns:
-            Lista de tuplas (envio_id, vector, envio_obj)
+            Lista de tuplas (envio_id, vector)
         """
-        filtros = {'envio__in': envios_queryset[:limite]}
+        filtros = {'envio__in': envios_queryset[:limite], 'embedding_vector__isnull': False}
         if modelo:
             filtros['modelo_usado'] = modelo
         
-        embeddings = (
-            self._get_optimized_queryset()
-            .filter(**filtros)
+        return list(
+            self.tabla(modelo).objects.filter(**filtros)
+            .order_by()
+            .values_list('envio_id', self._columna_vector())
         )
+    
+    def hay_embeddings(self, envios_queryset, modelo: str) -> bool:
+        """Indica si alguno de los envíos tiene embedding con el modelo indicado"""
+        return self.tabla(modelo).objects.filter(
+            envio__in=envios_queryset,
+            modelo_usado=modelo,
+            embedding_vector__isnull=False
+        ).exists()
+    
+    def soporta_busqueda_ann(self, modelo: str = None) -> bool:
+        """
+        Indica si la búsqueda top-k puede resolverse en la base de datos.
+        Requiere PostgreSQL con pgvector y, si se indica el modelo, que su tabla tenga
+        índice ANN (HNSW/IVFFlat de la migración 0013, HNSW halfvec de la 0016 o del
+        comando indice_ann_halfvec).
+        """
+        if not getattr(settings, 'SEMANTIC_SEARCH_USE_ANN', True) or connection.vendor != 'postgresql':
+            return False
+        if modelo is None:
+            return True
+        from .semantic.registro_modelos import RegistroModelos
+        return RegistroModelos.tiene_indice_ann(modelo)
+    
+    def soporta_busqueda_reducida(self, modelo: str) -> bool:
+        """
+        Indica si la pasada gruesa puede hacerse en SQL sobre embedding_vector_reducido
+        (índice HNSW de 256 dimensiones de la migración 0017).
+        """
+        if not getattr(settings, 'SEMANTIC_MATRYOSHKA', True) or not self.soporta_busqueda_ann():
+            return False
+        from .semantic.registro_modelos import RegistroModelos
+        return RegistroModelos.tiene_indice_reducido(modelo)
+    
+    def buscar_top_k_ann(
+        self,
+        envios_queryset,
+        vector_consulta: List[float],
+        modelo: str,
+        k: int = 200,
+        reducido: bool = False
+    ) -> List[Tuple[int, float]]:
+        """
+        Obtiene los k envíos más cercanos ordenando por distancia coseno (<=>) en SQL.
+        Los filtros de permisos, fechas y estado del queryset se aplican en la misma
+        consulta; si el índice HNSW devuelve menos de k filas dentro del alcance, se
+        re-consulta con hnsw.ef_search mayor y, como último recurso, sin índice.
         
-        resultado = []
-        for emb in embeddings:
-            vector = emb.get_vector()
-            if vector:
-                resultado.append((emb.envio_id, vector, emb.envio))
+        Args:
+            envios_queryset: QuerySet de envíos ya filtrado (permisos y criterios)
+            vector_consulta: Vector de la consulta
+            modelo: Modelo de embedding
+            k: Cantidad de candidatos a retornar
+            reducido: Ordenar por embedding_vector_reducido (pasada gruesa Matryoshka);
+                las distancias son aproximadas y deben re-rankearse con el vector completo
+            
+        Returns:
+            Lista de tuplas (envio_id, distancia_coseno) ordenada de menor a mayor distancia
+        """
+        from .semantic.registro_modelos import RegistroModelos
+        envios_ids = envios_queryset.order_by().values('id')
+        tabla = self.tabla(modelo)
+        info = RegistroModelos.info(modelo)
+        columna = 'embedding_vector'
         
-        return resultado
+        if reducido:
+            columna = 'embedding_vector_reducido'
+            distancia = CosineDistance(columna, EnvioEmbedding.reducir_vector(vector_consulta))
+        elif RegistroModelos.usa_halfvec(modelo):
+            # Misma expresión que el índice HNSW de la tabla para que el planner lo use
+            dimensiones = info['dimensiones']
+            distancia = RawSQL(
+                f'("{tabla._meta.db_table}"."embedding_vector"::halfvec({dimensiones})) '
+                f'<=> (%s::halfvec({dimensiones}))',
+                [to_db(vector_consulta)],
+                output_field=FloatField()
+            )
+        else:
+            distancia = CosineDistance('embedding_vector', vector_consulta)
+        
+        candidatos = tabla.objects.filter(
+            envio_id__in=envios_ids,
+            modelo_usado=modelo,
+            **{f'{columna}__isnull': False}
+        )
+        queryset = (
+            candidatos
+            .annotate(distancia=distancia)
+            .order_by('distancia')
+            .values_list('envio_id', 'distancia')[:k]
+        )
+        
+        # HNSW explora ef_search vecinos del corpus completo y el filtro de alcance
+        # (permisos, fechas, estado) se aplica después: con un alcance selectivo
+        # sobreviven menos de k filas. Se re-consulta con ef_search mayor y, si aun
+        # así faltan, se ordena sin índice (exacto sobre el subconjunto filtrado).
+        ef_search = max(int(getattr(settings, 'SEMANTIC_ANN_EF_SEARCH', None) or 40), min(int(k), 1000))
+        esperados = None
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Con ATOMIC_REQUESTS este atomic es un savepoint y liberarlo no deshace
+                # SET LOCAL: se guardan los valores previos y se restauran al terminar
+                cursor.execute(
+                    "SELECT current_setting('hnsw.ef_search', true), current_setting('enable_indexscan')"
+                )
+                ef_search_previo, indexscan_previo = cursor.fetchone()
+                while True:
+                    cursor.execute("SET LOCAL hnsw.ef_search = %s", [ef_search])
+                    filas = list(queryset.all())
+                    if len(filas) >= k:
+                        break
+                    if esperados is None:
+                        esperados = min(int(k), candidatos.count())
+                    if len(filas) >= esperados:
+                        break
+                    if ef_search >= 1000:
+                        # Límite de hnsw.ef_search: recorrido exacto del subconjunto
+                        cursor.execute("SET LOCAL enable_indexscan = off")
+                        filas = list(queryset.all())
+                        break
+                    ef_search = min(ef_search * 4, 1000)
+                # Si algo falla antes, el rollback del savepoint ya revierte los SET LOCAL
+                if ef_search_previo is None:
+                    cursor.execute("SET LOCAL hnsw.ef_search TO DEFAULT")
+                else:
+                    cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [ef_search_previo])
+                cursor.execute("SELECT set_config('enable_indexscan', %s, true)", [indexscan_previo])
+        return [(envio_id, float(distancia)) for envio_id, distancia in filas]
     
+    def soporta_busqueda_lexica(self) -> bool:
+        """
+        Indica si hay índice de texto completo (tsvector + GIN de las migraciones 0014
+        y 0018). Solo disponible en PostgreSQL.
+        """
+        return (
+            getattr(settings, 'SEMANTIC_SEARCH_HIBRIDA', True)
+            and connection.vendor == 'postgresql'
+        )
+    
+    @staticmethod
+    def _construir_tsquery(texto: str, max_terminos: int = 16, prefijo_minimo: int = None) -> str:
+        """
+        Convierte la consulta libre en un tsquery AND (todos los términos deben aparecer).
+        Solo los términos de al menos prefijo_minimo caracteres se buscan como prefijo
+        (término:*): "la" o "12" como prefijo coinciden con casi todo el corpus.
+        Solo se conservan caracteres alfanuméricos, por lo que la entrada del
+        usuario nunca llega como sintaxis de tsquery.
+        """
+        if prefijo_minimo is None:
+            prefijo_minimo = getattr(settings, 'SEMANTIC_LEXICO_PREFIJO_MINIMO', 4)
+        terminos = []
+        for termino in re.findall(r'\w+', (texto or '').lower()):
+            if termino not in terminos:
+                terminos.append(termino)
+        return ' & '.join(
+            f'{termino}:*' if len(termino) >= prefijo_minimo else termino
+            for termino in terminos[:max_terminos]
+        )
+    
+    def buscar_top_k_lexico(
+        self,
+        envios_queryset,
+        texto_consulta: str,
+        modelo: str,
+        k: int = 100
+    ) -> List[Tuple[int, float]]:
+        """
+        Obtiene los k envíos con mejor ranking de texto completo (ts_rank_cd) sobre
+        texto_indexado. Cubre todo el corpus filtrado usando el índice GIN, de modo
+        que HAWB, cédulas y nombres de productos coinciden aunque el vector no los
+        ubique entre los primeros. texto_consulta debe ser la consulta del usuario
+        (no la expandida con sinónimos): todos sus términos deben coincidir.
+        
+        Returns:
+            Lista de tuplas (envio_id, rank) ordenada de mayor a menor rank
+        """
+        tsquery = self._construir_tsquery(texto_consulta)
+        if not tsquery:
+            return []
+        
+        consulta_sql = "to_tsquery('spanish', busqueda_unaccent(%s))"
+        envios_ids = envios_queryset.order_by().values('id')
+        tabla = self.tabla(modelo)
+        # Cada tabla de vectores tiene su propio tsvector (migraciones 0014 y 0018): los
+        # candidatos léxicos salen de las filas del modelo solicitado
+        columna = f'"{tabla._meta.db_table}"."texto_busqueda"'
+        queryset = (
+            tabla.objects
+            .filter(envio_id__in=envios_ids, modelo_usado=modelo, embedding_vector__isnull=False)
+            .annotate(
+                coincide=RawSQL(
+                    f'{columna} @@ {consulta_sql}',
+                    [tsquery],
+                    output_field=BooleanField()
+                ),
+                rank_lexico=RawSQL(
+                    f'ts_rank_cd({columna}, {consulta_sql})',
+                    [tsquery],
+                    output_field=FloatField()
+                )
+            )
+            .filter(coincide=True)
+            .order_by('-rank_lexico')
+            .values_list('envio_id', 'rank_lexico')[:k]
+        )
+        return [(envio_id, float(rank)) for envio_id, rank in queryset]
+    
+    def obtener_vectores_por_envios(
+        self,
+        envios_ids: List[int],
+        modelo: str = None
+    ) -> List[Tuple[int, Any]]:
+        """
+        Obtiene vectores de un conjunto acotado de envíos (p. ej. candidatos ANN).
+        
+        Returns:
+            Lista de tuplas (envio_id, vector), mismo formato que
+            obtener_vectores_para_busqueda
+        """
+        filtros = {'envio_id__in': envios_ids, 'embedding_vector__isnull': False}
+        if modelo:
+            filtros['modelo_usado'] = modelo
+        
+        return list(
+            self.tabla(modelo).objects.filter(**filtros)
+            .order_by()
+            .values_list('envio_id', self._columna_vector())
+        )
+
+    def _vectores_activos(self, modelo: str) -> QuerySet:
+        """Embeddings con vector de envíos no eliminados"""
+        return self.tabla(modelo).objects.filter(
+            modelo_usado=modelo,
+            embedding_vector__isnull=False,
+            envio__deleted_at__isnull=True
+        )
+
+    def contar_vectores_activos(self, modelo: str) -> int:
+        return self._vectores_activos(modelo).count()
+
+    def iterar_vectores(
+        self,
+        modelo: str,
+        desde=None,
+        chunk_size: int = 2000,
+        campo_id: str = 'envio_id',
+        envios_queryset=None
+    ):
+        """
+        Itera (envio_id, vector) sin instanciar modelos, para construir el índice en memoria.
+
+        Args:
+            modelo: Modelo de embedding
+            desde: Si se indica, solo embeddings generados desde esa fecha
+            chunk_size: Filas por lote leído del cursor
+            campo_id: Identificador de cada par ('id' para la clave primaria del embedding)
+            envios_queryset: Si se indica, solo embeddings de esos envíos (permisos y filtros)
+        """
+        queryset = self._vectores_activos(modelo)
+        if desde is not None:
+            queryset = queryset.filter(fecha_generacion__gte=desde)
+        if envios_queryset is not None:
+            queryset = queryset.filter(envio__in=envios_queryset.order_by().values('id'))
+        return (
+            queryset.order_by()
+            .values_list(campo_id, self._columna_vector())
+            .iterator(chunk_size=chunk_size)
+        )
+
+    def soporta_similitud_promedio(self, modelo: str) -> bool:
+        """Solo la tabla de 1536 dimensiones tiene la columna cosine_similarity_avg"""
+        return any(
+            campo.name == 'cosine_similarity_avg' for campo in self.tabla(modelo)._meta.get_fields()
+        )
+
+    def guardar_similitud_promedio(self, modelo: str, valores: Iterable[Tuple[int, float]], batch_size: int = 1000) -> int:
+        """
+        Actualiza cosine_similarity_avg con bulk_update sin leer las filas: basta la clave
+        primaria. No dispara signals (el vector no cambia).
+
+        Args:
+            modelo: Modelo de embedding
+            valores: Pares (id del embedding, similitud promedio)
+
+        Returns:
+            Filas actualizadas
+        """
+        tabla = self.tabla(modelo)
+        embeddings = [tabla(pk=pk, cosine_similarity_avg=float(valor)) for pk, valor in valores]
+        return tabla.objects.bulk_update(embeddings, ['cosine_similarity_avg'], batch_size=batch_size)
+
+    def iterar_metadatos(self, modelo: str, envios_ids=None, desde=None, chunk_size: int = 2000):
+        """
+        Itera los metadatos de filtrado de los envíos activos con embedding del modelo,
+        para las columnas del índice en memoria:
+        (envio_id, fecha_emision, estado, comprador_id, ciudad, cantidad_total,
+        lineas, peso_total, valor_total)
+        
+        Args:
+            modelo: Modelo de embedding
+            envios_ids: Si se indica, solo esos envíos
+            desde: Si se indica, solo envíos cuyo registro, comprador o productos
+                cambiaron desde esa fecha
+            chunk_size: Filas por lote leído del cursor
+        """
+        from apps.archivos.models import Envio
+        queryset = Envio.objects.filter(id__in=self._vectores_activos(modelo).values('envio_id'))
+        if envios_ids is not None:
+            queryset = queryset.filter(id__in=list(envios_ids))
+        if desde is not None:
+            # Subconsulta: filtrar por productos antes del annotate alteraría el conteo de líneas
+            queryset = queryset.filter(id__in=Envio.objects.filter(
+                Q(fecha_actualizacion__gte=desde)
+                | Q(comprador__fecha_actualizacion__gte=desde)
+                | Q(productos__fecha_actualizacion__gte=desde)
+            ).values('id'))
+        return (
+            queryset.order_by()
+            .annotate(num_lineas_productos=Count('productos'))
+            .values_list(
+                'id', 'fecha_emision', 'estado', 'comprador_id', 'comprador__ciudad',
+                'cantidad_total', 'num_lineas_productos', 'peso_total', 'valor_total'
+            )
+            .iterator(chunk_size=chunk_size)
+        )
+
+    def obtener_envios_eliminados_desde(self, desde) -> List[int]:
+        """IDs de envíos con embedding eliminados lógicamente desde la fecha indicada"""
+        from apps.archivos.models import Envio
+        return list(
+            Envio.all_objects
+            .filter(deleted_at__gte=desde)
+            .filter(Q(embedding__isnull=False) | Q(embedding_grande__isnull=False))
+            .values_list('id', flat=True)
+            .distinct()
+        )
+
     def obtener_textos_indexados(
         self,
-        envios_ids: List[int]
+        envios_ids: List[int],
+        modelo: str = None
     ) -> Dict[int, str]:
         """
         Obtiene los textos indexados para un conjunto de envíos.
         
         Args:
             envios_ids: Lista de IDs de envíos
+            modelo: Modelo de embedding (define la tabla; por defecto embedding_envio)
             
         Returns:
             Diccionario {envio_id: texto_indexado}
         """
-        embeddings = self.model.objects.filter(
+        embeddings = self.tabla(modelo).objects.filter(
             envio_id__in=envios_ids
         ).values('envio_id', 'texto_indexado')
         
@@ -223,7 +595,8 @@ class EnvioEmbeddingRepository(BaseRepository):
         envio,
         texto_indexado: str,
         vector: List[float],
-        modelo: str
+        modelo: str,
+        version_plantilla: int = None
     ) -> EnvioEmbedding:
         """
         Crea o actualiza el embedding de un envío.
@@ -233,28 +606,130 @@ class EnvioEmbeddingRepository(BaseRepository):
             texto_indexado: Texto usado para generar el embedding
             vector: Vector de embedding
             modelo: Modelo usado
+            version_plantilla: Versión de la plantilla de texto (opcional)
             
         Returns:
             Instancia del embedding
         """
-        embedding, created = self.model.objects.get_or_create(
+        # Una fila por envío y tabla: si cambia el modelo (misma dimensión) se reemplaza
+        tabla = self.tabla(modelo)
+        embedding, created = tabla.objects.get_or_create(
             envio=envio,
-            modelo_usado=modelo,
-            defaults={'texto_indexado': texto_indexado}
+            defaults={'texto_indexado': texto_indexado, 'modelo_usado': modelo}
         )
         
         if not created:
             embedding.texto_indexado = texto_indexado
+            embedding.modelo_usado = modelo
         
+        embedding.hash_contenido = tabla.calcular_hash(texto_indexado)
+        if version_plantilla is not None:
+            embedding.version_plantilla = version_plantilla
         embedding.set_vector(vector)
         embedding.save()
         
         return embedding
     
+    def obtener_vectores_por_hash(
+        self,
+        hashes: List[str],
+        modelo: str
+    ) -> Dict[str, Any]:
+        """
+        Vectores ya calculados para textos idénticos (mismo hash y modelo),
+        para reutilizarlos sin llamar a la API.
+        
+        Returns:
+            Diccionario {hash_contenido: vector}
+        """
+        if not hashes:
+            return {}
+        return dict(
+            self.tabla(modelo).objects.filter(
+                hash_contenido__in=set(hashes),
+                modelo_usado=modelo,
+                embedding_vector__isnull=False
+            )
+            .order_by()
+            .values_list('hash_contenido', self._columna_vector())
+        )
+    
+    def guardar_embeddings_lote(
+        self,
+        items: List[Tuple[Any, str, List[float]]],
+        modelo: str,
+        version_plantilla: int = None
+    ) -> List[EnvioEmbedding]:
+        """
+        Crea o actualiza los embeddings de un lote con un bulk_create y un bulk_update.
+        Los signals post_save no se disparan, por lo que el índice en memoria, la versión
+        del caché de rankings y el registro de modelos se actualizan al confirmar la transacción.
+        
+        Args:
+            items: Lista de tuplas (envio, texto_indexado, vector)
+            modelo: Modelo usado
+            version_plantilla: Versión de la plantilla de texto (opcional)
+            
+        Returns:
+            Embeddings guardados, en el mismo orden que items
+        """
+        from .semantic.vector_index import notificar_embedding_actualizado, refrescar_metadatos
+        from .services import CacheResultadosSemanticos
+        from .semantic.registro_modelos import RegistroModelos
+        
+        tabla = self.tabla(modelo)
+        existentes = {
+            emb.envio_id: emb
+            for emb in tabla.objects.filter(envio_id__in=[envio.id for envio, _, _ in items])
+        }
+        ahora = timezone.now()
+        
+        nuevos = []
+        actualizados = []
+        resultado = []
+        for envio, texto_indexado, vector in items:
+            embedding = existentes.get(envio.id)
+            if embedding is None:
+                embedding = tabla(envio=envio, texto_indexado=texto_indexado, modelo_usado=modelo)
+                nuevos.append(embedding)
+            else:
+                embedding.texto_indexado = texto_indexado
+                embedding.modelo_usado = modelo
+                embedding.fecha_generacion = ahora  # bulk_update no aplica auto_now
+                actualizados.append(embedding)
+            embedding.hash_contenido = tabla.calcular_hash(texto_indexado)
+            if version_plantilla is not None:
+                embedding.version_plantilla = version_plantilla
+            embedding.set_vector(vector)
+            resultado.append(embedding)
+        
+        with transaction.atomic():
+            tabla.objects.bulk_create(nuevos, batch_size=500)
+            if actualizados:
+                tabla.objects.bulk_update(
+                    actualizados,
+                    [
+                        'texto_indexado', 'embedding_vector', 'embedding_vector_reducido',
+                        'modelo_usado', 'fecha_generacion', 'hash_contenido', 'version_plantilla'
+                    ],
+                    batch_size=500
+                )
+            transaction.on_commit(lambda: [
+                notificar_embedding_actualizado(modelo, emb.envio_id, emb.embedding_vector, metadatos=False)
+                for emb in resultado
+            ])
+            transaction.on_commit(lambda: refrescar_metadatos(
+                [emb.envio_id for emb in resultado], modelo=modelo
+            ))
+            transaction.on_commit(CacheResultadosSemanticos.invalidar)
+            transaction.on_commit(lambda: RegistroModelos.marcar_disponible(modelo))
+        
+        return resultado
+    
     def contar_embeddings(self, modelo: str = None) -> int:
         """Cuenta el total de embeddings"""
         if modelo:
-            return self.model.objects.filter(modelo_usado=modelo).count()
+            return self.tabla(modelo).objects.filter(modelo_usado=modelo).count()
         return self.model.objects.count()
     
     def existe_embedding(self, envio, modelo: str = None) -> bool:
@@ -262,7 +737,7 @@ class EnvioEmbeddingRepository(BaseRepository):
         filtros = {'envio': envio}
         if modelo:
             filtros['modelo_usado'] = modelo
-        return self.model.objects.filter(**filtros).exists()
+        return self.tabla(modelo).objects.filter(**filtros).exists()
 
 
 # Instancias singleton para uso en servicios
@@ -0,0 +1,190 @@
+"""
+Embedding Pool - Solicitudes concurrentes a OpenAI con límite de RPM/TPM
+"""
+from typing import Dict, Any, Callable, Iterable, Optional
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+
+from apps.core.exceptions import OpenAIRateLimitError, OpenAITransientError
+
+logger = logging.getLogger('apps.busqueda.semantic')
+
+
+class LimitadorTokenBucket:
+    """
+    Token bucket doble: solicitudes por minuto y tokens por minuto.
+    Además admite una pausa global cuando OpenAI responde 429, para que
+    todos los hilos esperen en lugar de seguir golpeando la API.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._solicitudes = float(rpm)
+        self._tokens = float(tpm)
+        self._ultima_recarga = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def _recargar(self, ahora: float):
+        transcurrido = ahora - self._ultima_recarga
+        self._solicitudes = min(self.rpm, self._solicitudes + transcurrido * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + transcurrido * self.tpm / 60.0)
+        self._ultima_recarga = ahora
+
+    def adquirir(self, tokens: int):
+        """Bloquea hasta que haya cupo para una solicitud de `tokens` tokens"""
+        tokens = min(tokens, self.tpm)  # Una solicitud mayor que el bucket nunca cabría
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._recargar(ahora)
+                espera = self._pausa_hasta - ahora
+                if espera <= 0:
+                    if self._solicitudes >= 1 and self._tokens >= tokens:
+                        self._solicitudes -= 1
+                        self._tokens -= tokens
+                        return
+                    espera = max(
+                        (1 - self._solicitudes) * 60.0 / self.rpm,
+                        (tokens - self._tokens) * 60.0 / self.tpm,
+                    )
+            time.sleep(max(espera, 0.01))
+
+    def pausar(self, segundos: float):
+        """Detiene todas las solicitudes durante `segundos` (respuesta 429)"""
+        with self._lock:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            # El bucket quedó sobreestimado: vaciarlo evita una ráfaga al reanudar
+            self._solicitudes = 0.0
+            self._tokens = 0.0
+
+
+class MedidorThroughput:
+    """Acumula envíos, tokens y costo para mostrar el avance en vivo"""
+
+    def __init__(self, precio_por_1k: float):
+        self.precio_por_1k = precio_por_1k
+        self.envios = 0
+        self.tokens = 0
+        self.solicitudes = 0
+        self.reintentos = 0
+        self.reintentos_transitorios = 0
+        self._inicio = time.monotonic()
+
+    def registrar(self, envios: int, tokens: int):
+        self.envios += envios
+        self.tokens += tokens
+        self.solicitudes += 1
+
+    @property
+    def costo(self) -> float:
+        return self.tokens / 1000.0 * self.precio_por_1k
+
+    def lectura(self) -> Dict[str, Any]:
+        transcurrido = max(time.monotonic() - self._inicio, 1e-6)
+        return {
+            'envios_por_segundo': round(self.envios / transcurrido, 2),
+            'tokens_por_segundo': round(self.tokens / transcurrido, 1),
+            'costo_acumulado': round(self.costo, 6),
+            'reintentos_429': self.reintentos,
+            'reintentos_transitorios': self.reintentos_transitorios,
+            'segundos': round(transcurrido, 1),
+        }
+
+
+class PoolEmbeddings:
+    """
+    Pool acotado de hilos para llamadas a la API de embeddings.
+
+    Los hilos solo hacen la solicitud HTTP; los resultados se entregan en el hilo
+    que llama a `ejecutar`, que es quien escribe en la BD (las conexiones de
+    Django son por hilo).
+    """
+
+    def __init__(
+        self,
+        concurrencia: int = None,
+        rpm: int = None,
+        tpm: int = None,
+        max_reintentos: int = None
+    ):
+        self.concurrencia = concurrencia or getattr(settings, 'EMBEDDING_CONCURRENCIA', 4)
+        self.limitador = LimitadorTokenBucket(
+            rpm or getattr(settings, 'OPENAI_EMBEDDING_RPM', 3000),
+            tpm or getattr(settings, 'OPENAI_EMBEDDING_TPM', 1000000),
+        )
+        self.max_reintentos = (
+            max_reintentos if max_reintentos is not None
+            else getattr(settings, 'EMBEDDING_MAX_REINTENTOS', 5)
+        )
+        self.reintentos = 0  # Por 429
+        self.reintentos_transitorios = 0  # Por conexión, timeout o 5xx
+
+    def _llamar(self, funcion: Callable, tokens_estimados: int):
+        """
+        Ejecuta la solicitud respetando el limitador y reintentando con backoff
+        exponencial ante 429 y fallas transitorias (conexión, timeout, 5xx). Un 429
+        pausa a todos los hilos; las demás fallas solo demoran al hilo que la recibió.
+        """
+        intento = 0
+        while True:
+            self.limitador.adquirir(tokens_estimados)
+            try:
+                return funcion()
+            except OpenAITransientError as e:
+                intento += 1
+                if isinstance(e, OpenAIRateLimitError):
+                    self.reintentos += 1
+                else:
+                    self.reintentos_transitorios += 1
+                if intento > self.max_reintentos:
+                    raise
+                espera = e.retry_after or min(2 ** intento, 60)
+                espera += random.uniform(0, espera * 0.1)
+                if isinstance(e, OpenAIRateLimitError):
+                    logger.warning(f"OpenAI 429: reintento {intento}/{self.max_reintentos} en {espera:.1f}s")
+                    self.limitador.pausar(espera)
+                else:
+                    logger.warning(
+                        f"OpenAI falla transitoria ({e.message}): reintento {intento}/{self.max_reintentos} "
+                        f"en {espera:.1f}s"
+                    )
+                    time.sleep(espera)
+
+    def ejecutar(
+        self,
+        tareas: Iterable[tuple],
+        al_completar: Callable[[Any, Any, Optional[Exception]], None]
+    ):
+        """
+        Ejecuta las tareas con varias solicitudes en vuelo.
+
+        Args:
+            tareas: Iterable (consumido de forma perezosa) de tuplas
+                (contexto, funcion, tokens_estimados)
+            al_completar: Se invoca en este hilo con (contexto, resultado, error)
+        """
+        ventana = self.concurrencia * 2  # Acota la memoria de resultados pendientes
+        with ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix='embeddings') as executor:
+            pendientes = {}
+
+            def procesar(terminados):
+                for futuro in terminados:
+                    contexto = pendientes.pop(futuro)
+                    error = futuro.exception()
+                    al_completar(contexto, None if error else futuro.result(), error)
+
+            for contexto, funcion, tokens_estimados in tareas:
+                if len(pendientes) >= ventana:
+                    terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    procesar(terminados)
+                pendientes[executor.submit(self._llamar, funcion, tokens_estimados)] = contexto
+
+            while pendientes:
+                terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                procesar(terminados)
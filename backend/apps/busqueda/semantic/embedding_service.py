@@ -1,17 +1,24 @@
 """
 Embedding Service - Servicio para generación de embeddings con OpenAI
 """
+import base64
 from typing import Dict, Any, List, Optional
+
+import numpy as np
 from django.conf import settings
-from openai import OpenAI
+from openai import OpenAI, RateLimitError, APIConnectionError, InternalServerError
 
 from apps.core.base.base_service import BaseService
 from apps.core.exceptions import (
     OpenAINotConfiguredError,
-    OpenAIServiceError
+    OpenAIServiceError,
+    OpenAIRateLimitError,
+    OpenAITransientError
 )
+from apps.busqueda.models import EnvioEmbedding
 from apps.busqueda.repositories import embedding_repository
 from .text_processor import TextProcessor
+from .registro_modelos import MODELOS_EMBEDDING
 
 
 class OpenAIClient:
@@ -45,12 +52,8 @@ class EmbeddingService(BaseService):
     Centraliza toda la lógica relacionada con embeddings de OpenAI.
     """
     
-    # Precios por 1K tokens según modelo (USD) - Actualizados 2024
-    PRECIOS_MODELOS = {
-        'text-embedding-3-small': 0.00002,   # $0.02 / 1M tokens
-        'text-embedding-3-large': 0.00013,   # $0.13 / 1M tokens
-        'text-embedding-ada-002': 0.0001     # $0.10 / 1M tokens
-    }
+    # Precios por 1K tokens según modelo (USD), tomados del registro de modelos
+    PRECIOS_MODELOS = {modelo: info['precio_por_1k'] for modelo, info in MODELOS_EMBEDDING.items()}
     
     MODELOS_VALIDOS = list(PRECIOS_MODELOS.keys())
     
@@ -68,6 +71,20 @@ class EmbeddingService(BaseService):
     
     # ==================== GENERACIÓN DE EMBEDDINGS ====================
     
+    @staticmethod
+    def decodificar_embedding(dato) -> np.ndarray:
+        """
+        Convierte el embedding de la respuesta de OpenAI en un vector float32.
+        
+        Con encoding_format="base64" OpenAI devuelve los float32 little-endian
+        codificados en base64: se decodifican directo a un buffer numpy sin crear
+        un float de Python por dimensión. Acepta también listas (respuestas en
+        formato "float").
+        """
+        if isinstance(dato, str):
+            return np.frombuffer(base64.b64decode(dato), dtype='<f4').astype(np.float32, copy=False)
+        return np.asarray(dato, dtype=np.float32)
+    
     @staticmethod
     def generar_embedding(texto: str, modelo: str = None) -> Dict[str, Any]:
         """
@@ -79,7 +96,7 @@ class EmbeddingService(BaseService):
         
         Returns:
             dict: {
-                'embedding': lista de floats,
+                'embedding': np.ndarray float32,
                 'tokens': int,
                 'costo': float,
                 'modelo': str
@@ -104,10 +121,10 @@ class EmbeddingService(BaseService):
             response = client.embeddings.create(
                 model=modelo,
                 input=texto,
-                encoding_format="float"
+                encoding_format="base64"
             )
             
-            embedding = response.data[0].embedding
+            embedding = EmbeddingService.decodificar_embedding(response.data[0].embedding)
             tokens_utilizados = response.usage.total_tokens
             
             # Calcular costo: (tokens / 1000) * precio_por_1k
@@ -133,10 +150,14 @@ class EmbeddingService(BaseService):
         """
         Genera o actualiza el embedding de un envío.
         
+        Con forzar_regeneracion solo se llama a OpenAI si cambió el contenido: si el
+        hash del texto y el modelo coinciden con los guardados se registra 'omitido'.
+        Si otro envío ya tiene un vector para el mismo texto y modelo, se reutiliza.
+        
         Args:
             envio: Instancia del modelo Envio
             modelo: Modelo de OpenAI a usar
-            forzar_regeneracion: Si True, regenera aunque ya exista
+            forzar_regeneracion: Si True, regenera aunque ya exista (si cambió el contenido)
             tipo_proceso: Tipo de proceso ('automatico', 'manual', 'masivo')
         
         Returns:
@@ -150,35 +171,43 @@ class EmbeddingService(BaseService):
         if modelo is None:
             modelo = EmbeddingService.get_modelo_default()
         
+        def registrar_omitido(embedding_existente):
+            registrar_generacion_embedding_manual(
+                envio=envio,
+                estado='omitido',
+                tiempo_generacion_ms=int((time.time() - tiempo_inicio) * 1000),
+                modelo_usado=modelo,
+                tipo_proceso=tipo_proceso,
+                embedding=embedding_existente
+            )
+            return embedding_existente
+        
         # Verificar si ya existe y no se fuerza regeneración
-        if not forzar_regeneracion:
-            embedding_existente = embedding_repository.obtener_por_envio(envio, modelo)
-            if embedding_existente:
-                # Registrar como omitido
-                tiempo_generacion_ms = int((time.time() - tiempo_inicio) * 1000)
-                registrar_generacion_embedding_manual(
-                    envio=envio,
-                    estado='omitido',
-                    tiempo_generacion_ms=tiempo_generacion_ms,
-                    modelo_usado=modelo,
-                    tipo_proceso=tipo_proceso,
-                    embedding=embedding_existente
-                )
-                return embedding_existente
+        embedding_existente = embedding_repository.obtener_por_envio(envio, modelo)
+        if embedding_existente and not forzar_regeneracion:
+            return registrar_omitido(embedding_existente)
         
         try:
             # Generar texto descriptivo
             texto_indexado = TextProcessor.generar_texto_envio(envio)
+            hash_contenido = EnvioEmbedding.calcular_hash(texto_indexado)
+            
+            # Mismo texto y modelo que el guardado: el vector sigue vigente
+            if embedding_existente and embedding_existente.contenido_vigente(hash_contenido, modelo):
+                return registrar_omitido(embedding_existente)
             
-            # Generar embedding
-            resultado = EmbeddingService.generar_embedding(texto_indexado, modelo)
+            # Reutilizar el vector de otro envío con texto idéntico; si no, generar
+            vector = embedding_repository.obtener_vectores_por_hash([hash_contenido], modelo).get(hash_contenido)
+            if vector is None:
+                vector = EmbeddingService.generar_embedding(texto_indexado, modelo)['embedding']
             
             # Guardar o actualizar embedding
             embedding = embedding_repository.crear_o_actualizar_embedding(
                 envio=envio,
                 texto_indexado=texto_indexado,
-                vector=resultado['embedding'],
-                modelo=modelo
+                vector=vector,
+                modelo=modelo,
+                version_plantilla=TextProcessor.VERSION_PLANTILLA
             )
             
             # Registrar generación exitosa
@@ -207,65 +236,331 @@ class EmbeddingService(BaseService):
             )
             raise
     
+    # ==================== GENERACIÓN EN LOTE ====================
+    
     @staticmethod
-    def generar_embeddings_masivo(
+    def estimar_tokens(texto: str) -> int:
+        """
+        Estimación conservadora de tokens (~3 caracteres por token en español).
+        Solo se usa para armar lotes; el costo se calcula con el uso real reportado.
+        """
+        return len(texto) // 3 + 1
+    
+    @staticmethod
+    def agrupar_por_presupuesto(
+        textos: List[str],
+        max_tokens: int = None,
+        max_inputs: int = None
+    ) -> List[List[int]]:
+        """
+        Agrupa los textos en lotes que respetan el presupuesto de tokens y de
+        entradas por solicitud.
+        
+        Returns:
+            Lista de lotes, cada uno con los índices de sus textos
+        """
+        max_tokens = max_tokens or getattr(settings, 'EMBEDDING_BATCH_MAX_TOKENS', 100000)
+        max_inputs = max_inputs or getattr(settings, 'EMBEDDING_BATCH_MAX_INPUTS', 500)
+        
+        lotes = []
+        lote_actual = []
+        tokens_lote = 0
+        for i, texto in enumerate(textos):
+            tokens = EmbeddingService.estimar_tokens(texto)
+            if lote_actual and (tokens_lote + tokens > max_tokens or len(lote_actual) >= max_inputs):
+                lotes.append(lote_actual)
+                lote_actual = []
+                tokens_lote = 0
+            lote_actual.append(i)
+            tokens_lote += tokens
+        
+        if lote_actual:
+            lotes.append(lote_actual)
+        return lotes
+    
+    @staticmethod
+    def generar_embeddings_lote(
+        textos: List[str],
+        modelo: str = None,
+        reintentos_cliente: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Genera embeddings para varios textos en una sola solicitud a OpenAI.
+        
+        Con reintentos_cliente=False se desactivan los reintentos del SDK: el llamador
+        (PoolEmbeddings) reintenta con su propio backoff las fallas transitorias.
+        
+        Returns:
+            dict: {
+                'embeddings': vectores float32 en el mismo orden que textos,
+                'tokens': int,
+                'costo': float,
+                'modelo': str
+            }
+        
+        Raises:
+            OpenAINotConfiguredError: Si no hay API key configurada
+            OpenAIRateLimitError: Si OpenAI responde 429
+            OpenAITransientError: Si falla la conexión, vence el timeout o OpenAI responde 5xx
+            OpenAIServiceError: Si falla la llamada a OpenAI
+        """
+        client = OpenAIClient.get_instance()
+        if not client:
+            raise OpenAINotConfiguredError()
+        
+        if modelo is None:
+            modelo = EmbeddingService.get_modelo_default()
+        else:
+            modelo = EmbeddingService.validar_modelo(modelo)
+        
+        precio_por_1k = EmbeddingService.PRECIOS_MODELOS.get(modelo, 0.00002)
+        if not reintentos_cliente:
+            client = client.with_options(max_retries=0)
+        
+        try:
+            response = client.embeddings.create(
+                model=modelo,
+                input=textos,
+                encoding_format="base64"
+            )
+            
+            # OpenAI indica la posición de cada entrada; no asumir el orden de la respuesta
+            embeddings = [None] * len(textos)
+            for item in response.data:
+                embeddings[item.index] = EmbeddingService.decodificar_embedding(item.embedding)
+            tokens_utilizados = response.usage.total_tokens
+            
+            return {
+                'embeddings': embeddings,
+                'tokens': tokens_utilizados,
+                'costo': (tokens_utilizados / 1000.0) * precio_por_1k,
+                'modelo': modelo
+            }
+        except RateLimitError as e:
+            raise OpenAIRateLimitError(str(e), retry_after=EmbeddingService._retry_after(e))
+        except (APIConnectionError, InternalServerError) as e:
+            # APITimeoutError es subclase de APIConnectionError (sin respuesta HTTP)
+            raise OpenAITransientError(str(e), retry_after=EmbeddingService._retry_after(e))
+        except Exception as e:
+            BaseService.log_error(e, f"Error generando lote de {len(textos)} embeddings")
+            raise OpenAIServiceError(str(e))
+    
+    @staticmethod
+    def _retry_after(error) -> Optional[float]:
+        """Segundos del encabezado Retry-After de la respuesta de error, si lo trae"""
+        respuesta = getattr(error, 'response', None)
+        retry_after = respuesta.headers.get('retry-after') if respuesta is not None else None
+        return float(retry_after) if retry_after else None
+    
+    @staticmethod
+    def generar_embeddings_envios_lote(
         envios,
         modelo: str = None,
-        forzar_regeneracion: bool = False
+        forzar_regeneracion: bool = False,
+        tipo_proceso: str = 'masivo',
+        max_tokens: int = None,
+        max_inputs: int = None,
+        concurrencia: int = None,
+        callback_progreso=None
     ) -> Dict[str, Any]:
         """
-        Genera embeddings para múltiples envíos.
+        Genera embeddings de muchos envíos empaquetando varios textos por solicitud
+        y manteniendo varias solicitudes en vuelo (PoolEmbeddings, con límite de
+        RPM/TPM y reintentos ante 429 y fallas transitorias). Cada lote se guarda con un
+        bulk_create/bulk_update y se registra en métricas con una sola escritura.
         
         Args:
-            envios: QuerySet de envíos
+            envios: QuerySet o lista de envíos
             modelo: Modelo a usar
-            forzar_regeneracion: Si True, regenera todos
+            forzar_regeneracion: Si True, regenera aunque ya exista
+            tipo_proceso: Tipo de proceso ('automatico', 'manual', 'masivo')
+            max_tokens: Presupuesto de tokens por solicitud
+            max_inputs: Máximo de textos por solicitud
+            concurrencia: Solicitudes simultáneas a OpenAI
+            callback_progreso: Función opcional llamada con el dict de estadísticas tras cada lote
             
         Returns:
-            Dict con estadísticas de la operación
+            Dict con estadísticas de la operación (incluye envíos/s, tokens/s y costo)
         """
+        import time
+        from apps.archivos.models import Envio
+        from apps.metricas.services import RegistroEmbeddingService
+        from .embedding_pool import PoolEmbeddings, MedidorThroughput
+        
         if modelo is None:
             modelo = EmbeddingService.get_modelo_default()
+        else:
+            modelo = EmbeddingService.validar_modelo(modelo)
         
-        total = envios.count()
-        procesados = 0
-        errores = 0
-        tokens_total = 0
-        costo_total = 0.0
+        if hasattr(envios, 'values_list'):
+            envios_ids = list(envios.values_list('id', flat=True))
+        else:
+            envios_ids = [envio.id for envio in envios]
         
-        for envio in envios:
-            try:
-                # Verificar si ya existe
-                if not forzar_regeneracion and embedding_repository.existe_embedding(envio, modelo):
+        estadisticas = {
+            'total': len(envios_ids),
+            'procesados': 0,
+            'errores': 0,
+            'omitidos': 0,
+            'reutilizados': 0,
+            'solicitudes': 0,
+            'tokens_total': 0,
+            'costo_total': 0.0,
+            'modelo': modelo
+        }
+        pool = PoolEmbeddings(concurrencia=concurrencia)
+        medidor = MedidorThroughput(EmbeddingService.PRECIOS_MODELOS.get(modelo, 0.00002))
+        
+        def registrar(lote, estado, tiempo_generacion_ms, embeddings=None, mensaje_error=None):
+            RegistroEmbeddingService.registrar_generacion_lote(
+                envios=lote,
+                estado=estado,
+                tiempo_generacion_ms=tiempo_generacion_ms,
+                modelo_usado=modelo,
+                tipo_proceso=tipo_proceso,
+                mensaje_error=mensaje_error,
+                embeddings=embeddings
+            )
+        
+        def guardar(lote, textos_lote, vectores, tiempo_generacion_ms):
+            embeddings = embedding_repository.guardar_embeddings_lote(
+                list(zip(lote, textos_lote, vectores)),
+                modelo,
+                version_plantilla=TextProcessor.VERSION_PLANTILLA
+            )
+            registrar(lote, 'generado', tiempo_generacion_ms, embeddings=embeddings)
+            estadisticas['procesados'] += len(lote)
+        
+        def generar_tareas():
+            # Los envíos se cargan por bloques para no materializar todo el corpus en memoria
+            tamano_bloque = getattr(settings, 'EMBEDDING_BATCH_BLOQUE_ENVIOS', 2000)
+            for inicio in range(0, len(envios_ids), tamano_bloque):
+                bloque_ids = envios_ids[inicio:inicio + tamano_bloque]
+                existentes = {
+                    emb.envio_id: emb
+                    for emb in embedding_repository.tabla(modelo).objects
+                    .filter(envio_id__in=bloque_ids, modelo_usado=modelo, embedding_vector__isnull=False)
+                    .defer('embedding_vector', 'texto_indexado')
+                }
+                if not forzar_regeneracion:
+                    estadisticas['omitidos'] += len(existentes)
+                    bloque_ids = [envio_id for envio_id in bloque_ids if envio_id not in existentes]
+                if not bloque_ids:
                     continue
                 
-                # Generar texto y embedding
-                texto = TextProcessor.generar_texto_envio(envio)
-                resultado = EmbeddingService.generar_embedding(texto, modelo)
+                bloque = list(
+                    Envio.objects.filter(id__in=bloque_ids)
+                    .select_related('comprador')
+                    .prefetch_related('productos')
+                )
+                textos = [TextProcessor.generar_texto_envio(envio) for envio in bloque]
+                hashes = [EnvioEmbedding.calcular_hash(texto) for texto in textos]
+                
+                # Contenido sin cambios (mismo hash y modelo): no se regenera
+                sin_cambios = [
+                    i for i, envio in enumerate(bloque)
+                    if envio.id in existentes and existentes[envio.id].hash_contenido == hashes[i]
+                ]
+                if sin_cambios:
+                    registrar(
+                        [bloque[i] for i in sin_cambios], 'omitido', 0,
+                        embeddings=[existentes[bloque[i].id] for i in sin_cambios]
+                    )
+                    estadisticas['omitidos'] += len(sin_cambios)
+                sin_cambios = set(sin_cambios)
                 
-                # Guardar
-                embedding_repository.crear_o_actualizar_embedding(
-                    envio=envio,
-                    texto_indexado=texto,
-                    vector=resultado['embedding'],
-                    modelo=modelo
+                # Textos idénticos comparten vector: los ya calculados se reutilizan
+                # y de los nuevos se pide uno solo por hash
+                conocidos = embedding_repository.obtener_vectores_por_hash(
+                    [hashes[i] for i in range(len(bloque)) if i not in sin_cambios], modelo
                 )
+                reutilizados = [i for i in range(len(bloque)) if i not in sin_cambios and hashes[i] in conocidos]
+                if reutilizados:
+                    guardar(
+                        [bloque[i] for i in reutilizados],
+                        [textos[i] for i in reutilizados],
+                        [conocidos[hashes[i]] for i in reutilizados],
+                        0
+                    )
+                    estadisticas['reutilizados'] += len(reutilizados)
                 
-                procesados += 1
-                tokens_total += resultado['tokens']
-                costo_total += resultado['costo']
+                indices_por_hash = {}
+                for i in range(len(bloque)):
+                    if i not in sin_cambios and hashes[i] not in conocidos:
+                        indices_por_hash.setdefault(hashes[i], []).append(i)
+                unicos = [indices[0] for indices in indices_por_hash.values()]
+                textos_unicos = [textos[i] for i in unicos]
                 
+                for grupo in EmbeddingService.agrupar_por_presupuesto(textos_unicos, max_tokens, max_inputs):
+                    textos_lote = [textos_unicos[j] for j in grupo]
+                    # Cada texto único se guarda en todos los envíos que lo comparten
+                    miembros = [indices_por_hash[hashes[unicos[j]]] for j in grupo]
+                    contexto = (bloque, textos, miembros, time.time())
+                    yield (
+                        contexto,
+                        lambda textos_lote=textos_lote: EmbeddingService.generar_embeddings_lote(
+                            textos_lote, modelo, reintentos_cliente=False
+                        ),
+                        sum(EmbeddingService.estimar_tokens(texto) for texto in textos_lote)
+                    )
+        
+        def al_completar(contexto, resultado, error):
+            bloque, textos, miembros, tiempo_lote = contexto
+            indices = [i for grupo in miembros for i in grupo]
+            lote = [bloque[i] for i in indices]
+            tiempo_generacion_ms = int((time.time() - tiempo_lote) * 1000 / len(lote))
+            try:
+                if error:
+                    raise error
+                vectores = [
+                    vector
+                    for grupo, vector in zip(miembros, resultado['embeddings'])
+                    for _ in grupo
+                ]
+                guardar(lote, [textos[i] for i in indices], vectores, tiempo_generacion_ms)
+                estadisticas['tokens_total'] += resultado['tokens']
+                estadisticas['costo_total'] += resultado['costo']
+                medidor.registrar(len(lote), resultado['tokens'])
             except Exception as e:
-                errores += 1
-                BaseService.log_error(e, f"Error generando embedding para envío {envio.hawb}")
-        
-        return {
-            'total': total,
-            'procesados': procesados,
-            'errores': errores,
-            'omitidos': total - procesados - errores,
-            'tokens_total': tokens_total,
-            'costo_total': round(costo_total, 6),
-            'modelo': modelo
-        }
-
+                estadisticas['errores'] += len(lote)
+                BaseService.log_error(e, f"Error generando lote de {len(lote)} embeddings")
+                registrar(lote, 'error', tiempo_generacion_ms, mensaje_error=str(e))
+            
+            estadisticas['solicitudes'] += 1
+            medidor.reintentos = pool.reintentos
+            medidor.reintentos_transitorios = pool.reintentos_transitorios
+            estadisticas.update(medidor.lectura())
+            if callback_progreso:
+                callback_progreso(estadisticas)
+        
+        pool.ejecutar(generar_tareas(), al_completar)
+        
+        medidor.reintentos = pool.reintentos
+        medidor.reintentos_transitorios = pool.reintentos_transitorios
+        estadisticas.update(medidor.lectura())
+        estadisticas['costo_total'] = round(estadisticas['costo_total'], 6)
+        estadisticas['tiempo_total_s'] = estadisticas['segundos']
+        return estadisticas
+    
+    @staticmethod
+    def generar_embeddings_masivo(
+        envios,
+        modelo: str = None,
+        forzar_regeneracion: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Genera embeddings para múltiples envíos (en lotes por solicitud).
+        
+        Args:
+            envios: QuerySet de envíos
+            modelo: Modelo a usar
+            forzar_regeneracion: Si True, regenera todos
+            
+        Returns:
+            Dict con estadísticas de la operación
+        """
+        return EmbeddingService.generar_embeddings_envios_lote(
+            envios,
+            modelo=modelo,
+            forzar_regeneracion=forzar_regeneracion
+        )
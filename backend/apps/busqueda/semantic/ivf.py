@@ -0,0 +1,135 @@
+"""
+IVF - Particionado del índice vectorial en listas por centroides de k-means
+
+Los centroides se entrenan con el comando entrenar_ivf y se persisten en
+SEMANTIC_IVF_DIR/ivf_<modelo>.npz. El índice en memoria asigna cada envío a la
+lista de su centroide más cercano y, en cada consulta, solo puntúa las filas de
+las SEMANTIC_IVF_NPROBE listas más cercanas a la consulta.
+"""
+from typing import Dict, Any, Optional
+import os
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+FILAS_POR_BLOQUE = 16384
+
+
+def ivf_habilitado() -> bool:
+    return getattr(settings, 'SEMANTIC_IVF', True)
+
+
+def ruta_centroides(modelo: str) -> str:
+    directorio = getattr(settings, 'SEMANTIC_IVF_DIR', os.path.join(settings.BASE_DIR, 'data', 'ivf'))
+    return os.path.join(str(directorio), f'ivf_{modelo}.npz')
+
+
+def normalizar_filas(matriz: np.ndarray) -> np.ndarray:
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return matriz / np.where(normas == 0, 1, normas)
+
+
+def cargar_centroides(modelo: str) -> Optional[Dict[str, Any]]:
+    """
+    Lee el archivo de centroides del modelo.
+
+    Returns:
+        dict con 'centroides' (medias, float32), 'conteos' (vectores por lista),
+        'fecha_entrenamiento', 'mtime'; None si no existe
+    """
+    ruta = ruta_centroides(modelo)
+    if not os.path.exists(ruta):
+        return None
+    with np.load(ruta) as datos:
+        return {
+            'centroides': datos['centroides'].astype(np.float32),
+            'conteos': datos['conteos'].astype(np.int64),
+            'fecha_entrenamiento': str(datos['fecha_entrenamiento']),
+            'mtime': os.path.getmtime(ruta),
+        }
+
+
+def guardar_centroides(modelo: str, centroides: np.ndarray, conteos: np.ndarray, fecha_entrenamiento=None) -> str:
+    """Persiste los centroides de forma atómica (archivo temporal + rename)"""
+    ruta = ruta_centroides(modelo)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.tmp.npz'
+    np.savez(
+        temporal,
+        centroides=np.asarray(centroides, dtype=np.float32),
+        conteos=np.asarray(conteos, dtype=np.int64),
+        fecha_entrenamiento=(fecha_entrenamiento or timezone.now()).isoformat(),
+    )
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def asignar_listas(vectores: np.ndarray, centroides_normalizados: np.ndarray) -> np.ndarray:
+    """Lista (centroide de mayor similitud coseno) de cada fila, calculada por bloques"""
+    listas = np.empty(vectores.shape[0], dtype=np.int32)
+    for inicio in range(0, vectores.shape[0], FILAS_POR_BLOQUE):
+        bloque = np.asarray(vectores[inicio:inicio + FILAS_POR_BLOQUE], dtype=np.float32)
+        listas[inicio:inicio + bloque.shape[0]] = np.argmax(bloque @ centroides_normalizados.T, axis=1)
+    return listas
+
+
+def entrenar_centroides(vectores: np.ndarray, listas: int, muestra: int = None, semilla: int = 42):
+    """
+    Entrena k-means (MiniBatchKMeans de scikit-learn) sobre vectores normalizados.
+
+    Args:
+        vectores: Matriz (n, dimensiones)
+        listas: Cantidad de centroides
+        muestra: Si se indica, entrena con a lo sumo esa cantidad de filas al azar
+        semilla: Semilla para reproducibilidad
+
+    Returns:
+        (centroides, conteos) con los conteos de todas las filas de vectores
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    vectores = normalizar_filas(vectores)
+    entrenamiento = vectores
+    if muestra and vectores.shape[0] > muestra:
+        rng = np.random.default_rng(semilla)
+        entrenamiento = vectores[rng.choice(vectores.shape[0], muestra, replace=False)]
+
+    kmeans = MiniBatchKMeans(
+        n_clusters=listas,
+        batch_size=max(1024, listas * 4),
+        n_init=3,
+        random_state=semilla
+    )
+    kmeans.fit(entrenamiento)
+    centroides = kmeans.cluster_centers_.astype(np.float32)
+    conteos = np.bincount(asignar_listas(vectores, normalizar_filas(centroides)), minlength=listas)
+    return centroides, conteos
+
+
+def actualizar_centroides(centroides: np.ndarray, conteos: np.ndarray, vectores: np.ndarray):
+    """
+    Reentrenamiento incremental: cada centroide pasa a ser la media de sus vectores
+    anteriores (conteos) y de los nuevos asignados a él (misma regla que MiniBatchKMeans).
+
+    Returns:
+        (centroides, conteos) actualizados
+    """
+    centroides = np.array(centroides, dtype=np.float32)
+    conteos = np.array(conteos, dtype=np.int64)
+    if len(vectores) == 0:
+        return centroides, conteos
+
+    vectores = normalizar_filas(vectores)
+    listas = asignar_listas(vectores, normalizar_filas(centroides))
+    nuevos = np.bincount(listas, minlength=centroides.shape[0])
+    sumas = np.zeros_like(centroides)
+    np.add.at(sumas, listas, vectores)
+
+    actualizadas = nuevos > 0
+    totales = conteos[actualizadas] + nuevos[actualizadas]
+    centroides[actualizadas] = (
+        centroides[actualizadas] * conteos[actualizadas, None] + sumas[actualizadas]
+    ) / totales[:, None]
+    conteos[actualizadas] = totales
+    return centroides, conteos
@@ -0,0 +1,87 @@
+"""
+Precarga - Carga del índice vectorial en el proceso maestro de gunicorn
+
+Con SEMANTIC_PRELOAD (y preload_app en gunicorn.conf.py) el maestro importa los
+módulos pesados y carga los índices una sola vez antes de hacer fork: los workers
+comparten esas páginas copy-on-write en lugar de construir cada uno su matriz.
+Después del fork cada worker debe abrir sus propias conexiones (BD y OpenAI);
+verificar_despues_de_fork lo garantiza.
+"""
+from typing import Dict, Any, List
+import gc
+import time
+import logging
+import threading
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('apps.busqueda.semantic')
+
+
+def precarga_habilitada() -> bool:
+    return getattr(settings, 'SEMANTIC_PRELOAD', False)
+
+
+def precargar() -> List[Dict[str, Any]]:
+    """
+    Importa numpy, openai y el paquete semántico y carga el índice de cada modelo con
+    embeddings. Cierra las conexiones a la BD al final: un socket abierto en el maestro
+    quedaría compartido por todos los workers.
+
+    Returns:
+        Estadísticas de los índices cargados
+    """
+    import numpy  # noqa: F401
+    import openai  # noqa: F401
+    from apps.busqueda import services  # noqa: F401
+    from .registro_modelos import RegistroModelos
+    from .vector_index import obtener_indice, indice_en_memoria_habilitado
+
+    tiempo_inicio = time.perf_counter()
+    cargados = []
+    try:
+        if indice_en_memoria_habilitado():
+            for modelo in RegistroModelos.modelos():
+                if RegistroModelos.disponible(modelo):
+                    cargados.append(obtener_indice(modelo).estadisticas())
+    finally:
+        connections.close_all()
+
+    if threading.active_count() > 1:
+        logger.warning(
+            f"Precarga: {threading.active_count()} hilos activos en el maestro; "
+            f"los hilos no sobreviven al fork"
+        )
+    # Los objetos de la precarga pasan a la generación permanente del GC: las
+    # recolecciones de los workers no los recorren ni ensucian sus páginas
+    gc.freeze()
+    logger.info(
+        f"Precarga en el maestro: {len(cargados)} índices en "
+        f"{(time.perf_counter() - tiempo_inicio) * 1000:.0f}ms"
+    )
+    return cargados
+
+
+def verificar_despues_de_fork() -> Dict[str, bool]:
+    """
+    Se ejecuta en cada worker recién creado. Descarta las conexiones heredadas del
+    maestro sin cerrarlas (cerrar el socket terminaría la sesión compartida) y el
+    cliente de OpenAI, para que cada worker cree su propio pool HTTP.
+
+    Returns:
+        dict con lo encontrado heredado del maestro: {'conexion_bd': bool, 'cliente_openai': bool}
+    """
+    from .embedding_service import OpenAIClient
+
+    heredado = {'conexion_bd': False, 'cliente_openai': False}
+    for conexion in connections.all(initialized_only=True):
+        if conexion.connection is not None:
+            heredado['conexion_bd'] = True
+            conexion.connection = None
+    if OpenAIClient._instance is not None:
+        heredado['cliente_openai'] = True
+        OpenAIClient.reset()
+
+    if any(heredado.values()):
+        logger.warning(f"Worker con recursos heredados del maestro (descartados): {heredado}")
+    return heredado
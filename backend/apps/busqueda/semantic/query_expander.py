@@ -13,6 +13,10 @@ class QueryExpander:
     """
     Expande consultas de búsqueda con sinónimos, contexto y términos relacionados.
     Mejora significativamente la precisión de búsquedas semánticas.
+    
+    Estado, fechas, peso y valor no están en el texto indexado de los envíos:
+    esas intenciones se devuelven solo como filtros_sugeridos y no se agregan
+    a la consulta que se vectoriza.
     """
     
     # Diccionario de sinónimos para estados de envío
@@ -111,14 +115,14 @@ class QueryExpander:
         # Detectar y expandir componentes
         sinonimos = set()
         contexto = []
+        contexto_filtros = []  # Intenciones aplicadas como filtro (no se vectorizan)
         filtros_sugeridos = {}
         
-        # 1. Expandir estados
+        # 1. Estados: filtro estricto
         estado_detectado = QueryExpander._detectar_estado(consulta_lower)
         if estado_detectado:
-            sinonimos.update(QueryExpander.SINONIMOS_ESTADOS.get(estado_detectado, []))
             filtros_sugeridos['estado'] = estado_detectado
-            contexto.append(f"Estado: {estado_detectado}")
+            contexto_filtros.append(f"Estado: {estado_detectado}")
         
         # 2. Expandir ciudades
         ciudad_detectada = QueryExpander._detectar_ciudad(consulta_lower)
@@ -127,23 +131,21 @@ class QueryExpander:
             filtros_sugeridos['ciudadDestino'] = ciudad_detectada.title()
             contexto.append(f"Ciudad: {ciudad_detectada}")
         
-        # 3. Expandir términos de peso
+        # 3. Peso: filtro numérico
         info_peso = QueryExpander._detectar_peso(consulta_lower)
         if info_peso:
-            sinonimos.update(info_peso['sinonimos'])
             if info_peso.get('filtro_peso'):
-                contexto.append(info_peso['filtro_peso'])
+                contexto_filtros.append(info_peso['filtro_peso'])
             # Agregar filtros numéricos al dict de filtros sugeridos
             if info_peso.get('peso_minimo'):
                 filtros_sugeridos['peso_minimo'] = info_peso['peso_minimo']
             if info_peso.get('peso_maximo'):
                 filtros_sugeridos['peso_maximo'] = info_peso['peso_maximo']
         
-        # 4. Expandir términos de valor
+        # 4. Valor: filtro numérico
         info_valor = QueryExpander._detectar_valor(consulta_lower)
         if info_valor:
-            sinonimos.update(info_valor['sinonimos'])
-            contexto.append(info_valor['contexto'])
+            contexto_filtros.append(info_valor['contexto'])
             # Agregar filtros numéricos de valor
             if info_valor.get('valor_minimo'):
                 filtros_sugeridos['valor_minimo'] = info_valor['valor_minimo']
@@ -157,16 +159,15 @@ class QueryExpander:
                 sinonimos.update(QueryExpander.SINONIMOS_PRODUCTOS.get(producto, []))
             contexto.append(f"Productos: {', '.join(productos_detectados)}")
         
-        # 6. Expandir referencias temporales
+        # 6. Referencias temporales: filtro de fechas
         if incluir_filtros_temporales:
             info_temporal = QueryExpander._detectar_tiempo(consulta_lower)
             if info_temporal:
-                sinonimos.update(info_temporal['sinonimos'])
                 if info_temporal.get('fecha_desde'):
                     filtros_sugeridos['fechaDesde'] = info_temporal['fecha_desde']
                 if info_temporal.get('fecha_hasta'):
                     filtros_sugeridos['fechaHasta'] = info_temporal['fecha_hasta']
-                contexto.append(info_temporal['contexto'])
+                contexto_filtros.append(info_temporal['contexto'])
         
         # 7. Detectar consultas sobre cantidad de productos
         info_cantidad = QueryExpander._detectar_cantidad(consulta_lower)
@@ -208,7 +209,7 @@ class QueryExpander:
             'terminos_originales': list(terminos_originales),
             'sinonimos_agregados': list(sinonimos),
             'filtros_sugeridos': filtros_sugeridos,
-            'contexto_adicional': contexto,
+            'contexto_adicional': contexto + contexto_filtros,
             'peso_query': len(sinonimos) / 10.0  # Score de expansión (0-1)
         }
     
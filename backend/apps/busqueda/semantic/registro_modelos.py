@@ -0,0 +1,217 @@
+"""
+Registro de modelos de embedding: dimensiones, tabla de almacenamiento, índice ANN y cobertura
+"""
+from typing import Dict, Any, List, Optional, Type
+import time
+import threading
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+
+from apps.busqueda.models import EnvioEmbedding, EnvioEmbeddingGrande
+
+
+# Definición estática de cada modelo. Los de 1536 dimensiones comparten embedding_envio
+# (filtrados por modelo_usado); los de 3072 usan embedding_envio_grande con su propio índice.
+# matryoshka: el modelo admite vectores truncados (copia embedding_vector_reducido).
+# indice_halfvec: HNSW opcional sobre embedding_vector::halfvec (comando indice_ann_halfvec);
+# si existe, la búsqueda ANN ordena por esa expresión (índice con la mitad de memoria).
+MODELOS_EMBEDDING: Dict[str, Dict[str, Any]] = {
+    'text-embedding-3-small': {
+        'dimensiones': 1536,
+        'precio_por_1k': 0.00002,   # $0.02 / 1M tokens
+        'tabla': EnvioEmbedding,
+        'indices_ann': [
+            'embedding_envio_vector_hnsw_idx', 'embedding_envio_vector_ivfflat_idx',
+            'embedding_envio_vector_halfvec_hnsw_idx',
+        ],
+        'halfvec': False,
+        'indice_halfvec': 'embedding_envio_vector_halfvec_hnsw_idx',
+        'matryoshka': True,
+        'indices_reducidos': ['embedding_envio_reducido_hnsw_idx'],
+    },
+    'text-embedding-3-large': {
+        'dimensiones': 3072,
+        'precio_por_1k': 0.00013,   # $0.13 / 1M tokens
+        'tabla': EnvioEmbeddingGrande,
+        'indices_ann': ['embedding_envio_grande_vector_hnsw_idx'],
+        'halfvec': True,  # El índice es sobre embedding_vector::halfvec(3072)
+        'indice_halfvec': 'embedding_envio_grande_vector_hnsw_idx',
+        'matryoshka': True,
+        'indices_reducidos': ['embedding_envio_grande_reducido_hnsw_idx'],
+    },
+    'text-embedding-ada-002': {
+        'dimensiones': 1536,
+        'precio_por_1k': 0.0001,    # $0.10 / 1M tokens
+        'tabla': EnvioEmbedding,
+        'indices_ann': [
+            'embedding_envio_vector_hnsw_idx', 'embedding_envio_vector_ivfflat_idx',
+            'embedding_envio_vector_halfvec_hnsw_idx',
+        ],
+        'halfvec': False,
+        'indice_halfvec': 'embedding_envio_vector_halfvec_hnsw_idx',
+        'matryoshka': False,
+        'indices_reducidos': [],
+    },
+}
+
+
+class RegistroModelos:
+    """
+    Consulta el registro de modelos y cachea en memoria (por worker) la cobertura de
+    cada modelo y los índices ANN existentes, para no consultar la BD en cada búsqueda.
+    La caché expira cada SEMANTIC_REGISTRO_TTL segundos; guardar un embedding de un
+    modelo sin cobertura lo marca disponible de inmediato.
+    """
+
+    _lock = threading.Lock()
+    _refresco = threading.Lock()  # Un solo hilo consulta la BD; _lock solo protege el reemplazo
+    _cobertura: Optional[Dict[str, int]] = None
+    _indices: Optional[set] = None
+    _expira = 0.0
+    _generacion = 0  # Cambia con invalidar/marcar_disponible durante una consulta en curso
+
+    # ==================== DEFINICIÓN ====================
+
+    @staticmethod
+    def modelos() -> List[str]:
+        return list(MODELOS_EMBEDDING.keys())
+
+    @staticmethod
+    def info(modelo: str) -> Dict[str, Any]:
+        """Definición del modelo (el por defecto si no está registrado)"""
+        return MODELOS_EMBEDDING.get(modelo) or MODELOS_EMBEDDING[
+            getattr(settings, 'OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+        ]
+
+    @staticmethod
+    def dimensiones(modelo: str) -> int:
+        return RegistroModelos.info(modelo)['dimensiones']
+
+    @staticmethod
+    def tabla(modelo: Optional[str]) -> Type:
+        """Modelo Django donde se guardan los vectores del modelo de embedding"""
+        if modelo is None:
+            return EnvioEmbedding
+        return RegistroModelos.info(modelo)['tabla']
+
+    @staticmethod
+    def tablas() -> List[Type]:
+        return list(dict.fromkeys(info['tabla'] for info in MODELOS_EMBEDDING.values()))
+
+    # ==================== ESTADO (CACHEADO EN MEMORIA) ====================
+
+    @classmethod
+    def _refrescar_si_expiro(cls):
+        if cls._cobertura is not None and time.monotonic() < cls._expira:
+            return
+        # Con un estado anterior disponible no se espera al hilo que ya está consultando
+        if not cls._refresco.acquire(blocking=cls._cobertura is None):
+            return
+        try:
+            if cls._cobertura is not None and time.monotonic() < cls._expira:
+                return
+            generacion = cls._generacion
+            cobertura = {modelo: 0 for modelo in MODELOS_EMBEDDING}
+            for tabla in cls.tablas():
+                conteos = (
+                    tabla.objects
+                    .filter(embedding_vector__isnull=False, envio__deleted_at__isnull=True)
+                    .order_by()
+                    .values('modelo_usado')
+                    .annotate(total=Count('id'))
+                )
+                for fila in conteos:
+                    cobertura[fila['modelo_usado']] = cobertura.get(fila['modelo_usado'], 0) + fila['total']
+            indices = cls._consultar_indices()
+
+            with cls._lock:
+                vigente = cls._generacion == generacion
+                if not vigente and cls._cobertura is not None:
+                    # Modelos marcados disponibles mientras se consultaba
+                    for modelo, total in cls._cobertura.items():
+                        if total and not cobertura.get(modelo):
+                            cobertura[modelo] = total
+                cls._cobertura = cobertura
+                cls._indices = indices
+                # Si hubo cambios durante la consulta, el próximo acceso vuelve a consultar
+                cls._expira = time.monotonic() + getattr(settings, 'SEMANTIC_REGISTRO_TTL', 60) if vigente else 0.0
+        finally:
+            cls._refresco.release()
+
+    @staticmethod
+    def _consultar_indices() -> set:
+        if connection.vendor != 'postgresql':
+            return set()
+        nombres = [
+            nombre
+            for info in MODELOS_EMBEDDING.values()
+            for nombre in info['indices_ann'] + info['indices_reducidos']
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)", [nombres])
+            return {fila[0] for fila in cursor.fetchall()}
+
+    @classmethod
+    def cobertura(cls, modelo: str) -> int:
+        """Embeddings con vector (de envíos activos) del modelo"""
+        cls._refrescar_si_expiro()
+        return cls._cobertura.get(modelo, 0)
+
+    @classmethod
+    def disponible(cls, modelo: str) -> bool:
+        return cls.cobertura(modelo) > 0
+
+    @classmethod
+    def tiene_indice_ann(cls, modelo: str) -> bool:
+        cls._refrescar_si_expiro()
+        return any(nombre in cls._indices for nombre in RegistroModelos.info(modelo)['indices_ann'])
+
+    @classmethod
+    def usa_halfvec(cls, modelo: str) -> bool:
+        """La búsqueda ANN debe ordenar por embedding_vector::halfvec (así está indexada)"""
+        info = RegistroModelos.info(modelo)
+        if info['halfvec']:
+            return True
+        cls._refrescar_si_expiro()
+        return info['indice_halfvec'] in cls._indices
+
+    @classmethod
+    def tiene_indice_reducido(cls, modelo: str) -> bool:
+        """Índice HNSW sobre embedding_vector_reducido (pasada gruesa en SQL)"""
+        cls._refrescar_si_expiro()
+        return any(nombre in cls._indices for nombre in RegistroModelos.info(modelo)['indices_reducidos'])
+
+    @classmethod
+    def marcar_disponible(cls, modelo: str):
+        """Llamado al guardar embeddings: evita esperar al TTL cuando un modelo pasa a tener cobertura"""
+        with cls._lock:
+            if cls._cobertura is not None and not cls._cobertura.get(modelo):
+                cls._cobertura[modelo] = 1
+                cls._generacion += 1
+
+    @classmethod
+    def invalidar(cls):
+        with cls._lock:
+            cls._cobertura = None
+            cls._indices = None
+            cls._expira = 0.0
+            cls._generacion += 1
+
+    @classmethod
+    def estado(cls) -> List[Dict[str, Any]]:
+        """Resumen por modelo para estadísticas y administración"""
+        cls._refrescar_si_expiro()
+        return [
+            {
+                'modelo': modelo,
+                'dimensiones': info['dimensiones'],
+                'tabla': info['tabla']._meta.db_table,
+                'indice_ann': cls.tiene_indice_ann(modelo),
+                'indice_reducido': cls.tiene_indice_reducido(modelo),
+                'halfvec': cls.usa_halfvec(modelo),
+                'cobertura': cls._cobertura.get(modelo, 0),
+                'precio_por_1k': info['precio_por_1k'],
+            }
+            for modelo, info in MODELOS_EMBEDDING.items()
+        ]
@@ -0,0 +1,85 @@
+"""
+Similitud promedio - cosine_similarity_avg de EnvioEmbedding
+
+La similitud coseno promedio de un embedding con los demás no necesita la matriz
+n×n de similitudes: con los vectores normalizados x_i y su suma s = Σ x_j,
+
+    promedio_i = (x_i · s - x_i · x_i) / (n - 1) = (x_i · s - 1) / (n - 1)
+
+El comando calcular_similitud_promedio recorre los embeddings dos veces por bloques
+(la memoria queda acotada a un bloque y el vector suma): la primera pasada acumula s
+en float64 y la segunda puntúa cada bloque con un producto matriz-vector. Un valor
+bajo frente al resto del corpus marca envíos atípicos (texto vacío o mal importado);
+uno muy alto, envíos genéricos o casi duplicados.
+"""
+from typing import Any, Iterable, Iterator, Tuple
+import numpy as np
+
+from .ivf import normalizar_filas
+
+FILAS_POR_BLOQUE = 4096
+
+
+def bloques_normalizados(
+    pares: Iterable[Tuple[int, Any]],
+    filas: int = FILAS_POR_BLOQUE
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Agrupa (id, vector) en bloques normalizados float32.
+
+    Yields:
+        (ids int64, matriz float32 de filas normalizadas; los vectores nulos quedan en cero)
+    """
+    ids, vectores = [], []
+    for identificador, vector in pares:
+        ids.append(identificador)
+        vectores.append(np.asarray(vector, dtype=np.float32))
+        if len(ids) == filas:
+            yield np.array(ids, dtype=np.int64), normalizar_filas(np.stack(vectores))
+            ids, vectores = [], []
+    if ids:
+        yield np.array(ids, dtype=np.int64), normalizar_filas(np.stack(vectores))
+
+
+def acumular_suma(bloques: Iterable[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, int]:
+    """
+    Primera pasada: suma (float64) de los vectores normalizados y cantidad de vectores
+    no nulos, que son los que cuentan como "otros embeddings"
+    """
+    suma, total = None, 0
+    for _, matriz in bloques:
+        if suma is None:
+            suma = np.zeros(matriz.shape[1], dtype=np.float64)
+        suma += matriz.sum(axis=0, dtype=np.float64)
+        total += int(np.count_nonzero(matriz.any(axis=1)))
+    return suma, total
+
+
+def similitud_promedio(matriz: np.ndarray, suma: np.ndarray, total: int) -> np.ndarray:
+    """
+    Segunda pasada: similitud coseno promedio de cada fila (normalizada) con las demás.
+    Las filas nulas y los corpus de un solo vector dan 0.
+    """
+    if total < 2:
+        return np.zeros(matriz.shape[0], dtype=np.float32)
+    propias = np.einsum('ij,ij->i', matriz, matriz)  # 1 por fila normalizada, 0 si es nula
+    return ((matriz @ suma.astype(np.float32) - propias) / (total - 1)).astype(np.float32)
+
+
+def similitud_promedio_exacta(
+    muestra: np.ndarray,
+    bloques: Iterable[Tuple[np.ndarray, np.ndarray]],
+    total: int
+) -> np.ndarray:
+    """
+    Promedio por fuerza bruta para verificar una muestra de filas: producto matriz-matriz
+    de la muestra contra cada bloque del corpus (O(muestra × n)). Las filas de la muestra
+    deben pertenecer al corpus (su similitud consigo mismas se descuenta).
+    """
+    sumas = np.zeros(muestra.shape[0], dtype=np.float64)
+    for _, matriz in bloques:
+        sumas += (muestra @ matriz.T).sum(axis=1, dtype=np.float64)
+    if total < 2:
+        return np.zeros(muestra.shape[0], dtype=np.float32)
+    propias = np.einsum('ij,ij->i', muestra, muestra)
+    return ((sumas - propias) / (total - 1)).astype(np.float32)
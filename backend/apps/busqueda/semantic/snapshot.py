@@ -0,0 +1,161 @@
+"""
+Snapshot - Copia en disco del índice vectorial para arrancar workers sin recorrer la BD
+
+El comando snapshot_indice escribe en SEMANTIC_SNAPSHOT_DIR/<modelo>/ un .npy por
+array del índice (matrices, ids, escalas, columnas de metadatos) y una cabecera
+snapshot.json con el modelo, la configuración del índice y la marca de
+sincronización. Cada worker abre las matrices con np.load(mmap_mode='c'): las
+páginas se comparten en el page cache del sistema operativo y una escritura solo
+copia la página modificada (copy-on-write, el archivo no cambia). Después de
+cargar el snapshot solo se reaplican los cambios posteriores a la marca.
+"""
+from typing import Dict, Any, Optional
+from datetime import datetime
+import os
+import json
+import logging
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('apps.busqueda.semantic')
+
+VERSION_FORMATO = 1
+ARCHIVO_CABECERA = 'snapshot.json'
+ARRAYS_MAPEADOS = ('matriz', 'matriz_reducida')  # El resto es pequeño y se lee completo
+FILAS_POR_BLOQUE = 16384
+
+
+def snapshot_habilitado() -> bool:
+    return getattr(settings, 'SEMANTIC_SNAPSHOT', True)
+
+
+def directorio_snapshot(modelo: str) -> str:
+    directorio = getattr(settings, 'SEMANTIC_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'data', 'snapshots'))
+    return os.path.join(str(directorio), modelo)
+
+
+def leer_cabecera(modelo: str) -> Optional[Dict[str, Any]]:
+    """Cabecera del snapshot del modelo; None si no existe"""
+    ruta = os.path.join(directorio_snapshot(modelo), ARCHIVO_CABECERA)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def guardar_snapshot(indice, marca: datetime, holgura: float = None) -> Dict[str, Any]:
+    """
+    Escribe el snapshot del índice (solo filas activas) y reemplaza la cabecera de forma
+    atómica; los archivos del snapshot anterior se eliminan después (los workers que aún
+    los tienen mapeados conservan el inodo hasta cerrarlos).
+
+    Args:
+        indice: IndiceVectorial ya construido
+        marca: Marca de sincronización (momento previo a leer la BD)
+        holgura: Fracción de filas vacías al final para altas sin realocar la matriz
+            (por defecto SEMANTIC_SNAPSHOT_HOLGURA)
+
+    Returns:
+        La cabecera escrita
+    """
+    if holgura is None:
+        holgura = getattr(settings, 'SEMANTIC_SNAPSHOT_HOLGURA', 0.1)
+
+    directorio = directorio_snapshot(indice.modelo)
+    os.makedirs(directorio, exist_ok=True)
+    sello = timezone.now().strftime('%Y%m%d%H%M%S%f')
+
+    with indice._lock:
+        columnas = indice.columnas()
+        filas = np.flatnonzero(columnas['activos'][:indice._total_filas])
+        capacidad = len(filas) + max(indice.CAPACIDAD_INICIAL, int(len(filas) * holgura))
+        archivos = {}
+        mapeados = []
+        for nombre, valores in columnas.items():
+            archivo = f'{nombre}_{sello}.npy'
+            ruta = os.path.join(directorio, archivo)
+            forma = (capacidad if valores.shape[0] else 0,) + valores.shape[1:]
+            if nombre in ARRAYS_MAPEADOS and int(np.prod(forma)) > 0:
+                # Copia por bloques: no duplica en memoria la matriz completa
+                destino = np.lib.format.open_memmap(ruta, mode='w+', dtype=valores.dtype, shape=forma)
+                for inicio in range(0, len(filas), FILAS_POR_BLOQUE):
+                    bloque = filas[inicio:inicio + FILAS_POR_BLOQUE]
+                    destino[inicio:inicio + len(bloque)] = valores[bloque]
+                destino.flush()
+                del destino
+                mapeados.append(nombre)
+            else:
+                salida = np.zeros(forma, dtype=valores.dtype)
+                if forma[0]:
+                    salida[:len(filas)] = valores[filas]
+                np.save(ruta, salida)
+            archivos[nombre] = archivo
+        vocabularios = indice.vocabularios()
+
+    cabecera = {
+        'version': VERSION_FORMATO,
+        'modelo': indice.modelo,
+        'dimensiones': indice.dimensiones,
+        'dimensiones_reducidas': indice.dimensiones_reducidas,
+        'cuantizacion': indice.cuantizacion,
+        'filas': int(len(filas)),
+        'capacidad': int(capacidad),
+        'marca': marca.isoformat(),
+        'fecha': timezone.now().isoformat(),
+        'archivos': archivos,
+        'mapeados': mapeados,
+        'vocabularios': vocabularios,
+    }
+    temporal = os.path.join(directorio, f'{ARCHIVO_CABECERA}.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(cabecera, f, ensure_ascii=False)
+    os.replace(temporal, os.path.join(directorio, ARCHIVO_CABECERA))
+
+    vigentes = set(archivos.values()) | {ARCHIVO_CABECERA}
+    for archivo in os.listdir(directorio):
+        if archivo.endswith('.npy') and archivo not in vigentes:
+            os.remove(os.path.join(directorio, archivo))
+    return cabecera
+
+
+def cargar_snapshot(indice) -> Optional[datetime]:
+    """
+    Restaura el índice desde el snapshot de su modelo.
+
+    Returns:
+        La marca de sincronización del snapshot, o None si no hay snapshot o no es
+        compatible con la configuración del índice (el llamador carga desde la BD)
+    """
+    cabecera = leer_cabecera(indice.modelo)
+    if cabecera is None:
+        return None
+
+    configuracion = (indice.dimensiones, indice.dimensiones_reducidas, indice.cuantizacion)
+    guardada = (cabecera['dimensiones'], cabecera['dimensiones_reducidas'], cabecera['cuantizacion'])
+    if cabecera.get('version') != VERSION_FORMATO or configuracion != guardada:
+        logger.warning(
+            f"Snapshot de {indice.modelo} incompatible (guardado {guardada}, índice {configuracion}); "
+            f"se carga desde la BD. Regenere con snapshot_indice."
+        )
+        return None
+
+    directorio = directorio_snapshot(indice.modelo)
+    try:
+        columnas = {
+            nombre: np.load(
+                os.path.join(directorio, archivo),
+                mmap_mode='c' if nombre in cabecera['mapeados'] else None
+            )
+            for nombre, archivo in cabecera['archivos'].items()
+        }
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudo abrir el snapshot de {indice.modelo}: {e}; se carga desde la BD")
+        return None
+
+    indice.restaurar(columnas, cabecera['filas'], cabecera['vocabularios'])
+    logger.info(
+        f"Índice vectorial restaurado desde snapshot: modelo={indice.modelo}, filas={cabecera['filas']}, "
+        f"marca={cabecera['marca']}, tiempo={indice.tiempo_construccion_ms:.0f}ms"
+    )
+    return datetime.fromisoformat(cabecera['marca'])
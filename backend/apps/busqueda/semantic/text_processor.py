@@ -12,6 +12,10 @@ class TextProcessor:
     Centraliza la lógica de generación de texto descriptivo.
     """
     
+    # Versión de la plantilla de generar_texto_envio; incrementar al cambiar su contenido
+    # 2: sin estado, fechas relativas, peso ni valor (atributos filtrables)
+    VERSION_PLANTILLA = 2
+    
     # TODO: Normaliza acentos y caracteres especiales a su equivalente sin acento.
     @staticmethod
     def normalizar_acentos(texto: str) -> str:
@@ -186,7 +190,11 @@ class TextProcessor:
     def generar_texto_envio(envio) -> str:
         """
         Genera texto descriptivo del envío para indexación semántica.
-        Versión mejorada con más contexto y repetición de información importante.
+        
+        Solo incluye contenido estable (código, comprador, ubicación, productos y
+        observaciones). Estado, fecha, peso y valor son atributos filtrables de Envio
+        y se aplican como filtros desde QueryExpander: si estuvieran en el texto, el
+        vector quedaría desactualizado con cada cambio de estado o con el paso de los días.
         
         Args:
             envio: Instancia del modelo Envio
@@ -194,43 +202,13 @@ class TextProcessor:
         Returns:
             str: Texto descriptivo completo del envío
         """
-        # Información principal (ordenada por importancia semántica)
-        estado_display = envio.get_estado_display()
-        estado_lower = estado_display.lower()
-        
-        # MEJORADO: Más variaciones del estado para mejor matching
+        # Código identificador primero (más importante para búsqueda)
         partes = [
-            # Estado y código identificador primero (más importante para búsqueda)
-            f"Envío {envio.hawb} con estado {estado_display}",
-            f"Estado del envío: {estado_display}",
-            f"Estado: {estado_lower}",
+            f"Envío {envio.hawb}",
             f"Código HAWB: {envio.hawb}",
             f"Paquete {envio.hawb}",
         ]
         
-        # Agregar variaciones del estado para mejor búsqueda
-        if 'pendiente' in estado_lower:
-            partes.extend([
-                "envío pendiente",
-                "no entregado",
-                "sin procesar",
-                "esperando entrega"
-            ])
-        elif 'transito' in estado_lower or 'en camino' in estado_lower:
-            partes.extend([
-                "en tránsito",
-                "en camino",
-                "enviado",
-                "no entregado aún"
-            ])
-        elif 'entregado' in estado_lower:
-            partes.extend([
-                "entregado",
-                "recibido",
-                "completado",
-                "ya entregado"
-            ])
-        
         # Información del comprador (si existe)
         if envio.comprador:
             nombre_comprador = envio.comprador.nombre
@@ -264,80 +242,11 @@ class TextProcessor:
             if envio.comprador.canton:
                 partes.append(f"Cantón: {envio.comprador.canton}")
         
-        # Información temporal (MEJORADO con más variaciones)
-        fecha_str = envio.fecha_emision.strftime('%Y-%m-%d')
-        fecha_humana = envio.fecha_emision.strftime('%d de %B de %Y')
-        mes_nombre = envio.fecha_emision.strftime('%B')
-        anio = envio.fecha_emision.strftime('%Y')
-        
-        partes.extend([
-            f"Fecha de emisión: {fecha_str}",
-            f"Fecha: {fecha_str}",
-            f"Registrado el: {fecha_humana}",
-            f"Mes: {mes_nombre}",
-            f"Año: {anio}",
-        ])
-        
-        # Agregar información temporal contextual
-        from django.utils import timezone
-        hoy = timezone.now().date()
-        dias_antiguedad = (hoy - envio.fecha_emision.date()).days
-        
-        if dias_antiguedad == 0:
-            partes.append("registrado hoy")
-        elif dias_antiguedad == 1:
-            partes.append("registrado ayer")
-        elif dias_antiguedad <= 7:
-            partes.extend(["registrado esta semana", "envío reciente", "hace pocos días"])
-        elif dias_antiguedad <= 30:
-            partes.extend(["registrado este mes", "envío reciente"])
-        elif dias_antiguedad <= 60:
-            partes.append("registrado el mes pasado")
-        
-        # Información de envío (MEJORADO con clasificaciones)
-        peso = float(envio.peso_total)
-        valor = float(envio.valor_total)
-        
-        partes.extend([
-            f"Peso total: {peso} kg",
-            f"Peso: {peso} kg",
-            f"Pesa {peso} kilogramos",
-        ])
-        
-        # Clasificación de peso para mejor búsqueda
-        if peso < 1:
-            partes.extend(["paquete liviano", "poco peso", "ligero"])
-        elif peso < 5:
-            partes.extend(["peso moderado", "peso medio"])
-        elif peso < 10:
-            partes.extend(["peso considerable", "bastante pesado"])
-        else:
-            partes.extend(["paquete pesado", "mucho peso", "peso alto"])
-        
-        # Información de valor
-        partes.extend([
-            f"Valor total: ${valor}",
-            f"Valor: ${valor}",
-            f"Precio: ${valor}",
-            f"Costo del servicio: ${envio.costo_servicio}",
-        ])
-        
-        # Clasificación de valor para mejor búsqueda
-        if valor < 50:
-            partes.extend(["valor bajo", "económico", "barato"])
-        elif valor < 200:
-            partes.extend(["valor moderado", "precio medio"])
-        elif valor < 500:
-            partes.extend(["valor considerable", "costoso"])
-        else:
-            partes.extend(["valor alto", "muy costoso", "caro", "requiere revisión"])
-        
         # Información de productos (muy importante para búsquedas de productos)
-        # MEJORADO: Incluye más información y sinónimos para mejor búsqueda semántica
-        productos = envio.productos.all()
-        if productos.exists():
+        productos = list(envio.productos.all())
+        if productos:
             descripciones = []
-            descripciones_completas = []  # Con detalles adicionales
+            descripciones_completas = []  # Con cantidad
             categorias = []
             categorias_sinonimos = []  # Sinónimos de categorías
             
@@ -350,60 +259,37 @@ class TextProcessor:
                 'otros': ['misceláneos', 'varios', 'diversos', 'otros artículos']
             }
             
-            # Procesar todos los productos (no limitar a 5)
             for producto in productos:
                 descripcion = producto.descripcion
                 descripciones.append(descripcion)
                 
-                # Crear descripción completa con detalles
                 descripcion_completa = descripcion
-                if producto.peso:
-                    descripcion_completa += f" peso {producto.peso}kg"
                 if producto.cantidad > 1:
                     descripcion_completa += f" cantidad {producto.cantidad}"
-                if producto.valor:
-                    descripcion_completa += f" valor ${producto.valor}"
                 descripciones_completas.append(descripcion_completa)
                 
                 # Categorías y sinónimos
                 cat_display = producto.get_categoria_display()
                 if cat_display not in categorias:
                     categorias.append(cat_display)
-                    # Agregar sinónimos de la categoría
                     cat_key = producto.categoria
                     if cat_key in sinonimos_categorias:
                         categorias_sinonimos.extend(sinonimos_categorias[cat_key])
             
             # Agregar información de productos de múltiples formas para mejor matching
-            if descripciones:
-                # Lista completa de productos
-                partes.append(f"Productos incluidos: {', '.join(descripciones)}")
-                # Versión corta con primeros productos
-                partes.append(f"Contiene: {', '.join(descripciones[:5])}")
-                # Descripciones con detalles
-                partes.append(f"Productos con detalles: {' | '.join(descripciones_completas[:10])}")
-                # Cada producto individualmente para mejor matching
-                for desc in descripciones[:10]:
-                    partes.append(f"Producto: {desc}")
+            partes.append(f"Productos incluidos: {', '.join(descripciones)}")
+            partes.append(f"Contiene: {', '.join(descripciones[:5])}")
+            partes.append(f"Productos con detalles: {' | '.join(descripciones_completas[:10])}")
+            for desc in descripciones[:10]:
+                partes.append(f"Producto: {desc}")
             
-            # Categorías
-            if categorias:
-                partes.append(f"Categorías de productos: {', '.join(categorias)}")
-                # Agregar sinónimos de categorías
-                if categorias_sinonimos:
-                    partes.append(f"Tipos de productos: {', '.join(set(categorias_sinonimos))}")
+            # Categorías (sinónimos en orden estable: el texto debe ser determinista)
+            partes.append(f"Categorías de productos: {', '.join(categorias)}")
+            if categorias_sinonimos:
+                partes.append(f"Tipos de productos: {', '.join(dict.fromkeys(categorias_sinonimos))}")
             
-            # Información numérica de productos
             partes.append(f"Cantidad total de productos: {envio.cantidad_total}")
             partes.append(f"Total de artículos: {envio.cantidad_total}")
-            
-            # Información agregada de productos
-            peso_total_productos = sum(p.peso * p.cantidad for p in productos)
-            valor_total_productos = sum(p.valor * p.cantidad for p in productos)
-            if peso_total_productos > 0:
-                partes.append(f"Peso total productos: {peso_total_productos} kg")
-            if valor_total_productos > 0:
-                partes.append(f"Valor total productos: ${valor_total_productos}")
         
         # Observaciones (pueden contener información relevante)
         if envio.observaciones:
@@ -412,11 +298,11 @@ class TextProcessor:
         
         # Resumen descriptivo al final
         if envio.comprador:
-            resumen = f"Envío {envio.hawb} {estado_display} para {envio.comprador.nombre}"
+            resumen = f"Envío {envio.hawb} para {envio.comprador.nombre}"
             if envio.comprador.ciudad:
                 resumen += f" en {envio.comprador.ciudad}"
         else:
-            resumen = f"Envío {envio.hawb} {estado_display}"
+            resumen = f"Envío {envio.hawb}"
         partes.append(resumen)
         
         # Concatenar todas las partes
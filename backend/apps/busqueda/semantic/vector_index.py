@@ -0,0 +1,977 @@
+"""
+Vector Index - Índice vectorial residente en memoria por modelo de embedding
+"""
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from datetime import datetime, timedelta, timezone as dt_timezone
+import os
+import sys
+import time
+import logging
+import threading
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .ivf import ivf_habilitado, ruta_centroides, cargar_centroides, asignar_listas, normalizar_filas
+from .snapshot import snapshot_habilitado, cargar_snapshot
+
+logger = logging.getLogger('apps.busqueda.semantic')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _microsegundos(fecha: datetime) -> int:
+    """Fecha como microsegundos desde epoch (UTC), para comparar en arrays int64"""
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return (fecha - _EPOCH) // timedelta(microseconds=1)
+
+
+class FiltroMetadatos:
+    """
+    Filtros estructurados de la búsqueda semántica que el índice resuelve con máscaras
+    booleanas sobre sus columnas de metadatos (mismos criterios que
+    BusquedaSemanticaService._obtener_envios_filtrados, sin consultar la BD).
+
+    Args:
+        comprador_id: Solo envíos de este comprador (permisos de compradores)
+        sin_permisos: El usuario no puede ver ningún envío
+        estado: Estado exacto del envío
+        fecha_desde / fecha_hasta: Rango de fecha_emision (inclusive)
+        ciudad: Subcadena de la ciudad del comprador (sin distinguir mayúsculas)
+        lineas_minima: Mínimo de líneas de producto
+        cantidad_minima: Mínimo de cantidad_total
+        peso_minimo / peso_maximo, valor_minimo / valor_maximo: Rangos de peso y valor
+        ids_validados: Envíos del índice aún sin metadatos que ya cumplen el filtro
+            (validados en SQL, ver IndiceVectorial.ids_sin_metadatos)
+    """
+
+    def __init__(
+        self,
+        comprador_id: int = None,
+        sin_permisos: bool = False,
+        estado: str = None,
+        fecha_desde: datetime = None,
+        fecha_hasta: datetime = None,
+        ciudad: str = None,
+        lineas_minima: int = None,
+        cantidad_minima: int = None,
+        peso_minimo: float = None,
+        peso_maximo: float = None,
+        valor_minimo: float = None,
+        valor_maximo: float = None,
+        ids_validados: Iterable[int] = None
+    ):
+        self.comprador_id = comprador_id
+        self.sin_permisos = sin_permisos
+        self.estado = estado or None
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.ciudad = ciudad or None
+        self.lineas_minima = lineas_minima
+        self.cantidad_minima = cantidad_minima
+        self.peso_minimo = peso_minimo
+        self.peso_maximo = peso_maximo
+        self.valor_minimo = valor_minimo
+        self.valor_maximo = valor_maximo
+        self.ids_validados = ids_validados
+
+    @property
+    def activo(self) -> bool:
+        return self.sin_permisos or any(
+            valor is not None for valor in (
+                self.comprador_id, self.estado, self.fecha_desde, self.fecha_hasta, self.ciudad,
+                self.lineas_minima, self.cantidad_minima, self.peso_minimo, self.peso_maximo,
+                self.valor_minimo, self.valor_maximo
+            )
+        )
+
+
+class IndiceVectorial:
+    """
+    Matriz contigua con filas pre-normalizadas, mapa id→fila y tombstones.
+
+    Se carga una sola vez por proceso y luego se mantiene al día con
+    actualizaciones incrementales (agregar_o_actualizar / eliminar). Una consulta
+    es un producto matriz-vector más un top-k con argpartition.
+
+    Con dimensiones_reducidas (Matryoshka) se mantiene además una matriz con el
+    prefijo renormalizado de cada fila: la consulta recorre esa matriz (6x menos
+    bytes con 256 de 1536 dimensiones) y re-rankea con los vectores completos solo
+    los mejores candidatos_reducidos.
+
+    Con cuantizacion='float16' o 'int8' (escala por fila) las matrices ocupan 1/2 o 1/4
+    de la memoria y las similitudes que retorna buscar() son aproximadas: la búsqueda
+    semántica re-puntúa los candidatos con los vectores float32 de la BD.
+
+    Con centroides IVF (configurar_ivf) cada fila pertenece a la lista de su centroide
+    más cercano y la consulta solo puntúa las filas de las nprobe listas más cercanas.
+
+    Cada fila lleva además columnas de metadatos (fecha_emision, estado, comprador,
+    ciudad, cantidades, peso y valor) cargadas con actualizar_metadatos: un
+    FiltroMetadatos se convierte en una máscara booleana antes de puntuar. Las fechas
+    se resuelven con búsqueda binaria sobre una permutación ordenada.
+    """
+
+    CAPACIDAD_INICIAL = 1024
+    CUANTIZACIONES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+    FILAS_POR_BLOQUE = 16384  # Acota la copia float32 temporal al puntuar matrices cuantizadas
+    COLUMNAS_METADATOS = {
+        'fecha': np.int64,       # fecha_emision en microsegundos desde epoch
+        'estado': np.int16,      # código en _codigos_estado
+        'comprador': np.int64,
+        'ciudad': np.int32,      # código en _codigos_ciudad
+        'cantidad': np.int32,
+        'lineas': np.int32,
+        'peso': np.float64,
+        'valor': np.float64,
+        'con_metadatos': bool,
+    }
+
+    def __init__(
+        self,
+        modelo: str,
+        dimensiones: int = None,
+        dimensiones_reducidas: int = 0,
+        cuantizacion: str = 'float32'
+    ):
+        self.modelo = modelo
+        self.dimensiones = dimensiones or getattr(settings, 'OPENAI_EMBEDDING_DIMENSIONS', 1536)
+        self.dimensiones_reducidas = (
+            dimensiones_reducidas if 0 < dimensiones_reducidas < self.dimensiones else 0
+        )
+        if cuantizacion not in self.CUANTIZACIONES:
+            raise ValueError(f"Cuantización no soportada: {cuantizacion}")
+        self.cuantizacion = cuantizacion
+        self._dtype = self.CUANTIZACIONES[cuantizacion]
+        self._centroides: Optional[np.ndarray] = None
+        self.ivf_mtime = None
+        # Vocabularios de las columnas categóricas; sobreviven a _crecer y compactar
+        self._codigos_estado: Dict[str, int] = {}
+        self._codigos_ciudad: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        # Un solo hilo por índice aplica la sincronización incremental; los demás siguen buscando
+        self._sincronizacion = threading.Lock()
+        self._reiniciar(self.CAPACIDAD_INICIAL)
+        self.cargado = False
+        self.tiempo_construccion_ms = 0.0
+        self.fecha_construccion = None
+        self.marca_sincronizacion = None
+        self.ultima_sincronizacion = 0.0
+
+    def _reiniciar(self, capacidad: int):
+        capacidad_escalas = capacidad if self.cuantizacion == 'int8' else 0
+        self._matriz = np.zeros((capacidad, self.dimensiones), dtype=self._dtype)
+        self._matriz_reducida = np.zeros((capacidad, self.dimensiones_reducidas), dtype=self._dtype)
+        self._escalas = np.ones(capacidad_escalas, dtype=np.float32)
+        self._escalas_reducidas = np.ones(capacidad_escalas, dtype=np.float32)
+        self._ids = np.zeros(capacidad, dtype=np.int64)
+        self._activos = np.zeros(capacidad, dtype=bool)
+        self._listas = np.zeros(capacidad, dtype=np.int32)
+        self._metadatos = {
+            columna: np.zeros(capacidad, dtype=dtype) for columna, dtype in self.COLUMNAS_METADATOS.items()
+        }
+        self._orden_fecha: Optional[np.ndarray] = None
+        self._fechas_ordenadas: Optional[np.ndarray] = None
+        self._fila_por_id: Dict[int, int] = {}
+        self._total_filas = 0
+
+    # ==================== CONSTRUCCIÓN ====================
+
+    def construir(self, pares: Iterable[Tuple[int, Any]], total: int = None):
+        """
+        Construye el índice desde cero.
+
+        Args:
+            pares: Iterable de tuplas (envio_id, vector)
+            total: Cantidad esperada de filas (evita realocaciones si se conoce)
+        """
+        tiempo_inicio = time.perf_counter()
+
+        with self._lock:
+            self._reiniciar(max(total or 0, self.CAPACIDAD_INICIAL))
+            for envio_id, vector in pares:
+                self._escribir_fila(envio_id, vector, asignar_lista=False)
+            self._asignar_listas()
+            self.cargado = True
+            self.tiempo_construccion_ms = (time.perf_counter() - tiempo_inicio) * 1000
+            self.fecha_construccion = timezone.now()
+
+        logger.info(
+            f"Índice vectorial construido: modelo={self.modelo}, filas={self.total_activos}, "
+            f"memoria={self.memoria_bytes / 1024 / 1024:.1f}MB, "
+            f"tiempo={self.tiempo_construccion_ms:.0f}ms"
+        )
+
+    def _escribir_fila(self, envio_id: int, vector, asignar_lista: bool = True) -> bool:
+        """Escribe (o sobrescribe) la fila normalizada de un envío. Requiere el lock."""
+        vec = np.asarray(vector, dtype=np.float32)
+        if vec.ndim != 1 or vec.shape[0] != self.dimensiones:
+            return False
+
+        norma = np.linalg.norm(vec)
+        if norma == 0:
+            return False
+
+        fila = self._fila_por_id.get(envio_id)
+        if fila is None:
+            if self._total_filas == self._matriz.shape[0]:
+                self._crecer()
+            fila = self._total_filas
+            self._total_filas += 1
+            self._fila_por_id[envio_id] = fila
+            self._ids[fila] = envio_id
+            self._orden_fecha = None
+
+        vec = vec / norma
+        if asignar_lista and self._centroides is not None:
+            self._listas[fila] = int(np.argmax(self._centroides @ vec))
+        self._codificar(self._matriz, self._escalas, fila, vec)
+        if self.dimensiones_reducidas:
+            self._codificar(self._matriz_reducida, self._escalas_reducidas, fila, self._reducir(vec))
+        self._activos[fila] = True
+        return True
+
+    def _codificar(self, matriz: np.ndarray, escalas: np.ndarray, fila: int, vec: np.ndarray):
+        """Escribe la fila normalizada en la precisión del índice (int8: escala max|v|/127)"""
+        if self.cuantizacion == 'int8':
+            escala = float(np.abs(vec).max()) / 127 or 1.0
+            matriz[fila] = np.rint(vec / escala)
+            escalas[fila] = escala
+        else:
+            matriz[fila] = vec
+
+    def _puntuar(self, matriz: np.ndarray, escalas: np.ndarray, filas, consulta: np.ndarray) -> np.ndarray:
+        """
+        Producto en float32 sobre las filas indicadas (None: todas): matriz-vector con una
+        consulta (d,) o matriz-matriz con varias (d, n). Las matrices cuantizadas se
+        convierten por bloques para no duplicar la memoria.
+        """
+        if self.cuantizacion == 'float32':
+            return (matriz if filas is None else matriz[filas]) @ consulta
+
+        total = matriz.shape[0] if filas is None else filas.shape[0]
+        scores = np.empty((total,) + consulta.shape[1:], dtype=np.float32)
+        for inicio in range(0, total, self.FILAS_POR_BLOQUE):
+            fin = min(inicio + self.FILAS_POR_BLOQUE, total)
+            bloque = matriz[inicio:fin] if filas is None else matriz[filas[inicio:fin]]
+            scores[inicio:fin] = bloque.astype(np.float32) @ consulta
+        if self.cuantizacion == 'int8':
+            factores = escalas if filas is None else escalas[filas]
+            scores *= factores.reshape((-1,) + (1,) * (consulta.ndim - 1))
+        return scores
+
+    def _reducir(self, vec: np.ndarray) -> np.ndarray:
+        """Prefijo de dimensiones_reducidas componentes, renormalizado"""
+        prefijo = vec[..., :self.dimensiones_reducidas]
+        norma = np.linalg.norm(prefijo, axis=-1, keepdims=True)
+        return prefijo / np.where(norma == 0, 1, norma)
+
+    def columnas(self) -> Dict[str, np.ndarray]:
+        """Arrays por fila del índice (capacidad completa), por nombre"""
+        return {
+            'matriz': self._matriz,
+            'matriz_reducida': self._matriz_reducida,
+            'escalas': self._escalas,
+            'escalas_reducidas': self._escalas_reducidas,
+            'ids': self._ids,
+            'activos': self._activos,
+            'listas': self._listas,
+            **{f'meta_{columna}': valores for columna, valores in self._metadatos.items()},
+        }
+
+    def _arrays_por_fila(self) -> Tuple[np.ndarray, ...]:
+        return tuple(self.columnas().values())
+
+    def _crecer(self):
+        """Duplica la capacidad de la matriz. Requiere el lock."""
+        anteriores = self._arrays_por_fila()
+        total = self._total_filas
+        fila_por_id = self._fila_por_id
+        self._reiniciar(self._matriz.shape[0] * 2)
+        nuevos = self._arrays_por_fila()
+        for nuevo, anterior in zip(nuevos, anteriores):
+            nuevo[:total] = anterior[:total]
+        self._fila_por_id = fila_por_id
+        self._total_filas = total
+
+    # ==================== ACTUALIZACIONES INCREMENTALES ====================
+
+    def agregar_o_actualizar(self, envio_id: int, vector) -> bool:
+        """Agrega o reemplaza el vector de un envío"""
+        with self._lock:
+            return self._escribir_fila(envio_id, vector)
+
+    def eliminar(self, envio_id: int) -> bool:
+        """Marca la fila del envío como eliminada (tombstone)"""
+        with self._lock:
+            fila = self._fila_por_id.get(envio_id)
+            if fila is None or not self._activos[fila]:
+                return False
+            self._activos[fila] = False
+            return True
+
+    def compactar(self):
+        """Reconstruye la matriz sin las filas eliminadas"""
+        with self._lock:
+            filas = np.flatnonzero(self._activos[:self._total_filas])
+            matriz = self._matriz[filas].copy()
+            matriz_reducida = self._matriz_reducida[filas].copy()
+            escalas = self._escalas[filas].copy() if self._escalas.size else None
+            escalas_reducidas = self._escalas_reducidas[filas].copy() if self._escalas_reducidas.size else None
+            ids = self._ids[filas].copy()
+            listas = self._listas[filas].copy()
+            metadatos = {columna: valores[filas].copy() for columna, valores in self._metadatos.items()}
+            self._reiniciar(max(len(filas), self.CAPACIDAD_INICIAL))
+            self._listas[:len(filas)] = listas
+            for columna, valores in metadatos.items():
+                self._metadatos[columna][:len(filas)] = valores
+            self._matriz[:len(filas)] = matriz
+            self._matriz_reducida[:len(filas)] = matriz_reducida
+            if escalas is not None:
+                self._escalas[:len(filas)] = escalas
+                self._escalas_reducidas[:len(filas)] = escalas_reducidas
+            self._ids[:len(filas)] = ids
+            self._activos[:len(filas)] = True
+            self._fila_por_id = {int(envio_id): i for i, envio_id in enumerate(ids)}
+            self._total_filas = len(filas)
+
+    # ==================== SNAPSHOT ====================
+
+    def vocabularios(self) -> Dict[str, Dict[str, int]]:
+        return {'estado': dict(self._codigos_estado), 'ciudad': dict(self._codigos_ciudad)}
+
+    def restaurar(self, columnas: Dict[str, np.ndarray], total: int, vocabularios: Dict[str, Dict[str, int]]):
+        """
+        Reemplaza el contenido del índice por arrays ya construidos (snapshot en disco).
+        Las matrices pueden ser np.memmap en modo copy-on-write: las páginas no
+        modificadas se comparten entre procesos a través del page cache.
+        """
+        tiempo_inicio = time.perf_counter()
+        with self._lock:
+            self._matriz = columnas['matriz']
+            self._matriz_reducida = columnas['matriz_reducida']
+            self._escalas = columnas['escalas']
+            self._escalas_reducidas = columnas['escalas_reducidas']
+            self._ids = columnas['ids']
+            self._activos = columnas['activos']
+            self._listas = columnas['listas']
+            self._metadatos = {columna: columnas[f'meta_{columna}'] for columna in self.COLUMNAS_METADATOS}
+            self._codigos_estado = dict(vocabularios.get('estado', {}))
+            self._codigos_ciudad = dict(vocabularios.get('ciudad', {}))
+            self._orden_fecha = None
+            self._fechas_ordenadas = None
+            self._total_filas = total
+            self._fila_por_id = {
+                int(envio_id): fila for fila, envio_id in enumerate(self._ids[:total].tolist())
+            }
+            self._asignar_listas()
+            self.cargado = True
+            self.tiempo_construccion_ms = (time.perf_counter() - tiempo_inicio) * 1000
+            self.fecha_construccion = timezone.now()
+
+    @property
+    def mapeado(self) -> bool:
+        """True mientras la matriz siga siendo el np.memmap del snapshot"""
+        return isinstance(self._matriz, np.memmap)
+
+    # ==================== METADATOS ====================
+
+    def actualizar_metadatos(self, filas: Iterable[Tuple]) -> int:
+        """
+        Carga o reemplaza las columnas de metadatos de envíos ya indexados.
+
+        Args:
+            filas: Iterable de tuplas (envio_id, fecha_emision, estado, comprador_id,
+                ciudad, cantidad_total, lineas, peso_total, valor_total)
+
+        Returns:
+            Cantidad de filas actualizadas (se ignoran los envíos sin vector en el índice)
+        """
+        actualizadas = 0
+        with self._lock:
+            meta = self._metadatos
+            for envio_id, fecha, estado, comprador_id, ciudad, cantidad, lineas, peso, valor in filas:
+                fila = self._fila_por_id.get(envio_id)
+                if fila is None:
+                    continue
+                meta['fecha'][fila] = _microsegundos(fecha) if fecha else 0
+                meta['estado'][fila] = self._codigo(self._codigos_estado, estado)
+                meta['comprador'][fila] = comprador_id or 0
+                meta['ciudad'][fila] = self._codigo(self._codigos_ciudad, ciudad)
+                meta['cantidad'][fila] = cantidad or 0
+                meta['lineas'][fila] = lineas or 0
+                meta['peso'][fila] = float(peso or 0)
+                meta['valor'][fila] = float(valor or 0)
+                meta['con_metadatos'][fila] = fecha is not None
+                actualizadas += 1
+            if actualizadas:
+                self._orden_fecha = None
+        return actualizadas
+
+    @staticmethod
+    def _codigo(vocabulario: Dict[str, int], valor: Optional[str]) -> int:
+        if not valor:
+            return -1
+        return vocabulario.setdefault(valor, len(vocabulario))
+
+    def _mascara(self, filtro: Optional[FiltroMetadatos], total: int) -> np.ndarray:
+        """Filas activas que cumplen el filtro. Requiere el lock."""
+        mascara = self._activos[:total].copy()
+        if filtro is None or not filtro.activo:
+            return mascara
+        if filtro.sin_permisos:
+            mascara[:] = False
+            return mascara
+
+        activos = mascara.copy()
+        mascara = self._mascara_metadatos(filtro, mascara, total)
+        # Las filas aún sin metadatos no se pueden validar con las columnas: entran
+        # solo las que el llamador validó en SQL
+        if filtro.ids_validados:
+            filas = [self._fila_por_id[i] for i in filtro.ids_validados if i in self._fila_por_id]
+            filas = np.array([fila for fila in filas if fila < total], dtype=np.int64)
+            mascara[filas] = activos[filas]
+        return mascara
+
+    def _mascara_metadatos(self, filtro: FiltroMetadatos, mascara: np.ndarray, total: int) -> np.ndarray:
+        """Aplica las columnas de metadatos sobre la máscara de filas activas. Requiere el lock."""
+        meta = {columna: valores[:total] for columna, valores in self._metadatos.items()}
+        mascara &= meta['con_metadatos']
+
+        if filtro.comprador_id is not None:
+            mascara &= meta['comprador'] == filtro.comprador_id
+        if filtro.estado:
+            codigo = self._codigos_estado.get(filtro.estado)
+            if codigo is None:
+                mascara[:] = False
+                return mascara
+            mascara &= meta['estado'] == codigo
+        if filtro.ciudad:
+            subcadena = filtro.ciudad.lower()
+            codigos = [codigo for ciudad, codigo in self._codigos_ciudad.items() if subcadena in ciudad.lower()]
+            mascara &= np.isin(meta['ciudad'], np.array(codigos, dtype=np.int32))
+        if filtro.fecha_desde is not None or filtro.fecha_hasta is not None:
+            mascara &= self._mascara_fechas(filtro.fecha_desde, filtro.fecha_hasta, total)
+        if filtro.lineas_minima is not None:
+            mascara &= meta['lineas'] >= filtro.lineas_minima
+        elif filtro.cantidad_minima is not None:
+            mascara &= meta['cantidad'] >= filtro.cantidad_minima
+        if filtro.peso_minimo is not None:
+            mascara &= meta['peso'] >= float(filtro.peso_minimo)
+        if filtro.peso_maximo is not None:
+            mascara &= meta['peso'] <= float(filtro.peso_maximo)
+        if filtro.valor_minimo is not None:
+            mascara &= meta['valor'] >= float(filtro.valor_minimo)
+        if filtro.valor_maximo is not None:
+            mascara &= meta['valor'] <= float(filtro.valor_maximo)
+        return mascara
+
+    def _mascara_fechas(self, desde: Optional[datetime], hasta: Optional[datetime], total: int) -> np.ndarray:
+        """
+        Rango de fecha_emision con búsqueda binaria sobre la permutación ordenada por fecha
+        (se recalcula solo cuando cambian filas o metadatos). Requiere el lock.
+        """
+        if self._orden_fecha is None or self._orden_fecha.shape[0] != total:
+            self._orden_fecha = np.argsort(self._metadatos['fecha'][:total], kind='stable')
+            self._fechas_ordenadas = self._metadatos['fecha'][:total][self._orden_fecha]
+
+        inicio = np.searchsorted(self._fechas_ordenadas, _microsegundos(desde), 'left') if desde else 0
+        fin = np.searchsorted(self._fechas_ordenadas, _microsegundos(hasta), 'right') if hasta else total
+        mascara = np.zeros(total, dtype=bool)
+        mascara[self._orden_fecha[inicio:fin]] = True
+        return mascara
+
+    def contar(self, filtro: Optional[FiltroMetadatos] = None) -> int:
+        """Envíos activos del índice que cumplen el filtro"""
+        with self._lock:
+            return int(np.count_nonzero(self._mascara(filtro, self._total_filas)))
+
+    def ids_sin_metadatos(self) -> List[int]:
+        """Envíos activos cuyas columnas de metadatos aún no se cargaron"""
+        with self._lock:
+            total = self._total_filas
+            filas = np.flatnonzero(self._activos[:total] & ~self._metadatos['con_metadatos'][:total])
+            return self._ids[filas].tolist()
+
+    # ==================== IVF ====================
+
+    def configurar_ivf(self, centroides: Optional[np.ndarray]):
+        """Activa (o desactiva con None) el particionado IVF y reasigna todas las filas"""
+        with self._lock:
+            self._centroides = None if centroides is None else normalizar_filas(centroides)
+            self._asignar_listas()
+
+    def _asignar_listas(self):
+        """
+        Asigna cada fila a su lista IVF por bloques. Requiere el lock.
+        La escala por fila de int8 no cambia el argmax, no hace falta aplicarla.
+        """
+        if self._centroides is None:
+            return
+        self._listas[:self._total_filas] = asignar_listas(self._matriz[:self._total_filas], self._centroides)
+
+    @property
+    def listas_ivf(self) -> int:
+        return 0 if self._centroides is None else int(self._centroides.shape[0])
+
+    def contiene(self, envio_id: int) -> bool:
+        fila = self._fila_por_id.get(envio_id)
+        return fila is not None and bool(self._activos[fila])
+
+    # ==================== BÚSQUEDA ====================
+
+    def buscar(
+        self,
+        vector_consulta,
+        k: int = 20,
+        envios_ids: Optional[Iterable[int]] = None,
+        candidatos_reducidos: int = None,
+        nprobe: int = None,
+        filtro: Optional[FiltroMetadatos] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Obtiene los k envíos con mayor similitud coseno.
+
+        Args:
+            vector_consulta: Vector de la consulta
+            k: Cantidad de resultados
+            envios_ids: Restringe la búsqueda a estos envíos (permisos y filtros)
+            candidatos_reducidos: Candidatos de la pasada reducida que se re-rankean
+                con el vector completo (por defecto SEMANTIC_MATRYOSHKA_CANDIDATOS)
+            nprobe: Listas IVF a recorrer (por defecto SEMANTIC_IVF_NPROBE); más listas,
+                más recall y más latencia
+            filtro: Filtros de metadatos aplicados como máscara antes de puntuar
+
+        Returns:
+            Lista de tuplas (envio_id, similitud_coseno) ordenada de mayor a menor
+            (aproximada si el índice está cuantizado)
+        """
+        consulta = np.asarray(vector_consulta, dtype=np.float32)
+        norma = np.linalg.norm(consulta)
+        if norma == 0 or consulta.shape[0] != self.dimensiones:
+            return []
+        consulta = consulta / norma
+
+        # Snapshot bajo lock; el cálculo se hace fuera para no bloquear a otros lectores
+        with self._lock:
+            total = self._total_filas
+            matriz = self._matriz[:total]
+            matriz_reducida = self._matriz_reducida[:total]
+            escalas = self._escalas[:total]
+            escalas_reducidas = self._escalas_reducidas[:total]
+            ids = self._ids[:total]
+            listas = self._listas[:total]
+            centroides = self._centroides
+            mascara = self._mascara(filtro, total)
+
+        if envios_ids is not None:
+            ids_permitidos = np.fromiter(envios_ids, dtype=np.int64)
+            mascara &= np.isin(ids, ids_permitidos)
+
+        filas = np.flatnonzero(mascara)
+        if filas.size == 0:
+            return []
+
+        if candidatos_reducidos is None:
+            candidatos_reducidos = getattr(settings, 'SEMANTIC_MATRYOSHKA_CANDIDATOS', 400)
+        candidatos_reducidos = max(candidatos_reducidos, k)
+        rango_completo = filas.size == total
+
+        if centroides is not None:
+            if nprobe is None:
+                nprobe = getattr(settings, 'SEMANTIC_IVF_NPROBE', 8)
+            if nprobe < centroides.shape[0]:
+                # Solo las filas de las nprobe listas más cercanas; si no alcanzan para
+                # el top-k (p. ej. pocos envíos permitidos) se recorren todas
+                sondeadas = np.zeros(centroides.shape[0], dtype=bool)
+                sondeadas[np.argpartition(-(centroides @ consulta), nprobe - 1)[:nprobe]] = True
+                filas_ivf = filas[sondeadas[listas[filas]]]
+                if filas_ivf.size >= k:
+                    filas = filas_ivf
+                    rango_completo = False
+
+        if self.dimensiones_reducidas and filas.size > candidatos_reducidos:
+            # Pasada gruesa con la matriz reducida; solo los mejores candidatos se
+            # puntúan con la matriz completa (similitudes exactas)
+            scores_reducidos = self._puntuar(
+                matriz_reducida, escalas_reducidas, None if rango_completo else filas, self._reducir(consulta)
+            )
+            preseleccion = np.argpartition(-scores_reducidos, candidatos_reducidos - 1)[:candidatos_reducidos]
+            filas = filas[preseleccion]
+            rango_completo = False
+
+        scores = self._puntuar(matriz, escalas, None if rango_completo else filas, consulta)
+
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        filas_top = top if rango_completo else filas[top]
+
+        return [(int(ids[f]), float(s)) for f, s in zip(filas_top, scores[top])]
+
+    def buscar_lote(
+        self,
+        vectores_consulta,
+        k: int = 20,
+        candidatos_reducidos: int = None,
+        filtro: Optional[FiltroMetadatos] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k de varias consultas con un solo producto matriz-matriz (GEMM): la matriz
+        del índice se recorre una vez para todo el lote en lugar de una vez por consulta,
+        por bloques de filas con un top-k acumulado (_top_k_por_bloques).
+
+        Recorre todas las filas que cumplen el filtro (sin IVF): con varias consultas la
+        lectura de la matriz se amortiza y las listas sondeadas diferirían por consulta.
+        Con dimensiones reducidas la pasada gruesa es una GEMM sobre la matriz reducida y
+        cada consulta re-puntúa solo su preselección con la matriz completa.
+
+        Args:
+            vectores_consulta: Matriz (n, dimensiones) o lista de vectores
+            k: Cantidad de resultados por consulta
+            candidatos_reducidos: Candidatos de la pasada reducida (ver buscar)
+            filtro: Filtros de metadatos comunes a todo el lote
+
+        Returns:
+            Una lista de tuplas (envio_id, similitud_coseno) por consulta, en el mismo
+            orden; vacía para consultas nulas o de otra dimensión
+        """
+        consultas = np.asarray(vectores_consulta, dtype=np.float32)
+        if consultas.ndim != 2 or consultas.shape[1] != self.dimensiones:
+            return [[] for _ in range(len(vectores_consulta))]
+        normas = np.linalg.norm(consultas, axis=1)
+        validas = np.flatnonzero(normas > 0)
+        resultados = [[] for _ in range(consultas.shape[0])]
+        if validas.size == 0:
+            return resultados
+        consultas = consultas[validas] / normas[validas, None]
+
+        with self._lock:
+            total = self._total_filas
+            matriz = self._matriz[:total]
+            matriz_reducida = self._matriz_reducida[:total]
+            escalas = self._escalas[:total]
+            escalas_reducidas = self._escalas_reducidas[:total]
+            ids = self._ids[:total]
+            mascara = self._mascara(filtro, total)
+
+        filas = np.flatnonzero(mascara)
+        if filas.size == 0:
+            return resultados
+        rango_completo = filas.size == total
+        k = min(k, filas.size)
+
+        if candidatos_reducidos is None:
+            candidatos_reducidos = getattr(settings, 'SEMANTIC_MATRYOSHKA_CANDIDATOS', 400)
+        candidatos_reducidos = max(candidatos_reducidos, k)
+
+        if self.dimensiones_reducidas and filas.size > candidatos_reducidos:
+            preselecciones, _ = self._top_k_por_bloques(
+                matriz_reducida, escalas_reducidas, None if rango_completo else filas,
+                self._reducir(consultas).T, candidatos_reducidos
+            )
+            for columna, posicion in enumerate(validas):
+                filas_consulta = preselecciones[:, columna]
+                scores = self._puntuar(matriz, escalas, filas_consulta, consultas[columna])
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                resultados[posicion] = [
+                    (int(ids[f]), float(s)) for f, s in zip(filas_consulta[top], scores[top])
+                ]
+            return resultados
+
+        filas_top, scores_top = self._top_k_por_bloques(
+            matriz, escalas, None if rango_completo else filas, consultas.T, k
+        )
+        for columna, posicion in enumerate(validas):
+            resultados[posicion] = [
+                (int(ids[f]), float(s)) for f, s in zip(filas_top[:, columna], scores_top[:, columna])
+            ]
+        return resultados
+
+    def _top_k_por_bloques(
+        self,
+        matriz: np.ndarray,
+        escalas: np.ndarray,
+        filas: Optional[np.ndarray],
+        consultas: np.ndarray,
+        k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k por columna de matriz[filas] @ consultas (d, n) recorriendo las filas en
+        bloques de FILAS_POR_BLOQUE con un top-k acumulado: la memoria temporal es
+        O((bloque + k) × n) en lugar de la matriz filas × consultas completa.
+
+        Returns:
+            (filas (k, n) de la matriz, scores (k, n)), cada columna en orden descendente
+        """
+        cantidad = matriz.shape[0] if filas is None else filas.size
+        n = consultas.shape[1]
+        mejores_filas = np.empty((0, n), dtype=np.int64)
+        mejores_scores = np.empty((0, n), dtype=np.float32)
+        for inicio in range(0, cantidad, self.FILAS_POR_BLOQUE):
+            fin = min(inicio + self.FILAS_POR_BLOQUE, cantidad)
+            if filas is None:
+                filas_bloque = np.arange(inicio, fin, dtype=np.int64)
+                scores = self._puntuar(matriz[inicio:fin], escalas[inicio:fin], None, consultas)
+            else:
+                filas_bloque = filas[inicio:fin].astype(np.int64)
+                scores = self._puntuar(matriz, escalas, filas_bloque, consultas)
+            candidatas = np.concatenate([mejores_filas, np.broadcast_to(filas_bloque[:, None], scores.shape)])
+            scores = np.concatenate([mejores_scores, scores])
+            if scores.shape[0] > k:
+                top = np.argpartition(-scores, k - 1, axis=0)[:k]
+                candidatas = np.take_along_axis(candidatas, top, axis=0)
+                scores = np.take_along_axis(scores, top, axis=0)
+            mejores_filas, mejores_scores = candidatas, scores
+        orden = np.argsort(-mejores_scores, axis=0, kind='stable')
+        return np.take_along_axis(mejores_filas, orden, axis=0), np.take_along_axis(mejores_scores, orden, axis=0)
+
+    # ==================== ESTADÍSTICAS ====================
+
+    @property
+    def total_activos(self) -> int:
+        return int(np.count_nonzero(self._activos[:self._total_filas]))
+
+    @property
+    def memoria_bytes(self) -> int:
+        """Memoria aproximada del índice (matriz, arrays y mapa id→fila)"""
+        return int(
+            self._matriz.nbytes + self._matriz_reducida.nbytes
+            + self._escalas.nbytes + self._escalas_reducidas.nbytes
+            + self._ids.nbytes + self._activos.nbytes
+            + sum(valores.nbytes for valores in self._metadatos.values())
+            + sys.getsizeof(self._fila_por_id)
+            + len(self._fila_por_id) * 2 * 28  # claves y valores int de Python
+        )
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Métricas del índice para dimensionar los workers de gunicorn"""
+        return {
+            'modelo': self.modelo,
+            'dimensiones': self.dimensiones,
+            'dimensiones_reducidas': self.dimensiones_reducidas,
+            'cuantizacion': self.cuantizacion,
+            'ivf_listas': self.listas_ivf,
+            'cargado': self.cargado,
+            'mapeado': self.mapeado,
+            'filas_activas': self.total_activos,
+            'filas_eliminadas': self._total_filas - self.total_activos,
+            'filas_con_metadatos': int(np.count_nonzero(
+                self._metadatos['con_metadatos'][:self._total_filas] & self._activos[:self._total_filas]
+            )),
+            'capacidad': int(self._matriz.shape[0]),
+            'memoria_mb': round(self.memoria_bytes / 1024 / 1024, 2),
+            'tiempo_construccion_ms': round(self.tiempo_construccion_ms, 2),
+            'fecha_construccion': self.fecha_construccion.isoformat() if self.fecha_construccion else None,
+        }
+
+
+# ==================== REGISTRO DE ÍNDICES POR MODELO ====================
+
+_indices: Dict[str, IndiceVectorial] = {}
+_indices_lock = threading.Lock()
+_cargas: Dict[str, threading.Lock] = {}
+
+
+def indice_en_memoria_habilitado() -> bool:
+    return getattr(settings, 'SEMANTIC_INDEX_EN_MEMORIA', False)
+
+
+def dimensiones_reducidas(modelo: str) -> int:
+    """Dimensiones de la pasada gruesa del modelo (0 si no admite Matryoshka o está desactivada)"""
+    from .registro_modelos import RegistroModelos
+    from apps.busqueda.models import DIMENSIONES_REDUCIDAS
+    if not getattr(settings, 'SEMANTIC_MATRYOSHKA', True) or not RegistroModelos.info(modelo)['matryoshka']:
+        return 0
+    return getattr(settings, 'SEMANTIC_MATRYOSHKA_DIMENSIONES', DIMENSIONES_REDUCIDAS)
+
+
+def crear_indice(modelo: str) -> IndiceVectorial:
+    """Índice vacío del modelo con la configuración de settings (Matryoshka, cuantización)"""
+    from .registro_modelos import RegistroModelos
+    return IndiceVectorial(
+        modelo,
+        RegistroModelos.dimensiones(modelo),
+        dimensiones_reducidas=dimensiones_reducidas(modelo),
+        cuantizacion=getattr(settings, 'SEMANTIC_INDEX_CUANTIZACION', 'float32')
+    )
+
+
+def obtener_indice(modelo: str) -> IndiceVectorial:
+    """
+    Obtiene el índice residente del modelo, cargándolo desde la BD la primera vez.
+    En llamadas posteriores aplica los cambios ocurridos en otros procesos
+    (sincronización incremental por fecha_generacion).
+
+    La carga inicial construye un índice nuevo fuera de los locks de búsqueda y lo
+    publica en el registro al terminar; solo esperan los hilos que piden el mismo
+    modelo. La sincronización la aplica un único hilo mientras los demás buscan.
+    """
+    indice = _indices.get(modelo)
+    if indice is None:
+        with _indices_lock:
+            carga = _cargas.setdefault(modelo, threading.Lock())
+        with carga:
+            indice = _indices.get(modelo)
+            if indice is None:
+                indice = crear_indice(modelo)
+                cargar_indice(indice)
+                sincronizar_ivf(indice)
+                with _indices_lock:
+                    _indices[modelo] = indice
+        return indice
+
+    intervalo = getattr(settings, 'SEMANTIC_INDEX_SYNC_SEGUNDOS', 30)
+    if (
+        time.monotonic() - indice.ultima_sincronizacion >= intervalo
+        and indice._sincronizacion.acquire(blocking=False)
+    ):
+        try:
+            sincronizar_indice(indice)
+            sincronizar_ivf(indice)
+        finally:
+            indice._sincronizacion.release()
+
+    return indice
+
+
+def cargar_indice(indice: IndiceVectorial, usar_snapshot: bool = True):
+    """
+    Carga el índice desde el snapshot en disco (si existe y es compatible) más los
+    cambios posteriores a su marca; si no, lee todos los embeddings del modelo de la BD
+    """
+    from apps.busqueda.repositories import embedding_repository
+
+    if usar_snapshot and snapshot_habilitado():
+        marca = cargar_snapshot(indice)
+        if marca is not None:
+            indice.marca_sincronizacion = marca
+            sincronizar_indice(indice)
+            return
+
+    marca = timezone.now()
+    total = embedding_repository.contar_vectores_activos(indice.modelo)
+    indice.construir(
+        embedding_repository.iterar_vectores(indice.modelo),
+        total=total
+    )
+    indice.actualizar_metadatos(embedding_repository.iterar_metadatos(indice.modelo))
+    indice.marca_sincronizacion = marca
+    indice.ultima_sincronizacion = time.monotonic()
+
+
+def sincronizar_indice(indice: IndiceVectorial):
+    """
+    Aplica al índice los embeddings generados, los envíos eliminados, los envíos
+    restaurados y los metadatos modificados desde la última sincronización. Necesario
+    con varios workers: los signals solo actualizan el índice del proceso que hizo el
+    cambio.
+
+    Los cambios se leen completos de la BD antes de tocar el índice: el lock de
+    búsqueda solo se toma para aplicarlos.
+    """
+    from apps.busqueda.repositories import embedding_repository
+
+    marca = timezone.now()
+    desde = indice.marca_sincronizacion
+
+    vectores = list(embedding_repository.iterar_vectores(indice.modelo, desde=desde))
+    eliminados = embedding_repository.obtener_envios_eliminados_desde(desde)
+    metadatos = list(embedding_repository.iterar_metadatos(indice.modelo, desde=desde))
+
+    # Un envío restaurado vuelve a estar activo sin que su embedding cambie: su vector
+    # no llega por fecha_generacion, pero sí aparece entre los envíos modificados
+    actualizados = {envio_id for envio_id, _ in vectores}
+    restaurados = [
+        fila[0] for fila in metadatos
+        if fila[0] not in actualizados and not indice.contiene(fila[0])
+    ]
+    if restaurados:
+        vectores += embedding_repository.obtener_vectores_por_envios(restaurados, modelo=indice.modelo)
+
+    with indice._lock:
+        nuevos = [envio_id for envio_id, _ in vectores if not indice.contiene(envio_id)]
+        for envio_id, vector in vectores:
+            indice.agregar_o_actualizar(envio_id, vector)
+        for envio_id in eliminados:
+            indice.eliminar(envio_id)
+        indice.actualizar_metadatos(metadatos)
+
+    # Metadatos de los envíos nuevos que no cambiaron desde la marca
+    pendientes = set(nuevos) - {fila[0] for fila in metadatos}
+    if pendientes:
+        indice.actualizar_metadatos(
+            list(embedding_repository.iterar_metadatos(indice.modelo, envios_ids=pendientes))
+        )
+
+    indice.marca_sincronizacion = marca
+    indice.ultima_sincronizacion = time.monotonic()
+
+
+def sincronizar_ivf(indice: IndiceVectorial):
+    """Carga (o recarga si el archivo cambió) los centroides IVF del modelo"""
+    ruta = ruta_centroides(indice.modelo)
+    mtime = os.path.getmtime(ruta) if ivf_habilitado() and os.path.exists(ruta) else None
+    if mtime == indice.ivf_mtime:
+        return
+
+    datos = cargar_centroides(indice.modelo) if mtime is not None else None
+    if datos is not None and datos['centroides'].shape[1] != indice.dimensiones:
+        logger.warning(
+            f"Centroides IVF de {indice.modelo} con {datos['centroides'].shape[1]} dimensiones "
+            f"(índice de {indice.dimensiones}); se ignoran. Reentrene con entrenar_ivf."
+        )
+        datos = None
+
+    indice.configurar_ivf(datos['centroides'] if datos is not None else None)
+    indice.ivf_mtime = mtime
+    logger.info(f"IVF de {indice.modelo}: listas={indice.listas_ivf}")
+
+
+def notificar_embedding_actualizado(modelo: str, envio_id: int, vector, metadatos: bool = True):
+    """
+    Actualiza el índice del modelo si ya está cargado en este proceso.
+    Con metadatos=False los metadatos de un envío nuevo quedan a cargo del llamador
+    (guardar_embeddings_lote los lee con una sola consulta para todo el lote).
+    """
+    indice = _indices.get(modelo)
+    if indice is not None and indice.cargado:
+        nuevo = not indice.contiene(envio_id)
+        if indice.agregar_o_actualizar(envio_id, vector) and nuevo and metadatos:
+            refrescar_metadatos([envio_id], modelo=modelo)
+
+
+def refrescar_metadatos(envios_ids: Iterable[int], modelo: str = None):
+    """
+    Relee de la BD los metadatos de filtrado de los envíos en los índices cargados
+    (todos, o solo el del modelo indicado)
+    """
+    from apps.busqueda.repositories import embedding_repository
+
+    envios_ids = list(envios_ids)
+    if not envios_ids:
+        return
+    for indice in list(_indices.values()):
+        if indice.cargado and (modelo is None or indice.modelo == modelo):
+            indice.actualizar_metadatos(
+                embedding_repository.iterar_metadatos(indice.modelo, envios_ids=envios_ids)
+            )
+
+
+def notificar_envio_eliminado(envio_id: int):
+    """Marca el envío como eliminado en todos los índices cargados"""
+    for indice in list(_indices.values()):
+        indice.eliminar(envio_id)
+
+
+def estadisticas_indices() -> List[Dict[str, Any]]:
+    return [indice.estadisticas() for indice in list(_indices.values())]
+
+
+def reiniciar_indices():
+    """Descarta todos los índices cargados (útil para testing)"""
+    with _indices_lock:
+        _indices.clear()
+        _cargas.clear()
@@ -121,6 +121,95 @@ class DotProductStrategy(SimilarityStrategy):
         return "dot_product"
 
 
+# ==================== RESULTADOS COLUMNARES ====================
+
+class ResultadosSimilitud:
+    """
+    Resultados de similitud en formato columnar (un array NumPy por métrica).
+    
+    Las distancias euclidiana y Manhattan se calculan de forma perezosa: sobre todo
+    el conjunto solo si se ordena por ellas, y si no, únicamente para las filas que
+    se convierten a dict al final.
+    """
+    
+    METRICAS_DESCENDENTES = ('cosine_similarity', 'dot_product', 'score_combinado', 'score_rrf')
+    METRICAS_ASCENDENTES = ('euclidean_distance', 'manhattan_distance')
+    
+    def __init__(
+        self,
+        envio_ids: np.ndarray,
+        matriz: np.ndarray,
+        consulta: np.ndarray,
+        columnas: Dict[str, np.ndarray]
+    ):
+        self.envio_ids = envio_ids
+        self._matriz = matriz
+        self._consulta = consulta
+        self.norma_consulta = float(np.linalg.norm(consulta))
+        self.columnas = columnas
+    
+    def __len__(self) -> int:
+        return int(self.envio_ids.shape[0])
+    
+    def metrica(self, nombre: str) -> np.ndarray:
+        """Obtiene la columna de una métrica, calculando las distancias si hace falta"""
+        if nombre not in self.columnas and nombre in self.METRICAS_ASCENDENTES:
+            self.columnas.update(self._distancias(self._matriz))
+        return self.columnas[nombre]
+    
+    def _distancias(self, matriz: np.ndarray) -> Dict[str, np.ndarray]:
+        diferencias = matriz - self._consulta
+        return {
+            'euclidean_distance': np.linalg.norm(diferencias, axis=1),
+            'manhattan_distance': np.sum(np.abs(diferencias), axis=1),
+        }
+    
+    def seleccionar(self, indices: np.ndarray) -> 'ResultadosSimilitud':
+        """Subconjunto de filas (máscara booleana o índices), en ese orden"""
+        return ResultadosSimilitud(
+            self.envio_ids[indices],
+            self._matriz[indices],
+            self._consulta,
+            {nombre: columna[indices] for nombre, columna in self.columnas.items()}
+        )
+    
+    def a_dicts(self) -> List[Dict]:
+        """Convierte las filas a dicts (usar solo sobre el top-k final)"""
+        if len(self) == 0:
+            return []
+        columnas = dict(self.columnas)
+        if 'euclidean_distance' not in columnas:
+            columnas.update(self._distancias(self._matriz))
+        
+        resultados = []
+        for i in range(len(self)):
+            norma_envio = float(columnas['norma_envio'][i])
+            dot_product = float(columnas['dot_product'][i])
+            resultados.append({
+                'envio_id': int(self.envio_ids[i]),
+                'cosine_similarity': float(columnas['cosine_similarity'][i]),
+                'dot_product': dot_product,
+                'euclidean_distance': float(columnas['euclidean_distance'][i]),
+                'manhattan_distance': float(columnas['manhattan_distance'][i]),
+                'score_combinado': float(columnas['score_combinado'][i]),
+                'boost_exactas': float(columnas['boost_exactas'][i]),
+                'boost_productos': float(columnas['boost_productos'][i]),
+                'coincidencias_exactas': float(columnas['coincidencias_exactas'][i]),
+                # Información adicional para debugging/visualización
+                'norma_envio': norma_envio,
+                'norma_consulta': self.norma_consulta,
+                'dot_product_normalizado': (
+                    dot_product / (norma_envio * self.norma_consulta)
+                    if norma_envio > 0 and self.norma_consulta > 0 else 0.0
+                )
+            })
+            if 'score_rrf' in columnas:
+                # Solo en búsqueda híbrida (fusión léxica + vectorial)
+                resultados[-1]['score_rrf'] = float(columnas['score_rrf'][i])
+                resultados[-1]['coincidencia_lexica'] = bool(columnas['rango_lexico'][i] > 0)
+        return resultados
+
+
 # ==================== SERVICIO DE BÚSQUEDA ====================
 
 class VectorSearchService(BaseService):
@@ -146,144 +235,158 @@ class VectorSearchService(BaseService):
         embedding_consulta: List[float],
         embeddings_envios: List[Tuple],
         texto_consulta: str = "",
-        textos_indexados: Dict[int, str] = None
-    ) -> List[Dict]:
+        textos_indexados: Dict[int, str] = None,
+        metrica_ordenamiento: str = None
+    ) -> ResultadosSimilitud:
         """
-        Calcula múltiples métricas de similitud entre la consulta y los embeddings.
-        OPTIMIZADO: Usa operaciones vectorizadas de NumPy para máximo rendimiento.
+        Calcula las métricas de similitud entre la consulta y los embeddings.
+        OPTIMIZADO: Todo vectorizado con NumPy; no se crea ningún dict por candidato.
         
         Args:
             embedding_consulta: Vector de la consulta
-            embeddings_envios: Lista de tuplas (envio_id, vector_embedding, envio_obj)
+            embeddings_envios: Lista de tuplas (envio_id, vector_embedding). El envío no
+                se necesita para puntuar; se carga después solo para el top-k.
             texto_consulta: Texto de la consulta original (opcional, para boost)
             textos_indexados: Diccionario {envio_id: texto_indexado} (opcional)
+            metrica_ordenamiento: Si es una distancia, se calcula para todos los candidatos;
+                si no, solo para las filas finales
         
         Returns:
-            List[Dict]: Lista de resultados con métricas de similitud
+            ResultadosSimilitud: Métricas en formato columnar
         """
+        consulta_vec = np.asarray(embedding_consulta, dtype=np.float32)
         if not embeddings_envios:
-            return []
+            return ResultadosSimilitud(
+                np.empty(0, dtype=np.int64),
+                np.empty((0, consulta_vec.shape[0]), dtype=np.float32),
+                consulta_vec,
+                {nombre: np.empty(0, dtype=np.float32) for nombre in (
+                    'cosine_similarity', 'dot_product', 'score_combinado', 'boost_exactas',
+                    'boost_productos', 'coincidencias_exactas', 'norma_envio'
+                )}
+            )
         
         # ==================== VECTORIZACIÓN MASIVA ====================
-        # Extraer datos en listas separadas para procesamiento batch
-        envio_ids = []
-        envio_objs = []
-        vectores_envios = []
-        
-        for envio_id, vector_envio, envio_obj in embeddings_envios:
-            envio_ids.append(envio_id)
-            envio_objs.append(envio_obj)
-            vectores_envios.append(vector_envio)
+        envio_ids = np.fromiter((e[0] for e in embeddings_envios), dtype=np.int64, count=len(embeddings_envios))
+        matriz_envios = np.asarray([e[1] for e in embeddings_envios], dtype=np.float32)
         
-        # Convertir a matrices NumPy de una sola vez (MUCHO más rápido)
-        consulta_vec = np.array(embedding_consulta, dtype=np.float32)
-        matriz_envios = np.array(vectores_envios, dtype=np.float32)
-        
-        # Pre-calcular norma de consulta (una sola vez)
         consulta_norm = np.linalg.norm(consulta_vec)
-        
-        # ==================== CÁLCULOS VECTORIZADOS ====================
-        # Todas las operaciones se realizan en paralelo sobre la matriz completa
-        
-        # 1. Normas de todos los envíos (vectorizado)
         normas_envios = np.linalg.norm(matriz_envios, axis=1)
+        dot_products = matriz_envios @ consulta_vec
         
-        # 2. Productos punto de todos los envíos con la consulta (vectorizado)
-        dot_products = np.dot(matriz_envios, consulta_vec)
-        
-        # 3. Similitud Coseno vectorizada
-        # Evitar división por cero
         denominadores = normas_envios * consulta_norm
         denominadores = np.where(denominadores == 0, 1e-10, denominadores)
         cosine_similarities = dot_products / denominadores
         
-        # 4. Distancia Euclidiana vectorizada
-        diferencias = matriz_envios - consulta_vec
-        euclidean_distances = np.linalg.norm(diferencias, axis=1)
-        
-        # 5. Distancia Manhattan vectorizada
-        manhattan_distances = np.sum(np.abs(diferencias), axis=1)
-        
-        # ==================== BOOST POR TEXTO (OPTIMIZADO) ====================
-        # Pre-calcular boost para productos una sola vez
+        # ==================== BOOST POR TEXTO (VECTORIZADO) ====================
+        coincidencias, boost_productos = self._calcular_coincidencias(
+            envio_ids, texto_consulta, textos_indexados
+        )
         es_consulta_productos = VectorSearchService._es_consulta_productos(texto_consulta) if texto_consulta else False
         boost_base = 0.25 if es_consulta_productos else 0.15
-        
-        # Pre-procesar consulta para coincidencias
-        consulta_lower = texto_consulta.lower() if texto_consulta else ""
-        palabras_consulta = set(consulta_lower.split()) if consulta_lower else set()
-        
-        # Palabras clave para boost de productos (pre-procesado)
+        boost_exactas = coincidencias * boost_base + np.minimum(boost_productos, 0.10)
+        
+        # Score combinado
+        score_combinado = np.minimum((cosine_similarities + 1) / 2 + boost_exactas, 1.0)
+        
+        resultados = ResultadosSimilitud(
+            envio_ids,
+            matriz_envios,
+            consulta_vec,
+            {
+                'cosine_similarity': cosine_similarities,
+                'dot_product': dot_products,
+                'score_combinado': score_combinado,
+                'boost_exactas': boost_exactas,
+                'boost_productos': boost_productos,
+                'coincidencias_exactas': coincidencias,
+                'norma_envio': normas_envios,
+            }
+        )
+        if metrica_ordenamiento in ResultadosSimilitud.METRICAS_ASCENDENTES:
+            resultados.metrica(metrica_ordenamiento)
+        return resultados
+    
+    @staticmethod
+    def _calcular_coincidencias(
+        envio_ids: np.ndarray,
+        texto_consulta: str,
+        textos_indexados: Optional[Dict[int, str]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Proporción de palabras de la consulta presentes en cada texto indexado y boost
+        de productos. Busca ' palabra ' en los textos con np.char (equivale a comparar
+        contra set(texto.split()) sin construir un set por fila).
+        """
+        n = envio_ids.shape[0]
+        coincidencias = np.zeros(n, dtype=np.float32)
+        boost_productos = np.zeros(n, dtype=np.float32)
+        
+        palabras_consulta = set(texto_consulta.lower().split()) if texto_consulta else set()
+        if not palabras_consulta or not textos_indexados:
+            return coincidencias, boost_productos
+        
+        separadores = str.maketrans('\t\n\r\f\v', '     ')
+        textos = np.array([
+            ' ' + textos_indexados.get(int(envio_id), '').lower().translate(separadores) + ' '
+            for envio_id in envio_ids
+        ])
+        
+        presentes = np.zeros(n, dtype=np.int32)
+        for palabra in palabras_consulta:
+            presentes += np.char.find(textos, f' {palabra} ') >= 0
+        coincidencias = (presentes / len(palabras_consulta)).astype(np.float32)
+        
+        # Boost para productos
         palabras_producto = {'producto', 'artículo', 'item', 'mercancía', 'bien'}
-        tiene_palabras_producto = bool(palabras_consulta & palabras_producto) if es_consulta_productos else False
+        if VectorSearchService._es_consulta_productos(texto_consulta) and palabras_consulta & palabras_producto:
+            palabras_clave = [
+                p for p in palabras_consulta
+                if len(p) > 3 and p not in {'producto', 'productos', 'artículo', 'artículos'}
+            ]
+            tiene_seccion = (np.char.find(textos, 'producto:') >= 0) | (np.char.find(textos, 'contiene:') >= 0)
+            tiene_clave = np.zeros(n, dtype=bool)
+            for palabra_clave in palabras_clave:
+                tiene_clave |= np.char.find(textos, palabra_clave) >= 0
+            boost_productos = np.where(tiene_seccion & tiene_clave, 0.05, 0.0).astype(np.float32)
         
-        # Palabras clave filtradas (pre-procesado)
-        palabras_clave = [
-            p for p in palabras_consulta 
-            if len(p) > 3 and p not in {'producto', 'productos', 'artículo', 'artículos'}
-        ] if tiene_palabras_producto else []
+        return coincidencias, boost_productos
+    
+    def fusionar_rrf(
+        self,
+        resultados: ResultadosSimilitud,
+        candidatos_lexicos: List[Tuple[int, float]],
+        k: int = 60
+    ) -> ResultadosSimilitud:
+        """
+        Reciprocal Rank Fusion entre el ranking vectorial y el léxico.
         
-        # ==================== CONSTRUIR RESULTADOS ====================
-        resultados = []
+        score_rrf = 1 / (k + rango_vectorial) + 1 / (k + rango_lexico), con rangos
+        desde 1; un envío ausente de una lista no suma por ella. El ranking vectorial
+        es el orden por score_combinado de todos los candidatos.
         
-        for i in range(len(envio_ids)):
-            envio_id = envio_ids[i]
-            
-            # Obtener métricas pre-calculadas (acceso directo, sin cálculo)
-            cosine_similarity = float(cosine_similarities[i])
-            dot_product = float(dot_products[i])
-            euclidean_distance = float(euclidean_distances[i])
-            manhattan_distance = float(manhattan_distances[i])
-            
-            # Calcular boost (optimizado: sin regex, lógica simplificada)
-            boost_exactas = 0.0
-            coincidencias_score = 0.0
-            boost_productos = 0.0
-            
-            if texto_consulta and textos_indexados and envio_id in textos_indexados:
-                texto_indexado = textos_indexados[envio_id].lower()
-                
-                # Coincidencias exactas simplificadas (sin regex)
-                palabras_texto = set(texto_indexado.split())
-                palabras_comunes = palabras_consulta & palabras_texto
-                if palabras_consulta:
-                    coincidencias_score = len(palabras_comunes) / len(palabras_consulta)
-                
-                # Boost para productos
-                if tiene_palabras_producto:
-                    if 'producto:' in texto_indexado or 'contiene:' in texto_indexado:
-                        for palabra_clave in palabras_clave:
-                            if palabra_clave in texto_indexado:
-                                boost_productos = 0.05
-                                break
-                
-                boost_exactas = coincidencias_score * boost_base + min(boost_productos, 0.10)
-            
-            # Score combinado
-            cosine_normalizado = (cosine_similarity + 1) / 2
-            score_combinado = min(cosine_normalizado + boost_exactas, 1.0)
-            
-            # Calcular normas para información adicional
-            norma_envio = float(normas_envios[i])
-            norma_consulta = float(consulta_norm)
-            
-            resultados.append({
-                'envio_id': envio_id,
-                'envio': envio_objs[i],
-                'cosine_similarity': cosine_similarity,
-                'dot_product': dot_product,
-                'euclidean_distance': euclidean_distance,
-                'manhattan_distance': manhattan_distance,
-                'score_combinado': score_combinado,
-                'boost_exactas': boost_exactas,
-                'boost_productos': boost_productos,
-                'coincidencias_exactas': coincidencias_score,
-                # Información adicional para debugging/visualización
-                'norma_envio': norma_envio,
-                'norma_consulta': norma_consulta,
-                'dot_product_normalizado': dot_product / (norma_envio * norma_consulta) if norma_envio > 0 and norma_consulta > 0 else 0.0
-            })
+        Args:
+            resultados: ResultadosSimilitud con la unión de candidatos
+            candidatos_lexicos: (envio_id, rank) ordenados de mayor a menor rank
+            k: Constante de RRF (60 es el valor habitual)
         
+        Returns:
+            El mismo objeto con las columnas 'score_rrf' y 'rango_lexico' (0 = sin coincidencia)
+        """
+        n = len(resultados)
+        rango_vectorial = np.empty(n, dtype=np.int64)
+        rango_vectorial[np.argsort(-resultados.metrica('score_combinado'), kind='stable')] = np.arange(1, n + 1)
+        
+        rangos = {envio_id: posicion for posicion, (envio_id, _) in enumerate(candidatos_lexicos, start=1)}
+        rango_lexico = np.array(
+            [rangos.get(int(envio_id), 0) for envio_id in resultados.envio_ids],
+            dtype=np.int64
+        )
+        
+        score = 1.0 / (k + rango_vectorial)
+        score = score + np.where(rango_lexico > 0, 1.0 / (k + np.maximum(rango_lexico, 1)), 0.0)
+        resultados.columnas['score_rrf'] = score
+        resultados.columnas['rango_lexico'] = rango_lexico
         return resultados
     
     def ordenar_por_metrica(
@@ -296,13 +399,16 @@ class VectorSearchService(BaseService):
         Ordena resultados por la métrica especificada.
         
         Args:
-            resultados: Lista de resultados con métricas
+            resultados: ResultadosSimilitud o lista de resultados con métricas
             metrica: Métrica a usar para ordenar
             limite: Cantidad máxima de resultados
         
         Returns:
-            List[Dict]: Resultados ordenados y limitados
+            List[Dict]: Resultados ordenados y limitados (solo estos se convierten a dict)
         """
+        if isinstance(resultados, ResultadosSimilitud):
+            return self._top_k_columnar(resultados, metrica, limite)
+        
         # Métricas donde mayor es mejor
         metricas_descendentes = ['cosine_similarity', 'dot_product', 'score_combinado']
         # Métricas donde menor es mejor
@@ -329,23 +435,57 @@ class VectorSearchService(BaseService):
         
         return resultados_ordenados[:limite]
     
+    @staticmethod
+    def _top_k_columnar(resultados: ResultadosSimilitud, metrica: str, limite: int) -> List[Dict]:
+        """Top-k con argpartition + argsort solo sobre los k seleccionados"""
+        if len(resultados) == 0 or limite <= 0:
+            return []
+        if metrica not in ResultadosSimilitud.METRICAS_DESCENDENTES + ResultadosSimilitud.METRICAS_ASCENDENTES:
+            metrica = 'score_combinado'
+        if metrica in ResultadosSimilitud.METRICAS_DESCENDENTES and metrica not in resultados.columnas:
+            metrica = 'score_combinado'  # score_rrf solo existe tras fusionar_rrf
+        
+        valores = resultados.metrica(metrica)
+        if metrica in ResultadosSimilitud.METRICAS_DESCENDENTES:
+            valores = -valores
+        
+        k = min(limite, len(resultados))
+        top = np.argpartition(valores, k - 1)[:k] if k < len(resultados) else np.arange(len(resultados))
+        top = top[np.argsort(valores[top], kind='stable')]
+        return resultados.seleccionar(top).a_dicts()
+    
     def aplicar_umbral(
         self,
         resultados: List[Dict],
         umbral_base: float = 0.35,
-        usar_adaptativo: bool = True
+        usar_adaptativo: bool = True,
+        conservar: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Filtra resultados según umbral de similitud.
         
         Args:
-            resultados: Lista de resultados con métricas
+            resultados: ResultadosSimilitud o lista de resultados con métricas
             umbral_base: Umbral mínimo absoluto
-            usar_adaptativo: Si True, usa umbral adaptativo
+            usar_adaptativo: Si True, usa umbral adaptativo (percentil 75)
+            conservar: Máscara booleana (solo formato columnar) de filas que pasan
+                siempre, p. ej. coincidencias léxicas en la búsqueda híbrida
         
         Returns:
-            List[Dict]: Resultados filtrados
+            Resultados filtrados, en el mismo formato recibido
         """
+        if isinstance(resultados, ResultadosSimilitud):
+            if len(resultados) == 0:
+                return resultados
+            scores = np.maximum(resultados.metrica('cosine_similarity'), resultados.metrica('score_combinado'))
+            umbral = umbral_base
+            if usar_adaptativo and len(resultados) > 3:
+                umbral = max(float(np.percentile(scores, 75)), umbral_base)
+            mascara = scores >= umbral
+            if conservar is not None:
+                mascara |= conservar
+            return resultados.seleccionar(mascara)
+        
         if not resultados:
             return []
         
@@ -2,10 +2,16 @@
 Servicios para la app de búsqueda
 Implementa la lógica de negocio para búsquedas tradicionales y semánticas
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Tuple, Iterator, Iterable
+import re
+import copy
 import time
+import json
+import hashlib
 import logging
+import threading
 from datetime import datetime, time as dt_time, date
+import numpy as np
 from django.db.models import Q, Count
 from django.contrib.auth import get_user_model
 from django.core.cache import caches
@@ -13,7 +19,7 @@ from django.conf import settings
 from django.utils import timezone
 
 from apps.core.base.base_service import BaseService
-from apps.core.exceptions import OpenAINotConfiguredError
+from apps.core.exceptions import OpenAINotConfiguredError, EnvioNoEncontradoError, EmbeddingNoEncontradoError
 from .repositories import (
     busqueda_tradicional_repository,
     embedding_busqueda_repository,
@@ -21,6 +27,14 @@ from .repositories import (
     embedding_repository
 )
 from .semantic import EmbeddingService, VectorSearchService, TextProcessor, QueryExpander
+from .semantic.vector_index import (
+    obtener_indice,
+    indice_en_memoria_habilitado,
+    estadisticas_indices,
+    FiltroMetadatos,
+)
+from .semantic.registro_modelos import RegistroModelos
+from .semantic.similitud_promedio import bloques_normalizados
 from apps.archivos.repositories import envio_repository, producto_repository
 from apps.usuarios.repositories import usuario_repository
 from apps.archivos.serializers import EnvioSerializer
@@ -39,6 +53,318 @@ def get_semantic_cache():
         return caches['default']
 
 
+class CacheEmbeddingsConsulta:
+    """
+    Caché read-through de vectores de consulta.
+    Clave: modelo + SHA-256 de la consulta procesada. Valor: bytes float32 compactos
+    (~6KB para 1536 dimensiones frente a ~30KB de una lista de floats serializada).
+    """
+    
+    PREFIJO = 'qemb'
+    CLAVE_HITS = 'qemb:stats:hits'
+    CLAVE_MISSES = 'qemb:stats:misses'
+    
+    @staticmethod
+    def _clave(texto: str, modelo: str) -> str:
+        digest = hashlib.sha256(texto.encode('utf-8')).hexdigest()
+        return f"{CacheEmbeddingsConsulta.PREFIJO}:{modelo}:{digest}"
+    
+    @staticmethod
+    def _incrementar(clave: str, cantidad: int = 1):
+        cache = get_semantic_cache()
+        try:
+            cache.add(clave, 0, timeout=None)
+            cache.incr(clave, cantidad)
+        except ValueError:
+            # La clave expiró entre add e incr
+            cache.set(clave, cantidad, timeout=None)
+    
+    @staticmethod
+    def obtener_embedding(texto: str, modelo: str) -> Dict[str, Any]:
+        """
+        Obtiene el embedding de la consulta desde caché o, si no existe, desde OpenAI.
+        
+        Returns:
+            Mismo dict que EmbeddingService.generar_embedding más 'desde_cache'.
+            En un hit, tokens y costo son 0 (no hubo llamada a la API).
+        """
+        cache = get_semantic_cache()
+        clave = CacheEmbeddingsConsulta._clave(texto, modelo)
+        
+        datos = cache.get(clave)
+        if datos is not None:
+            CacheEmbeddingsConsulta._incrementar(CacheEmbeddingsConsulta.CLAVE_HITS)
+            return {
+                'embedding': np.frombuffer(datos, dtype=np.float32),
+                'tokens': 0,
+                'costo': 0.0,
+                'modelo': modelo,
+                'desde_cache': True
+            }
+        
+        CacheEmbeddingsConsulta._incrementar(CacheEmbeddingsConsulta.CLAVE_MISSES)
+        resultado = EmbeddingService.generar_embedding(texto, modelo)
+        cache.set(
+            clave,
+            np.asarray(resultado['embedding'], dtype=np.float32).tobytes(),
+            timeout=getattr(settings, 'EMBEDDING_CACHE_TIMEOUT', 604800)
+        )
+        resultado['desde_cache'] = False
+        return resultado
+    
+    @staticmethod
+    def obtener_embeddings(textos: List[str], modelo: str) -> Dict[str, Any]:
+        """
+        Versión por lotes de obtener_embedding: una lectura get_many del caché y una sola
+        solicitud a OpenAI con los textos faltantes (sin repetidos).
+        
+        Returns:
+            dict: {'embeddings': vectores float32 en el orden de textos, 'tokens', 'costo',
+                   'modelo', 'desde_cache': cantidad de textos resueltos por el caché}
+        """
+        cache = get_semantic_cache()
+        claves = {texto: CacheEmbeddingsConsulta._clave(texto, modelo) for texto in textos}
+        guardados = cache.get_many(list(claves.values()))
+        vectores = {
+            texto: np.frombuffer(guardados[clave], dtype=np.float32)
+            for texto, clave in claves.items() if clave in guardados
+        }
+        faltantes = [texto for texto in claves if texto not in vectores]
+        desde_cache = sum(1 for texto in textos if texto in vectores)
+        
+        if desde_cache:
+            CacheEmbeddingsConsulta._incrementar(CacheEmbeddingsConsulta.CLAVE_HITS, desde_cache)
+        if faltantes:
+            CacheEmbeddingsConsulta._incrementar(CacheEmbeddingsConsulta.CLAVE_MISSES, len(faltantes))
+        
+        tokens, costo = 0, 0.0
+        if faltantes:
+            generados = EmbeddingService.generar_embeddings_lote(faltantes, modelo)
+            tokens, costo = generados['tokens'], generados['costo']
+            nuevos = {}
+            for texto, vector in zip(faltantes, generados['embeddings']):
+                vectores[texto] = np.asarray(vector, dtype=np.float32)
+                nuevos[claves[texto]] = vectores[texto].tobytes()
+            cache.set_many(nuevos, timeout=getattr(settings, 'EMBEDDING_CACHE_TIMEOUT', 604800))
+        
+        return {
+            'embeddings': [vectores[texto] for texto in textos],
+            'tokens': tokens,
+            'costo': costo,
+            'modelo': modelo,
+            'desde_cache': desde_cache
+        }
+    
+    @staticmethod
+    def estadisticas() -> Dict[str, Any]:
+        """Contadores de hits/misses (compartidos entre workers si el caché es Redis)"""
+        cache = get_semantic_cache()
+        hits = cache.get(CacheEmbeddingsConsulta.CLAVE_HITS) or 0
+        misses = cache.get(CacheEmbeddingsConsulta.CLAVE_MISSES) or 0
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'tasa_aciertos': round(hits / total * 100, 2) if total else 0.0
+        }
+
+
+class CacheResultadosSemanticos:
+    """
+    Caché del ranking final (top-k de envio_id con sus scores) de una búsqueda semántica.
+    
+    La clave combina el alcance de permisos, la consulta procesada, los filtros, el modelo,
+    la métrica, el límite y una versión global. La versión se incrementa cuando un cambio en
+    Envio, Producto o EnvioEmbedding puede alterar un ranking (ver signals), lo que invalida
+    todas las entradas sin recorrerlas. En un hit se omite el ranking; la hidratación de envíos
+    sigue siendo fresca.
+    
+    Si el incremento no llega al caché (Redis con IGNORE_EXCEPTIONS devuelve None), el proceso
+    deja de usar el caché de rankings hasta reintentarlo con éxito; para los demás procesos la
+    obsolescencia queda acotada por SEMANTIC_RESULT_CACHE_TIMEOUT.
+    """
+    
+    PREFIJO = 'semres'
+    CLAVE_VERSION = 'semres:version'
+    CLAVE_HITS = 'semres:stats:hits'
+    CLAVE_MISSES = 'semres:stats:misses'
+    
+    _invalidacion_pendiente = False
+    
+    @staticmethod
+    def habilitado() -> bool:
+        if not getattr(settings, 'SEMANTIC_RESULT_CACHE', True):
+            return False
+        if CacheResultadosSemanticos._invalidacion_pendiente:
+            CacheResultadosSemanticos.invalidar()
+        return not CacheResultadosSemanticos._invalidacion_pendiente
+    
+    @staticmethod
+    def version() -> int:
+        cache = get_semantic_cache()
+        version = cache.get(CacheResultadosSemanticos.CLAVE_VERSION)
+        if version is None:
+            # Si la versión se perdió (expulsión o reinicio de Redis) se parte de un valor
+            # nuevo para no volver a servir entradas de una versión anterior
+            cache.add(CacheResultadosSemanticos.CLAVE_VERSION, time.time_ns(), timeout=None)
+            version = cache.get(CacheResultadosSemanticos.CLAVE_VERSION) or 0
+        return version
+    
+    @staticmethod
+    def invalidar():
+        """Incrementa la versión: todas las entradas existentes dejan de usarse"""
+        cache = get_semantic_cache()
+        try:
+            incrementada = cache.incr(CacheResultadosSemanticos.CLAVE_VERSION) is not None
+        except ValueError:
+            version = time.time_ns()
+            cache.set(CacheResultadosSemanticos.CLAVE_VERSION, version, timeout=None)
+            incrementada = cache.get(CacheResultadosSemanticos.CLAVE_VERSION) == version
+        if not incrementada:
+            logger.warning("No se pudo invalidar el caché de rankings semánticos; se omite hasta reintentar")
+        CacheResultadosSemanticos._invalidacion_pendiente = not incrementada
+    
+    @staticmethod
+    def clave(*partes) -> str:
+        serializado = json.dumps(partes, sort_keys=True, default=str)
+        digest = hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+        return f"{CacheResultadosSemanticos.PREFIJO}:{CacheResultadosSemanticos.version()}:{digest}"
+    
+    @staticmethod
+    def obtener(clave: str) -> Optional[List[Dict]]:
+        ranking = get_semantic_cache().get(clave)
+        CacheEmbeddingsConsulta._incrementar(
+            CacheResultadosSemanticos.CLAVE_HITS if ranking is not None
+            else CacheResultadosSemanticos.CLAVE_MISSES
+        )
+        return ranking
+    
+    @staticmethod
+    def guardar(clave: str, ranking: List[Dict]):
+        get_semantic_cache().set(
+            clave,
+            ranking,
+            timeout=getattr(settings, 'SEMANTIC_RESULT_CACHE_TIMEOUT', 300)
+        )
+    
+    @staticmethod
+    def estadisticas() -> Dict[str, Any]:
+        cache = get_semantic_cache()
+        hits = cache.get(CacheResultadosSemanticos.CLAVE_HITS) or 0
+        misses = cache.get(CacheResultadosSemanticos.CLAVE_MISSES) or 0
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'tasa_aciertos': round(hits / total * 100, 2) if total else 0.0
+        }
+
+
+class CoalescenciaConsultas:
+    """
+    Single-flight para búsquedas semánticas idénticas concurrentes.
+    
+    Dentro del worker, la primera petición de una clave calcula y las demás esperan en un
+    threading.Event y reciben una copia del resultado (o el mismo error). Entre workers, el
+    cálculo se protege con un lock en el caché (cache.add es atómico en Redis) y el resultado
+    queda publicado SEMANTIC_SINGLE_FLIGHT_TTL segundos: una petición que llega tras liberarse
+    el lock lo lee en lugar de volver a calcular.
+    """
+    
+    PREFIJO = 'sflight'
+    INTERVALO_ESPERA = 0.05  # Segundos entre consultas al caché mientras otro worker calcula
+    
+    _lock = threading.Lock()
+    _vuelos: Dict[str, '_Vuelo'] = {}
+    
+    class _Vuelo:
+        """Cálculo en curso dentro del worker"""
+        
+        def __init__(self):
+            self.evento = threading.Event()
+            self.resultado = None
+            self.error: Optional[BaseException] = None
+    
+    @staticmethod
+    def clave(*partes) -> str:
+        """Clave estable a partir de las partes (dicts ordenados, fechas como texto)"""
+        serializado = json.dumps(partes, sort_keys=True, default=str)
+        return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def ejecutar(cls, clave: str, funcion: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Ejecuta funcion() una sola vez por clave entre las peticiones concurrentes.
+        
+        Returns:
+            (resultado, compartido): compartido es True si el resultado lo calculó otra petición
+        """
+        timeout = getattr(settings, 'SEMANTIC_SINGLE_FLIGHT_TIMEOUT', 30)
+        
+        with cls._lock:
+            vuelo = cls._vuelos.get(clave)
+            es_lider = vuelo is None
+            if es_lider:
+                vuelo = cls._Vuelo()
+                cls._vuelos[clave] = vuelo
+        
+        if not es_lider:
+            if not vuelo.evento.wait(timeout):
+                # El cálculo en curso tarda demasiado: no bloquear más a esta petición
+                return funcion(), False
+            if vuelo.error is not None:
+                raise vuelo.error
+            # Cada petición recibe su propia copia: el llamador puede modificar la lista
+            return copy.deepcopy(vuelo.resultado), True
+        
+        try:
+            vuelo.resultado, compartido = cls._ejecutar_entre_workers(clave, funcion, timeout)
+            return vuelo.resultado, compartido
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with cls._lock:
+                cls._vuelos.pop(clave, None)
+            vuelo.evento.set()
+    
+    @classmethod
+    def _ejecutar_entre_workers(cls, clave: str, funcion: Callable[[], Any], timeout: float) -> Tuple[Any, bool]:
+        cache = get_semantic_cache()
+        clave_lock = f"{cls.PREFIJO}:lock:{clave}"
+        clave_resultado = f"{cls.PREFIJO}:res:{clave}"
+        
+        # Un vuelo que terminó hace menos de SEMANTIC_SINGLE_FLIGHT_TTL segundos ya publicó el resultado
+        resultado = cache.get(clave_resultado)
+        if resultado is not None:
+            return resultado, True
+        
+        limite = time.monotonic() + timeout
+        # add devuelve None si Redis no responde (IGNORE_EXCEPTIONS): calcular sin coordinar
+        while cache.add(clave_lock, 1, timeout=int(timeout) + 1) is False:
+            time.sleep(cls.INTERVALO_ESPERA)
+            resultado = cache.get(clave_resultado)
+            if resultado is not None:
+                return resultado, True
+            if time.monotonic() >= limite:
+                return funcion(), False
+        
+        try:
+            # El líder anterior pudo publicar y soltar el lock entre la última lectura y el add
+            resultado = cache.get(clave_resultado)
+            if resultado is not None:
+                return resultado, True
+            resultado = funcion()
+            cache.set(
+                clave_resultado,
+                resultado,
+                timeout=getattr(settings, 'SEMANTIC_SINGLE_FLIGHT_TTL', 3)
+            )
+            return resultado, False
+        finally:
+            cache.delete(clave_lock)
+
+
 class BusquedaTradicionalService(BaseService):
     """
     Servicio para búsquedas tradicionales (texto).
@@ -48,20 +374,27 @@ class BusquedaTradicionalService(BaseService):
     def buscar(
         query: str,
         tipo: str,
-        usuario
+        usuario,
+        limite: int = None
     ) -> Dict[str, Any]:
         """
         Realiza una búsqueda tradicional en usuarios, envíos y productos.
         
+        Cada sección se ordena por similitud (pg_trgm en PostgreSQL) y se limita
+        a `limite` resultados; el total de coincidencias se informa en `totales`.
+        
         Args:
             query: Término de búsqueda
             tipo: Tipo de búsqueda ('general', 'usuarios', 'envios', 'productos')
             usuario: Usuario que realiza la búsqueda
+            limite: Máximo de resultados por sección (BUSQUEDA_TRADICIONAL_LIMITE por defecto)
             
         Returns:
             Dict con resultados de búsqueda
         """
+        limite = limite or getattr(settings, 'BUSQUEDA_TRADICIONAL_LIMITE', 20)
         resultados = {}
+        totales = {}
         
         if tipo in ['general', 'usuarios']:
             usuarios = usuario_repository.buscar(query)
@@ -69,21 +402,28 @@ class BusquedaTradicionalService(BaseService):
             usuarios = BusquedaTradicionalService._filtrar_usuarios_por_permisos(
                 usuarios, usuario
             )
+            usuarios, totales['usuarios'] = usuario_repository.rankear_por_similitud(
+                usuarios, query, limite
+            )
             from apps.usuarios.serializers import UsuarioListSerializer
             resultados['usuarios'] = UsuarioListSerializer(usuarios, many=True).data
         
         if tipo in ['general', 'envios']:
-            envios = envio_repository.buscar(query, usuario)
+            envios, totales['envios'] = envio_repository.rankear_por_similitud(
+                envio_repository.buscar(query, usuario), query, limite
+            )
             from apps.archivos.serializers import EnvioListSerializer
             resultados['envios'] = EnvioListSerializer(envios, many=True).data
         
         if tipo in ['general', 'productos']:
-            productos = producto_repository.buscar(query, usuario)
+            productos, totales['productos'] = producto_repository.rankear_por_similitud(
+                producto_repository.buscar(query, usuario), query, limite
+            )
             from apps.archivos.serializers import ProductoListSerializer
             resultados['productos'] = ProductoListSerializer(productos, many=True).data
         
-        # Calcular total
-        total_resultados = sum(len(resultados.get(key, [])) for key in resultados)
+        # Calcular total (coincidencias reales, no solo las devueltas)
+        total_resultados = sum(totales.values())
         
         # Guardar en historial
         busqueda_tradicional_repository.crear(
@@ -119,6 +459,8 @@ class BusquedaTradicionalService(BaseService):
             'query': query,
             'tipo': tipo,
             'total_resultados': total_resultados,
+            'totales': totales,
+            'limite': limite,
             'resultados': resultados
         }
     
@@ -147,7 +489,8 @@ class BusquedaSemanticaService(BaseService):
         filtros: Dict[str, Any] = None,
         limite: int = 20,
         modelo_embedding: str = None,
-        metrica_ordenamiento: str = 'score_combinado'
+        metrica_ordenamiento: str = 'score_combinado',
+        usar_cache: bool = True
     ) -> Dict[str, Any]:
         """
         Realiza una búsqueda semántica de envíos.
@@ -164,6 +507,7 @@ class BusquedaSemanticaService(BaseService):
                 - 'dot_product': Producto punto
                 - 'euclidean_distance': Distancia euclidiana (menor es mejor)
                 - 'manhattan_distance': Distancia Manhattan (menor es mejor)
+            usar_cache: False para omitir el caché de rankings (corridas de evaluación)
             
         Returns:
             Dict con resultados, métricas y costos
@@ -176,131 +520,552 @@ class BusquedaSemanticaService(BaseService):
         else:
             modelo_embedding = EmbeddingService.validar_modelo(modelo_embedding)
         
-        # 1. Expandir consulta con sinónimos y contexto (incluye detección de fechas, cantidades, etc.)
-        expansion = QueryExpander.expandir_consulta(consulta, incluir_filtros_temporales=True)
-        consulta_expandida = expansion['consulta_expandida']
-        filtros_sugeridos = expansion['filtros_sugeridos']
+        calculo, compartido = BusquedaSemanticaService._calcular_coalescido(
+            consulta, usuario, filtros, limite, modelo_embedding, metrica_ordenamiento, usar_cache
+        )
         
-        # Mezclar filtros sugeridos con filtros proporcionados (prioridad a los proporcionados)
-        filtros_completos = {**filtros_sugeridos, **(filtros or {})}
+        resultados = calculo['resultados']
+        modelo_embedding = calculo['modelo']
+        embedding_consulta = calculo['embedding']
+        # Quien recibe un resultado compartido no consumió tokens
+        tokens_consulta = 0 if compartido else calculo['tokens']
+        costo_consulta = 0.0 if compartido else calculo['costo']
         
-        # Guardar filtros para post-validación estricta de resultados
-        filtros_estrictos = {k: v for k, v in filtros_completos.items() 
-                           if k in ('fechaDesde', 'fechaHasta', 'cantidad_lineas_minima', 
-                                   'cantidad_productos_minima', 'estado', 'ciudadDestino')}
+        # 4. Calcular tiempo de respuesta
+        tiempo_respuesta = int((time.time() - tiempo_inicio) * 1000)
         
-        logger.info(
-            f"Consulta expandida: original='{consulta[:50]}...', "
-            f"expandida='{consulta_expandida[:100]}...', "
-            f"filtros_sugeridos={filtros_sugeridos}"
+        # 5. Guardar en historial con embedding y resultados (una entrada por usuario,
+        # también cuando el cálculo fue compartido)
+        busqueda = BusquedaSemanticaService._registrar_busqueda(
+            consulta, usuario, filtros, resultados, tiempo_respuesta, modelo_embedding,
+            embedding_consulta, tokens_consulta, costo_consulta, compartido
         )
         
-        # 2. Obtener envíos filtrados (con filtros mejorados)
-        envios_queryset = BusquedaSemanticaService._obtener_envios_filtrados(
-            usuario, filtros_completos
+        return {
+            'consulta': consulta,
+            'resultados': resultados,
+            'totalEncontrados': len(resultados),
+            'tiempoRespuesta': tiempo_respuesta,
+            'modeloUtilizado': modelo_embedding,
+            'costoConsulta': float(costo_consulta),
+            'tokensUtilizados': tokens_consulta,
+            'busquedaId': busqueda.id,
+            'metricaOrdenamiento': metrica_ordenamiento or 'score_combinado',
+            'consultaCompartida': compartido
+        }
+    
+    @staticmethod
+    def buscar_streaming(
+        consulta: str,
+        usuario,
+        filtros: Dict[str, Any] = None,
+        limite: int = 20,
+        modelo_embedding: str = None,
+        metrica_ordenamiento: str = 'score_combinado'
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Variante incremental de buscar() para respuestas en streaming (NDJSON).
+        
+        El embedding de la consulta y el ranking se calculan al llamar (antes de que la
+        vista envíe los encabezados): sus errores llegan al llamador como excepciones.
+        El iterador retornado solo hidrata y serializa, y emite en orden:
+            - {'tipo': 'ranking'}: ids y scores del ranking
+            - {'tipo': 'resultado'}: cada fila hidratada, por lotes de SEMANTIC_STREAM_LOTE;
+              las que no pasan la post-validación estricta se emiten como {'tipo': 'descartado'}
+            - {'tipo': 'fin'}: totales, tiempo, costo y tokens
+            - {'tipo': 'historial'}: id de la búsqueda guardada; el historial se escribe
+              después de enviar los resultados
+        """
+        tiempo_inicio = time.time()
+        
+        if modelo_embedding is None:
+            modelo_embedding = EmbeddingService.get_modelo_default()
+        else:
+            modelo_embedding = EmbeddingService.validar_modelo(modelo_embedding)
+        
+        calculo, compartido = BusquedaSemanticaService._calcular_coalescido(
+            consulta, usuario, filtros, limite, modelo_embedding, metrica_ordenamiento, True, hidratar=False
+        )
+        # Textos indexados de todo el top-k en una consulta, compartidos por los lotes
+        textos_indexados = embedding_repository.obtener_textos_indexados(
+            [r['envio_id'] for r in calculo['resultados']], calculo['modelo']
         )
         
-        # Procesar consulta expandida: aplicar limpieza y normalización
-        consulta_procesada = TextProcessor.procesar_texto(consulta_expandida)
+        return BusquedaSemanticaService._eventos_streaming(
+            consulta, usuario, filtros, calculo, compartido, textos_indexados,
+            metrica_ordenamiento, tiempo_inicio
+        )
+    
+    @staticmethod
+    def _eventos_streaming(
+        consulta: str,
+        usuario,
+        filtros: Optional[Dict[str, Any]],
+        calculo: Dict[str, Any],
+        compartido: bool,
+        textos_indexados: Dict[int, str],
+        metrica_ordenamiento: str,
+        tiempo_inicio: float
+    ) -> Iterator[Dict[str, Any]]:
+        """Eventos de buscar_streaming a partir del ranking ya calculado"""
+        ranking = calculo['resultados']
+        modelo_embedding = calculo['modelo']
+        
+        yield {
+            'tipo': 'ranking',
+            'consulta': consulta,
+            'modeloUtilizado': modelo_embedding,
+            'metricaOrdenamiento': metrica_ordenamiento or 'score_combinado',
+            'resultados': [
+                {
+                    'envioId': r['envio_id'],
+                    'scoreCombinado': round(r['score_combinado'], 4),
+                    'cosineSimilarity': round(r['cosine_similarity'], 4),
+                }
+                for r in ranking
+            ],
+            'tiempoRanking': int((time.time() - tiempo_inicio) * 1000),
+        }
         
-        if envios_queryset.count() == 0:
-            # Generar embedding para calcular costo incluso sin resultados
-            try:
-                embedding_resultado = EmbeddingService.generar_embedding(
-                    consulta_procesada, modelo_embedding
+        resultados = []
+        envios_visibles = envio_repository.filtrar_por_permisos_usuario(usuario)
+        lote = max(1, getattr(settings, 'SEMANTIC_STREAM_LOTE', 5))
+        for inicio in range(0, len(ranking), lote):
+            parte = ranking[inicio:inicio + lote]
+            hidratados = BusquedaSemanticaService._hidratar_resultados(
+                parte, calculo['consulta_procesada'], envios_visibles, textos_indexados=textos_indexados
+            )
+            validos = {
+                r['envio']['id'] for r in BusquedaSemanticaService._post_filtrar_resultados_estrictos(
+                    hidratados, calculo['filtros_estrictos']
                 )
-                costo = embedding_resultado['costo']
-                tokens = embedding_resultado['tokens']
-            except OpenAINotConfiguredError:
-                costo = 0
-                tokens = 0
-            
-            tiempo_respuesta = int((time.time() - tiempo_inicio) * 1000)
-            
-            # Guardar búsqueda (incluso sin resultados)
-            # Guardar consulta original para el historial
-            busqueda = embedding_busqueda_repository.crear(
-                usuario=usuario,
-                consulta=consulta,  # Consulta original sin procesar
-                resultados_encontrados=0,
-                tiempo_respuesta=tiempo_respuesta,
-                filtros_aplicados=filtros,
-                modelo_utilizado=modelo_embedding,
-                costo_consulta=costo,
-                tokens_utilizados=tokens,
-                resultados_json=[]
+            }
+            hidratados_por_id = {r['envio']['id']: r for r in hidratados}
+            for r in parte:
+                resultado = hidratados_por_id.get(r['envio_id'])
+                if resultado is None or r['envio_id'] not in validos:
+                    yield {'tipo': 'descartado', 'envioId': r['envio_id']}
+                    continue
+                yield {'tipo': 'resultado', 'posicion': len(resultados), 'resultado': resultado}
+                resultados.append(resultado)
+        
+        tiempo_respuesta = int((time.time() - tiempo_inicio) * 1000)
+        tokens_consulta = 0 if compartido else calculo['tokens']
+        costo_consulta = 0.0 if compartido else calculo['costo']
+        yield {
+            'tipo': 'fin',
+            'totalEncontrados': len(resultados),
+            'tiempoRespuesta': tiempo_respuesta,
+            'costoConsulta': float(costo_consulta),
+            'tokensUtilizados': tokens_consulta,
+            'consultaCompartida': compartido,
+        }
+        
+        busqueda = BusquedaSemanticaService._registrar_busqueda(
+            consulta, usuario, filtros, resultados, tiempo_respuesta, modelo_embedding,
+            calculo['embedding'], tokens_consulta, costo_consulta, compartido
+        )
+        yield {'tipo': 'historial', 'busquedaId': busqueda.id}
+    
+    @staticmethod
+    def buscar_lote(
+        consultas: List[str],
+        usuario,
+        filtros: Dict[str, Any] = None,
+        limite: int = 10,
+        modelo_embedding: str = None,
+        metrica_ordenamiento: str = 'score_combinado'
+    ) -> Dict[str, Any]:
+        """
+        Búsqueda semántica de varias consultas en una sola pasada (suites de evaluación e
+        integraciones). Frente a N llamadas a buscar():
+            - los embeddings se leen del caché con get_many y los faltantes se generan
+              en una sola solicitud a OpenAI
+            - con el índice en memoria, las consultas con los mismos filtros se puntúan
+              con un solo producto matriz-matriz (IndiceVectorial.buscar_lote)
+            - vectores, textos indexados y envíos de todos los candidatos se leen con
+              una consulta cada uno
+        No usa el caché de rankings ni escribe historial por consulta.
+        
+        Returns:
+            dict con un elemento en 'resultados' por consulta, en el mismo orden
+        """
+        tiempo_inicio = time.time()
+        
+        if modelo_embedding is None:
+            modelo_embedding = EmbeddingService.get_modelo_default()
+        else:
+            modelo_embedding = EmbeddingService.validar_modelo(modelo_embedding)
+        modelo_embedding = BusquedaSemanticaService._obtener_modelo_disponible(None, modelo_embedding)
+        
+        preparadas = [BusquedaSemanticaService._preparar_consulta(consulta, filtros) for consulta in consultas]
+        embeddings = CacheEmbeddingsConsulta.obtener_embeddings(
+            [preparada['consulta_procesada'] for preparada in preparadas], modelo_embedding
+        )
+        
+        textos_indexados = None
+        if indice_en_memoria_habilitado():
+            rankings, textos_indexados = BusquedaSemanticaService._rankear_lote_indice(
+                usuario, preparadas, embeddings['embeddings'], limite, modelo_embedding, metrica_ordenamiento
             )
-            
-            # Guardar el embedding si se generó y las dimensiones coinciden
-            if 'embedding' in embedding_resultado:
-                embedding = embedding_resultado['embedding']
-                dimensiones_esperadas = 1536  # Dimensiones del campo en el modelo
-                dimensiones_reales = len(embedding) if embedding else 0
-                
-                if dimensiones_reales == dimensiones_esperadas:
-                    busqueda.set_vector(embedding)
-                    busqueda.save()
-                else:
-                    # Guardar sin el vector si las dimensiones no coinciden
-                    busqueda.save()
-                    logger.debug(
-                        f"No se guardó el embedding de la consulta: dimensiones esperadas={dimensiones_esperadas}, "
-                        f"dimensiones reales={dimensiones_reales}, modelo={modelo_embedding}"
-                    )
-            else:
-                busqueda.save()
-            
-            return {
-                'consulta': consulta,  # Retornar consulta original
-                'resultados': [],
-                'totalEncontrados': 0,
-                'tiempoRespuesta': tiempo_respuesta,
-                'modeloUtilizado': modelo_embedding,
-                'costoConsulta': float(costo),
-                'tokensUtilizados': tokens,
-                'busquedaId': busqueda.id
+        else:
+            # Sin índice en memoria el top-k lo resuelve la BD consulta por consulta;
+            # el lote ahorra las llamadas a OpenAI y la hidratación
+            rankings = []
+            for preparada, embedding in zip(preparadas, embeddings['embeddings']):
+                envios_queryset = BusquedaSemanticaService._obtener_envios_filtrados(
+                    usuario, preparada['filtros_completos']
+                )
+                rankings.append(
+                    BusquedaSemanticaService._buscar_envios_similares(
+                        envios_queryset, embedding, preparada['consulta_procesada'], limite,
+                        modelo_embedding, metrica_ordenamiento, hidratar=False,
+                        texto_lexico=preparada['consulta_lexica']
+                    ) if envios_queryset.exists() else []
+                )
+        
+        envios_ids = list({r['envio_id'] for ranking in rankings for r in ranking})
+        envios_por_id = {
+            envio.id: envio
+            for envio in envio_repository.filtrar_por_permisos_usuario(usuario).filter(id__in=envios_ids)
+        }
+        if textos_indexados is None:
+            textos_indexados = embedding_repository.obtener_textos_indexados(envios_ids, modelo_embedding)
+        
+        resultados = []
+        for consulta, preparada, ranking in zip(consultas, preparadas, rankings):
+            hidratados = BusquedaSemanticaService._hidratar_resultados(
+                ranking, preparada['consulta_procesada'], textos_indexados=textos_indexados,
+                envios_por_id=envios_por_id
+            )
+            hidratados = BusquedaSemanticaService._post_filtrar_resultados_estrictos(
+                hidratados, preparada['filtros_estrictos']
+            )
+            resultados.append({
+                'consulta': consulta,
+                'totalEncontrados': len(hidratados),
+                'resultados': hidratados
+            })
+        
+        tiempo_respuesta = int((time.time() - tiempo_inicio) * 1000)
+        BaseService.log_operacion(
+            operacion='buscar_semantica_lote',
+            entidad='BusquedaSemantica',
+            usuario_id=usuario.id,
+            detalles={
+                'consultas': len(consultas),
+                'embeddings_desde_cache': embeddings['desde_cache'],
+                'tiempo_respuesta_ms': tiempo_respuesta,
+                'modelo': modelo_embedding,
+                'costo': float(embeddings['costo']),
+                'tokens': embeddings['tokens']
             }
+        )
+        BaseService.log_metrica(
+            metrica='busqueda_semantica_lote_tiempo',
+            valor=tiempo_respuesta,
+            unidad='ms',
+            usuario_id=usuario.id,
+            contexto={'modelo': modelo_embedding, 'consultas': len(consultas)}
+        )
         
-        # 2. Verificar qué embeddings están disponibles antes de generar el embedding de la consulta
-        # Esto evita generar embeddings con un modelo que no tiene embeddings de envíos
-        modelo_disponible = BusquedaSemanticaService._obtener_modelo_disponible(
-            envios_queryset, modelo_embedding
+        return {
+            'modeloUtilizado': modelo_embedding,
+            'metricaOrdenamiento': metrica_ordenamiento or 'score_combinado',
+            'totalConsultas': len(consultas),
+            'resultados': resultados,
+            'tiempoRespuesta': tiempo_respuesta,
+            'costoConsulta': float(embeddings['costo']),
+            'tokensUtilizados': embeddings['tokens'],
+            'embeddingsDesdeCache': embeddings['desde_cache']
+        }
+    
+    @staticmethod
+    def _rankear_lote_indice(
+        usuario,
+        preparadas: List[Dict[str, Any]],
+        embeddings: List[np.ndarray],
+        limite: int,
+        modelo_embedding: str,
+        metrica_ordenamiento: str
+    ) -> Tuple[List[List[Dict]], Dict[int, str]]:
+        """
+        Ranking de un lote con el índice en memoria: una GEMM por grupo de consultas con
+        los mismos filtros y una sola lectura de vectores y textos para todos los candidatos.
+        
+        Returns:
+            (rankings sin hidratar en el orden de preparadas, textos indexados de los candidatos)
+        """
+        indice = obtener_indice(modelo_embedding)
+        k_candidatos = max(getattr(settings, 'SEMANTIC_ANN_CANDIDATES', 200), limite * 5)
+        
+        grupos: Dict[str, List[int]] = {}
+        for posicion, preparada in enumerate(preparadas):
+            clave = json.dumps(preparada['filtros_completos'], sort_keys=True, default=str)
+            grupos.setdefault(clave, []).append(posicion)
+        
+        candidatos = [[] for _ in preparadas]
+        for posiciones in grupos.values():
+            filtros_grupo = preparadas[posiciones[0]]['filtros_completos']
+            filtro = BusquedaSemanticaService._validar_filas_sin_metadatos(
+                BusquedaSemanticaService._filtro_indice(usuario, filtros_grupo),
+                indice,
+                BusquedaSemanticaService._obtener_envios_filtrados(usuario, filtros_grupo)
+            )
+            top_k = indice.buscar_lote(
+                np.stack([np.asarray(embeddings[p], dtype=np.float32) for p in posiciones]),
+                k=k_candidatos,
+                filtro=filtro
+            )
+            for posicion, candidatos_consulta in zip(posiciones, top_k):
+                candidatos[posicion] = candidatos_consulta
+        
+        lexicos = [[] for _ in preparadas]
+        if embedding_repository.soporta_busqueda_lexica():
+            for posicion, preparada in enumerate(preparadas):
+                lexicos[posicion] = embedding_repository.buscar_top_k_lexico(
+                    BusquedaSemanticaService._obtener_envios_filtrados(usuario, preparada['filtros_completos']),
+                    preparada['consulta_lexica'],
+                    modelo=modelo_embedding,
+                    k=getattr(settings, 'SEMANTIC_LEXICO_CANDIDATOS', 100)
+                )
+        
+        envios_ids = list({
+            envio_id for lista in candidatos + lexicos for envio_id, _ in lista
+        })
+        vectores = dict(embedding_repository.obtener_vectores_por_envios(envios_ids, modelo=modelo_embedding))
+        textos_indexados = embedding_repository.obtener_textos_indexados(envios_ids, modelo_embedding)
+        
+        rankings = []
+        for posicion, preparada in enumerate(preparadas):
+            ids_consulta = dict.fromkeys(
+                [envio_id for envio_id, _ in candidatos[posicion]]
+                + [envio_id for envio_id, _ in lexicos[posicion]]
+            )
+            embeddings_envios = [(envio_id, vectores[envio_id]) for envio_id in ids_consulta if envio_id in vectores]
+            if not embeddings_envios:
+                rankings.append([])
+                continue
+            ranking, _ = BusquedaSemanticaService._rankear_candidatos(
+                embeddings[posicion],
+                embeddings_envios,
+                preparada['consulta_procesada'],
+                textos_indexados,
+                lexicos[posicion],
+                limite,
+                metrica_ordenamiento,
+                BusquedaSemanticaService._coincidencias_identificador(
+                    preparada['consulta_lexica'], lexicos[posicion]
+                )
+            )
+            rankings.append(ranking)
+        return rankings, textos_indexados
+    
+    @staticmethod
+    def buscar_similares(
+        usuario,
+        envio_id: int = None,
+        hawb: str = None,
+        filtros: Dict[str, Any] = None,
+        limite: int = 10,
+        modelo_embedding: str = None
+    ) -> Dict[str, Any]:
+        """
+        Envíos parecidos a uno dado ("más como este"): usa el vector guardado del envío
+        como consulta, sin llamadas a OpenAI ni expansión de texto. Aplica los permisos del
+        usuario y los filtros (mismas claves que filtrosAdicionales de la búsqueda semántica).
+        
+        Raises:
+            EnvioNoEncontradoError: Si el envío no existe o el usuario no puede verlo
+            EmbeddingNoEncontradoError: Si el envío no tiene embedding del modelo
+        """
+        tiempo_inicio = time.perf_counter()
+        filtros = filtros or {}
+        
+        if modelo_embedding is None:
+            modelo_embedding = EmbeddingService.get_modelo_default()
+        else:
+            modelo_embedding = EmbeddingService.validar_modelo(modelo_embedding)
+        modelo_embedding = BusquedaSemanticaService._obtener_modelo_disponible(None, modelo_embedding)
+        
+        campo = {'id': envio_id} if envio_id is not None else {'hawb': hawb}
+        referencia = (
+            envio_repository.filtrar_por_permisos_usuario(usuario)
+            .filter(**campo).order_by().values_list('id', 'hawb').first()
         )
+        if referencia is None:
+            raise EnvioNoEncontradoError(str(envio_id if envio_id is not None else hawb))
+        referencia_id, referencia_hawb = referencia
+        
+        vectores = embedding_repository.obtener_vectores_por_envios([referencia_id], modelo=modelo_embedding)
+        if not vectores:
+            raise EmbeddingNoEncontradoError(f'{referencia_hawb} ({modelo_embedding})')
+        vector = np.asarray(vectores[0][1], dtype=np.float32)
+        
+        if indice_en_memoria_habilitado():
+            indice = obtener_indice(modelo_embedding)
+            exacto = indice.cuantizacion == 'float32'
+            filtro = BusquedaSemanticaService._validar_filas_sin_metadatos(
+                BusquedaSemanticaService._filtro_indice(usuario, filtros),
+                indice,
+                BusquedaSemanticaService._obtener_envios_filtrados(usuario, filtros)
+            )
+            candidatos = indice.buscar(
+                vector,
+                k=limite + 1 if exacto else limite * 4 + 1,
+                filtro=filtro
+            )
+            candidatos = [(e, s) for e, s in candidatos if e != referencia_id]
+            if not exacto:
+                # Similitudes aproximadas de la matriz cuantizada: re-puntuar con float32
+                candidatos = BusquedaSemanticaService._similitudes_coseno(
+                    vector,
+                    embedding_repository.obtener_vectores_por_envios(
+                        [e for e, _ in candidatos], modelo=modelo_embedding
+                    )
+                )
+        else:
+            envios_queryset = BusquedaSemanticaService._obtener_envios_filtrados(
+                usuario, filtros
+            ).exclude(id=referencia_id)
+            if embedding_repository.soporta_busqueda_ann(modelo_embedding):
+                reducido = embedding_repository.soporta_busqueda_reducida(modelo_embedding)
+                cercanos = embedding_repository.buscar_top_k_ann(
+                    envios_queryset,
+                    vector,
+                    modelo=modelo_embedding,
+                    k=max(limite, getattr(settings, 'SEMANTIC_MATRYOSHKA_CANDIDATOS', 400)) if reducido else limite,
+                    reducido=reducido
+                )
+                if reducido:
+                    candidatos = BusquedaSemanticaService._similitudes_coseno(
+                        vector,
+                        embedding_repository.obtener_vectores_por_envios(
+                            [e for e, _ in cercanos], modelo=modelo_embedding
+                        )
+                    )
+                else:
+                    candidatos = [(e, 1.0 - float(distancia)) for e, distancia in cercanos]
+            else:
+                # Sin ANN: recorrer todo el alcance por bloques con un top-k acumulado
+                candidatos = BusquedaSemanticaService._top_k_coseno_por_bloques(
+                    vector,
+                    embedding_repository.iterar_vectores(modelo_embedding, envios_queryset=envios_queryset),
+                    limite
+                )
+        candidatos = candidatos[:limite]
+        
+        # Hidratar dentro del alcance del usuario: los candidatos del índice o de la base
+        # de datos pudieron quedar fuera de sus permisos desde la última sincronización
+        envios_por_id = {
+            envio.id: envio
+            for envio in envio_repository.filtrar_por_permisos_usuario(usuario).filter(
+                id__in=[e for e, _ in candidatos]
+            )
+        }
+        resultados = [
+            {'envio': EnvioSerializer(envios_por_id[e]).data, 'cosineSimilarity': round(similitud, 4)}
+            for e, similitud in candidatos
+            if e in envios_por_id
+        ]
+        
+        return {
+            'envioReferencia': {'id': referencia_id, 'hawb': referencia_hawb},
+            'modeloUtilizado': modelo_embedding,
+            'totalEncontrados': len(resultados),
+            'resultados': resultados,
+            'tiempoRespuesta': round((time.perf_counter() - tiempo_inicio) * 1000, 2)
+        }
+    
+    @staticmethod
+    def _similitudes_coseno(vector: np.ndarray, pares: List[Tuple[int, Any]]) -> List[Tuple[int, float]]:
+        """Similitud coseno exacta (float32) de cada (envio_id, vector), de mayor a menor"""
+        if not pares:
+            return []
+        matriz = np.asarray([v for _, v in pares], dtype=np.float32)
+        normas = np.linalg.norm(matriz, axis=1) * (np.linalg.norm(vector) or 1.0)
+        similitudes = (matriz @ vector) / np.where(normas == 0, 1, normas)
+        orden = np.argsort(-similitudes, kind='stable')
+        return [(int(pares[i][0]), float(similitudes[i])) for i in orden]
+    
+    @staticmethod
+    def _top_k_coseno_por_bloques(
+        vector: np.ndarray,
+        pares: Iterable[Tuple[int, Any]],
+        k: int
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k por similitud coseno sobre (envio_id, vector) leídos por bloques normalizados;
+        la memoria queda acotada a un bloque más los k mejores. De mayor a menor.
+        """
+        if k <= 0:
+            return []
+        consulta = (vector / (np.linalg.norm(vector) or 1.0)).astype(np.float32)
+        mejores_ids = np.empty(0, dtype=np.int64)
+        mejores = np.empty(0, dtype=np.float32)
+        for ids, matriz in bloques_normalizados(pares):
+            mejores_ids = np.concatenate([mejores_ids, ids])
+            mejores = np.concatenate([mejores, matriz @ consulta])
+            if len(mejores) > k:
+                seleccion = np.argpartition(-mejores, k - 1)[:k]
+                mejores_ids, mejores = mejores_ids[seleccion], mejores[seleccion]
+        orden = np.argsort(-mejores, kind='stable')
+        return [(int(mejores_ids[i]), float(mejores[i])) for i in orden]
+    
+    @staticmethod
+    def _calcular_coalescido(
+        consulta: str,
+        usuario,
+        filtros: Optional[Dict[str, Any]],
+        limite: int,
+        modelo_embedding: str,
+        metrica_ordenamiento: str,
+        usar_cache: bool,
+        hidratar: bool = True
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Ejecuta _calcular_busqueda; consultas idénticas concurrentes (mismo alcance de
+        permisos) comparten un solo cálculo.
         
-        # Si el modelo solicitado no tiene embeddings, usar el modelo disponible
-        if modelo_disponible != modelo_embedding:
-            logger.info(
-                f"Modelo solicitado {modelo_embedding} no tiene embeddings disponibles. "
-                f"Usando modelo {modelo_disponible} que tiene embeddings."
+        Returns:
+            (calculo, compartido)
+        """
+        def calcular():
+            return BusquedaSemanticaService._calcular_busqueda(
+                consulta, usuario, filtros, limite, modelo_embedding, metrica_ordenamiento, usar_cache,
+                hidratar=hidratar
             )
-            modelo_embedding = modelo_disponible
         
-        # 3. Generar embedding de la consulta con el modelo disponible (usando consulta procesada)
-        embedding_resultado = EmbeddingService.generar_embedding(consulta_procesada, modelo_embedding)
-        embedding_consulta = embedding_resultado['embedding']
-        tokens_consulta = embedding_resultado['tokens']
-        costo_consulta = embedding_resultado['costo']
+        if not getattr(settings, 'SEMANTIC_SINGLE_FLIGHT', True):
+            return calcular(), False
         
-        # 4. Buscar envíos similares (usar consulta procesada para comparaciones)
-        resultados = BusquedaSemanticaService._buscar_envios_similares(
-            envios_queryset,
-            embedding_consulta,
-            consulta_procesada,  # Usar consulta procesada
-            limite,
+        partes = [
+            BusquedaSemanticaService._alcance_permisos(usuario),
+            ' '.join(consulta.lower().split()),
+            filtros or {},
             modelo_embedding,
-            metrica_ordenamiento
-        )
-        
-        # 4b. Post-validación estricta: eliminar resultados que no cumplan filtros exactos
-        # (safety net por si algún edge case pasó el filtro inicial)
-        resultados = BusquedaSemanticaService._post_filtrar_resultados_estrictos(
-            resultados, filtros_estrictos
-        )
-        
-        # 4. Calcular tiempo de respuesta
-        tiempo_respuesta = int((time.time() - tiempo_inicio) * 1000)
-        
-        # 5. Guardar en historial con embedding y resultados
+            metrica_ordenamiento,
+            limite,
+            usar_cache
+        ]
+        if not hidratar:
+            partes.append('ranking')
+        return CoalescenciaConsultas.ejecutar(CoalescenciaConsultas.clave(*partes), calcular)
+    
+    @staticmethod
+    def _registrar_busqueda(
+        consulta: str,
+        usuario,
+        filtros: Optional[Dict[str, Any]],
+        resultados: List[Dict],
+        tiempo_respuesta: int,
+        modelo_embedding: str,
+        embedding_consulta,
+        tokens_consulta: int,
+        costo_consulta: float,
+        compartido: bool
+    ):
+        """Guarda la búsqueda en el historial (con embedding y resultados) y registra logs y métricas"""
         # Guardar consulta original para el historial
         busqueda = embedding_busqueda_repository.crear(
             usuario=usuario,
@@ -314,11 +1079,10 @@ class BusquedaSemanticaService(BaseService):
             resultados_json=resultados  # Guardar resultados para PDF
         )
         
-        # Guardar el embedding de la consulta solo si las dimensiones coinciden
-        # text-embedding-3-small y text-embedding-ada-002: 1536 dimensiones
-        # text-embedding-3-large: 3072 dimensiones
-        if embedding_consulta:
-            dimensiones_esperadas = 1536  # Dimensiones del campo en el modelo
+        # Guardar el embedding de la consulta solo si las dimensiones coinciden con las
+        # del registro (1536 o 3072; set_vector elige la columna según la dimensión)
+        if embedding_consulta is not None and len(embedding_consulta):
+            dimensiones_esperadas = RegistroModelos.dimensiones(modelo_embedding)
             dimensiones_reales = len(embedding_consulta)
             
             # Solo guardar si las dimensiones coinciden
@@ -345,7 +1109,8 @@ class BusquedaSemanticaService(BaseService):
                 'tiempo_respuesta_ms': tiempo_respuesta,
                 'modelo': modelo_embedding,
                 'costo': float(costo_consulta),
-                'tokens': tokens_consulta
+                'tokens': tokens_consulta,
+                'compartida': compartido
             }
         )
         
@@ -365,18 +1130,232 @@ class BusquedaSemanticaService(BaseService):
             contexto={'modelo': modelo_embedding}
         )
         
+        return busqueda
+    
+    @staticmethod
+    def _alcance_permisos(usuario) -> str:
+        """
+        Alcance de envíos visibles para el usuario (ver filtrar_por_permisos_usuario).
+        Usuarios con el mismo alcance obtienen los mismos resultados para una consulta.
+        """
+        if usuario.es_admin or usuario.es_gerente or usuario.es_digitador:
+            return 'todos'
+        if usuario.es_comprador:
+            return f'comprador:{usuario.id}'
+        return 'ninguno'
+    
+    @staticmethod
+    def _calcular_busqueda(
+        consulta: str,
+        usuario,
+        filtros: Optional[Dict[str, Any]],
+        limite: int,
+        modelo_embedding: str,
+        metrica_ordenamiento: str,
+        usar_cache: bool = True,
+        hidratar: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Parte compartible de la búsqueda: expansión, embedding de la consulta y ranking.
+        No escribe historial (lo hace buscar() para cada usuario).
+        Con hidratar=False 'resultados' es el ranking sin formatear ni post-filtrar
+        (buscar_streaming lo hidrata por lotes).
+        
+        Returns:
+            dict: {'resultados', 'modelo', 'embedding', 'tokens', 'costo',
+                   'consulta_procesada', 'filtros_estrictos'}
+        """
+        # 1. Expandir consulta con sinónimos y contexto (incluye detección de fechas, cantidades, etc.)
+        preparada = BusquedaSemanticaService._preparar_consulta(consulta, filtros)
+        filtros_completos = preparada['filtros_completos']
+        filtros_estrictos = preparada['filtros_estrictos']
+        consulta_procesada = preparada['consulta_procesada']
+        consulta_lexica = preparada['consulta_lexica']
+        
+        # 2. Obtener envíos filtrados (con filtros mejorados)
+        envios_queryset = BusquedaSemanticaService._obtener_envios_filtrados(
+            usuario, filtros_completos
+        )
+        
+        # Con el índice en memoria los mismos filtros se resuelven como máscaras sobre
+        # sus columnas de metadatos: el conjunto candidato no se consulta en SQL
+        filtro_indice = None
+        if indice_en_memoria_habilitado():
+            filtro_indice = BusquedaSemanticaService._filtro_indice(usuario, filtros_completos)
+        elif envios_queryset.count() == 0:
+            return BusquedaSemanticaService._resultado_sin_envios(
+                consulta_procesada, modelo_embedding, filtros_estrictos
+            )
+        
+        # 2. Verificar qué embeddings están disponibles antes de generar el embedding de la consulta
+        # Esto evita generar embeddings con un modelo que no tiene embeddings de envíos
+        modelo_disponible = BusquedaSemanticaService._obtener_modelo_disponible(
+            envios_queryset, modelo_embedding
+        )
+        
+        # Si el modelo solicitado no tiene embeddings, usar el modelo disponible
+        if modelo_disponible != modelo_embedding:
+            logger.info(
+                f"Modelo solicitado {modelo_embedding} no tiene embeddings disponibles. "
+                f"Usando modelo {modelo_disponible} que tiene embeddings."
+            )
+            modelo_embedding = modelo_disponible
+        
+        if filtro_indice is not None:
+            BusquedaSemanticaService._validar_filas_sin_metadatos(
+                filtro_indice, obtener_indice(modelo_embedding), envios_queryset
+            )
+        if filtro_indice is not None and obtener_indice(modelo_embedding).contar(filtro_indice) == 0:
+            return BusquedaSemanticaService._resultado_sin_envios(
+                consulta_procesada, modelo_embedding, filtros_estrictos
+            )
+        
+        # 3. Generar embedding de la consulta con el modelo disponible (usando consulta procesada)
+        embedding_resultado = CacheEmbeddingsConsulta.obtener_embedding(consulta_procesada, modelo_embedding)
+        
+        # Ranking cacheado por alcance de permisos (se invalida al cambiar envíos o embeddings)
+        clave_ranking = None
+        if usar_cache and CacheResultadosSemanticos.habilitado():
+            clave_ranking = CacheResultadosSemanticos.clave(
+                BusquedaSemanticaService._alcance_permisos(usuario),
+                consulta_procesada,
+                consulta_lexica,
+                filtros_completos,
+                modelo_embedding,
+                metrica_ordenamiento,
+                limite
+            )
+        
+        # 4. Buscar envíos similares (usar consulta procesada para comparaciones)
+        resultados = BusquedaSemanticaService._buscar_envios_similares(
+            envios_queryset,
+            embedding_resultado['embedding'],
+            consulta_procesada,  # Usar consulta procesada
+            limite,
+            modelo_embedding,
+            metrica_ordenamiento,
+            clave_ranking=clave_ranking,
+            filtro_indice=filtro_indice,
+            hidratar=hidratar,
+            texto_lexico=consulta_lexica
+        )
+        
+        # 4b. Post-validación estricta: eliminar resultados que no cumplan filtros exactos
+        # (safety net por si algún edge case pasó el filtro inicial)
+        if hidratar:
+            resultados = BusquedaSemanticaService._post_filtrar_resultados_estrictos(
+                resultados, filtros_estrictos
+            )
+        
         return {
-            'consulta': consulta,
             'resultados': resultados,
-            'totalEncontrados': len(resultados),
-            'tiempoRespuesta': tiempo_respuesta,
-            'modeloUtilizado': modelo_embedding,
-            'costoConsulta': float(costo_consulta),
-            'tokensUtilizados': tokens_consulta,
-            'busquedaId': busqueda.id,
-            'metricaOrdenamiento': metrica_ordenamiento or 'score_combinado'
+            'modelo': modelo_embedding,
+            'embedding': embedding_resultado['embedding'],
+            'tokens': embedding_resultado['tokens'],
+            'costo': embedding_resultado['costo'],
+            'consulta_procesada': consulta_procesada,
+            'filtros_estrictos': filtros_estrictos
+        }
+    
+    @staticmethod
+    def _preparar_consulta(consulta: str, filtros: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Expande la consulta (sinónimos, fechas, cantidades) y combina los filtros sugeridos
+        con los proporcionados (prioridad a los proporcionados).
+        
+        Returns:
+            dict: {'consulta_procesada', 'consulta_lexica', 'filtros_completos', 'filtros_estrictos'}
+            consulta_lexica es la consulta del usuario sin expandir: la búsqueda de texto
+            completo exige todos sus términos y los sinónimos agregados no aparecen juntos.
+        """
+        expansion = QueryExpander.expandir_consulta(consulta, incluir_filtros_temporales=True)
+        consulta_expandida = expansion['consulta_expandida']
+        filtros_sugeridos = expansion['filtros_sugeridos']
+        
+        filtros_completos = {**filtros_sugeridos, **(filtros or {})}
+        
+        logger.info(
+            f"Consulta expandida: original='{consulta[:50]}...', "
+            f"expandida='{consulta_expandida[:100]}...', "
+            f"filtros_sugeridos={filtros_sugeridos}"
+        )
+        
+        return {
+            # Procesar consulta expandida: aplicar limpieza y normalización
+            'consulta_procesada': TextProcessor.procesar_texto(consulta_expandida),
+            'consulta_lexica': TextProcessor.procesar_texto(consulta),
+            'filtros_completos': filtros_completos,
+            # Filtros para post-validación estricta de resultados
+            'filtros_estrictos': {
+                k: v for k, v in filtros_completos.items()
+                if k in ('fechaDesde', 'fechaHasta', 'cantidad_lineas_minima',
+                         'cantidad_productos_minima', 'estado', 'ciudadDestino')
+            }
+        }
+    
+    @staticmethod
+    def _resultado_sin_envios(
+        consulta_procesada: str,
+        modelo_embedding: str,
+        filtros_estrictos: Dict = None
+    ) -> Dict[str, Any]:
+        """Resultado vacío cuando ningún envío cumple permisos y filtros"""
+        # Generar embedding para calcular costo incluso sin resultados
+        try:
+            embedding_resultado = CacheEmbeddingsConsulta.obtener_embedding(
+                consulta_procesada, modelo_embedding
+            )
+        except OpenAINotConfiguredError:
+            embedding_resultado = {'embedding': None, 'tokens': 0, 'costo': 0}
+        
+        return {
+            'resultados': [],
+            'modelo': modelo_embedding,
+            'embedding': embedding_resultado['embedding'],
+            'tokens': embedding_resultado['tokens'],
+            'costo': embedding_resultado['costo'],
+            'consulta_procesada': consulta_procesada,
+            'filtros_estrictos': filtros_estrictos or {}
         }
     
+    @staticmethod
+    def _filtro_indice(usuario, filtros: Dict) -> FiltroMetadatos:
+        """
+        Traduce permisos y filtros de la búsqueda (los de _obtener_envios_filtrados)
+        a un FiltroMetadatos para el índice en memoria
+        """
+        filtros = BusquedaSemanticaService._normalizar_fechas_filtro(filtros)
+        alcance = BusquedaSemanticaService._alcance_permisos(usuario)
+        return FiltroMetadatos(
+            comprador_id=usuario.id if alcance.startswith('comprador:') else None,
+            sin_permisos=alcance == 'ninguno',
+            estado=filtros.get('estado'),
+            fecha_desde=filtros.get('fechaDesde') if isinstance(filtros.get('fechaDesde'), datetime) else None,
+            fecha_hasta=filtros.get('fechaHasta') if isinstance(filtros.get('fechaHasta'), datetime) else None,
+            ciudad=filtros.get('ciudadDestino'),
+            lineas_minima=filtros.get('cantidad_lineas_minima'),
+            cantidad_minima=filtros.get('cantidad_productos_minima'),
+            peso_minimo=filtros.get('peso_minimo'),
+            peso_maximo=filtros.get('peso_maximo'),
+            valor_minimo=filtros.get('valor_minimo'),
+            valor_maximo=filtros.get('valor_maximo')
+        )
+    
+    @staticmethod
+    def _validar_filas_sin_metadatos(filtro: FiltroMetadatos, indice, envios_queryset) -> FiltroMetadatos:
+        """
+        Las filas del índice cuyos metadatos aún no se cargaron no pueden filtrarse con
+        las columnas del índice: se validan contra envios_queryset (permisos y filtros en SQL)
+        para no excluirlas de la búsqueda.
+        """
+        if filtro.activo and not filtro.sin_permisos:
+            pendientes = indice.ids_sin_metadatos()
+            if pendientes:
+                filtro.ids_validados = set(
+                    envios_queryset.filter(id__in=pendientes).values_list('id', flat=True)
+                )
+        return filtro
+    
     @staticmethod
     def _normalizar_fechas_filtro(filtros: Dict) -> Dict:
         """
@@ -471,6 +1450,8 @@ class BusquedaSemanticaService(BaseService):
         """
         Obtiene el modelo de embedding que tiene embeddings disponibles.
         Si el modelo solicitado no tiene embeddings, retorna el modelo por defecto.
+        La cobertura por modelo se lee del registro de modelos (cacheado en memoria),
+        sin consultar la BD en cada búsqueda.
         
         Args:
             envios_queryset: QuerySet de envíos
@@ -479,29 +1460,13 @@ class BusquedaSemanticaService(BaseService):
         Returns:
             Modelo que tiene embeddings disponibles
         """
-        # Limitar a los primeros envíos para verificar rápidamente
-        envios_limite = envios_queryset[:100]
-        
-        # Verificar si hay embeddings con el modelo solicitado
-        embeddings = embedding_repository.obtener_embeddings_para_busqueda(
-            envios_limite,
-            modelo=modelo_solicitado,
-            limite=100
-        )
-        
-        if embeddings:
+        if RegistroModelos.disponible(modelo_solicitado):
             return modelo_solicitado
         
         # Si no hay embeddings con el modelo solicitado, intentar con el modelo por defecto
         modelo_default = EmbeddingService.get_modelo_default()
-        if modelo_default != modelo_solicitado:
-            embeddings = embedding_repository.obtener_embeddings_para_busqueda(
-                envios_limite,
-                modelo=modelo_default,
-                limite=100
-            )
-            if embeddings:
-                return modelo_default
+        if modelo_default != modelo_solicitado and RegistroModelos.disponible(modelo_default):
+            return modelo_default
         
         # Si tampoco hay embeddings con el modelo por defecto, retornar el solicitado
         # (el error se manejará más adelante)
@@ -510,40 +1475,124 @@ class BusquedaSemanticaService(BaseService):
     @staticmethod
     def _buscar_envios_similares(
         envios_queryset,
-        embedding_consulta: List[float],
+        embedding_consulta: np.ndarray,
         texto_consulta: str,
         limite: int,
         modelo_embedding: str,
-        metrica_ordenamiento: str = 'score_combinado'
+        metrica_ordenamiento: str = 'score_combinado',
+        clave_ranking: Optional[str] = None,
+        filtro_indice: Optional[FiltroMetadatos] = None,
+        hidratar: bool = True,
+        texto_lexico: Optional[str] = None
     ) -> List[Dict]:
         """
         Busca envíos similares usando búsqueda vectorial.
         OPTIMIZADO: Solo usa embeddings existentes, no genera en tiempo real.
+        Con clave_ranking, el top-k se lee de CacheResultadosSemanticos (o se guarda allí).
+        Con filtro_indice (y el índice en memoria activo) el top-k se resuelve en el
+        índice, que filtra con sus columnas de metadatos; sin él, en la BD.
+        Con hidratar=False retorna el ranking (ids y métricas) sin formatear.
+        texto_lexico es la consulta sin expandir para la búsqueda de texto completo
+        (por defecto texto_consulta).
         """
         tiempo_inicio_busqueda = time.time()
         
-        # LIMITAR envíos a procesar para mejorar rendimiento
+        if clave_ranking:
+            ranking = CacheResultadosSemanticos.obtener(clave_ranking)
+            if ranking is not None:
+                if not hidratar:
+                    return ranking
+                return BusquedaSemanticaService._hidratar_resultados(
+                    ranking, texto_consulta, envios_queryset, modelo=modelo_embedding
+                )
+        
+        # LIMITAR envíos a procesar para mejorar rendimiento (solo modo sin índice ANN)
         # Aumentado significativamente para mejor cobertura con muchos registros
         # Con expansión de consultas, podemos procesar más sin pérdida de rendimiento
         MAX_ENVIOS_A_PROCESAR = 1000
         
-        # Limitar el queryset antes de procesar
-        envios_limitados = envios_queryset[:MAX_ENVIOS_A_PROCESAR]
-        total_envios_disponibles = envios_queryset.count()
+        # El índice en memoria solo se usa con el alcance traducido a sus columnas de
+        # metadatos: sin filtro_indice habría que pasarle todos los IDs del queryset
+        usar_indice_memoria = indice_en_memoria_habilitado() and filtro_indice is not None
+        if usar_indice_memoria:
+            total_envios_disponibles = obtener_indice(modelo_embedding).contar(filtro_indice)
+        else:
+            total_envios_disponibles = envios_queryset.count()
+        usar_reducido = not usar_indice_memoria and embedding_repository.soporta_busqueda_reducida(modelo_embedding)
+        usar_ann = not usar_indice_memoria and (
+            usar_reducido or embedding_repository.soporta_busqueda_ann(modelo_embedding)
+        )
         
         logger.info(
             f"Búsqueda semántica iniciada: consulta='{texto_consulta[:50]}...', "
-            f"envios_disponibles={total_envios_disponibles}, limite={limite}"
+            f"envios_disponibles={total_envios_disponibles}, limite={limite}, "
+            f"indice_memoria={usar_indice_memoria}, ann={usar_ann}, reducido={usar_reducido}"
         )
         
         # Obtener embeddings de envíos EXISTENTES únicamente
         # No generar embeddings en tiempo real para evitar demoras
         try:
-            embeddings_envios = embedding_repository.obtener_embeddings_para_busqueda(
-                envios_limitados,
-                modelo=modelo_embedding,
-                limite=MAX_ENVIOS_A_PROCESAR
-            )
+            k_candidatos = max(getattr(settings, 'SEMANTIC_ANN_CANDIDATES', 200), limite * 5)
+            if usar_indice_memoria:
+                # Top-k exacto sobre la matriz residente del proceso: un producto
+                # matriz-vector restringido a los envíos que el usuario puede ver
+                candidatos = obtener_indice(modelo_embedding).buscar(
+                    embedding_consulta, k=k_candidatos, filtro=filtro_indice
+                )
+                embeddings_envios = embedding_repository.obtener_vectores_por_envios(
+                    [envio_id for envio_id, _ in candidatos],
+                    modelo=modelo_embedding
+                )
+            elif usar_ann:
+                # Top-k resuelto en PostgreSQL con el índice HNSW: cubre todo el corpus
+                # filtrado y solo trae a Python los vectores de los candidatos. Con la
+                # copia reducida (Matryoshka) el índice es de 256 dimensiones y el
+                # re-ranking con el vector completo lo hace calcular_similitudes
+                candidatos = embedding_repository.buscar_top_k_ann(
+                    envios_queryset,
+                    embedding_consulta,
+                    modelo=modelo_embedding,
+                    k=(
+                        max(k_candidatos, getattr(settings, 'SEMANTIC_MATRYOSHKA_CANDIDATOS', 400))
+                        if usar_reducido else k_candidatos
+                    ),
+                    reducido=usar_reducido
+                )
+                embeddings_envios = embedding_repository.obtener_vectores_por_envios(
+                    [envio_id for envio_id, _ in candidatos],
+                    modelo=modelo_embedding
+                )
+            else:
+                embeddings_envios = embedding_repository.obtener_vectores_para_busqueda(
+                    envios_queryset[:MAX_ENVIOS_A_PROCESAR],
+                    modelo=modelo_embedding,
+                    limite=MAX_ENVIOS_A_PROCESAR
+                )
+            
+            candidatos_lexicos = []
+            ids_exactos = set()
+            if embedding_repository.soporta_busqueda_lexica():
+                # Búsqueda híbrida: candidatos de texto completo (índice GIN) sobre todo el
+                # corpus filtrado; los que no trajo el top-k vectorial se agregan a la unión
+                candidatos_lexicos = embedding_repository.buscar_top_k_lexico(
+                    envios_queryset,
+                    texto_lexico or texto_consulta,
+                    modelo=modelo_embedding,
+                    k=getattr(settings, 'SEMANTIC_LEXICO_CANDIDATOS', 100)
+                )
+                ids_exactos = BusquedaSemanticaService._coincidencias_identificador(
+                    texto_lexico or texto_consulta, candidatos_lexicos
+                )
+                embeddings_envios = list(embeddings_envios)
+                ids_vectoriales = {envio_id for envio_id, _ in embeddings_envios}
+                faltantes = [
+                    envio_id for envio_id, _ in candidatos_lexicos
+                    if envio_id not in ids_vectoriales
+                ]
+                if faltantes:
+                    embeddings_envios.extend(
+                        embedding_repository.obtener_vectores_por_envios(faltantes, modelo=modelo_embedding)
+                    )
         except Exception as e:
             logger.error(
                 f"Error al obtener embeddings: {str(e)}", 
@@ -570,21 +1619,95 @@ class BusquedaSemanticaService(BaseService):
                 f"No se encontraron embeddings existentes. "
                 f"Ejecute 'python manage.py generar_embeddings --modelo {modelo_embedding}' para generarlos."
             )
+            if clave_ranking:
+                CacheResultadosSemanticos.guardar(clave_ranking, [])
             return []
         
         logger.debug(f"Embeddings encontrados: {len(embeddings_envios)} de {total_envios_disponibles} envíos")
         
         # Obtener textos indexados en batch
         envio_ids = [e[0] for e in embeddings_envios]
-        textos_indexados = embedding_repository.obtener_textos_indexados(envio_ids)
+        textos_indexados = embedding_repository.obtener_textos_indexados(envio_ids, modelo_embedding)
+        
+        resultados_ordenados, detalle = BusquedaSemanticaService._rankear_candidatos(
+            embedding_consulta,
+            embeddings_envios,
+            texto_consulta,
+            textos_indexados,
+            candidatos_lexicos,
+            limite,
+            metrica_ordenamiento,
+            ids_exactos
+        )
+        
+        if clave_ranking:
+            CacheResultadosSemanticos.guardar(clave_ranking, resultados_ordenados)
+        
+        if not hidratar:
+            return resultados_ordenados
+        
+        resultados_formateados = BusquedaSemanticaService._hidratar_resultados(
+            resultados_ordenados, texto_consulta, envios_queryset, textos_indexados
+        )
+        
+        # Log métricas de rendimiento
+        tiempo_total_busqueda = (time.time() - tiempo_inicio_busqueda) * 1000
+        logger.info(
+            f"Búsqueda semántica completada: "
+            f"tiempo={tiempo_total_busqueda:.2f}ms, "
+            f"resultados_similitud={detalle['resultados_similitud']}, "
+            f"resultados_filtrados={detalle['resultados_filtrados']}, "
+            f"candidatos_lexicos={len(candidatos_lexicos)}, "
+            f"resultados_finales={len(resultados_formateados)}"
+        )
+        
+        # Log detallado si hay pocos resultados
+        if len(resultados_formateados) < 3 and len(embeddings_envios) > 10:
+            logger.warning(
+                f"Pocos resultados para consulta '{texto_consulta[:50]}': "
+                f"{len(resultados_formateados)} de {len(embeddings_envios)} embeddings. "
+                f"Umbral: {detalle['umbral_base']}, Es consulta productos: {detalle['es_consulta_productos']}"
+            )
+        
+        return resultados_formateados
+    
+    @staticmethod
+    def _rankear_candidatos(
+        embedding_consulta: np.ndarray,
+        embeddings_envios: List[Tuple[int, Any]],
+        texto_consulta: str,
+        textos_indexados: Dict[int, str],
+        candidatos_lexicos: List[Tuple[int, Any]],
+        limite: int,
+        metrica_ordenamiento: str,
+        ids_exactos: Optional[set] = None
+    ) -> Tuple[List[Dict], Dict[str, Any]]:
+        """
+        Puntúa los candidatos (similitudes, fusión RRF con los léxicos, umbral adaptativo)
+        y retorna el top-k sin hidratar. Las coincidencias léxicas suben en el ranking
+        por RRF, pero solo ids_exactos (HAWB escrito en la consulta) pasan aunque no
+        alcancen el umbral de similitud.
+        
+        Returns:
+            (ranking, detalle) con detalle: {'resultados_similitud', 'resultados_filtrados',
+            'umbral_base', 'es_consulta_productos'} para los logs
+        """
+        # Validar métrica de ordenamiento
+        metricas_validas = [
+            'score_combinado', 'cosine_similarity', 'dot_product',
+            'euclidean_distance', 'manhattan_distance'
+        ]
+        if metrica_ordenamiento not in metricas_validas:
+            metrica_ordenamiento = 'score_combinado'
         
-        # Calcular similitudes
+        # Calcular similitudes (formato columnar; las distancias solo si se ordena por ellas)
         vector_search = VectorSearchService()
         resultados_similitud = vector_search.calcular_similitudes(
             embedding_consulta,
             embeddings_envios,
             texto_consulta=texto_consulta,
-            textos_indexados=textos_indexados
+            textos_indexados=textos_indexados,
+            metrica_ordenamiento=metrica_ordenamiento
         )
         
         # Aplicar umbral y ordenar (MEJORADO para productos)
@@ -598,52 +1721,94 @@ class BusquedaSemanticaService(BaseService):
         # Esto permite encontrar más resultados relevantes, especialmente con muchos registros
         umbral_base = 0.25 if es_consulta_productos else 0.28
         
+        conservar = None
+        metrica_top_k = metrica_ordenamiento
+        if candidatos_lexicos:
+            # Reciprocal Rank Fusion: las coincidencias léxicas (HAWB, cédula, producto)
+            # suben en el ranking; solo un HAWB exacto no depende del umbral vectorial
+            vector_search.fusionar_rrf(
+                resultados_similitud,
+                candidatos_lexicos,
+                k=getattr(settings, 'SEMANTIC_RRF_K', 60)
+            )
+            if ids_exactos:
+                conservar = np.isin(
+                    resultados_similitud.envio_ids, np.fromiter(ids_exactos, dtype=np.int64)
+                )
+            if metrica_ordenamiento == 'score_combinado':
+                metrica_top_k = 'score_rrf'
+        
         resultados_filtrados = vector_search.aplicar_umbral(
             resultados_similitud,
             umbral_base=umbral_base,
-            usar_adaptativo=True
+            usar_adaptativo=True,
+            conservar=conservar
         )
         
-        # Validar métrica de ordenamiento
-        metricas_validas = [
-            'score_combinado', 'cosine_similarity', 'dot_product',
-            'euclidean_distance', 'manhattan_distance'
-        ]
-        if metrica_ordenamiento not in metricas_validas:
-            metrica_ordenamiento = 'score_combinado'
-        
+        # Top-k con argpartition; solo estos resultados se convierten a dict
         resultados_ordenados = vector_search.ordenar_por_metrica(
             resultados_filtrados,
-            metrica=metrica_ordenamiento,
+            metrica=metrica_top_k,
             limite=limite
         )
         
+        return resultados_ordenados, {
+            'resultados_similitud': len(resultados_similitud),
+            'resultados_filtrados': len(resultados_filtrados),
+            'umbral_base': umbral_base,
+            'es_consulta_productos': es_consulta_productos
+        }
+    
+    @staticmethod
+    def _coincidencias_identificador(texto_lexico: str, candidatos_lexicos: List[Tuple[int, Any]]) -> set:
+        """
+        Candidatos léxicos cuyo HAWB (número de guía) aparece completo en la consulta.
+        Solo los términos con letras y dígitos de al menos 4 caracteres se consideran
+        identificadores.
+        """
+        if not candidatos_lexicos:
+            return set()
+        terminos = [
+            termino for termino in re.findall(r'\w+', texto_lexico or '')
+            if len(termino) >= 4 and any(c.isdigit() for c in termino)
+        ]
+        return envio_repository.ids_con_hawb([envio_id for envio_id, _ in candidatos_lexicos], terminos)
+    
+    @staticmethod
+    def _hidratar_resultados(
+        ranking: List[Dict],
+        texto_consulta: str,
+        envios_queryset=None,
+        textos_indexados: Optional[Dict[int, str]] = None,
+        modelo: str = None,
+        envios_por_id: Optional[Dict[int, Any]] = None
+    ) -> List[Dict]:
+        """
+        Hidrata y formatea el top-k: una consulta con comprador y productos.
+        Los envíos se leen siempre de la base de datos (también con ranking cacheado) a
+        través de envios_queryset, los envíos que el usuario puede ver: el ranking puede
+        venir del caché o del índice en memoria de otro momento, y un envío reasignado a
+        otro comprador no se muestra. buscar_lote pasa envios_por_id ya leídos (con
+        permisos) para todas sus consultas.
+        """
+        envios_ids = [r['envio_id'] for r in ranking]
+        if envios_por_id is None:
+            envios_por_id = {envio.id: envio for envio in envios_queryset.filter(id__in=envios_ids)}
+        if textos_indexados is None:
+            textos_indexados = embedding_repository.obtener_textos_indexados(envios_ids, modelo)
+        
+        resultados = [
+            {**r, 'envio': envios_por_id[r['envio_id']]}
+            for r in ranking
+            if r['envio_id'] in envios_por_id
+        ]
+        
         # Formatear resultados
-        resultados_formateados = BusquedaSemanticaService._formatear_resultados(
-            resultados_ordenados,
+        return BusquedaSemanticaService._formatear_resultados(
+            resultados,
             texto_consulta,
             textos_indexados
         )
-        
-        # Log métricas de rendimiento
-        tiempo_total_busqueda = (time.time() - tiempo_inicio_busqueda) * 1000
-        logger.info(
-            f"Búsqueda semántica completada: "
-            f"tiempo={tiempo_total_busqueda:.2f}ms, "
-            f"resultados_similitud={len(resultados_similitud)}, "
-            f"resultados_filtrados={len(resultados_filtrados)}, "
-            f"resultados_finales={len(resultados_formateados)}"
-        )
-        
-        # Log detallado si hay pocos resultados
-        if len(resultados_formateados) < 3 and len(embeddings_envios) > 10:
-            logger.warning(
-                f"Pocos resultados para consulta '{texto_consulta[:50]}': "
-                f"{len(resultados_formateados)} de {len(embeddings_envios)} embeddings. "
-                f"Umbral: {umbral_base}, Es consulta productos: {es_consulta_productos}"
-            )
-        
-        return resultados_formateados
     
     @staticmethod
     def _formatear_resultados(
@@ -687,6 +1852,8 @@ class BusquedaSemanticaService(BaseService):
                 'manhattanDistance': round(resultado['manhattan_distance'], 4),
                 'scoreCombinado': round(resultado['score_combinado'], 4),
                 'boostExactas': round(resultado.get('boost_exactas', 0), 4),
+                'scoreRrf': round(resultado['score_rrf'], 6) if 'score_rrf' in resultado else None,
+                'coincidenciaLexica': resultado.get('coincidencia_lexica', False),
                 'fragmentosRelevantes': fragmentos,
                 'razonRelevancia': razon,
                 'textoIndexado': texto_indexado[:200] + "..." if len(texto_indexado) > 200 else texto_indexado,
@@ -877,7 +2044,7 @@ class BusquedaSemanticaService(BaseService):
         
         # Contar embeddings directamente desde el modelo
         envios_ids = list(envios_queryset.values_list('id', flat=True))
-        total_con_embedding = embedding_repository.model.objects.filter(
+        total_con_embedding = embedding_repository.tabla(modelo_default).objects.filter(
             envio_id__in=envios_ids,
             modelo_usado=modelo_default
         ).count()
@@ -889,7 +2056,11 @@ class BusquedaSemanticaService(BaseService):
             'total_con_embedding': total_con_embedding,
             'total_sin_embedding': total_sin_embedding,
             'porcentaje_con_embedding': round((total_con_embedding / total_envios * 100) if total_envios > 0 else 0, 2),
-            'modelo_default': modelo_default
+            'modelo_default': modelo_default,
+            'indices_en_memoria': estadisticas_indices(),
+            'cache_embeddings_consulta': CacheEmbeddingsConsulta.estadisticas(),
+            'cache_resultados': CacheResultadosSemanticos.estadisticas(),
+            'modelos': RegistroModelos.estado()
         }
     
     @staticmethod
@@ -922,7 +2093,7 @@ class BusquedaSemanticaService(BaseService):
             # Solo envíos sin embedding
             envios_ids = list(envios_queryset.values_list('id', flat=True))
             envios_con_embedding_ids = set(
-                embedding_repository.model.objects.filter(
+                embedding_repository.tabla(modelo).objects.filter(
                     envio_id__in=envios_ids,
                     modelo_usado=modelo
                 ).values_list('envio_id', flat=True)
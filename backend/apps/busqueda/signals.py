@@ -0,0 +1,130 @@
+"""
+Signals que mantienen al día el índice vectorial residente en memoria
+y la versión del caché de rankings semánticos.
+"""
+from django.db import transaction
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from apps.archivos.models import Envio, Producto
+from .models import EnvioEmbedding, EnvioEmbeddingGrande
+from .semantic.vector_index import (
+    notificar_embedding_actualizado,
+    notificar_envio_eliminado,
+    refrescar_metadatos,
+)
+from .semantic.registro_modelos import RegistroModelos
+from .services import CacheResultadosSemanticos
+
+
+@receiver(post_save, sender=EnvioEmbedding, dispatch_uid='indice_embedding_save')
+@receiver(post_save, sender=EnvioEmbeddingGrande, dispatch_uid='indice_embedding_grande_save')
+def actualizar_indice_embedding(sender, instance, **kwargs):
+    """Agrega o reemplaza el vector en el índice una vez confirmada la transacción"""
+    if instance.embedding_vector is None:
+        return
+    transaction.on_commit(
+        lambda: notificar_embedding_actualizado(
+            instance.modelo_usado, instance.envio_id, instance.embedding_vector
+        )
+    )
+    transaction.on_commit(lambda: RegistroModelos.marcar_disponible(instance.modelo_usado))
+
+
+@receiver(post_delete, sender=EnvioEmbedding, dispatch_uid='indice_embedding_delete')
+@receiver(post_delete, sender=EnvioEmbeddingGrande, dispatch_uid='indice_embedding_grande_delete')
+def eliminar_embedding_indice(sender, instance, **kwargs):
+    transaction.on_commit(lambda: notificar_envio_eliminado(instance.envio_id))
+
+
+@receiver(post_save, sender=Envio, dispatch_uid='indice_envio_soft_delete')
+def actualizar_indice_envio(sender, instance, update_fields=None, **kwargs):
+    """Refleja en el índice el borrado lógico (y la restauración) de un envío"""
+    if not update_fields or 'deleted_at' not in update_fields:
+        return
+
+    if instance.deleted_at is not None:
+        transaction.on_commit(lambda: notificar_envio_eliminado(instance.id))
+        return
+
+    for tabla in RegistroModelos.tablas():
+        embedding = tabla.objects.filter(
+            envio_id=instance.id, embedding_vector__isnull=False
+        ).only('envio_id', 'modelo_usado', 'embedding_vector').first()
+        if embedding:
+            transaction.on_commit(
+                lambda embedding=embedding: notificar_embedding_actualizado(
+                    embedding.modelo_usado, embedding.envio_id, embedding.embedding_vector
+                )
+            )
+
+
+@receiver(post_save, sender=Envio, dispatch_uid='indice_metadatos_envio_save')
+def actualizar_metadatos_envio(sender, instance, update_fields=None, **kwargs):
+    """Estado, fechas y totales del envío alimentan las máscaras de filtrado del índice"""
+    if update_fields and set(update_fields) <= {'deleted_at', 'fecha_actualizacion'}:
+        return
+    transaction.on_commit(lambda: refrescar_metadatos([instance.id]))
+
+
+@receiver(post_save, sender=Producto, dispatch_uid='indice_metadatos_producto_save')
+@receiver(post_delete, sender=Producto, dispatch_uid='indice_metadatos_producto_delete')
+def actualizar_metadatos_producto(sender, instance, **kwargs):
+    """Las líneas de producto cuentan para el filtro cantidad_lineas_minima"""
+    if instance.envio_id:
+        transaction.on_commit(lambda: refrescar_metadatos([instance.envio_id]))
+
+
+# Campos que alteran un ranking cacheado: texto indexado (TextProcessor.generar_texto_envio),
+# alcance de permisos (comprador) y atributos filtrables; el resto solo cambia la hidratación
+CAMPOS_RANKING_ENVIO = (
+    'hawb', 'comprador', 'observaciones', 'estado', 'fecha_emision',
+    'peso_total', 'valor_total', 'cantidad_total', 'deleted_at',
+)
+CAMPOS_RANKING_PRODUCTO = ('envio', 'descripcion', 'cantidad', 'categoria')
+
+
+def _modifica_campos(sender, instance, campos, update_fields) -> bool:
+    """Compara los campos con la fila guardada; un alta siempre cuenta como cambio"""
+    if instance._state.adding:
+        return True
+    if update_fields is not None:
+        campos = [campo for campo in campos if campo in update_fields]
+        if not campos:
+            return False
+    columnas = [sender._meta.get_field(campo).attname for campo in campos]
+    anterior = sender._base_manager.filter(pk=instance.pk).values(*columnas).first()
+    if anterior is None:
+        return True
+    return any(anterior[columna] != getattr(instance, columna) for columna in columnas)
+
+
+@receiver(pre_save, sender=Envio, dispatch_uid='resultados_envio_pre_save')
+@receiver(pre_save, sender=Producto, dispatch_uid='resultados_producto_pre_save')
+def detectar_cambio_ranking(sender, instance, update_fields=None, **kwargs):
+    """Marca la instancia si el guardado puede alterar algún ranking cacheado"""
+    if not getattr(settings, 'SEMANTIC_RESULT_CACHE', True):
+        instance._cambia_ranking = False
+        return
+    campos = CAMPOS_RANKING_ENVIO if sender is Envio else CAMPOS_RANKING_PRODUCTO
+    instance._cambia_ranking = _modifica_campos(sender, instance, campos, update_fields)
+
+
+@receiver(post_save, sender=Envio, dispatch_uid='resultados_envio_save')
+@receiver(post_save, sender=Producto, dispatch_uid='resultados_producto_save')
+def invalidar_cache_resultados_guardado(sender, instance, **kwargs):
+    """Un guardado que no toca texto, permisos ni filtros no invalida los rankings"""
+    if getattr(instance, '_cambia_ranking', True):
+        transaction.on_commit(CacheResultadosSemanticos.invalidar)
+
+
+@receiver(post_delete, sender=Envio, dispatch_uid='resultados_envio_delete')
+@receiver(post_delete, sender=Producto, dispatch_uid='resultados_producto_delete')
+@receiver(post_save, sender=EnvioEmbedding, dispatch_uid='resultados_embedding_save')
+@receiver(post_delete, sender=EnvioEmbedding, dispatch_uid='resultados_embedding_delete')
+@receiver(post_save, sender=EnvioEmbeddingGrande, dispatch_uid='resultados_embedding_grande_save')
+@receiver(post_delete, sender=EnvioEmbeddingGrande, dispatch_uid='resultados_embedding_grande_delete')
+def invalidar_cache_resultados(sender, **kwargs):
+    """Borrados de envíos o productos y cambios de embeddings siempre pueden alterar un ranking"""
+    transaction.on_commit(CacheResultadosSemanticos.invalidar)
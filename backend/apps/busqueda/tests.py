@@ -2,7 +2,7 @@
 Tests completos para la aplicación de búsqueda semántica
 Incluye tests de funcionalidad, precisión, rendimiento y métricas
 """
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -14,7 +14,7 @@ from unittest.mock import patch, MagicMock
 
 from apps.archivos.models import Envio, Producto
 from .services import BusquedaSemanticaService
-from .models import HistorialBusqueda
+from .models import BusquedaTradicional
 
 Usuario = get_user_model()
 
@@ -23,6 +23,13 @@ class BusquedaSemanticaTestCase(TestCase):
     """Tests básicos de funcionalidad de búsqueda semántica"""
     
     def setUp(self):
+        from .repositories import embedding_repository
+        from .services import get_semantic_cache
+        from .semantic.vector_index import reiniciar_indices
+        get_semantic_cache().clear()
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
         self.client = APIClient()
         self.usuario = Usuario.objects.create(
             username='testuser',
@@ -36,12 +43,13 @@ class BusquedaSemanticaTestCase(TestCase):
         self.usuario.save()
         self.client.force_authenticate(user=self.usuario)
         
-        # Crear comprador
+        # Crear comprador (la ciudad de destino es la del comprador)
         self.comprador = Usuario.objects.create(
             username='comprador1',
             correo='comprador1@test.com',
             cedula='0987654321',
             nombre='Juan Pérez',
+            ciudad='Quito',
             rol=4,
             is_active=True
         )
@@ -53,8 +61,7 @@ class BusquedaSemanticaTestCase(TestCase):
             peso_total=Decimal('5.0'),
             cantidad_total=1,
             valor_total=Decimal('150.0'),
-            estado='entregado',
-            ciudad_destino='Quito'
+            estado='entregado'
         )
         Producto.objects.create(
             envio=self.envio1,
@@ -71,8 +78,7 @@ class BusquedaSemanticaTestCase(TestCase):
             peso_total=Decimal('10.0'),
             cantidad_total=2,
             valor_total=Decimal('300.0'),
-            estado='en_transito',
-            ciudad_destino='Guayaquil'
+            estado='en_transito'
         )
         Producto.objects.create(
             envio=self.envio2,
@@ -97,8 +103,7 @@ class BusquedaSemanticaTestCase(TestCase):
             peso_total=Decimal('15.0'),
             cantidad_total=1,
             valor_total=Decimal('500.0'),
-            estado='pendiente',
-            ciudad_destino='Cuenca'
+            estado='pendiente'
         )
         Producto.objects.create(
             envio=self.envio3,
@@ -108,112 +113,143 @@ class BusquedaSemanticaTestCase(TestCase):
             valor=Decimal('500.0'),
             categoria='electronica'
         )
+        
+        # Embeddings alineados con la consulta simulada para que todos superen el umbral
+        for envio in (self.envio1, self.envio2, self.envio3):
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {envio.hawb}', [1.0] + [0.0] * 1535, 'text-embedding-3-small'
+            )
+        parche = patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding', return_value={
+            'embedding': [1.0] + [0.0] * 1535, 'tokens': 3, 'costo': 0.0001, 'modelo': 'text-embedding-3-small'
+        })
+        parche.start()
+        self.addCleanup(parche.stop)
+    
+    def _buscar_semantica(self, texto, filtros=None):
+        return self.client.post('/api/v1/busqueda/semantica/', {
+            'texto': texto,
+            'limite': 10,
+            'modeloEmbedding': 'text-embedding-3-small',
+            'filtrosAdicionales': filtros or {}
+        }, format='json')
     
     def test_busqueda_basica_funciona(self):
         """Test que la búsqueda básica retorna resultados"""
-        response = self.client.get('/api/busqueda/buscar/?q=laptop')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=HAW001&tipo=envios')
         self.assertEqual(response.status_code, 200)
         self.assertIn('resultados', response.data)
+        hawbs = [e['hawb'] for e in response.data['resultados']['envios']]
+        self.assertEqual(hawbs, ['HAW001'])
     
-    @patch('apps.busqueda.services.openai_client')
-    def test_busqueda_semantica_funciona(self, mock_openai):
+    def test_busqueda_semantica_funciona(self):
         """Test que la búsqueda semántica funciona correctamente"""
-        # Mock del embedding de OpenAI
-        mock_embedding = MagicMock()
-        mock_embedding.data = [MagicMock(embedding=[0.1] * 1536)]
-        mock_openai.embeddings.create.return_value = mock_embedding
-        
-        response = self.client.post('/api/busqueda/semantica/', {
-            'consulta': 'computadoras portátiles',
-            'limite': 10
-        }, format='json')
+        response = self._buscar_semantica('computadoras portátiles')
         
         self.assertEqual(response.status_code, 200)
         self.assertIn('resultados', response.data)
         self.assertIn('tiempoRespuesta', response.data)
+        self.assertEqual(len(response.data['resultados']), 3)
     
     def test_busqueda_guarda_historial(self):
         """Test que la búsqueda guarda el historial"""
-        count_inicial = HistorialBusqueda.objects.count()
+        count_inicial = BusquedaTradicional.objects.count()
         
-        response = self.client.get('/api/busqueda/buscar/?q=laptop')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=laptop')
         self.assertEqual(response.status_code, 200)
         
-        count_final = HistorialBusqueda.objects.count()
+        count_final = BusquedaTradicional.objects.count()
         self.assertEqual(count_final, count_inicial + 1)
     
     def test_filtros_fecha_funcionan(self):
         """Test que los filtros de fecha funcionan correctamente"""
-        # Crear envío con fecha específica
-        fecha_especifica = timezone.now() - timezone.timedelta(days=10)
-        Envio.objects.create(
+        from .repositories import embedding_repository
+        # Envío fuera del rango de fechas
+        envio_antiguo = Envio.objects.create(
             hawb='HAW004',
             comprador=self.comprador,
             peso_total=Decimal('5.0'),
             cantidad_total=1,
             valor_total=Decimal('100.0'),
             estado='pendiente',
-            fecha_emision=fecha_especifica
+            fecha_emision=timezone.now() - timezone.timedelta(days=30)
+        )
+        embedding_repository.crear_o_actualizar_embedding(
+            envio_antiguo, 'envio HAW004', [1.0] + [0.0] * 1535, 'text-embedding-3-small'
         )
         
-        # Buscar con filtro de fecha
         fecha_desde = (timezone.now() - timezone.timedelta(days=15)).date().isoformat()
-        fecha_hasta = timezone.now().date().isoformat()
+        fecha_hasta = (timezone.now() + timezone.timedelta(days=1)).date().isoformat()
         
-        response = self.client.get(
-            f'/api/busqueda/buscar/?q=HAW004&fecha_desde={fecha_desde}&fecha_hasta={fecha_hasta}'
-        )
+        response = self._buscar_semantica('envios recientes', {
+            'fechaDesde': fecha_desde, 'fechaHasta': fecha_hasta
+        })
         self.assertEqual(response.status_code, 200)
+        ids = {r['envio']['id'] for r in response.data['resultados']}
+        self.assertEqual(ids, {self.envio1.id, self.envio2.id, self.envio3.id})
     
     def test_filtro_estado_funciona(self):
         """Test que el filtro de estado funciona"""
-        response = self.client.get('/api/busqueda/buscar/?q=&estado=entregado')
+        response = self._buscar_semantica('envios', {'estado': 'entregado'})
         self.assertEqual(response.status_code, 200)
         
         # Verificar que todos los resultados son entregados
-        for resultado in response.data.get('resultados', []):
-            self.assertEqual(resultado.get('estado'), 'entregado')
+        resultados = response.data['resultados']
+        self.assertEqual([r['envio']['id'] for r in resultados], [self.envio1.id])
+        for resultado in resultados:
+            self.assertEqual(resultado['envio']['estado'], 'entregado')
     
     def test_filtro_ciudad_funciona(self):
         """Test que el filtro de ciudad funciona"""
-        response = self.client.get('/api/busqueda/buscar/?q=&ciudad_destino=Quito')
+        response = self._buscar_semantica('envios', {'ciudadDestino': 'Quito'})
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['resultados']), 3)
         
-        # Verificar que todos los resultados son de Quito
-        for resultado in response.data.get('resultados', []):
-            self.assertEqual(resultado.get('ciudad_destino'), 'Quito')
-    
-    def test_busqueda_vacia_retorna_todos(self):
-        """Test que búsqueda vacía retorna todos los envíos"""
-        response = self.client.get('/api/busqueda/buscar/?q=')
+        response = self._buscar_semantica('envios', {'ciudadDestino': 'Cuenca'})
         self.assertEqual(response.status_code, 200)
-        self.assertGreater(len(response.data.get('resultados', [])), 0)
+        self.assertEqual(response.data['resultados'], [])
+    
+    def test_busqueda_vacia_requiere_termino(self):
+        """Test que la búsqueda sin término se rechaza"""
+        response = self.client.get('/api/v1/busqueda/buscar/?q=')
+        self.assertEqual(response.status_code, 400)
     
     def test_busqueda_sin_resultados(self):
         """Test búsqueda que no retorna resultados"""
-        response = self.client.get('/api/busqueda/buscar/?q=ZZZZZZZZZ')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=ZZZZZZZZZ')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data.get('resultados', [])), 0)
+        self.assertEqual(response.data['total_resultados'], 0)
     
     def test_historial_busqueda_usuario(self):
         """Test que el historial se filtra por usuario"""
+        otro = Usuario.objects.create(
+            username='otro', correo='otro@test.com', cedula='1122334455',
+            nombre='Otro Usuario', rol=2, is_active=True
+        )
+        BusquedaTradicional.objects.create(usuario=otro, termino_busqueda='ajeno', tipo_busqueda='general')
+        
         # Realizar búsquedas
-        self.client.get('/api/busqueda/buscar/?q=laptop')
-        self.client.get('/api/busqueda/buscar/?q=televisor')
+        self.client.get('/api/v1/busqueda/buscar/?q=laptop')
+        self.client.get('/api/v1/busqueda/buscar/?q=televisor')
         
         # Obtener historial
-        response = self.client.get('/api/busqueda/historial/')
+        response = self.client.get('/api/v1/busqueda/historial/')
         self.assertEqual(response.status_code, 200)
         
         # Verificar que solo muestra del usuario actual
-        for busqueda in response.data.get('results', []):
-            self.assertEqual(busqueda['usuario'], self.usuario.id)
+        datos = response.data.get('results', response.data)
+        self.assertEqual({b['termino_busqueda'] for b in datos}, {'laptop', 'televisor'})
 
 
 class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
     """Tests de rendimiento para búsqueda semántica"""
     
     def setUp(self):
+        from .services import get_semantic_cache
+        from .semantic.vector_index import reiniciar_indices
+        get_semantic_cache().clear()
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
         self.client = APIClient()
         self.usuario = Usuario.objects.create(
             username='testuser',
@@ -233,6 +269,7 @@ class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
             correo='comprador1@test.com',
             cedula='0987654321',
             nombre='Comprador Test',
+            ciudad='Quito',
             rol=4,
             is_active=True
         )
@@ -246,8 +283,7 @@ class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
                 peso_total=Decimal('10.0'),
                 cantidad_total=1,
                 valor_total=Decimal('100.0'),
-                estado='pendiente',
-                ciudad_destino='Quito'
+                estado='pendiente'
             ))
         Envio.objects.bulk_create(envios)
         
@@ -271,7 +307,7 @@ class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
         
         for _ in range(10):
             inicio = time.time()
-            response = self.client.get('/api/busqueda/buscar/?q=producto')
+            response = self.client.get('/api/v1/busqueda/buscar/?q=producto')
             tiempo = time.time() - inicio
             
             self.assertEqual(response.status_code, 200)
@@ -285,21 +321,19 @@ class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
         self.assertLess(tiempo_maximo, 1.0,
                        f"Tiempo máximo {tiempo_maximo:.3f}s debe ser < 1.0s")
     
-    @patch('apps.busqueda.services.openai_client')
-    def test_busqueda_semantica_tiempo_respuesta(self, mock_openai):
+    @patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding', return_value={
+        'embedding': [0.1] * 1536, 'tokens': 3, 'costo': 0.0001, 'modelo': 'text-embedding-3-small'
+    })
+    def test_busqueda_semantica_tiempo_respuesta(self, mock_embedding):
         """Test tiempo de respuesta de búsqueda semántica"""
-        # Mock del embedding
-        mock_embedding = MagicMock()
-        mock_embedding.data = [MagicMock(embedding=[0.1] * 1536)]
-        mock_openai.embeddings.create.return_value = mock_embedding
-        
         tiempos = []
         
         for _ in range(5):
             inicio = time.time()
-            response = self.client.post('/api/busqueda/semantica/', {
-                'consulta': 'productos electrónicos',
-                'limite': 20
+            response = self.client.post('/api/v1/busqueda/semantica/', {
+                'texto': 'productos electrónicos',
+                'limite': 20,
+                'modeloEmbedding': 'text-embedding-3-small'
             }, format='json')
             tiempo = time.time() - inicio
             
@@ -316,32 +350,33 @@ class BusquedaSemanticaPerformanceTestCase(TransactionTestCase):
         """Test rendimiento de búsqueda con múltiples filtros"""
         inicio = time.time()
         response = self.client.get(
-            '/api/busqueda/buscar/?q=HAWPERF&estado=pendiente&ciudad_destino=Quito'
+            '/api/v1/busqueda/buscar/?q=HAWPERF&tipo=envios&limite=50'
         )
         tiempo = time.time() - inicio
         
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totales']['envios'], 100)
         self.assertLess(tiempo, 0.5,
                        f"Búsqueda con filtros tomó {tiempo:.3f}s, debe ser < 0.5s")
     
-    def test_paginacion_rendimiento(self):
-        """Test que la paginación no afecta rendimiento"""
-        # Primera página
+    def test_limite_rendimiento(self):
+        """Test que el límite de resultados no afecta el rendimiento"""
         inicio = time.time()
-        response1 = self.client.get('/api/busqueda/buscar/?q=&page=1&page_size=20')
+        response1 = self.client.get('/api/v1/busqueda/buscar/?q=HAWPERF&tipo=envios&limite=20')
         tiempo1 = time.time() - inicio
         
-        # Página intermedia
         inicio = time.time()
-        response2 = self.client.get('/api/busqueda/buscar/?q=&page=3&page_size=20')
+        response2 = self.client.get('/api/v1/busqueda/buscar/?q=HAWPERF&tipo=envios&limite=100')
         tiempo2 = time.time() - inicio
         
         self.assertEqual(response1.status_code, 200)
         self.assertEqual(response2.status_code, 200)
+        self.assertEqual(len(response1.data['resultados']['envios']), 20)
+        self.assertEqual(len(response2.data['resultados']['envios']), 100)
         
         # Los tiempos deben ser similares
         self.assertLess(abs(tiempo1 - tiempo2), 0.2,
-                       "La paginación no debe afectar significativamente el rendimiento")
+                       "El límite no debe afectar significativamente el rendimiento")
 
 
 class BusquedaSemanticaPrecisionTestCase(TestCase):
@@ -381,13 +416,13 @@ class BusquedaSemanticaPrecisionTestCase(TestCase):
             estado='pendiente'
         )
         
-        response = self.client.get('/api/busqueda/buscar/?q=HAW12345')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=HAW12345&tipo=envios')
         self.assertEqual(response.status_code, 200)
-        self.assertGreater(len(response.data.get('resultados', [])), 0)
+        envios = response.data['resultados']['envios']
+        self.assertGreater(len(envios), 0)
         
         # El primer resultado debe ser el envío buscado
-        primer_resultado = response.data['resultados'][0]
-        self.assertEqual(primer_resultado['hawb'], 'HAW12345')
+        self.assertEqual(envios[0]['hawb'], 'HAW12345')
     
     def test_busqueda_por_nombre_comprador(self):
         """Test búsqueda por nombre de comprador"""
@@ -409,11 +444,11 @@ class BusquedaSemanticaPrecisionTestCase(TestCase):
             estado='pendiente'
         )
         
-        response = self.client.get('/api/busqueda/buscar/?q=María')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=María&tipo=envios')
         self.assertEqual(response.status_code, 200)
         
         # Debe encontrar el envío de María
-        hawbs = [r['hawb'] for r in response.data.get('resultados', [])]
+        hawbs = [r['hawb'] for r in response.data['resultados']['envios']]
         self.assertIn('HAW99999', hawbs)
     
     def test_busqueda_por_descripcion_producto(self):
@@ -436,9 +471,2967 @@ class BusquedaSemanticaPrecisionTestCase(TestCase):
             categoria='electronica'
         )
         
-        response = self.client.get('/api/busqueda/buscar/?q=iPhone')
+        response = self.client.get('/api/v1/busqueda/buscar/?q=iPhone&tipo=productos')
         self.assertEqual(response.status_code, 200)
         
-        # Debe encontrar el envío con el iPhone
-        hawbs = [r['hawb'] for r in response.data.get('resultados', [])]
-        self.assertIn('HAW88888', hawbs)
+        # Debe encontrar el producto del iPhone
+        descripciones = [p['descripcion'] for p in response.data['resultados']['productos']]
+        self.assertIn('iPhone 15 Pro Max', descripciones)
+
+
+class BusquedaAnnTestCase(TestCase):
+    """Tests del modo de búsqueda top-k en base de datos (índice ANN de pgvector)"""
+    
+    def test_sqlite_no_soporta_ann(self):
+        """Fuera de PostgreSQL se usa el cálculo de similitudes en Python"""
+        from .repositories import embedding_repository
+        self.assertFalse(embedding_repository.soporta_busqueda_ann())
+    
+    @override_settings(SEMANTIC_INDEX_EN_MEMORIA=False)
+    @patch('apps.busqueda.services.embedding_repository')
+    def test_modo_ann_solo_carga_candidatos(self, mock_repo):
+        """Con ANN solo se cargan los vectores de los candidatos devueltos por SQL"""
+        mock_repo.soporta_busqueda_ann.return_value = True
+        mock_repo.buscar_top_k_ann.return_value = [(7, 0.12), (3, 0.31)]
+        mock_repo.obtener_vectores_por_envios.return_value = []
+        envios_queryset = MagicMock()
+        envios_queryset.count.return_value = 50000
+        
+        resultados = BusquedaSemanticaService._buscar_envios_similares(
+            envios_queryset, [0.1] * 1536, 'laptop', 20, 'text-embedding-3-small'
+        )
+        
+        self.assertEqual(resultados, [])
+        mock_repo.obtener_vectores_para_busqueda.assert_not_called()
+        mock_repo.obtener_vectores_por_envios.assert_called_once_with(
+            [7, 3], modelo='text-embedding-3-small'
+        )
+    
+    def test_ajustes_del_planner_no_sobreviven_al_savepoint(self):
+        """Con ATOMIC_REQUESTS el atomic del repositorio es un savepoint: SET LOCAL debe restaurarse"""
+        from django.db import connection, transaction
+        from .repositories import embedding_repository
+        if connection.vendor != 'postgresql':
+            self.skipTest('Requiere PostgreSQL con pgvector')
+        comprador = Usuario.objects.create(
+            username='comprador_ann',
+            correo='comprador_ann@test.com',
+            cedula='0956781234',
+            nombre='Comprador ANN',
+            rol=4,
+            is_active=True
+        )
+        modelo = 'text-embedding-3-small'
+        for i in range(3):
+            envio = Envio.objects.create(
+                hawb=f'ANN{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = [0.0] * 1536
+            vector[i] = 1.0
+            embedding_repository.crear_o_actualizar_embedding(envio, f'envio {i}', vector, modelo)
+        consulta_ajustes = "SELECT current_setting('hnsw.ef_search', true), current_setting('enable_indexscan')"
+        
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(consulta_ajustes)
+                previos = cursor.fetchone()
+                # k mayor que el alcance: fuerza la re-consulta con ef_search máximo
+                filas = embedding_repository.buscar_top_k_ann(
+                    Envio.objects.filter(comprador=comprador), [1.0] + [0.0] * 1535, modelo, k=2000
+                )
+                cursor.execute(consulta_ajustes)
+                self.assertEqual(cursor.fetchone(), previos)
+        
+        self.assertEqual(len(filas), 3)
+
+
+class IndiceVectorialTestCase(TestCase):
+    """Tests del índice vectorial residente en memoria"""
+    
+    def setUp(self):
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        self.comprador = Usuario.objects.create(
+            username='comprador_indice',
+            correo='comprador_indice@test.com',
+            cedula='1122334455',
+            nombre='Comprador Índice',
+            rol=4,
+            is_active=True
+        )
+    
+    def _crear_envio(self, hawb):
+        envio = Envio.objects.create(
+            hawb=hawb,
+            comprador=self.comprador,
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0')
+        )
+        Producto.objects.create(
+            envio=envio,
+            descripcion='Producto de prueba',
+            peso=Decimal('1.0'),
+            cantidad=1,
+            valor=Decimal('10.0'),
+            categoria='otros'
+        )
+        return envio
+    
+    def _vector(self, *valores, dimensiones=1536):
+        import numpy as np
+        vector = np.zeros(dimensiones, dtype=np.float32)
+        vector[:len(valores)] = valores
+        return vector
+    
+    def test_top_k_ordenado_y_filtrado(self):
+        """El top-k devuelve similitud coseno descendente y respeta el filtro de ids"""
+        from .semantic.vector_index import IndiceVectorial
+        indice = IndiceVectorial('modelo-test', dimensiones=4)
+        indice.construir([
+            (1, [1, 0, 0, 0]),
+            (2, [0.9, 0.1, 0, 0]),
+            (3, [0, 1, 0, 0]),
+            (4, [0.5, 0.5, 0, 0]),
+        ])
+        
+        resultados = indice.buscar([1, 0, 0, 0], k=3)
+        self.assertEqual([envio_id for envio_id, _ in resultados], [1, 2, 4])
+        self.assertAlmostEqual(resultados[0][1], 1.0, places=5)
+        
+        resultados = indice.buscar([1, 0, 0, 0], k=3, envios_ids=[3, 4])
+        self.assertEqual([envio_id for envio_id, _ in resultados], [4, 3])
+    
+    def test_actualizaciones_incrementales_y_tombstones(self):
+        from .semantic.vector_index import IndiceVectorial
+        indice = IndiceVectorial('modelo-test', dimensiones=2)
+        indice.CAPACIDAD_INICIAL = 2
+        indice.construir([(1, [1, 0]), (2, [0, 1])])
+        
+        indice.agregar_o_actualizar(3, [1, 0.1])  # Fuerza el crecimiento de la matriz
+        indice.agregar_o_actualizar(2, [1, 0.05])
+        indice.eliminar(1)
+        
+        self.assertEqual([envio_id for envio_id, _ in indice.buscar([1, 0], k=5)], [2, 3])
+        self.assertEqual(indice.estadisticas()['filas_eliminadas'], 1)
+        
+        indice.compactar()
+        self.assertEqual(indice.estadisticas()['filas_eliminadas'], 0)
+        self.assertEqual([envio_id for envio_id, _ in indice.buscar([1, 0], k=5)], [2, 3])
+        self.assertGreater(indice.memoria_bytes, 0)
+    
+    def test_indice_se_mantiene_con_signals(self):
+        """Guardar un embedding o eliminar un envío actualiza el índice ya cargado"""
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice
+        modelo = 'text-embedding-3-small'
+        envio1 = self._crear_envio('IDX001')
+        envio2 = self._crear_envio('IDX002')
+        embedding_repository.crear_o_actualizar_embedding(envio1, 'texto 1', self._vector(1, 0), modelo)
+        
+        indice = obtener_indice(modelo)
+        self.assertTrue(indice.contiene(envio1.id))
+        self.assertFalse(indice.contiene(envio2.id))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            embedding_repository.crear_o_actualizar_embedding(envio2, 'texto 2', self._vector(0, 1), modelo)
+        self.assertEqual(indice.buscar(self._vector(0, 1), k=1)[0][0], envio2.id)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            envio2.delete()
+        self.assertFalse(indice.contiene(envio2.id))
+        self.assertEqual([envio_id for envio_id, _ in indice.buscar(self._vector(0, 1), k=5)], [envio1.id])
+    
+    def test_sincronizacion_reaplica_envio_restaurado(self):
+        """Borrado y restauración hechos en otro worker llegan al índice al sincronizar"""
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice
+        modelo = 'text-embedding-3-small'
+        envio = self._crear_envio('IDX003')
+        embedding_repository.crear_o_actualizar_embedding(envio, 'texto', self._vector(1, 0), modelo)
+        indice = obtener_indice(modelo)
+        
+        # Sin captureOnCommitCallbacks los signals no tocan el índice (como en otro worker)
+        envio.delete()
+        indice.ultima_sincronizacion = 0
+        obtener_indice(modelo)
+        self.assertFalse(indice.contiene(envio.id))
+        
+        Envio.all_objects.get(id=envio.id).restore()
+        indice.ultima_sincronizacion = 0
+        obtener_indice(modelo)
+        self.assertTrue(indice.contiene(envio.id))
+        self.assertEqual(indice.ids_sin_metadatos(), [])
+    
+    def test_sincronizacion_en_curso_no_bloquea_busquedas(self):
+        """Mientras un hilo sincroniza, obtener_indice retorna el índice sin esperar"""
+        from .repositories import embedding_repository
+        from .semantic import vector_index
+        modelo = 'text-embedding-3-small'
+        envio = self._crear_envio('IDX004')
+        embedding_repository.crear_o_actualizar_embedding(envio, 'texto', self._vector(1, 0), modelo)
+        indice = vector_index.obtener_indice(modelo)
+        indice.ultima_sincronizacion = 0
+        
+        with indice._sincronizacion, patch.object(vector_index, 'sincronizar_indice') as sincronizar:
+            self.assertIs(vector_index.obtener_indice(modelo), indice)
+        sincronizar.assert_not_called()
+    
+    @override_settings(SEMANTIC_SEARCH_USE_ANN=True)
+    def test_indice_en_memoria_tiene_prioridad_sobre_ann(self):
+        """Con el índice activo el top-k no se resuelve con el índice ANN de pgvector"""
+        from .repositories import embedding_repository
+        from .services import BusquedaSemanticaService
+        modelo = 'text-embedding-3-small'
+        envio = self._crear_envio('IDX005')
+        embedding_repository.crear_o_actualizar_embedding(envio, 'texto', self._vector(1, 0), modelo)
+        
+        with patch.object(embedding_repository, 'soporta_busqueda_ann', return_value=True), \
+                patch.object(embedding_repository, 'buscar_top_k_ann') as ann, \
+                patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding', return_value={
+                    'embedding': self._vector(1, 0), 'tokens': 1, 'costo': 0.0, 'modelo': modelo
+                }):
+            resultado = BusquedaSemanticaService.buscar('texto', self.comprador, modelo_embedding=modelo)
+        
+        ann.assert_not_called()
+        self.assertEqual([r['envio']['id'] for r in resultado['resultados']], [envio.id])
+    
+    def test_sin_filtro_de_metadatos_no_usa_el_indice(self):
+        """Sin FiltroMetadatos el alcance no se traduce a una lista de IDs para el índice"""
+        from .repositories import embedding_repository
+        from .services import BusquedaSemanticaService
+        modelo = 'text-embedding-3-small'
+        envio = self._crear_envio('IDX006')
+        embedding_repository.crear_o_actualizar_embedding(envio, 'texto', self._vector(1, 0), modelo)
+        
+        with patch('apps.busqueda.services.obtener_indice') as obtener:
+            resultados = BusquedaSemanticaService._buscar_envios_similares(
+                Envio.objects.all(), self._vector(1, 0), 'texto', 5, modelo
+            )
+        
+        obtener.assert_not_called()
+        self.assertEqual([r['envio']['id'] for r in resultados], [envio.id])
+
+
+
+class CacheEmbeddingsConsultaTestCase(TestCase):
+    """Tests del caché read-through de vectores de consulta"""
+    
+    def setUp(self):
+        from .services import get_semantic_cache
+        get_semantic_cache().clear()
+    
+    @patch('apps.busqueda.services.EmbeddingService.generar_embedding')
+    def test_segunda_consulta_no_llama_a_openai(self, mock_generar):
+        import numpy as np
+        from .services import CacheEmbeddingsConsulta, get_semantic_cache
+        mock_generar.return_value = {
+            'embedding': [0.5, -0.25, 0.125],
+            'tokens': 4,
+            'costo': 0.00008,
+            'modelo': 'text-embedding-3-small'
+        }
+        
+        primero = CacheEmbeddingsConsulta.obtener_embedding('laptop dell', 'text-embedding-3-small')
+        segundo = CacheEmbeddingsConsulta.obtener_embedding('laptop dell', 'text-embedding-3-small')
+        
+        mock_generar.assert_called_once()
+        self.assertFalse(primero['desde_cache'])
+        self.assertTrue(segundo['desde_cache'])
+        self.assertIsInstance(segundo['embedding'], np.ndarray)
+        self.assertEqual(segundo['embedding'].tolist(), [0.5, -0.25, 0.125])
+        self.assertEqual(segundo['costo'], 0.0)
+        
+        clave = CacheEmbeddingsConsulta._clave('laptop dell', 'text-embedding-3-small')
+        self.assertEqual(len(get_semantic_cache().get(clave)), 3 * 4)  # float32
+        self.assertEqual(
+            CacheEmbeddingsConsulta.estadisticas(),
+            {'hits': 1, 'misses': 1, 'tasa_aciertos': 50.0}
+        )
+    
+    @patch('apps.busqueda.services.EmbeddingService.generar_embedding')
+    def test_clave_distingue_modelo(self, mock_generar):
+        from .services import CacheEmbeddingsConsulta
+        mock_generar.return_value = {'embedding': [1.0], 'tokens': 1, 'costo': 0.0, 'modelo': 'x'}
+        
+        CacheEmbeddingsConsulta.obtener_embedding('laptop', 'text-embedding-3-small')
+        CacheEmbeddingsConsulta.obtener_embedding('laptop', 'text-embedding-3-large')
+        
+        self.assertEqual(mock_generar.call_count, 2)
+
+
+class EmbeddingsLoteTestCase(TestCase):
+    """Tests de generación de embeddings en lote (varios textos por solicitud)"""
+    
+    def setUp(self):
+        self.comprador = Usuario.objects.create(
+            username='comprador_lote',
+            correo='comprador_lote@test.com',
+            cedula='5544332211',
+            nombre='Comprador Lote',
+            rol=4,
+            is_active=True
+        )
+        self.envios = []
+        for i in range(5):
+            envio = Envio.objects.create(
+                hawb=f'LOTE{i:03d}',
+                comprador=self.comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            Producto.objects.create(
+                envio=envio,
+                descripcion=f'Producto {i}',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='otros'
+            )
+            self.envios.append(envio)
+    
+    def _cliente_falso(self):
+        """Cliente que responde en orden inverso para verificar el mapeo por index"""
+        def crear(model, input, encoding_format):
+            datos = [
+                MagicMock(index=i, embedding=[float(i + 1)] + [0.0] * 1535)
+                for i in range(len(input))
+            ]
+            return MagicMock(data=list(reversed(datos)), usage=MagicMock(total_tokens=10 * len(input)))
+        
+        cliente = MagicMock()
+        cliente.with_options.return_value = cliente
+        cliente.embeddings.create.side_effect = crear
+        return cliente
+    
+    def test_agrupar_por_presupuesto(self):
+        from .semantic.embedding_service import EmbeddingService
+        textos = ['a' * 30] * 5  # ~11 tokens estimados cada uno
+        
+        self.assertEqual(EmbeddingService.agrupar_por_presupuesto(textos, max_tokens=25, max_inputs=10),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(EmbeddingService.agrupar_por_presupuesto(textos, max_tokens=1000, max_inputs=3),
+                         [[0, 1, 2], [3, 4]])
+    
+    @patch('apps.busqueda.semantic.embedding_service.OpenAIClient.get_instance')
+    def test_lote_una_solicitud_y_escritura_masiva(self, mock_cliente):
+        from .models import EnvioEmbedding
+        from .semantic.embedding_service import EmbeddingService
+        from apps.metricas.models import RegistroGeneracionEmbedding
+        cliente = self._cliente_falso()
+        mock_cliente.return_value = cliente
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small'
+        )
+        
+        self.assertEqual(cliente.embeddings.create.call_count, 1)
+        self.assertEqual(resultado['procesados'], 5)
+        self.assertEqual(resultado['tokens_total'], 50)
+        
+        # Cada vector corresponde al texto enviado en su misma posición
+        entradas = cliente.embeddings.create.call_args.kwargs['input']
+        for embedding in EnvioEmbedding.objects.all():
+            posicion = entradas.index(embedding.texto_indexado)
+            self.assertEqual(float(embedding.embedding_vector[0]), float(posicion + 1))
+        self.assertEqual(
+            RegistroGeneracionEmbedding.objects.filter(estado='generado', embedding__isnull=False).count(), 5
+        )
+        
+        # Segunda ejecución: ya existen, no se llama a la API
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small'
+        )
+        self.assertEqual(cliente.embeddings.create.call_count, 1)
+        self.assertEqual(resultado['omitidos'], 5)
+        
+        # Regeneración forzada: solo los envíos cuyo contenido cambió (bulk_update)
+        Producto.objects.filter(envio__in=self.envios[:3]).update(descripcion='Producto modificado')
+        Producto.objects.filter(envio=self.envios[3]).update(descripcion='Otro producto')
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small', forzar_regeneracion=True, max_inputs=1
+        )
+        self.assertEqual(cliente.embeddings.create.call_count, 5)  # Una solicitud por envío modificado
+        self.assertEqual(resultado['procesados'], 4)
+        self.assertEqual(resultado['omitidos'], 1)
+        self.assertEqual(EnvioEmbedding.objects.count(), 5)
+        self.assertEqual(RegistroGeneracionEmbedding.objects.count(), 5)
+        self.assertEqual(RegistroGeneracionEmbedding.objects.filter(estado='omitido').count(), 1)
+
+
+class PoolEmbeddingsTestCase(TestCase):
+    """Tests del pool concurrente contra un servidor local que imita la API de embeddings"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import base64
+        import json
+        import threading
+        import numpy as np
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class ManejadorEmbeddings(BaseHTTPRequestHandler):
+            def do_POST(self):
+                servidor = self.server
+                datos = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with servidor.lock:
+                    servidor.solicitudes += 1
+                    servidor.en_vuelo += 1
+                    servidor.max_en_vuelo = max(servidor.max_en_vuelo, servidor.en_vuelo)
+                    responder_429 = servidor.fallos_429 > 0
+                    if responder_429:
+                        servidor.fallos_429 -= 1
+                    responder_500 = not responder_429 and servidor.fallos_500 > 0
+                    if responder_500:
+                        servidor.fallos_500 -= 1
+                time.sleep(0.05)
+                with servidor.lock:
+                    servidor.en_vuelo -= 1
+                
+                if responder_429:
+                    cuerpo = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0.05')
+                elif responder_500:
+                    cuerpo = {'error': {'message': 'The server had an error', 'type': 'server_error', 'code': None}}
+                    self.send_response(500)
+                    self.send_header('Retry-After', '0.05')
+                else:
+                    entradas = datos['input']
+                    vector = [1.0] + [0.0] * 1535
+                    if datos.get('encoding_format') == 'base64':
+                        # Igual que la API: float32 little-endian codificados en base64
+                        vector = base64.b64encode(np.asarray(vector, dtype='<f4').tobytes()).decode()
+                    cuerpo = {
+                        'object': 'list',
+                        'model': datos['model'],
+                        'data': [
+                            {'object': 'embedding', 'index': i, 'embedding': vector}
+                            for i in range(len(entradas))
+                        ],
+                        'usage': {'prompt_tokens': 7 * len(entradas), 'total_tokens': 7 * len(entradas)},
+                    }
+                    self.send_response(200)
+                contenido = json.dumps(cuerpo).encode()
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(contenido)))
+                self.end_headers()
+                self.wfile.write(contenido)
+            
+            def log_message(self, *args):
+                pass
+        
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), ManejadorEmbeddings)
+        cls.servidor.lock = threading.Lock()
+        cls.hilo_servidor = threading.Thread(target=cls.servidor.serve_forever, daemon=True)
+        cls.hilo_servidor.start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+    
+    def setUp(self):
+        from openai import OpenAI
+        self.servidor.solicitudes = 0
+        self.servidor.en_vuelo = 0
+        self.servidor.max_en_vuelo = 0
+        self.servidor.fallos_429 = 0
+        self.servidor.fallos_500 = 0
+        
+        cliente = OpenAI(
+            api_key='sk-test',
+            base_url=f'http://127.0.0.1:{self.servidor.server_address[1]}/v1',
+            max_retries=0
+        )
+        parche = patch('apps.busqueda.semantic.embedding_service.OpenAIClient.get_instance', return_value=cliente)
+        parche.start()
+        self.addCleanup(parche.stop)
+        
+        comprador = Usuario.objects.create(
+            username='comprador_pool',
+            correo='comprador_pool@test.com',
+            cedula='6677889900',
+            nombre='Comprador Pool',
+            rol=4,
+            is_active=True
+        )
+        for i in range(8):
+            envio = Envio.objects.create(
+                hawb=f'POOL{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            Producto.objects.create(
+                envio=envio,
+                descripcion=f'Producto pool {i}',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='otros'
+            )
+    
+    def test_solicitudes_concurrentes_con_throughput(self):
+        from .models import EnvioEmbedding
+        from .semantic.embedding_service import EmbeddingService
+        lecturas = []
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(),
+            modelo='text-embedding-3-small',
+            max_inputs=2,
+            concurrencia=4,
+            callback_progreso=lambda e: lecturas.append(e['envios_por_segundo'])
+        )
+        
+        self.assertEqual(self.servidor.solicitudes, 4)
+        self.assertGreater(self.servidor.max_en_vuelo, 1)
+        self.assertEqual(resultado['procesados'], 8)
+        self.assertEqual(EnvioEmbedding.objects.count(), 8)
+        self.assertEqual(len(lecturas), 4)
+        self.assertGreater(resultado['envios_por_segundo'], 0)
+        self.assertEqual(resultado['tokens_total'], 56)
+        self.assertEqual(resultado['costo_acumulado'], round(56 / 1000.0 * 0.00002, 6))
+    
+    def test_reintenta_ante_429(self):
+        from .semantic.embedding_service import EmbeddingService
+        self.servidor.fallos_429 = 2
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small', max_inputs=4, concurrencia=2
+        )
+        
+        self.assertEqual(resultado['procesados'], 8)
+        self.assertEqual(resultado['errores'], 0)
+        self.assertEqual(resultado['reintentos_429'], 2)
+        self.assertEqual(self.servidor.solicitudes, 4)
+    
+    def test_reintenta_ante_fallas_transitorias(self):
+        from .semantic.embedding_service import EmbeddingService
+        self.servidor.fallos_500 = 2
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small', max_inputs=4, concurrencia=2
+        )
+        
+        self.assertEqual(resultado['procesados'], 8)
+        self.assertEqual(resultado['errores'], 0)
+        self.assertEqual(resultado['reintentos_transitorios'], 2)
+        self.assertEqual(resultado['reintentos_429'], 0)
+        self.assertEqual(self.servidor.solicitudes, 4)
+    
+    def test_fuera_del_pool_conserva_los_reintentos_del_cliente(self):
+        from openai import OpenAI
+        from .semantic.embedding_service import EmbeddingService
+        cliente = OpenAI(
+            api_key='sk-test',
+            base_url=f'http://127.0.0.1:{self.servidor.server_address[1]}/v1',
+            max_retries=2
+        )
+        self.servidor.fallos_500 = 1
+        
+        with patch('apps.busqueda.semantic.embedding_service.OpenAIClient.get_instance', return_value=cliente):
+            resultado = EmbeddingService.generar_embeddings_lote(['laptop'], 'text-embedding-3-small')
+        
+        self.assertEqual(len(resultado['embeddings']), 1)
+        self.assertEqual(self.servidor.solicitudes, 2)
+    
+    def test_limitador_espera_cupo_de_tokens(self):
+        from .semantic.embedding_pool import LimitadorTokenBucket
+        limitador = LimitadorTokenBucket(rpm=6000, tpm=600)  # 10 tokens/s
+        limitador.adquirir(600)
+        
+        inicio = time.monotonic()
+        limitador.adquirir(3)
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.25)
+
+
+class HidratacionDiferidaTestCase(TestCase):
+    """La puntuación usa solo (envio_id, vector); los Envio se cargan para el top-k"""
+    
+    def setUp(self):
+        from .repositories import embedding_repository
+        from .semantic.vector_index import reiniciar_indices
+        import numpy as np
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
+        comprador = Usuario.objects.create(
+            username='comprador_hidratacion',
+            correo='comprador_hidratacion@test.com',
+            cedula='9988776655',
+            nombre='Comprador Hidratación',
+            rol=4,
+            is_active=True
+        )
+        for i in range(6):
+            envio = Envio.objects.create(
+                hawb=f'HID{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = np.zeros(1536, dtype=np.float32)
+            vector[0] = 1.0
+            vector[1] = i * 0.1
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+    
+    def test_solo_hidrata_top_k(self):
+        consulta = [1.0] + [0.0] * 1535
+        envios = Envio.objects.all()
+        
+        with patch.object(envios, 'filter', wraps=envios.filter) as espia:
+            resultados = BusquedaSemanticaService._buscar_envios_similares(
+                envios, consulta, 'envio', 2, 'text-embedding-3-small'
+            )
+        
+        espia.assert_called_once()
+        self.assertEqual(len(espia.call_args.kwargs['id__in']), 2)
+        self.assertEqual([r['envio']['hawb'] for r in resultados], ['HID000', 'HID001'])
+
+    
+    @override_settings(SEMANTIC_INDEX_EN_MEMORIA=False)
+    def test_solo_hidrata_top_k_sin_indice_en_memoria(self):
+        self.test_solo_hidrata_top_k()
+
+
+class ResultadosColumnaresTestCase(TestCase):
+    """Tests del cálculo vectorizado de métricas, umbral y top-k"""
+    
+    def setUp(self):
+        import numpy as np
+        from .semantic.vector_search import VectorSearchService
+        self.servicio = VectorSearchService()
+        rng = np.random.default_rng(7)
+        self.consulta = rng.normal(size=16).astype(np.float32)
+        self.candidatos = [(i + 1, rng.normal(size=16).astype(np.float32)) for i in range(40)]
+        self.textos = {
+            envio_id: f'envio {envio_id} | laptop dell inspiron | quito\tentregado' if envio_id % 3 == 0
+            else f'envio {envio_id} | camiseta nike'
+            for envio_id, _ in self.candidatos
+        }
+    
+    def test_metricas_equivalen_al_calculo_por_fila(self):
+        import numpy as np
+        resultados = self.servicio.calcular_similitudes(
+            self.consulta, self.candidatos, texto_consulta='laptop dell quito', textos_indexados=self.textos
+        )
+        self.assertNotIn('euclidean_distance', resultados.columnas)  # Cálculo perezoso
+        
+        filas = {r['envio_id']: r for r in resultados.seleccionar(np.arange(len(resultados))).a_dicts()}
+        for envio_id, vector in self.candidatos:
+            fila = filas[envio_id]
+            coseno = float(np.dot(vector, self.consulta) / (np.linalg.norm(vector) * np.linalg.norm(self.consulta)))
+            palabras = {'laptop', 'dell', 'quito'}
+            coincidencias = len(palabras & set(self.textos[envio_id].split())) / len(palabras)
+            self.assertAlmostEqual(fila['cosine_similarity'], coseno, places=5)
+            self.assertAlmostEqual(fila['euclidean_distance'], float(np.linalg.norm(vector - self.consulta)), places=4)
+            self.assertAlmostEqual(fila['coincidencias_exactas'], coincidencias, places=5)
+            self.assertAlmostEqual(
+                fila['score_combinado'], min((coseno + 1) / 2 + coincidencias * 0.25, 1.0), places=5  # Consulta de productos
+            )
+    
+    def test_umbral_percentil_y_top_k(self):
+        import numpy as np
+        resultados = self.servicio.calcular_similitudes(self.consulta, self.candidatos)
+        scores = np.maximum(resultados.metrica('cosine_similarity'), resultados.metrica('score_combinado'))
+        
+        filtrados = self.servicio.aplicar_umbral(resultados, umbral_base=0.0)
+        self.assertEqual(len(filtrados), int(np.sum(scores >= np.percentile(scores, 75))))
+        
+        top = self.servicio.ordenar_por_metrica(filtrados, metrica='score_combinado', limite=5)
+        esperado = sorted(filtrados.a_dicts(), key=lambda r: r['score_combinado'], reverse=True)[:5]
+        self.assertEqual([r['envio_id'] for r in top], [r['envio_id'] for r in esperado])
+        
+        top = self.servicio.ordenar_por_metrica(resultados, metrica='manhattan_distance', limite=3)
+        esperado = sorted(resultados.a_dicts(), key=lambda r: r['manhattan_distance'])[:3]
+        self.assertEqual([r['envio_id'] for r in top], [r['envio_id'] for r in esperado])
+    
+    def test_listas_de_dicts_siguen_soportadas(self):
+        resultados = [
+            {'envio_id': 1, 'cosine_similarity': 0.2, 'score_combinado': 0.6},
+            {'envio_id': 2, 'cosine_similarity': 0.9, 'score_combinado': 0.95},
+        ]
+        top = self.servicio.ordenar_por_metrica(resultados, metrica='cosine_similarity', limite=1)
+        self.assertEqual(top[0]['envio_id'], 2)
+
+
+class BusquedaHibridaTestCase(TestCase):
+    """Tests de la fusión léxica + vectorial (Reciprocal Rank Fusion)"""
+    
+    def setUp(self):
+        import numpy as np
+        from .semantic.vector_search import VectorSearchService
+        self.servicio = VectorSearchService()
+        rng = np.random.default_rng(11)
+        self.consulta = rng.normal(size=8).astype(np.float32)
+        self.candidatos = [(i + 1, rng.normal(size=8).astype(np.float32)) for i in range(10)]
+    
+    def test_sqlite_no_soporta_busqueda_lexica(self):
+        from .repositories import embedding_repository
+        self.assertFalse(embedding_repository.soporta_busqueda_lexica())
+    
+    def test_tsquery_solo_con_terminos_alfanumericos(self):
+        from .repositories import EnvioEmbeddingRepository
+        self.assertEqual(
+            EnvioEmbeddingRepository._construir_tsquery("HAW123 & laptop:* | laptop ')"),
+            'haw123:* & laptop:*'
+        )
+        self.assertEqual(EnvioEmbeddingRepository._construir_tsquery('!!'), '')
+    
+    def test_tsquery_and_con_prefijo_minimo(self):
+        """Todos los términos deben coincidir; los cortos no se buscan como prefijo"""
+        from .repositories import EnvioEmbeddingRepository
+        self.assertEqual(
+            EnvioEmbeddingRepository._construir_tsquery('tv de 55 pulgadas', prefijo_minimo=4),
+            'tv & de & 55 & pulgadas:*'
+        )
+    
+    def test_solo_hawb_exacto_ignora_el_umbral(self):
+        """Una coincidencia léxica cualquiera no salta el umbral de similitud; un HAWB exacto sí"""
+        import numpy as np
+        consulta = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        candidatos = [
+            (1, np.array([1.0, 0.0, 0.0], dtype=np.float32)),
+            (2, np.array([-1.0, 0.0, 0.0], dtype=np.float32)),
+            (3, np.array([-1.0, 0.1, 0.0], dtype=np.float32)),
+        ]
+        ranking, _ = BusquedaSemanticaService._rankear_candidatos(
+            consulta, candidatos, 'consulta', {}, [(2, 0.9), (3, 0.5)], 10, 'score_combinado', {3}
+        )
+        self.assertEqual(sorted(r['envio_id'] for r in ranking), [1, 3])
+    
+    def test_coincidencias_identificador(self):
+        comprador = Usuario.objects.create(
+            username='comprador_hibrida', correo='comprador_hibrida@test.com', cedula='0923456781',
+            nombre='Comprador Hibrida', rol=4, is_active=True
+        )
+        envio = Envio.objects.create(
+            hawb='HAW555001', comprador=comprador, peso_total=Decimal('1.0'),
+            cantidad_total=1, valor_total=Decimal('10.0')
+        )
+        lexicos = [(envio.id, 0.5)]
+        self.assertEqual(
+            BusquedaSemanticaService._coincidencias_identificador('guia haw555001', lexicos), {envio.id}
+        )
+        self.assertEqual(BusquedaSemanticaService._coincidencias_identificador('haw555', lexicos), set())
+        self.assertEqual(BusquedaSemanticaService._coincidencias_identificador('guia haw555001', []), set())
+    
+    def test_rrf_combina_rangos(self):
+        import numpy as np
+        resultados = self.servicio.calcular_similitudes(self.consulta, self.candidatos)
+        orden_vectorial = [int(i) for i in resultados.envio_ids[np.argsort(-resultados.metrica('score_combinado'))]]
+        ultimo = orden_vectorial[-1]
+        
+        self.servicio.fusionar_rrf(resultados, [(ultimo, 0.9), (orden_vectorial[0], 0.1)], k=60)
+        
+        filas = {r['envio_id']: r for r in resultados.a_dicts()}
+        self.assertAlmostEqual(filas[orden_vectorial[0]]['score_rrf'], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(filas[ultimo]['score_rrf'], 1 / 70 + 1 / 61)
+        self.assertAlmostEqual(filas[orden_vectorial[1]]['score_rrf'], 1 / 62)
+        self.assertTrue(filas[ultimo]['coincidencia_lexica'])
+        self.assertFalse(filas[orden_vectorial[1]]['coincidencia_lexica'])
+        
+        # La coincidencia léxica sobrevive al umbral y sube en el ranking fusionado
+        filtrados = self.servicio.aplicar_umbral(
+            resultados, umbral_base=1.0, conservar=resultados.columnas['rango_lexico'] > 0
+        )
+        top = self.servicio.ordenar_por_metrica(filtrados, metrica='score_rrf', limite=2)
+        self.assertEqual([r['envio_id'] for r in top], [orden_vectorial[0], ultimo])
+    
+    @override_settings(SEMANTIC_INDEX_EN_MEMORIA=False)
+    @patch('apps.busqueda.services.embedding_repository')
+    def test_candidatos_lexicos_se_agregan_a_la_union(self, mock_repo):
+        mock_repo.soporta_busqueda_ann.return_value = True
+        mock_repo.soporta_busqueda_lexica.return_value = True
+        mock_repo.buscar_top_k_ann.return_value = [(1, 0.1), (2, 0.2)]
+        mock_repo.buscar_top_k_lexico.return_value = [(9, 0.8), (2, 0.3)]
+        vectores = dict(self.candidatos)
+        mock_repo.obtener_vectores_por_envios.side_effect = (
+            lambda ids, modelo=None: [(i, vectores[i]) for i in ids]
+        )
+        mock_repo.obtener_textos_indexados.return_value = {}
+        envios_queryset = MagicMock()
+        envios_queryset.count.return_value = 10
+        envios_queryset.filter.return_value = []
+        
+        BusquedaSemanticaService._buscar_envios_similares(
+            envios_queryset, self.consulta, 'HAW9', 5, 'text-embedding-3-small'
+        )
+        
+        self.assertEqual(mock_repo.obtener_vectores_por_envios.call_args_list[-1].args[0], [9])
+        hidratados = envios_queryset.filter.call_args.kwargs['id__in']
+        self.assertIn(9, hidratados)
+        self.assertIn(2, hidratados)
+
+
+class BusquedaTradicionalRankeadaTestCase(TestCase):
+    """Tests de la búsqueda tradicional limitada y con totales por sección"""
+    
+    def setUp(self):
+        self.admin = Usuario.objects.create(
+            username='admin_trigram',
+            correo='admin_trigram@test.com',
+            cedula='1710034065',
+            nombre='Admin Trigram',
+            rol=1,
+            is_active=True
+        )
+        self.comprador = Usuario.objects.create(
+            username='comprador_trigram',
+            correo='comprador_trigram@test.com',
+            cedula='0926687856',
+            nombre='Comprador Trigram',
+            rol=4,
+            is_active=True
+        )
+        for i in range(5):
+            envio = Envio.objects.create(
+                hawb=f'TRG{i:03d}',
+                comprador=self.comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            Producto.objects.create(
+                envio=envio,
+                descripcion=f'Audifonos TRG modelo {i}',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='electronica'
+            )
+    
+    def test_secciones_limitadas_con_total(self):
+        from .services import BusquedaTradicionalService
+        resultado = BusquedaTradicionalService.buscar('trg', 'general', self.admin, limite=2)
+        
+        self.assertEqual(resultado['totales'], {'usuarios': 0, 'envios': 5, 'productos': 5})
+        self.assertEqual(resultado['total_resultados'], 10)
+        self.assertEqual(len(resultado['resultados']['envios']), 2)
+        self.assertEqual(len(resultado['resultados']['productos']), 2)
+    
+    def test_permisos_se_aplican_antes_del_limite(self):
+        from .services import BusquedaTradicionalService
+        resultado = BusquedaTradicionalService.buscar('trigram', 'usuarios', self.comprador, limite=5)
+        
+        self.assertEqual(resultado['totales'], {'usuarios': 1})
+        self.assertEqual(resultado['resultados']['usuarios'][0]['username'], 'comprador_trigram')
+    
+    def test_sqlite_ordena_sin_similitud(self):
+        from apps.archivos.repositories import envio_repository
+        envios, total = envio_repository.rankear_por_similitud(
+            envio_repository.buscar('TRG00'), 'TRG00', limite=3
+        )
+        self.assertEqual(total, 5)
+        self.assertEqual([e.hawb for e in envios], ['TRG004', 'TRG003', 'TRG002'])
+    
+    def test_filtro_usa_ilike_sobre_la_columna_en_postgresql(self):
+        """Sin UPPER(columna::text): los índices gin_trgm_ops solo cubren la columna tal cual"""
+        from django.db import connection
+        from django.db.backends.postgresql.base import DatabaseWrapper
+        from apps.archivos.repositories import envio_repository
+        postgresql = DatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'})
+        
+        sql, params = envio_repository.buscar('trg_1%').query.get_compiler(connection=postgresql).as_sql()
+        
+        self.assertIn('("envio"."hawb" ILIKE %s OR "usuarios"."nombre" ILIKE %s OR "envio"."estado" ILIKE %s)', sql)
+        self.assertNotIn('UPPER', sql)
+        self.assertEqual(params[-1], '%trg\\_1\\%%')
+    
+    def test_comodines_del_termino_se_escapan(self):
+        from apps.archivos.repositories import envio_repository
+        self.assertEqual(envio_repository.buscar('trg%').count(), 0)
+        self.assertEqual(envio_repository.buscar('trg_0').count(), 0)
+        self.assertEqual(envio_repository.buscar('trg00').count(), 5)
+
+
+class TextoInvarianteTestCase(TestCase):
+    """Tests del texto indexado estable (estado, fecha, peso y valor como filtros)"""
+    
+    def setUp(self):
+        self.admin = Usuario.objects.create(
+            username='admin_texto',
+            correo='admin_texto@test.com',
+            cedula='1710034065',
+            nombre='Admin Texto',
+            rol=1,
+            is_active=True
+        )
+        self.comprador = Usuario.objects.create(
+            username='comprador_texto',
+            correo='comprador_texto@test.com',
+            cedula='0926687856',
+            nombre='Comprador Texto',
+            ciudad='Quito',
+            rol=4,
+            is_active=True
+        )
+        self.envio = Envio.objects.create(
+            hawb='TXT001',
+            comprador=self.comprador,
+            peso_total=Decimal('12.0'),
+            cantidad_total=1,
+            valor_total=Decimal('800.0'),
+            estado='pendiente'
+        )
+        Producto.objects.create(
+            envio=self.envio,
+            descripcion='Laptop Lenovo',
+            peso=Decimal('12.0'),
+            cantidad=1,
+            valor=Decimal('800.0'),
+            categoria='electronica'
+        )
+    
+    def test_texto_no_depende_de_estado_ni_fecha(self):
+        from datetime import timedelta
+        from .semantic.text_processor import TextProcessor
+        texto = TextProcessor.generar_texto_envio(self.envio)
+        self.assertIn('txt001', texto)
+        self.assertIn('laptop lenovo', texto)
+        for termino in ('pendiente', 'registrado', 'fecha', 'peso', 'valor alto'):
+            self.assertNotIn(termino, texto)
+        
+        self.envio.estado = 'en_transito'
+        self.envio.fecha_emision = self.envio.fecha_emision - timedelta(days=90)
+        self.assertEqual(TextProcessor.generar_texto_envio(self.envio), texto)
+    
+    def test_intencion_de_estado_y_tiempo_se_aplica_como_filtro(self):
+        from .semantic.query_expander import QueryExpander
+        expansion = QueryExpander.expandir_consulta('laptops pendientes de hoy')
+        
+        self.assertEqual(expansion['filtros_sugeridos']['estado'], 'pendiente')
+        self.assertIn('fechaDesde', expansion['filtros_sugeridos'])
+        self.assertNotIn('en espera', expansion['consulta_expandida'])
+        self.assertNotIn('el día de hoy', expansion['consulta_expandida'])
+        self.assertIn('portátil', expansion['consulta_expandida'])
+    
+    @patch('apps.archivos.services.EnvioService._notificar_cambio_estado_async')
+    @patch('apps.archivos.services.EnvioService._generar_embedding_async')
+    def test_cambiar_estado_no_regenera_embedding(self, mock_generar, mock_notificar):
+        from apps.archivos.services import EnvioService
+        EnvioService.cambiar_estado(self.envio.id, 'en_transito', self.admin)
+        mock_generar.assert_not_called()
+
+
+class HashContenidoEmbeddingTestCase(TestCase):
+    """Tests de la omisión por hash de contenido y la reutilización de vectores"""
+    
+    def setUp(self):
+        self.comprador = Usuario.objects.create(
+            username='comprador_hash',
+            correo='comprador_hash@test.com',
+            cedula='0926687856',
+            nombre='Comprador Hash',
+            rol=4,
+            is_active=True
+        )
+        self.envios = []
+        for i in range(3):
+            envio = Envio.objects.create(
+                hawb=f'HASH{i:03d}',
+                comprador=self.comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            Producto.objects.create(
+                envio=envio,
+                descripcion='Reloj inteligente',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='electronica'
+            )
+            self.envios.append(envio)
+    
+    @patch('apps.busqueda.semantic.embedding_service.EmbeddingService.generar_embedding')
+    def test_regeneracion_forzada_omite_contenido_sin_cambios(self, mock_generar):
+        from .semantic.embedding_service import EmbeddingService
+        from .semantic.text_processor import TextProcessor
+        from apps.metricas.models import RegistroGeneracionEmbedding
+        mock_generar.return_value = {'embedding': [0.1] * 1536, 'tokens': 10, 'costo': 0.0}
+        envio = self.envios[0]
+        
+        embedding = EmbeddingService.generar_embedding_envio(envio)
+        self.assertEqual(embedding.hash_contenido, embedding.calcular_hash(embedding.texto_indexado))
+        self.assertEqual(embedding.version_plantilla, TextProcessor.VERSION_PLANTILLA)
+        
+        EmbeddingService.generar_embedding_envio(envio, forzar_regeneracion=True)
+        self.assertEqual(mock_generar.call_count, 1)
+        self.assertEqual(RegistroGeneracionEmbedding.objects.get(envio=envio).estado, 'omitido')
+        
+        envio.observaciones = 'Frágil'
+        envio.save()
+        EmbeddingService.generar_embedding_envio(envio, forzar_regeneracion=True)
+        self.assertEqual(mock_generar.call_count, 2)
+    
+    @patch('apps.busqueda.semantic.embedding_service.TextProcessor.generar_texto_envio',
+           return_value='reloj inteligente')
+    @patch('apps.busqueda.semantic.embedding_service.OpenAIClient.get_instance')
+    def test_textos_identicos_comparten_vector(self, mock_cliente, mock_texto):
+        from .models import EnvioEmbedding
+        from .semantic.embedding_service import EmbeddingService
+        cliente = MagicMock()
+        cliente.with_options.return_value = cliente
+        cliente.embeddings.create.side_effect = lambda model, input, encoding_format: MagicMock(
+            data=[MagicMock(index=i, embedding=[0.5] * 1536) for i in range(len(input))],
+            usage=MagicMock(total_tokens=5 * len(input))
+        )
+        mock_cliente.return_value = cliente
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.filter(id__in=[e.id for e in self.envios[:2]]), modelo='text-embedding-3-small'
+        )
+        self.assertEqual(cliente.embeddings.create.call_args.kwargs['input'], ['reloj inteligente'])
+        self.assertEqual(resultado['procesados'], 2)
+        
+        resultado = EmbeddingService.generar_embeddings_envios_lote(
+            Envio.objects.all(), modelo='text-embedding-3-small'
+        )
+        self.assertEqual(cliente.embeddings.create.call_count, 1)
+        self.assertEqual(resultado['reutilizados'], 1)
+        self.assertEqual(EnvioEmbedding.objects.filter(hash_contenido=EnvioEmbedding.calcular_hash('reloj inteligente')).count(), 3)
+
+
+class VectorNumpyTestCase(TestCase):
+    """Tests del camino de vectores como np.ndarray float32 (sin listas intermedias)"""
+    
+    def setUp(self):
+        self.comprador = Usuario.objects.create(
+            username='comprador_np',
+            correo='comprador_np@test.com',
+            cedula='0912345679',
+            nombre='Comprador Numpy',
+            rol=4,
+            is_active=True
+        )
+        self.envio = Envio.objects.create(
+            hawb='NP001',
+            comprador=self.comprador,
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0')
+        )
+    
+    def test_decodifica_base64_de_openai(self):
+        import base64
+        import numpy as np
+        from .semantic.embedding_service import EmbeddingService
+        original = np.array([0.5, -0.25, 0.125, 3.0], dtype=np.float32)
+        
+        vector = EmbeddingService.decodificar_embedding(base64.b64encode(original.astype('<f4').tobytes()).decode())
+        
+        self.assertEqual(vector.dtype, np.float32)
+        np.testing.assert_array_equal(vector, original)
+        self.assertEqual(EmbeddingService.decodificar_embedding([1.0, 2.0]).dtype, np.float32)
+    
+    @patch('apps.busqueda.semantic.embedding_service.OpenAIClient.get_instance')
+    def test_generar_embedding_pide_base64(self, mock_cliente):
+        import base64
+        import numpy as np
+        from .semantic.embedding_service import EmbeddingService
+        cliente = MagicMock()
+        cliente.embeddings.create.return_value = MagicMock(
+            data=[MagicMock(embedding=base64.b64encode(np.ones(1536, dtype='<f4').tobytes()).decode())],
+            usage=MagicMock(total_tokens=3)
+        )
+        mock_cliente.return_value = cliente
+        
+        resultado = EmbeddingService.generar_embedding('laptop', 'text-embedding-3-small')
+        
+        self.assertEqual(cliente.embeddings.create.call_args.kwargs['encoding_format'], 'base64')
+        self.assertIsInstance(resultado['embedding'], np.ndarray)
+        self.assertEqual(resultado['embedding'].shape, (1536,))
+    
+    def test_vectores_de_repositorio_son_ndarray(self):
+        import numpy as np
+        from .models import EnvioEmbedding
+        from .repositories import embedding_repository
+        embedding = EnvioEmbedding(envio=self.envio, texto_indexado='laptop', modelo_usado='text-embedding-3-small')
+        embedding.set_vector(np.full(1536, 0.25, dtype=np.float32))
+        embedding.save()
+        
+        vectores = embedding_repository.obtener_vectores_por_envios([self.envio.id], 'text-embedding-3-small')
+        
+        self.assertEqual(len(vectores), 1)
+        self.assertIsInstance(vectores[0][1], np.ndarray)
+        self.assertEqual(vectores[0][1].dtype, np.float32)
+        embedding.refresh_from_db()
+        self.assertIsInstance(embedding.get_vector(), np.ndarray)
+        self.assertEqual(EnvioEmbedding(embedding_vector=None).get_vector().shape, (0,))
+
+
+class CoalescenciaConsultasTestCase(TestCase):
+    """Tests del single-flight de consultas semánticas idénticas"""
+    
+    def setUp(self):
+        from .services import get_semantic_cache
+        get_semantic_cache().clear()
+        self.admin = Usuario.objects.create(
+            username='admin_sflight',
+            correo='admin_sflight@test.com',
+            cedula='0923456781',
+            nombre='Admin Single Flight',
+            rol=1,
+            is_active=True
+        )
+        self.comprador = Usuario.objects.create(
+            username='comprador_sflight',
+            correo='comprador_sflight@test.com',
+            cedula='0923456782',
+            nombre='Comprador Single Flight',
+            rol=4,
+            is_active=True
+        )
+    
+    def test_hilos_concurrentes_comparten_un_calculo(self):
+        import threading
+        from .services import CoalescenciaConsultas
+        llamadas = []
+        
+        def calcular():
+            llamadas.append(1)
+            time.sleep(0.2)
+            return {'resultados': [1, 2, 3]}
+        
+        salidas = []
+        hilos = [
+            threading.Thread(target=lambda: salidas.append(CoalescenciaConsultas.ejecutar('misma', calcular)))
+            for _ in range(5)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        
+        self.assertEqual(len(llamadas), 1)
+        self.assertEqual([resultado for resultado, _ in salidas], [{'resultados': [1, 2, 3]}] * 5)
+        self.assertEqual(sum(1 for _, compartido in salidas if compartido), 4)
+        # Cada petición recibe su propia lista
+        listas = [resultado['resultados'] for resultado, _ in salidas]
+        self.assertEqual(len({id(lista) for lista in listas}), 5)
+    
+    def test_peticion_tardia_lee_el_resultado_publicado(self):
+        from .services import CoalescenciaConsultas
+        llamadas = []
+        
+        def calcular():
+            llamadas.append(1)
+            return [{'id': 1}]
+        
+        primero, compartido_primero = CoalescenciaConsultas.ejecutar('tardia', calcular)
+        # Otro worker llega con el lock ya liberado, dentro del TTL del resultado
+        segundo, compartido_segundo = CoalescenciaConsultas.ejecutar('tardia', calcular)
+        
+        self.assertEqual(len(llamadas), 1)
+        self.assertFalse(compartido_primero)
+        self.assertTrue(compartido_segundo)
+        self.assertEqual(segundo, primero)
+        self.assertIsNot(segundo, primero)
+    
+    def test_error_del_lider_se_propaga_y_no_queda_vuelo(self):
+        from .services import CoalescenciaConsultas
+        
+        def fallar():
+            raise ValueError('sin conexión')
+        
+        with self.assertRaises(ValueError):
+            CoalescenciaConsultas.ejecutar('con_error', fallar)
+        self.assertEqual(CoalescenciaConsultas._vuelos, {})
+        self.assertEqual(CoalescenciaConsultas.ejecutar('con_error', lambda: 'ok'), ('ok', False))
+    
+    def test_clave_distingue_alcance_de_permisos(self):
+        from .services import BusquedaSemanticaService, CoalescenciaConsultas
+        alcance_admin = BusquedaSemanticaService._alcance_permisos(self.admin)
+        alcance_comprador = BusquedaSemanticaService._alcance_permisos(self.comprador)
+        
+        self.assertEqual(alcance_admin, 'todos')
+        self.assertEqual(alcance_comprador, f'comprador:{self.comprador.id}')
+        self.assertNotEqual(
+            CoalescenciaConsultas.clave(alcance_admin, 'laptop', {}, 'm', 'score_combinado', 20),
+            CoalescenciaConsultas.clave(alcance_comprador, 'laptop', {}, 'm', 'score_combinado', 20)
+        )
+        self.assertEqual(
+            CoalescenciaConsultas.clave('todos', 'laptop', {'a': 1, 'b': 2}),
+            CoalescenciaConsultas.clave('todos', 'laptop', {'b': 2, 'a': 1})
+        )
+    
+    @patch('apps.busqueda.services.BusquedaSemanticaService._calcular_busqueda')
+    def test_espera_el_resultado_de_otro_worker(self, mock_calcular):
+        import threading
+        from .models import EmbeddingBusqueda
+        from .services import BusquedaSemanticaService, CoalescenciaConsultas, get_semantic_cache
+        cache = get_semantic_cache()
+        clave = CoalescenciaConsultas.clave(
+            'todos', 'laptop dell', {}, 'text-embedding-3-small', 'score_combinado', 20, True
+        )
+        calculo = {'resultados': [{'id': 7}], 'modelo': 'text-embedding-3-small',
+                   'embedding': None, 'tokens': 9, 'costo': 0.001}
+        # Otro worker tiene el lock y publica su resultado al terminar
+        cache.add(f'sflight:lock:{clave}', 1, timeout=30)
+        threading.Timer(0.15, lambda: cache.set(f'sflight:res:{clave}', calculo, timeout=3)).start()
+        
+        respuesta = BusquedaSemanticaService.buscar(
+            '  Laptop   DELL ', self.admin, modelo_embedding='text-embedding-3-small'
+        )
+        
+        mock_calcular.assert_not_called()
+        self.assertTrue(respuesta['consultaCompartida'])
+        self.assertEqual(respuesta['resultados'], [{'id': 7}])
+        self.assertEqual(respuesta['tokensUtilizados'], 0)
+        # Cada usuario conserva su entrada de historial
+        self.assertEqual(EmbeddingBusqueda.objects.get(id=respuesta['busquedaId']).usuario, self.admin)
+
+
+class CacheResultadosSemanticosTestCase(TestCase):
+    """Tests del caché de rankings con invalidación por versión"""
+    
+    def setUp(self):
+        from .repositories import embedding_repository
+        from .services import get_semantic_cache
+        from .semantic.vector_index import reiniciar_indices
+        import numpy as np
+        get_semantic_cache().clear()
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
+        self.comprador = Usuario.objects.create(
+            username='comprador_semres',
+            correo='comprador_semres@test.com',
+            cedula='0934567812',
+            nombre='Comprador Rankings',
+            rol=4,
+            is_active=True
+        )
+        self.envios = []
+        for i in range(4):
+            envio = Envio.objects.create(
+                hawb=f'RES{i:03d}',
+                comprador=self.comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = np.zeros(1536, dtype=np.float32)
+            vector[0] = 1.0
+            vector[1] = i * 0.1
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+            self.envios.append(envio)
+    
+    def _buscar(self, clave):
+        return BusquedaSemanticaService._buscar_envios_similares(
+            Envio.objects.all(), [1.0] + [0.0] * 1535, 'envio', 2, 'text-embedding-3-small',
+            clave_ranking=clave
+        )
+    
+    def test_hit_omite_ranking_e_hidrata_fresco(self):
+        from .services import CacheResultadosSemanticos
+        from .semantic import VectorSearchService
+        clave = CacheResultadosSemanticos.clave('todos', 'envio', {}, 'text-embedding-3-small', 'score_combinado', 2)
+        
+        with patch.object(VectorSearchService, 'calcular_similitudes',
+                          autospec=True, side_effect=VectorSearchService.calcular_similitudes) as espia:
+            primero = self._buscar(clave)
+            # Cambio sin signals: solo la hidratación puede reflejarlo
+            Envio.objects.filter(id=self.envios[0].id).update(observaciones='Revisado en aduana')
+            segundo = self._buscar(clave)
+        
+        espia.assert_called_once()
+        self.assertEqual(
+            [r['envio']['hawb'] for r in primero], [r['envio']['hawb'] for r in segundo]
+        )
+        self.assertEqual(segundo[0]['envio']['observaciones'], 'Revisado en aduana')
+        self.assertEqual(segundo[0]['scoreCombinado'], primero[0]['scoreCombinado'])
+        self.assertEqual(
+            CacheResultadosSemanticos.estadisticas(),
+            {'hits': 1, 'misses': 1, 'tasa_aciertos': 50.0}
+        )
+    
+    def test_cambios_incrementan_la_version(self):
+        from .services import CacheResultadosSemanticos
+        clave = CacheResultadosSemanticos.clave('todos', 'envio')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(
+                envio=self.envios[0], descripcion='Audífonos', categoria='electronica',
+                peso=Decimal('0.5'), cantidad=1, valor=Decimal('20.0')
+            )
+        self.assertNotEqual(CacheResultadosSemanticos.clave('todos', 'envio'), clave)
+        
+        clave = CacheResultadosSemanticos.clave('todos', 'envio')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.envios[0].observaciones = 'Cambio de dirección'
+            self.envios[0].save()
+        self.assertNotEqual(CacheResultadosSemanticos.clave('todos', 'envio'), clave)
+    
+    def test_guardado_sin_cambios_de_ranking_conserva_la_version(self):
+        from .services import CacheResultadosSemanticos
+        producto = Producto.objects.create(
+            envio=self.envios[0], descripcion='Audífonos', categoria='electronica',
+            peso=Decimal('0.5'), cantidad=1, valor=Decimal('20.0')
+        )
+        clave = CacheResultadosSemanticos.clave('todos', 'envio')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.envios[0].costo_servicio = Decimal('3.5')
+            self.envios[0].save()
+            Envio.objects.get(id=self.envios[0].id).save()
+            self.envios[0].save(update_fields=['fecha_actualizacion'])
+            producto.peso = Decimal('0.7')
+            producto.save()
+        self.assertEqual(CacheResultadosSemanticos.clave('todos', 'envio'), clave)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.envios[0].estado = 'entregado'
+            self.envios[0].save()
+        self.assertNotEqual(CacheResultadosSemanticos.clave('todos', 'envio'), clave)
+    
+    def test_invalidacion_fallida_omite_el_cache_hasta_reintentar(self):
+        from .services import CacheResultadosSemanticos, get_semantic_cache
+        cache = get_semantic_cache()
+        self.addCleanup(setattr, CacheResultadosSemanticos, '_invalidacion_pendiente', False)
+        clave = CacheResultadosSemanticos.clave('todos', 'envio')
+        
+        # Redis con IGNORE_EXCEPTIONS devuelve None en lugar de fallar
+        with patch.object(cache, 'incr', return_value=None):
+            CacheResultadosSemanticos.invalidar()
+            self.assertFalse(CacheResultadosSemanticos.habilitado())
+        
+        # Con el caché disponible, el reintento incrementa la versión y lo reactiva
+        self.assertTrue(CacheResultadosSemanticos.habilitado())
+        self.assertNotEqual(CacheResultadosSemanticos.clave('todos', 'envio'), clave)
+        
+    @patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding')
+    def test_evaluacion_omite_el_cache(self, mock_embedding):
+        from .services import CacheResultadosSemanticos
+        admin = Usuario.objects.create(
+            username='admin_semres', correo='admin_semres@test.com', cedula='0934567813',
+            nombre='Admin Rankings', rol=1, is_active=True
+        )
+        mock_embedding.return_value = {
+            'embedding': [1.0] + [0.0] * 1535, 'tokens': 1, 'costo': 0.0, 'modelo': 'text-embedding-3-small'
+        }
+        
+        with patch.object(CacheResultadosSemanticos, 'obtener', return_value=None) as mock_obtener:
+            BusquedaSemanticaService.buscar('envio', admin, modelo_embedding='text-embedding-3-small',
+                                            usar_cache=False)
+            mock_obtener.assert_not_called()
+            BusquedaSemanticaService.buscar('envio', admin, modelo_embedding='text-embedding-3-small')
+            mock_obtener.assert_called_once()
+
+
+class RegistroModelosTestCase(TestCase):
+    """Tests del registro de modelos y la convivencia de vectores de 1536 y 3072 dimensiones"""
+    
+    def setUp(self):
+        from .semantic.registro_modelos import RegistroModelos
+        from .semantic.vector_index import reiniciar_indices
+        RegistroModelos.invalidar()
+        reiniciar_indices()
+        self.addCleanup(RegistroModelos.invalidar)
+        self.addCleanup(reiniciar_indices)
+        
+        self.comprador = Usuario.objects.create(
+            username='comprador_registro',
+            correo='comprador_registro@test.com',
+            cedula='0945678123',
+            nombre='Comprador Registro',
+            rol=4,
+            is_active=True
+        )
+        self.envio = Envio.objects.create(
+            hawb='REG001',
+            comprador=self.comprador,
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0')
+        )
+    
+    def _vector(self, dimensiones):
+        import numpy as np
+        vector = np.zeros(dimensiones, dtype=np.float32)
+        vector[0] = 1.0
+        return vector
+    
+    def test_modelos_conviven_en_tablas_separadas(self):
+        from .models import EnvioEmbedding, EnvioEmbeddingGrande
+        from .repositories import embedding_repository
+        embedding_repository.crear_o_actualizar_embedding(
+            self.envio, 'envio reg001', self._vector(1536), 'text-embedding-3-small'
+        )
+        embedding_repository.crear_o_actualizar_embedding(
+            self.envio, 'envio reg001', self._vector(3072), 'text-embedding-3-large'
+        )
+        
+        self.assertEqual(EnvioEmbedding.objects.count(), 1)
+        self.assertEqual(EnvioEmbeddingGrande.objects.count(), 1)
+        pequeno = embedding_repository.obtener_vectores_por_envios([self.envio.id], 'text-embedding-3-small')
+        grande = embedding_repository.obtener_vectores_por_envios([self.envio.id], 'text-embedding-3-large')
+        self.assertEqual(pequeno[0][1].shape, (1536,))
+        self.assertEqual(grande[0][1].shape, (3072,))
+    
+    def test_cambio_de_modelo_con_misma_dimension_reemplaza_la_fila(self):
+        from .models import EnvioEmbedding
+        from .repositories import embedding_repository
+        embedding_repository.crear_o_actualizar_embedding(
+            self.envio, 'envio reg001', self._vector(1536), 'text-embedding-3-small'
+        )
+        embedding_repository.crear_o_actualizar_embedding(
+            self.envio, 'envio reg001', self._vector(1536), 'text-embedding-ada-002'
+        )
+        
+        self.assertEqual(list(EnvioEmbedding.objects.values_list('modelo_usado', flat=True)), ['text-embedding-ada-002'])
+    
+    def test_cobertura_se_cachea_en_memoria(self):
+        from .repositories import embedding_repository
+        from .semantic.registro_modelos import RegistroModelos
+        self.assertFalse(RegistroModelos.disponible('text-embedding-3-large'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            embedding_repository.crear_o_actualizar_embedding(
+                self.envio, 'envio reg001', self._vector(3072), 'text-embedding-3-large'
+            )
+        
+        with self.assertNumQueries(0):
+            self.assertTrue(RegistroModelos.disponible('text-embedding-3-large'))
+            modelo = BusquedaSemanticaService._obtener_modelo_disponible(
+                Envio.objects.all(), 'text-embedding-3-large'
+            )
+        self.assertEqual(modelo, 'text-embedding-3-large')
+        
+        RegistroModelos.invalidar()
+        estado = {fila['modelo']: fila for fila in RegistroModelos.estado()}
+        self.assertEqual(estado['text-embedding-3-large']['cobertura'], 1)
+        self.assertEqual(estado['text-embedding-3-large']['dimensiones'], 3072)
+        self.assertEqual(estado['text-embedding-3-large']['tabla'], 'embedding_envio_grande')
+        self.assertFalse(estado['text-embedding-3-large']['indice_ann'])
+    
+    def test_refresco_consulta_fuera_del_lock(self):
+        from .semantic.registro_modelos import RegistroModelos
+        self.assertFalse(RegistroModelos.disponible('text-embedding-3-large'))
+        RegistroModelos._expira = 0.0
+        bloqueado = []
+        
+        def consultar_indices():
+            bloqueado.append(RegistroModelos._lock.locked())
+            # Un embedding guardado mientras se consulta no debe esperar ni perderse
+            RegistroModelos.marcar_disponible('text-embedding-3-large')
+            return set()
+        
+        with patch.object(RegistroModelos, '_consultar_indices', side_effect=consultar_indices):
+            self.assertTrue(RegistroModelos.disponible('text-embedding-3-large'))
+        
+        self.assertEqual(bloqueado, [False])
+        # Hubo cambios durante la consulta: el próximo acceso vuelve a consultar
+        self.assertEqual(RegistroModelos._expira, 0.0)
+        
+    def test_indice_en_memoria_usa_dimensiones_del_modelo(self):
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice
+        embedding_repository.crear_o_actualizar_embedding(
+            self.envio, 'envio reg001', self._vector(3072), 'text-embedding-3-large'
+        )
+        
+        indice = obtener_indice('text-embedding-3-large')
+        
+        self.assertEqual(indice.dimensiones, 3072)
+        self.assertEqual(indice.buscar(self._vector(3072), k=1)[0][0], self.envio.id)
+    
+    def test_vector_de_consulta_grande_se_guarda(self):
+        from .models import EmbeddingBusqueda
+        busqueda = EmbeddingBusqueda(usuario=self.comprador, consulta='laptop')
+        busqueda.set_vector(self._vector(3072))
+        busqueda.save()
+        busqueda.refresh_from_db()
+        
+        self.assertIsNone(busqueda.embedding_vector)
+        self.assertEqual(busqueda.get_vector().shape, (3072,))
+
+
+class MatryoshkaTestCase(TestCase):
+    """Tests de la búsqueda en dos etapas con la copia reducida de los vectores"""
+    
+    def setUp(self):
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        self.comprador = Usuario.objects.create(
+            username='comprador_matryoshka',
+            correo='comprador_matryoshka@test.com',
+            cedula='0956781234',
+            nombre='Comprador Matryoshka',
+            rol=4,
+            is_active=True
+        )
+    
+    def _crear_envio(self, hawb):
+        envio = Envio.objects.create(
+            hawb=hawb,
+            comprador=self.comprador,
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0')
+        )
+        return envio
+    
+    def _corpus(self, filas, dimensiones, semilla=7):
+        """Vectores con energía decreciente por dimensión, como los de text-embedding-3"""
+        import numpy as np
+        rng = np.random.default_rng(semilla)
+        escala = np.linspace(1.0, 0.1, dimensiones, dtype=np.float32)
+        return (rng.standard_normal((filas, dimensiones)).astype(np.float32) * escala)
+    
+    def test_set_vector_guarda_copia_reducida_normalizada(self):
+        import numpy as np
+        from .repositories import embedding_repository
+        envio = self._crear_envio('MAT001')
+        vector = self._corpus(1, 1536)[0]
+        
+        embedding = embedding_repository.crear_o_actualizar_embedding(
+            envio, 'envio mat001', vector, 'text-embedding-3-small'
+        )
+        embedding.refresh_from_db()
+        
+        reducido = np.asarray(embedding.embedding_vector_reducido, dtype=np.float32)
+        self.assertEqual(reducido.shape, (256,))
+        self.assertAlmostEqual(float(np.linalg.norm(reducido)), 1.0, places=5)
+        np.testing.assert_allclose(
+            reducido, vector[:256] / np.linalg.norm(vector[:256]), rtol=1e-5
+        )
+    
+    def test_modelo_sin_matryoshka_no_guarda_copia(self):
+        from .repositories import embedding_repository
+        envio = self._crear_envio('MAT002')
+        embedding = embedding_repository.crear_o_actualizar_embedding(
+            envio, 'envio mat002', self._corpus(1, 1536)[0], 'text-embedding-ada-002'
+        )
+        embedding.refresh_from_db()
+        
+        self.assertIsNone(embedding.embedding_vector_reducido)
+    
+    def test_dos_etapas_recupera_el_top_k_exacto(self):
+        import numpy as np
+        from .semantic.vector_index import IndiceVectorial
+        corpus = self._corpus(3000, 512)
+        pares = list(enumerate(corpus, start=1))
+        exacto = IndiceVectorial('modelo-test', dimensiones=512)
+        exacto.construir(pares)
+        reducido = IndiceVectorial('modelo-test', dimensiones=512, dimensiones_reducidas=128)
+        reducido.construir(pares)
+        
+        consultas = self._corpus(20, 512, semilla=11)
+        coincidencias = []
+        for consulta in consultas:
+            top_exacto = exacto.buscar(consulta, k=10)
+            top_reducido = reducido.buscar(consulta, k=10, candidatos_reducidos=300)
+            ids_exactos = {envio_id for envio_id, _ in top_exacto}
+            coincidencias.append(len(ids_exactos & {envio_id for envio_id, _ in top_reducido}) / 10)
+            # Las similitudes del re-ranking son las del vector completo
+            similitudes_exactas = dict(top_exacto)
+            for envio_id, similitud in top_reducido:
+                if envio_id in similitudes_exactas:
+                    self.assertAlmostEqual(similitud, similitudes_exactas[envio_id], places=5)
+        
+        self.assertGreaterEqual(float(np.mean(coincidencias)), 0.9)
+    
+    def test_filtro_de_ids_y_pocas_filas_usan_busqueda_exacta(self):
+        from .semantic.vector_index import IndiceVectorial
+        corpus = self._corpus(50, 64)
+        indice = IndiceVectorial('modelo-test', dimensiones=64, dimensiones_reducidas=16)
+        indice.construir(list(enumerate(corpus, start=1)))
+        
+        resultados = indice.buscar(corpus[9], k=3, envios_ids=[10, 20, 30], candidatos_reducidos=2)
+        
+        self.assertEqual(resultados[0][0], 10)
+        self.assertEqual({envio_id for envio_id, _ in resultados}, {10, 20, 30})
+    
+    @override_settings(SEMANTIC_MATRYOSHKA=True, SEMANTIC_MATRYOSHKA_DIMENSIONES=256)
+    def test_indice_residente_por_modelo(self):
+        from .semantic.vector_index import obtener_indice
+        self.assertEqual(obtener_indice('text-embedding-3-small').dimensiones_reducidas, 256)
+        self.assertEqual(obtener_indice('text-embedding-ada-002').dimensiones_reducidas, 0)
+    
+    def test_reporte_recall_vs_latencia(self):
+        import io
+        from django.core.management import call_command
+        from apps.metricas.models import PruebaControladaSemantica
+        from .repositories import embedding_repository
+        corpus = self._corpus(30, 1536)
+        envios = []
+        for i, vector in enumerate(corpus):
+            envio = self._crear_envio(f'MATR{i:03d}')
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+            envios.append(envio)
+        PruebaControladaSemantica.objects.create(
+            nombre='Prueba Matryoshka',
+            consulta='laptop',
+            resultados_relevantes=[envios[3].id]
+        )
+        salida = io.StringIO()
+        
+        with patch(
+            'apps.busqueda.management.commands.reporte_matryoshka.CacheEmbeddingsConsulta.obtener_embedding',
+            return_value={'embedding': corpus[3]}
+        ):
+            call_command(
+                'reporte_matryoshka', modelo='text-embedding-3-small', dimensiones=[256],
+                candidatos=[5], k=5, repeticiones=1, stdout=salida
+            )
+        
+        texto = salida.getvalue()
+        self.assertIn('exacta', texto)
+        self.assertIn('256d x 5', texto)
+
+
+class CuantizacionIndiceTestCase(TestCase):
+    """Tests del índice en memoria cuantizado (float16 / int8 con escala por fila)"""
+    
+    def setUp(self):
+        from .semantic.vector_index import reiniciar_indices
+        from .semantic.registro_modelos import RegistroModelos
+        reiniciar_indices()
+        RegistroModelos.invalidar()
+        self.addCleanup(reiniciar_indices)
+        self.addCleanup(RegistroModelos.invalidar)
+    
+    def _corpus(self, filas, dimensiones, semilla=3):
+        import numpy as np
+        rng = np.random.default_rng(semilla)
+        return rng.standard_normal((filas, dimensiones)).astype(np.float32)
+    
+    def _indice(self, cuantizacion, corpus, **kwargs):
+        from .semantic.vector_index import IndiceVectorial
+        indice = IndiceVectorial('modelo-test', dimensiones=corpus.shape[1], cuantizacion=cuantizacion, **kwargs)
+        indice.construir(list(enumerate(corpus, start=1)))
+        return indice
+    
+    def test_memoria_y_similitudes_aproximadas(self):
+        import numpy as np
+        corpus = self._corpus(2000, 256)
+        consultas = self._corpus(10, 256, semilla=5)
+        indices = {c: self._indice(c, corpus) for c in ('float32', 'float16', 'int8')}
+        
+        self.assertEqual(indices['float16']._matriz.nbytes * 2, indices['float32']._matriz.nbytes)
+        self.assertEqual(indices['int8']._matriz.nbytes * 4, indices['float32']._matriz.nbytes)
+        # Las columnas de metadatos (iguales en las tres precisiones) no se cuantizan
+        vectores = {
+            c: indice.memoria_bytes - sum(v.nbytes for v in indice._metadatos.values())
+            for c, indice in indices.items()
+        }
+        self.assertLess(vectores['int8'], vectores['float32'] / 3)
+        
+        for consulta in consultas:
+            exactos = dict(indices['float32'].buscar(consulta, k=50))
+            for cuantizacion in ('float16', 'int8'):
+                aproximados = indices[cuantizacion].buscar(consulta, k=50)
+                comunes = [e for e, _ in aproximados if e in exactos]
+                self.assertGreaterEqual(len(comunes), 40)
+                for envio_id, similitud in aproximados:
+                    if envio_id in exactos:
+                        self.assertAlmostEqual(similitud, exactos[envio_id], delta=0.01)
+    
+    def test_crecer_y_compactar_conservan_escalas(self):
+        corpus = self._corpus(1500, 32)
+        indice = self._indice('int8', corpus)
+        antes = indice.buscar(corpus[1200], k=6)
+        eliminado = antes[1][0]
+        
+        indice.eliminar(eliminado)
+        indice.compactar()
+        
+        self.assertEqual(indice.buscar(corpus[1200], k=5), [par for par in antes if par[0] != eliminado])
+        self.assertEqual(indice.buscar(corpus[1200], k=1)[0][0], 1201)
+    
+    def test_cuantizacion_con_pasada_reducida(self):
+        corpus = self._corpus(1000, 128)
+        indice = self._indice('int8', corpus, dimensiones_reducidas=32)
+        
+        self.assertEqual(indice.buscar(corpus[500], k=1, candidatos_reducidos=100)[0][0], 501)
+    
+    def test_cuantizacion_invalida(self):
+        from .semantic.vector_index import IndiceVectorial
+        with self.assertRaises(ValueError):
+            IndiceVectorial('modelo-test', dimensiones=4, cuantizacion='int4')
+    
+    @override_settings(SEMANTIC_INDEX_CUANTIZACION='float16')
+    def test_indice_residente_usa_la_configuracion(self):
+        from .semantic.vector_index import obtener_indice
+        indice = obtener_indice('text-embedding-3-small')
+        
+        self.assertEqual(indice.estadisticas()['cuantizacion'], 'float16')
+    
+    def test_indice_halfvec_opcional_cambia_la_expresion_ann(self):
+        from .semantic.registro_modelos import RegistroModelos
+        self.assertFalse(RegistroModelos.usa_halfvec('text-embedding-3-small'))
+        self.assertTrue(RegistroModelos.usa_halfvec('text-embedding-3-large'))
+        
+        RegistroModelos.invalidar()
+        with patch.object(
+            RegistroModelos, '_consultar_indices',
+            return_value={'embedding_envio_vector_halfvec_hnsw_idx'}
+        ):
+            self.assertTrue(RegistroModelos.usa_halfvec('text-embedding-3-small'))
+            self.assertTrue(RegistroModelos.tiene_indice_ann('text-embedding-3-small'))
+    
+    def test_reporte_memoria_y_ndcg(self):
+        import io
+        from django.core.management import call_command
+        from apps.metricas.models import PruebaControladaSemantica
+        from .repositories import embedding_repository
+        comprador = Usuario.objects.create(
+            username='comprador_cuantizacion',
+            correo='comprador_cuantizacion@test.com',
+            cedula='0967812345',
+            nombre='Comprador Cuantización',
+            rol=4,
+            is_active=True
+        )
+        corpus = self._corpus(20, 1536)
+        ids = []
+        for i, vector in enumerate(corpus):
+            envio = Envio.objects.create(
+                hawb=f'CUANT{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            embedding_repository.crear_o_actualizar_embedding(envio, f'envio {i}', vector, 'text-embedding-3-small')
+            ids.append(envio.id)
+        PruebaControladaSemantica.objects.create(
+            nombre='Prueba cuantización', consulta='laptop', resultados_relevantes=[ids[7]]
+        )
+        salida = io.StringIO()
+        
+        with patch(
+            'apps.busqueda.management.commands.reporte_cuantizacion.CacheEmbeddingsConsulta.obtener_embedding',
+            return_value={'embedding': corpus[7]}
+        ):
+            call_command(
+                'reporte_cuantizacion', modelo='text-embedding-3-small', candidatos=5,
+                repeticiones=1, stdout=salida
+            )
+        
+        texto = salida.getvalue()
+        for cuantizacion in ('float32', 'float16', 'int8'):
+            self.assertIn(cuantizacion, texto)
+        self.assertIn('1.0000', texto)
+
+
+class IndiceIvfTestCase(TestCase):
+    """Tests del particionado IVF del índice en memoria (centroides de k-means)"""
+    
+    def setUp(self):
+        import tempfile
+        import shutil
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        configuracion = override_settings(SEMANTIC_IVF=True, SEMANTIC_IVF_DIR=self.directorio)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+    
+    def _grupos(self, grupos=8, por_grupo=100, dimensiones=64, semilla=1):
+        """Vectores agrupados alrededor de centros bien separados"""
+        import numpy as np
+        rng = np.random.default_rng(semilla)
+        centros = rng.standard_normal((grupos, dimensiones)).astype(np.float32) * 4
+        vectores = np.concatenate([
+            centro + rng.standard_normal((por_grupo, dimensiones)).astype(np.float32)
+            for centro in centros
+        ])
+        return centros, vectores
+    
+    def test_actualizacion_incremental_es_media_acumulada(self):
+        import numpy as np
+        from .semantic.ivf import actualizar_centroides
+        centroides = np.array([[1, 0], [0, 1]], dtype=np.float32)
+        conteos = np.array([3, 1])
+        
+        nuevos_centroides, nuevos_conteos = actualizar_centroides(
+            centroides, conteos, np.array([[0.6, 0.8]], dtype=np.float32)
+        )
+        
+        np.testing.assert_allclose(nuevos_centroides[1], [0.3, 0.9], rtol=1e-6)
+        np.testing.assert_allclose(nuevos_centroides[0], [1, 0])
+        self.assertEqual(nuevos_conteos.tolist(), [3, 2])
+    
+    def test_nprobe_recorre_solo_las_listas_cercanas(self):
+        from .semantic.vector_index import IndiceVectorial
+        centros, vectores = self._grupos()
+        indice = IndiceVectorial('modelo-test', dimensiones=64)
+        indice.construir(list(enumerate(vectores, start=1)))
+        exactos = [indice.buscar(centro, k=10) for centro in centros]
+        
+        indice.configurar_ivf(centros)
+        
+        self.assertEqual(indice.listas_ivf, 8)
+        self.assertEqual([indice.buscar(centro, k=10, nprobe=1) for centro in centros], exactos)
+        # Con una lista, los resultados salen solo del grupo de la consulta
+        self.assertTrue(all(1 <= envio_id <= 100 for envio_id, _ in indice.buscar(centros[0], k=10, nprobe=1)))
+    
+    def test_sin_candidatos_suficientes_recorre_todas_las_listas(self):
+        from .semantic.vector_index import IndiceVectorial
+        centros, vectores = self._grupos()
+        indice = IndiceVectorial('modelo-test', dimensiones=64)
+        indice.construir(list(enumerate(vectores, start=1)))
+        indice.configurar_ivf(centros)
+        
+        # Envíos permitidos solo del último grupo, consulta cercana al primero
+        resultados = indice.buscar(centros[0], k=5, envios_ids=range(701, 801), nprobe=1)
+        
+        self.assertEqual(len(resultados), 5)
+        self.assertTrue(all(701 <= envio_id <= 800 for envio_id, _ in resultados))
+    
+    def test_actualizaciones_incrementales_asignan_lista(self):
+        from .semantic.vector_index import IndiceVectorial
+        centros, vectores = self._grupos()
+        indice = IndiceVectorial('modelo-test', dimensiones=64, cuantizacion='int8')
+        indice.construir(list(enumerate(vectores[:400], start=1)))
+        indice.configurar_ivf(centros)
+        
+        indice.agregar_o_actualizar(9999, centros[6])
+        indice.eliminar(1)
+        indice.compactar()
+        
+        self.assertEqual(indice.buscar(centros[6], k=1, nprobe=1)[0][0], 9999)
+    
+    def test_comando_entrena_incrementa_y_el_indice_carga_los_centroides(self):
+        import io
+        import numpy as np
+        from django.core.management import call_command
+        from .repositories import embedding_repository
+        from .semantic.ivf import cargar_centroides
+        from .semantic.vector_index import obtener_indice
+        comprador = Usuario.objects.create(
+            username='comprador_ivf',
+            correo='comprador_ivf@test.com',
+            cedula='0978123456',
+            nombre='Comprador IVF',
+            rol=4,
+            is_active=True
+        )
+        _, vectores = self._grupos(grupos=4, por_grupo=10, dimensiones=1536)
+        
+        def crear(i, vector):
+            envio = Envio.objects.create(
+                hawb=f'IVF{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            embedding_repository.crear_o_actualizar_embedding(envio, f'envio {i}', vector, 'text-embedding-3-small')
+        
+        for i, vector in enumerate(vectores[:36]):
+            crear(i, vector)
+        call_command('entrenar_ivf', modelo='text-embedding-3-small', listas=4, evaluar=True, stdout=io.StringIO())
+        datos = cargar_centroides('text-embedding-3-small')
+        self.assertEqual(datos['centroides'].shape, (4, 1536))
+        self.assertEqual(int(datos['conteos'].sum()), 36)
+        
+        for i, vector in enumerate(vectores[36:], start=36):
+            crear(i, vector)
+        call_command('entrenar_ivf', modelo='text-embedding-3-small', incremental=True, stdout=io.StringIO())
+        self.assertEqual(int(cargar_centroides('text-embedding-3-small')['conteos'].sum()), 40)
+        
+        indice = obtener_indice('text-embedding-3-small')
+        self.assertEqual(indice.listas_ivf, 4)
+        self.assertEqual(indice.estadisticas()['ivf_listas'], 4)
+        self.assertTrue(np.isfinite(indice.buscar(vectores[0], k=3)[0][1]))
+
+
+class FiltroMetadatosIndiceTestCase(TestCase):
+    """Tests de las columnas de metadatos del índice en memoria (filtros como máscaras)"""
+    
+    def setUp(self):
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        self.admin = Usuario.objects.create(
+            username='admin_metadatos',
+            correo='admin_metadatos@test.com',
+            cedula='1711111111',
+            nombre='Admin Metadatos',
+            rol=1,
+            is_active=True
+        )
+        self.compradores = [
+            Usuario.objects.create(
+                username=f'comprador_metadatos{i}',
+                correo=f'comprador_metadatos{i}@test.com',
+                cedula=f'17222222{i:02d}',
+                nombre=f'Comprador Metadatos {i}',
+                rol=4,
+                ciudad=ciudad,
+                is_active=True
+            )
+            for i, ciudad in enumerate(['Quito', 'Guayaquil', 'San Antonio de Quito'])
+        ]
+    
+    def _indice_manual(self):
+        """Índice de 6 filas con metadatos de tres meses consecutivos"""
+        from datetime import datetime
+        from .semantic.vector_index import IndiceVectorial
+        indice = IndiceVectorial('modelo-test', dimensiones=2)
+        indice.CAPACIDAD_INICIAL = 2
+        indice.construir([(i, [1, i / 10]) for i in range(1, 7)])
+        fecha = lambda mes: timezone.make_aware(datetime(2025, mes, 15))
+        indice.actualizar_metadatos([
+            (1, fecha(1), 'pendiente', 10, 'Quito', 1, 1, Decimal('1.5'), Decimal('10')),
+            (2, fecha(2), 'entregado', 10, 'Quito', 5, 3, Decimal('4.0'), Decimal('80')),
+            (3, fecha(3), 'pendiente', 20, 'Guayaquil', 2, 2, Decimal('2.0'), Decimal('30')),
+            (4, fecha(1), 'entregado', 20, 'Guayaquil', 8, 4, Decimal('9.0'), Decimal('200')),
+            (5, fecha(2), 'pendiente', 30, None, 3, 1, Decimal('1.0'), Decimal('15')),
+        ])
+        return indice, fecha
+    
+    def _ids(self, indice, **filtros):
+        from .semantic.vector_index import FiltroMetadatos
+        return sorted(e for e, _ in indice.buscar([1, 0], k=10, filtro=FiltroMetadatos(**filtros)))
+    
+    def test_mascaras_por_columna(self):
+        from datetime import timedelta
+        indice, fecha = self._indice_manual()
+        
+        self.assertEqual(self._ids(indice), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self._ids(indice, estado='pendiente'), [1, 3, 5])
+        self.assertEqual(self._ids(indice, estado='cancelado'), [])
+        self.assertEqual(self._ids(indice, comprador_id=20), [3, 4])
+        self.assertEqual(self._ids(indice, ciudad='QUITO'), [1, 2])
+        self.assertEqual(self._ids(indice, lineas_minima=3), [2, 4])
+        self.assertEqual(self._ids(indice, cantidad_minima=3), [2, 4, 5])
+        self.assertEqual(self._ids(indice, peso_minimo=2, valor_maximo=100), [2, 3])
+        self.assertEqual(self._ids(indice, sin_permisos=True), [])
+        self.assertEqual(
+            self._ids(indice, fecha_desde=fecha(2) - timedelta(days=1), fecha_hasta=fecha(3)), [2, 3, 5]
+        )
+        self.assertEqual(self._ids(indice, fecha_hasta=fecha(1)), [1, 4])
+        self.assertEqual(self._ids(indice, estado='entregado', fecha_desde=fecha(2)), [2])
+    
+    def test_filas_sin_metadatos_solo_sin_filtro(self):
+        """La fila 6 no tiene metadatos: aparece sin filtros y se excluye con cualquier filtro"""
+        from .semantic.vector_index import FiltroMetadatos
+        indice, _ = self._indice_manual()
+        self.assertEqual(indice.contar(), 6)
+        self.assertEqual(indice.contar(FiltroMetadatos(peso_minimo=0)), 5)
+        self.assertEqual(indice.estadisticas()['filas_con_metadatos'], 5)
+        self.assertEqual(indice.ids_sin_metadatos(), [6])
+        # Validada en SQL por el llamador, entra aunque la máscara de columnas no la cubra
+        self.assertEqual(self._ids(indice, estado='entregado', ids_validados={6}), [2, 4, 6])
+    
+    def test_filas_sin_metadatos_se_validan_en_sql(self):
+        """Una fila sin metadatos no desaparece del alcance de su comprador"""
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice
+        from .services import BusquedaSemanticaService
+        modelo = 'text-embedding-3-small'
+        propio, ajeno = [
+            Envio.objects.create(
+                hawb=f'META95{i}', comprador=comprador, peso_total=Decimal('1.0'),
+                cantidad_total=1, valor_total=Decimal('10.0')
+            )
+            for i, comprador in enumerate(self.compradores[:2])
+        ]
+        for envio in (propio, ajeno):
+            embedding_repository.crear_o_actualizar_embedding(envio, 'envio', [1.0] * 1536, modelo)
+        indice = obtener_indice(modelo)
+        with indice._lock:
+            indice._metadatos['con_metadatos'][:indice._total_filas] = False
+        
+        usuario = self.compradores[0]
+        filtro = BusquedaSemanticaService._validar_filas_sin_metadatos(
+            BusquedaSemanticaService._filtro_indice(usuario, {}),
+            indice,
+            BusquedaSemanticaService._obtener_envios_filtrados(usuario, {})
+        )
+        self.assertEqual([e for e, _ in indice.buscar([1.0] * 1536, k=10, filtro=filtro)], [propio.id])
+    
+    def test_envio_reasignado_no_se_hidrata_para_el_comprador_anterior(self):
+        """Con el índice aún sin sincronizar, la hidratación aplica los permisos de la BD"""
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice, FiltroMetadatos
+        from .services import BusquedaSemanticaService, get_semantic_cache
+        get_semantic_cache().clear()
+        modelo = 'text-embedding-3-small'
+        envio = Envio.objects.create(
+            hawb='META960', comprador=self.compradores[0], peso_total=Decimal('1.0'),
+            cantidad_total=1, valor_total=Decimal('10.0')
+        )
+        embedding_repository.crear_o_actualizar_embedding(envio, 'envio', [1.0] + [0.0] * 1535, modelo)
+        obtener_indice(modelo)
+        # update() no dispara signals: el índice conserva el comprador anterior
+        Envio.objects.filter(id=envio.id).update(comprador=self.compradores[1])
+        self.assertEqual(
+            obtener_indice(modelo).contar(FiltroMetadatos(comprador_id=self.compradores[0].id)), 1
+        )
+        
+        with patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding', return_value={
+            'embedding': [1.0] + [0.0] * 1535, 'tokens': 1, 'costo': 0.0, 'modelo': modelo
+        }):
+            anterior = BusquedaSemanticaService.buscar('envio', self.compradores[0], modelo_embedding=modelo)
+        
+        self.assertEqual(anterior['resultados'], [])
+        self.assertEqual(anterior['totalEncontrados'], 0)
+    
+    def test_crecer_y_compactar_conservan_metadatos(self):
+        from .semantic.vector_index import FiltroMetadatos
+        indice, fecha = self._indice_manual()
+        indice.agregar_o_actualizar(7, [1, 0.7])
+        indice.actualizar_metadatos([(7, fecha(3), 'pendiente', 10, 'Quito', 1, 1, 1, 1)])
+        self.assertEqual(self._ids(indice, fecha_desde=fecha(3)), [3, 7])
+        
+        indice.eliminar(3)
+        indice.compactar()
+        self.assertEqual(self._ids(indice, fecha_desde=fecha(3)), [7])
+        self.assertEqual(self._ids(indice, ciudad='quito', estado='pendiente'), [1, 7])
+        self.assertEqual(indice.contar(FiltroMetadatos(comprador_id=20)), 1)
+    
+    def test_mismo_resultado_que_el_queryset(self):
+        """El filtro del índice selecciona los mismos envíos que _obtener_envios_filtrados"""
+        import numpy as np
+        from datetime import datetime
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice
+        from .services import BusquedaSemanticaService
+        modelo = 'text-embedding-3-small'
+        rng = np.random.default_rng(3)
+        estados = ['pendiente', 'en_transito', 'entregado']
+        for i in range(24):
+            envio = Envio.objects.create(
+                hawb=f'META{i:03d}',
+                comprador=self.compradores[i % 3],
+                peso_total=Decimal('1.0') + i,
+                cantidad_total=1 + i % 5,
+                valor_total=Decimal('10.0') * (i + 1),
+                estado=estados[i % 3],
+                fecha_emision=timezone.make_aware(datetime(2025, 1 + i % 6, 1 + i))
+            )
+            for j in range(i % 4):
+                Producto.objects.create(
+                    envio=envio,
+                    descripcion=f'Producto {j}',
+                    peso=Decimal('1.0'),
+                    cantidad=1,
+                    valor=Decimal('10.0'),
+                    categoria='otros'
+                )
+            embedding_repository.crear_o_actualizar_embedding(envio, f'envio {i}', rng.standard_normal(1536), modelo)
+        
+        indice = obtener_indice(modelo)
+        casos = [
+            (self.admin, {}),
+            (self.compradores[1], {}),
+            (self.admin, {'estado': 'entregado', 'ciudadDestino': 'quito'}),
+            (self.admin, {'fechaDesde': '2025-02-01', 'fechaHasta': '2025-04-30'}),
+            (self.admin, {'fechaDesde': '2025-03-04', 'fechaHasta': '2025-03-04'}),
+            (self.compradores[0], {'cantidad_lineas_minima': 2, 'peso_minimo': 5}),
+            (self.admin, {'cantidad_productos_minima': 3, 'valor_maximo': 150}),
+        ]
+        for usuario, filtros in casos:
+            with self.subTest(usuario=usuario.username, filtros=filtros):
+                esperados = sorted(
+                    BusquedaSemanticaService._obtener_envios_filtrados(usuario, filtros).values_list('id', flat=True)
+                )
+                filtro = BusquedaSemanticaService._filtro_indice(usuario, filtros)
+                encontrados = sorted(e for e, _ in indice.buscar(rng.standard_normal(1536), k=50, filtro=filtro))
+                self.assertEqual(encontrados, esperados)
+                self.assertEqual(indice.contar(filtro), len(esperados))
+    
+    def test_signals_refrescan_metadatos(self):
+        """Cambiar el estado o agregar productos actualiza las columnas del índice cargado"""
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice, FiltroMetadatos
+        modelo = 'text-embedding-3-small'
+        envio = Envio.objects.create(
+            hawb='META900',
+            comprador=self.compradores[0],
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0'),
+            estado='pendiente'
+        )
+        embedding_repository.crear_o_actualizar_embedding(envio, 'envio', [1.0] * 1536, modelo)
+        indice = obtener_indice(modelo)
+        self.assertEqual(indice.contar(FiltroMetadatos(estado='pendiente')), 1)
+        self.assertEqual(indice.contar(FiltroMetadatos(lineas_minima=1)), 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(
+                envio=envio,
+                descripcion='Producto nuevo',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='otros'
+            )
+        self.assertEqual(indice.contar(FiltroMetadatos(lineas_minima=1)), 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            envio.estado = 'entregado'
+            envio.save()
+        self.assertEqual(indice.contar(FiltroMetadatos(estado='pendiente')), 0)
+        self.assertEqual(indice.contar(FiltroMetadatos(estado='entregado')), 1)
+
+
+class SnapshotIndiceTestCase(TestCase):
+    """Tests del snapshot en disco del índice vectorial (np.memmap copy-on-write)"""
+    
+    def setUp(self):
+        import tempfile
+        import shutil
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        configuracion = override_settings(SEMANTIC_SNAPSHOT=True, SEMANTIC_SNAPSHOT_DIR=self.directorio)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+    
+    def _indice(self, cuantizacion='int8', filas=300):
+        import numpy as np
+        from .semantic.vector_index import IndiceVectorial
+        rng = np.random.default_rng(4)
+        indice = IndiceVectorial('modelo-test', dimensiones=64, dimensiones_reducidas=16, cuantizacion=cuantizacion)
+        indice.construir([(i, rng.standard_normal(64)) for i in range(1, filas + 1)])
+        indice.actualizar_metadatos([
+            (i, timezone.now(), 'pendiente' if i % 2 else 'entregado', i % 5, 'Quito', 1, 1, 1, 1)
+            for i in range(1, filas + 1)
+        ])
+        indice.eliminar(7)
+        return indice
+    
+    def test_snapshot_restaura_mapeado_con_mismos_resultados(self):
+        import numpy as np
+        from .semantic.snapshot import guardar_snapshot, cargar_snapshot
+        from .semantic.vector_index import IndiceVectorial, FiltroMetadatos
+        indice = self._indice()
+        marca = timezone.now()
+        cabecera = guardar_snapshot(indice, marca, holgura=0.5)
+        self.assertEqual(cabecera['filas'], 299)
+        self.assertEqual(set(cabecera['mapeados']), {'matriz', 'matriz_reducida'})
+        
+        restaurado = IndiceVectorial('modelo-test', dimensiones=64, dimensiones_reducidas=16, cuantizacion='int8')
+        self.assertEqual(cargar_snapshot(restaurado), marca)
+        self.assertTrue(restaurado.mapeado)
+        self.assertFalse(restaurado.contiene(7))
+        
+        consultas = np.random.default_rng(9).standard_normal((5, 64))
+        for consulta in consultas:
+            self.assertEqual(restaurado.buscar(consulta, k=10), indice.buscar(consulta, k=10))
+        filtro = FiltroMetadatos(estado='entregado', comprador_id=2)
+        self.assertEqual(restaurado.contar(filtro), indice.contar(filtro))
+    
+    def test_altas_en_la_holgura_no_modifican_el_archivo(self):
+        import os
+        import numpy as np
+        from .semantic.snapshot import guardar_snapshot, cargar_snapshot, directorio_snapshot
+        from .semantic.vector_index import IndiceVectorial
+        cabecera = guardar_snapshot(self._indice(cuantizacion='float32'), timezone.now())
+        restaurado = IndiceVectorial('modelo-test', dimensiones=64, dimensiones_reducidas=16)
+        cargar_snapshot(restaurado)
+        
+        nuevo = np.ones(64, dtype=np.float32)
+        restaurado.agregar_o_actualizar(5000, nuevo)
+        restaurado.agregar_o_actualizar(1, -nuevo)
+        self.assertTrue(restaurado.mapeado)
+        self.assertEqual(restaurado.buscar(nuevo, k=1)[0][0], 5000)
+        self.assertEqual(restaurado.buscar(-nuevo, k=1)[0][0], 1)
+        
+        en_disco = np.load(os.path.join(directorio_snapshot('modelo-test'), cabecera['archivos']['matriz']))
+        self.assertEqual(np.count_nonzero(en_disco[299:]), 0)
+        self.assertFalse(np.allclose(en_disco[0], -nuevo / np.linalg.norm(nuevo)))
+    
+    def test_snapshot_incompatible_se_ignora(self):
+        from .semantic.snapshot import guardar_snapshot, cargar_snapshot
+        from .semantic.vector_index import IndiceVectorial
+        guardar_snapshot(self._indice(), timezone.now())
+        self.assertIsNone(cargar_snapshot(IndiceVectorial('modelo-test', dimensiones=64, cuantizacion='int8')))
+        self.assertIsNone(cargar_snapshot(IndiceVectorial('otro-modelo', dimensiones=64)))
+    
+    def test_comando_y_arranque_reaplican_cambios_posteriores(self):
+        import io
+        import numpy as np
+        from django.core.management import call_command
+        from .repositories import embedding_repository
+        from .semantic.vector_index import obtener_indice, FiltroMetadatos
+        modelo = 'text-embedding-3-small'
+        comprador = Usuario.objects.create(
+            username='comprador_snapshot',
+            correo='comprador_snapshot@test.com',
+            cedula='1733333333',
+            nombre='Comprador Snapshot',
+            rol=4,
+            is_active=True
+        )
+        rng = np.random.default_rng(2)
+        
+        def crear(hawb):
+            envio = Envio.objects.create(
+                hawb=hawb,
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            Producto.objects.create(
+                envio=envio,
+                descripcion='Producto de prueba',
+                peso=Decimal('1.0'),
+                cantidad=1,
+                valor=Decimal('10.0'),
+                categoria='otros'
+            )
+            vector = rng.standard_normal(1536)
+            embedding_repository.crear_o_actualizar_embedding(envio, hawb, vector, modelo)
+            return envio, vector
+        
+        envios = [crear(f'SNAP{i:03d}') for i in range(5)]
+        salida = io.StringIO()
+        call_command('snapshot_indice', modelo=modelo, verificar=True, stdout=salida)
+        self.assertIn('Verificado', salida.getvalue())
+        
+        nuevo, vector_nuevo = crear('SNAP999')
+        envios[0][0].delete()
+        
+        indice = obtener_indice(modelo)
+        self.assertTrue(indice.mapeado)
+        self.assertEqual(indice.total_activos, 5)
+        self.assertEqual(indice.buscar(vector_nuevo, k=1)[0][0], nuevo.id)
+        self.assertFalse(indice.contiene(envios[0][0].id))
+        self.assertEqual(indice.contar(FiltroMetadatos(comprador_id=comprador.id)), 5)
+        
+        # Refresco incremental: snapshot vigente más cambios, sin recorrer la tabla completa
+        from datetime import datetime
+        from .semantic.snapshot import leer_cabecera
+        marca_anterior = datetime.fromisoformat(leer_cabecera(modelo)['marca'])
+        with patch.object(
+            embedding_repository, 'contar_vectores_activos', side_effect=AssertionError('recorrido completo')
+        ):
+            call_command('snapshot_indice', modelo=modelo, incremental=True, verificar=True, stdout=salida)
+        cabecera = leer_cabecera(modelo)
+        self.assertGreater(datetime.fromisoformat(cabecera['marca']), marca_anterior)
+        self.assertEqual(cabecera['filas'], 5)
+
+
+class PrecargaGunicornTestCase(TestCase):
+    """Tests de la precarga del índice en el maestro de gunicorn y de la medición de memoria"""
+    
+    def setUp(self):
+        from .semantic.vector_index import reiniciar_indices
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+    
+    def test_precarga_carga_indices_y_cierra_conexiones(self):
+        import gc
+        from .repositories import embedding_repository
+        from .semantic.precarga import precargar
+        from .semantic.registro_modelos import RegistroModelos
+        from .semantic.vector_index import _indices
+        RegistroModelos.invalidar()
+        self.addCleanup(RegistroModelos.invalidar)
+        self.addCleanup(gc.unfreeze)
+        comprador = Usuario.objects.create(
+            username='comprador_precarga',
+            correo='comprador_precarga@test.com',
+            cedula='1744444444',
+            nombre='Comprador Precarga',
+            rol=4,
+            is_active=True
+        )
+        envio = Envio.objects.create(
+            hawb='PRE001',
+            comprador=comprador,
+            peso_total=Decimal('1.0'),
+            cantidad_total=1,
+            valor_total=Decimal('10.0')
+        )
+        embedding_repository.crear_o_actualizar_embedding(envio, 'texto', [1.0] * 1536, 'text-embedding-3-small')
+        
+        with patch('apps.busqueda.semantic.precarga.connections') as conexiones:
+            cargados = precargar()
+        
+        conexiones.close_all.assert_called_once()
+        self.assertEqual([c['modelo'] for c in cargados], ['text-embedding-3-small'])
+        self.assertTrue(_indices['text-embedding-3-small'].contiene(envio.id))
+    
+    def test_despues_del_fork_descarta_conexion_y_cliente_heredados(self):
+        from .semantic.embedding_service import OpenAIClient
+        from .semantic.precarga import verificar_despues_de_fork
+        self.addCleanup(OpenAIClient.reset)
+        conexion = MagicMock(connection=object())
+        OpenAIClient._instance = object()
+        
+        with patch('apps.busqueda.semantic.precarga.connections') as conexiones:
+            conexiones.all.return_value = [conexion]
+            heredado = verificar_despues_de_fork()
+        
+        self.assertEqual(heredado, {'conexion_bd': True, 'cliente_openai': True})
+        self.assertIsNone(conexion.connection)
+        self.assertIsNone(OpenAIClient._instance)
+        
+        with patch('apps.busqueda.semantic.precarga.connections') as conexiones:
+            conexiones.all.return_value = [MagicMock(connection=None)]
+            self.assertEqual(verificar_despues_de_fork(), {'conexion_bd': False, 'cliente_openai': False})
+    
+    def test_comando_memoria_guarda_y_compara(self):
+        import io
+        import os
+        import json
+        import sys
+        import shutil
+        import tempfile
+        from django.core.management import call_command
+        if not sys.platform.startswith('linux'):
+            self.skipTest('PSS solo disponible en Linux')
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        ruta = os.path.join(directorio, 'memoria.json')
+        
+        call_command('memoria_workers', pid=os.getpid(), guardar=ruta, stdout=io.StringIO())
+        with open(ruta, encoding='utf-8') as f:
+            medicion = json.load(f)
+        self.assertEqual(medicion['procesos'][0]['pid'], os.getpid())
+        self.assertGreater(medicion['totales']['pss_mb'], 0)
+        
+        salida = io.StringIO()
+        call_command('memoria_workers', pid=os.getpid(), comparar=ruta, stdout=salida)
+        self.assertIn('PSS total', salida.getvalue())
+
+
+class StreamingBusquedaTestCase(TestCase):
+    """Tests de la búsqueda semántica en streaming (NDJSON)"""
+    
+    def setUp(self):
+        from .repositories import embedding_repository
+        from .services import get_semantic_cache
+        from .semantic.vector_index import reiniciar_indices
+        import numpy as np
+        get_semantic_cache().clear()
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
+        self.admin = Usuario.objects.create(
+            username='admin_stream',
+            correo='admin_stream@test.com',
+            cedula='0956781234',
+            nombre='Admin Streaming',
+            rol=1,
+            is_active=True
+        )
+        comprador = Usuario.objects.create(
+            username='comprador_stream',
+            correo='comprador_stream@test.com',
+            cedula='0956781235',
+            nombre='Comprador Streaming',
+            rol=4,
+            is_active=True
+        )
+        self.envios = []
+        for i in range(5):
+            envio = Envio.objects.create(
+                hawb=f'STR{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = np.zeros(1536, dtype=np.float32)
+            vector[0] = 1.0
+            vector[1] = i * 0.2
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+            self.envios.append(envio)
+        
+        parche = patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding', return_value={
+            'embedding': [1.0] + [0.0] * 1535, 'tokens': 3, 'costo': 0.0001, 'modelo': 'text-embedding-3-small'
+        })
+        parche.start()
+        self.addCleanup(parche.stop)
+    
+    @override_settings(SEMANTIC_STREAM_LOTE=2)
+    def test_orden_de_eventos_e_historial_al_final(self):
+        from .models import EmbeddingBusqueda
+        eventos = BusquedaSemanticaService.buscar_streaming(
+            'envio', self.admin, limite=5, modelo_embedding='text-embedding-3-small'
+        )
+        
+        ranking = next(eventos)
+        self.assertEqual(ranking['tipo'], 'ranking')
+        self.assertEqual(len(ranking['resultados']), 5)
+        self.assertEqual(ranking['resultados'][0]['envioId'], self.envios[0].id)
+        
+        resto = []
+        for evento in eventos:
+            if evento['tipo'] == 'fin':
+                # El historial se escribe después de enviar los resultados
+                self.assertFalse(EmbeddingBusqueda.objects.exists())
+            resto.append(evento)
+        
+        self.assertEqual([e['tipo'] for e in resto], ['resultado'] * 5 + ['fin', 'historial'])
+        self.assertEqual(
+            [e['resultado']['envio']['id'] for e in resto[:5]],
+            [r['envioId'] for r in ranking['resultados']]
+        )
+        self.assertEqual([e['posicion'] for e in resto[:5]], list(range(5)))
+        self.assertEqual(resto[5]['totalEncontrados'], 5)
+        self.assertEqual(resto[5]['tokensUtilizados'], 3)
+        busqueda = EmbeddingBusqueda.objects.get(id=resto[6]['busquedaId'])
+        self.assertEqual(busqueda.resultados_encontrados, 5)
+    
+    def test_envio_eliminado_tras_el_ranking_se_descarta(self):
+        eventos = BusquedaSemanticaService.buscar_streaming(
+            'envio', self.admin, limite=3, modelo_embedding='text-embedding-3-small'
+        )
+        ranking = next(eventos)
+        eliminado = ranking['resultados'][1]['envioId']
+        Envio.objects.filter(id=eliminado).delete()
+        
+        resto = list(eventos)
+        
+        self.assertIn({'tipo': 'descartado', 'envioId': eliminado}, resto)
+        self.assertEqual([e['posicion'] for e in resto if e['tipo'] == 'resultado'], [0, 1])
+        self.assertEqual(next(e for e in resto if e['tipo'] == 'fin')['totalEncontrados'], 2)
+    
+    def test_endpoint_responde_ndjson(self):
+        import json
+        cliente = APIClient()
+        cliente.force_authenticate(user=self.admin)
+        
+        sin_texto = cliente.post('/api/v1/busqueda/semantica/stream/', {}, format='json')
+        self.assertEqual(sin_texto.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        respuesta = cliente.post(
+            '/api/v1/busqueda/semantica/stream/',
+            {'texto': 'envio', 'limite': 2, 'modeloEmbedding': 'text-embedding-3-small'},
+            format='json'
+        )
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(respuesta['X-Accel-Buffering'], 'no')
+        lineas = b''.join(respuesta.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(
+            [json.loads(linea)['tipo'] for linea in lineas],
+            ['ranking', 'resultado', 'resultado', 'fin', 'historial']
+        )
+    
+    def test_error_del_ranking_responde_antes_del_stream(self):
+        """Un error al generar el embedding se devuelve con su código, no dentro de un 200"""
+        from apps.core.exceptions import OpenAINotConfiguredError
+        cliente = APIClient()
+        cliente.force_authenticate(user=self.admin)
+        
+        with patch('apps.busqueda.services.CacheEmbeddingsConsulta.obtener_embedding',
+                   side_effect=OpenAINotConfiguredError()):
+            respuesta = cliente.post(
+                '/api/v1/busqueda/semantica/stream/',
+                {'texto': 'envio', 'modeloEmbedding': 'text-embedding-3-small'},
+                format='json'
+            )
+        
+        self.assertEqual(respuesta.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(respuesta.streaming)
+        self.assertIn('OPENAI_API_KEY', respuesta.json()['error'])
+    
+    @override_settings(SEMANTIC_STREAM_LOTE=2)
+    def test_textos_indexados_se_leen_una_vez(self):
+        from .repositories import embedding_repository
+        with patch.object(embedding_repository, 'obtener_textos_indexados',
+                          wraps=embedding_repository.obtener_textos_indexados) as espia:
+            eventos = BusquedaSemanticaService.buscar_streaming(
+                'envio', self.admin, limite=5, modelo_embedding='text-embedding-3-small'
+            )
+            llamadas_ranking = espia.call_count
+            resultados = [e for e in eventos if e['tipo'] == 'resultado']
+        
+        self.assertEqual(len(resultados), 5)
+        self.assertEqual(espia.call_count, llamadas_ranking)
+        self.assertEqual(resultados[0]['resultado']['textoIndexado'], 'envio 0')
+
+
+class BusquedaLoteTestCase(TestCase):
+    """Tests de la búsqueda semántica por lotes (embedding por lotes y ranking matriz-matriz)"""
+    
+    def setUp(self):
+        from .repositories import embedding_repository
+        from .services import get_semantic_cache
+        from .semantic.vector_index import reiniciar_indices
+        import numpy as np
+        get_semantic_cache().clear()
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
+        self.admin = Usuario.objects.create(
+            username='admin_lote',
+            correo='admin_lote@test.com',
+            cedula='0967812345',
+            nombre='Admin Lote',
+            rol=1,
+            is_active=True
+        )
+        comprador = Usuario.objects.create(
+            username='comprador_lote',
+            correo='comprador_lote@test.com',
+            cedula='0967812346',
+            nombre='Comprador Lote',
+            rol=4,
+            is_active=True
+        )
+        rng = np.random.default_rng(3)
+        for i in range(8):
+            envio = Envio.objects.create(
+                hawb=f'LOT{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = rng.standard_normal(1536).astype(np.float32)
+            vector[0] = 40.0
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+    
+    @staticmethod
+    def _vector_texto(texto):
+        import numpy as np
+        vector = np.random.default_rng(sum(texto.encode('utf-8'))).standard_normal(1536).astype(np.float32)
+        vector[0] = 40.0
+        return vector
+    
+    def _generar_lote(self, textos, modelo=None):
+        return {
+            'embeddings': [self._vector_texto(texto) for texto in textos],
+            'tokens': 4 * len(textos),
+            'costo': 0.0001 * len(textos),
+            'modelo': modelo
+        }
+    
+    def test_indice_buscar_lote_igual_a_buscar(self):
+        import itertools
+        import numpy as np
+        from .semantic.vector_index import IndiceVectorial, FiltroMetadatos
+        rng = np.random.default_rng(0)
+        pares = [(i, rng.standard_normal(64).astype(np.float32)) for i in range(1, 301)]
+        consultas = rng.standard_normal((6, 64)).astype(np.float32)
+        consultas[2] = 0
+        
+        # Bloques de 32 filas: el top-k acumulado cruza varios bloques
+        for opciones, bloque in itertools.product(
+            ({}, {'cuantizacion': 'int8'}, {'dimensiones_reducidas': 16}), (IndiceVectorial.FILAS_POR_BLOQUE, 32)
+        ):
+            indice = IndiceVectorial('m', 64, **opciones)
+            indice.FILAS_POR_BLOQUE = bloque
+            indice.construir(pares, total=len(pares))
+            indice.actualizar_metadatos([
+                (i, None, 'pendiente' if i % 2 else 'entregado', 1, None, 1, 1, 1.0, 1.0) for i, _ in pares
+            ])
+            filtro = FiltroMetadatos(estado='pendiente')
+            lote = indice.buscar_lote(consultas, k=10, candidatos_reducidos=50, filtro=filtro)
+            
+            self.assertEqual(len(lote), 6)
+            self.assertEqual(lote[2], [])
+            for consulta, resultado in zip(consultas, lote):
+                esperado = indice.buscar(consulta, k=10, candidatos_reducidos=50, filtro=filtro)
+                self.assertEqual([e for e, _ in resultado], [e for e, _ in esperado], opciones)
+                np.testing.assert_allclose([s for _, s in resultado], [s for _, s in esperado], rtol=1e-5)
+    
+    def test_embeddings_por_lote_consultan_el_cache_primero(self):
+        from .services import CacheEmbeddingsConsulta
+        from .semantic import EmbeddingService
+        with patch.object(EmbeddingService, 'generar_embedding', return_value={
+            'embedding': self._vector_texto('laptop'), 'tokens': 2, 'costo': 0.0, 'modelo': 'text-embedding-3-small'
+        }):
+            CacheEmbeddingsConsulta.obtener_embedding('laptop', 'text-embedding-3-small')
+        
+        with patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=self._generar_lote) as mock_lote:
+            resultado = CacheEmbeddingsConsulta.obtener_embeddings(
+                ['laptop', 'celular', 'zapatos', 'celular'], 'text-embedding-3-small'
+            )
+            repetido = CacheEmbeddingsConsulta.obtener_embeddings(['zapatos'], 'text-embedding-3-small')
+        
+        mock_lote.assert_called_once_with(['celular', 'zapatos'], 'text-embedding-3-small')
+        self.assertEqual(resultado['desde_cache'], 1)
+        self.assertEqual(resultado['tokens'], 8)
+        self.assertEqual(len(resultado['embeddings']), 4)
+        self.assertEqual(repetido['desde_cache'], 1)
+        self.assertEqual(repetido['tokens'], 0)
+    
+    def test_buscar_lote_igual_a_consultas_individuales(self):
+        from .repositories import embedding_repository
+        from .semantic import EmbeddingService
+        consultas = ['envio pendiente', 'paquete grande', 'envio pendiente', 'laptop']
+        
+        with patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=self._generar_lote) as mock_lote, \
+                patch.object(embedding_repository, 'obtener_vectores_por_envios',
+                             wraps=embedding_repository.obtener_vectores_por_envios) as espia:
+            lote = BusquedaSemanticaService.buscar_lote(
+                consultas, self.admin, limite=5, modelo_embedding='text-embedding-3-small'
+            )
+        
+        mock_lote.assert_called_once()
+        espia.assert_called_once()
+        self.assertEqual(lote['totalConsultas'], 4)
+        self.assertTrue(all(r['totalEncontrados'] > 0 for r in lote['resultados']))
+        self.assertEqual(lote['tokensUtilizados'], 12)
+        self.assertEqual([r['consulta'] for r in lote['resultados']], consultas)
+        # Los embeddings quedaron en caché: buscar() no llama a OpenAI
+        with patch.object(EmbeddingService, 'generar_embedding') as mock_individual:
+            for consulta, resultado in zip(consultas, lote['resultados']):
+                individual = BusquedaSemanticaService.buscar(
+                    consulta, self.admin, limite=5, modelo_embedding='text-embedding-3-small', usar_cache=False
+                )
+                self.assertEqual(
+                    [r['envio']['hawb'] for r in resultado['resultados']],
+                    [r['envio']['hawb'] for r in individual['resultados']]
+                )
+        mock_individual.assert_not_called()
+    
+    @override_settings(SEMANTIC_LOTE_MAX_CONSULTAS=3)
+    def test_endpoint_valida_y_responde_por_consulta(self):
+        from .semantic import EmbeddingService
+        cliente = APIClient()
+        cliente.force_authenticate(user=self.admin)
+        url = '/api/v1/busqueda/semantica/lote/'
+        
+        self.assertEqual(cliente.post(url, {'consultas': []}, format='json').status_code, 400)
+        self.assertEqual(cliente.post(url, {'consultas': ['a', ' ']}, format='json').status_code, 400)
+        self.assertEqual(cliente.post(url, {'consultas': ['a', 'b', 'c', 'd']}, format='json').status_code, 400)
+        
+        with patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=self._generar_lote):
+            respuesta = cliente.post(
+                url,
+                {'consultas': ['envio', 'paquete'], 'limite': 3, 'modeloEmbedding': 'text-embedding-3-small'},
+                format='json'
+            )
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['consulta'] for r in respuesta.data['resultados']], ['envio', 'paquete'])
+        self.assertTrue(all(r['totalEncontrados'] <= 3 for r in respuesta.data['resultados']))
+    
+    def test_throttle_cobra_cada_consulta_del_lote(self):
+        from django.core.cache import cache
+        from apps.core.throttling import BusquedaSemanticaRateThrottle
+        from .semantic import EmbeddingService
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cliente = APIClient()
+        cliente.force_authenticate(user=self.admin)
+        url = '/api/v1/busqueda/semantica/lote/'
+        
+        with patch.object(BusquedaSemanticaRateThrottle, 'rate', '5/minute'), \
+                patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=self._generar_lote):
+            primero = cliente.post(url, {'consultas': ['a', 'b', 'c', 'd']}, format='json')
+            segundo = cliente.post(url, {'consultas': ['e', 'f']}, format='json')
+            tercero = cliente.post(url, {'consultas': ['g']}, format='json')
+        
+        self.assertEqual(primero.status_code, status.HTTP_200_OK)
+        self.assertEqual(segundo.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(tercero.status_code, status.HTTP_200_OK)
+    
+    def test_pruebas_controladas_usan_buscar_lote(self):
+        from apps.metricas.models import PruebaControladaSemantica
+        from apps.metricas.services import MetricaSemanticaService
+        from .semantic import EmbeddingService
+        envio = Envio.objects.get(hawb='LOT000')
+        pruebas = [
+            PruebaControladaSemantica.objects.create(
+                nombre=f'Prueba {i}', consulta=consulta, resultados_relevantes=[envio.id], creado_por=self.admin
+            )
+            for i, consulta in enumerate(['envio pendiente', 'paquete grande', 'laptop'])
+        ]
+        
+        with patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=self._generar_lote) as mock_lote, \
+                patch.object(BusquedaSemanticaService, 'buscar', side_effect=AssertionError) as mock_buscar, \
+                override_settings(SEMANTIC_LOTE_MAX_CONSULTAS=2):
+            ejecuciones = MetricaSemanticaService.ejecutar_pruebas_controladas(pruebas, self.admin, limite=8)
+        
+        self.assertEqual(mock_lote.call_count, 2)
+        mock_buscar.assert_not_called()
+        self.assertEqual([e['error'] for e in ejecuciones], [None, None, None])
+        metricas = [e['metrica'] for e in ejecuciones]
+        self.assertEqual([m.prueba_controlada_id for m in metricas], [p.id for p in pruebas])
+        for metrica in metricas:
+            ids = [r['envio']['id'] for r in metrica.resultados_rankeados]
+            self.assertTrue(ids)
+            self.assertEqual(metrica.total_relevantes_encontrados, int(envio.id in ids))
+        self.assertTrue(all(m.busqueda_semantica_id is None for m in metricas))
+    
+    def test_lote_fallido_se_reintenta_por_prueba(self):
+        from apps.metricas.models import MetricaSemantica, PruebaControladaSemantica
+        from apps.metricas.services import MetricaSemanticaService
+        from .semantic import EmbeddingService
+        envio = Envio.objects.get(hawb='LOT000')
+        pruebas = [
+            PruebaControladaSemantica.objects.create(
+                nombre=f'Prueba {i}', consulta=consulta, resultados_relevantes=[envio.id], creado_por=self.admin
+            )
+            for i, consulta in enumerate(['envio pendiente', 'consulta rota', 'laptop'])
+        ]
+        
+        def generar_lote(textos, *args, **kwargs):
+            if 'consulta rota' in textos:
+                raise RuntimeError('sin conexión')
+            return self._generar_lote(textos, *args, **kwargs)
+        
+        with patch.object(EmbeddingService, 'generar_embeddings_lote', side_effect=generar_lote):
+            ejecuciones = MetricaSemanticaService.ejecutar_pruebas_controladas(pruebas, self.admin, limite=8)
+        
+        self.assertEqual([e['prueba'] for e in ejecuciones], pruebas)
+        self.assertIsNone(ejecuciones[0]['error'])
+        self.assertIsInstance(ejecuciones[1]['error'], RuntimeError)
+        self.assertIsNone(ejecuciones[1]['metrica'])
+        self.assertIsNone(ejecuciones[2]['error'])
+        self.assertEqual(
+            set(MetricaSemantica.objects.values_list('prueba_controlada_id', flat=True)),
+            {pruebas[0].id, pruebas[2].id}
+        )
+
+
+class EnviosSimilaresTestCase(TestCase):
+    """Tests de la búsqueda 'más como este' con el vector guardado del envío"""
+    
+    def setUp(self):
+        from .repositories import embedding_repository
+        from .semantic.vector_index import reiniciar_indices
+        import numpy as np
+        reiniciar_indices()
+        self.addCleanup(reiniciar_indices)
+        
+        self.admin = Usuario.objects.create(
+            username='admin_similares',
+            correo='admin_similares@test.com',
+            cedula='0978123456',
+            nombre='Admin Similares',
+            rol=1,
+            is_active=True
+        )
+        self.compradores = [
+            Usuario.objects.create(
+                username=f'comprador_similares{i}',
+                correo=f'comprador_similares{i}@test.com',
+                cedula=f'097812345{i + 7}',
+                nombre=f'Comprador Similares {i}',
+                rol=4,
+                is_active=True
+            )
+            for i in range(2)
+        ]
+        # SIM000 es la referencia; SIM001..SIM005 se alejan de ella progresivamente
+        self.envios = []
+        for i in range(6):
+            envio = Envio.objects.create(
+                hawb=f'SIM{i:03d}',
+                comprador=self.compradores[i % 2],
+                estado='entregado' if i == 1 else 'pendiente',
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            vector = np.zeros(1536, dtype=np.float32)
+            vector[0] = 1.0
+            vector[1] = i * 0.3
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+            self.envios.append(envio)
+    
+    def _hawbs(self, resultado):
+        return [r['envio']['hawb'] for r in resultado['resultados']]
+    
+    def test_similares_por_hawb_sin_llamar_a_openai(self):
+        from .semantic import EmbeddingService
+        with patch.object(EmbeddingService, 'generar_embedding') as mock_openai:
+            resultado = BusquedaSemanticaService.buscar_similares(
+                self.admin, hawb='SIM000', limite=3, modelo_embedding='text-embedding-3-small'
+            )
+        
+        mock_openai.assert_not_called()
+        self.assertEqual(resultado['envioReferencia'], {'id': self.envios[0].id, 'hawb': 'SIM000'})
+        self.assertEqual(self._hawbs(resultado), ['SIM001', 'SIM002', 'SIM003'])
+        similitudes = [r['cosineSimilarity'] for r in resultado['resultados']]
+        self.assertEqual(similitudes, sorted(similitudes, reverse=True))
+    
+    def test_permisos_y_filtros(self):
+        from apps.core.exceptions import EnvioNoEncontradoError
+        comprador = self.compradores[0]
+        
+        propios = BusquedaSemanticaService.buscar_similares(
+            comprador, envio_id=self.envios[0].id, modelo_embedding='text-embedding-3-small'
+        )
+        self.assertEqual(self._hawbs(propios), ['SIM002', 'SIM004'])
+        
+        with self.assertRaises(EnvioNoEncontradoError):
+            BusquedaSemanticaService.buscar_similares(
+                comprador, hawb='SIM001', modelo_embedding='text-embedding-3-small'
+            )
+        
+        pendientes = BusquedaSemanticaService.buscar_similares(
+            self.admin, hawb='SIM000', filtros={'estado': 'pendiente'}, limite=2,
+            modelo_embedding='text-embedding-3-small'
+        )
+        self.assertEqual(self._hawbs(pendientes), ['SIM002', 'SIM003'])
+    
+    @override_settings(SEMANTIC_INDEX_EN_MEMORIA=False)
+    def test_sin_indice_en_memoria_mismo_orden(self):
+        resultado = BusquedaSemanticaService.buscar_similares(
+            self.admin, hawb='SIM000', limite=4, modelo_embedding='text-embedding-3-small'
+        )
+        self.assertEqual(self._hawbs(resultado), ['SIM001', 'SIM002', 'SIM003', 'SIM004'])
+    
+    @override_settings(SEMANTIC_INDEX_EN_MEMORIA=False)
+    def test_sin_indice_recorre_todo_el_alcance_por_bloques(self):
+        from functools import partial
+        from .semantic.similitud_promedio import bloques_normalizados
+        # Bloques de 2 filas: el top-k acumulado debe cruzar varios bloques
+        with patch('apps.busqueda.services.bloques_normalizados', partial(bloques_normalizados, filas=2)):
+            resultado = BusquedaSemanticaService.buscar_similares(
+                self.admin, hawb='SIM005', limite=2, modelo_embedding='text-embedding-3-small'
+            )
+            propios = BusquedaSemanticaService.buscar_similares(
+                self.compradores[0], envio_id=self.envios[0].id, modelo_embedding='text-embedding-3-small'
+            )
+        
+        self.assertEqual(self._hawbs(resultado), ['SIM004', 'SIM003'])
+        self.assertEqual(self._hawbs(propios), ['SIM002', 'SIM004'])
+    
+    def test_filas_sin_metadatos_siguen_entre_los_similares(self):
+        from .semantic.vector_index import obtener_indice
+        comprador = self.compradores[0]
+        indice = obtener_indice('text-embedding-3-small')
+        # Vectores ya indexados cuyos metadatos aún no se refrescaron
+        with indice._lock:
+            indice._metadatos['con_metadatos'][:indice._total_filas] = False
+        
+        resultado = BusquedaSemanticaService.buscar_similares(
+            comprador, envio_id=self.envios[0].id, modelo_embedding='text-embedding-3-small'
+        )
+        self.assertEqual(self._hawbs(resultado), ['SIM002', 'SIM004'])
+    
+    def test_hidratacion_respeta_permisos_actuales(self):
+        comprador = self.compradores[0]
+        BusquedaSemanticaService.buscar_similares(
+            comprador, envio_id=self.envios[0].id, modelo_embedding='text-embedding-3-small'
+        )
+        # Cambio sin señales: los metadatos del índice en memoria quedan desactualizados
+        Envio.objects.filter(id=self.envios[2].id).update(comprador=self.compradores[1])
+        
+        resultado = BusquedaSemanticaService.buscar_similares(
+            comprador, envio_id=self.envios[0].id, modelo_embedding='text-embedding-3-small'
+        )
+        self.assertEqual(self._hawbs(resultado), ['SIM004'])
+        
+    def test_endpoint(self):
+        cliente = APIClient()
+        cliente.force_authenticate(user=self.admin)
+        url = '/api/v1/busqueda/semantica/similares/'
+        
+        self.assertEqual(cliente.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(cliente.get(url, {'envioId': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(cliente.get(url, {'hawb': 'NOEXISTE'}).status_code, status.HTTP_404_NOT_FOUND)
+        
+        respuesta = cliente.get(url, {'hawb': 'SIM000', 'limite': 2, 'modeloEmbedding': 'text-embedding-3-small'})
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._hawbs(respuesta.data), ['SIM001', 'SIM002'])
+
+
+class SimilitudPromedioTestCase(TestCase):
+    """Tests de cosine_similarity_avg calculado por bloques sin la matriz n×n"""
+    
+    @staticmethod
+    def _promedio_ingenuo(vectores):
+        import numpy as np
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        validos = normas[:, 0] > 0
+        normalizados = vectores / np.where(normas == 0, 1, normas)
+        similitudes = normalizados @ normalizados[validos].T
+        total = int(validos.sum())
+        return (similitudes.sum(axis=1) - validos) / (total - 1)
+    
+    def test_bloques_igual_a_matriz_completa(self):
+        import numpy as np
+        from .semantic.similitud_promedio import (
+            bloques_normalizados, acumular_suma, similitud_promedio, similitud_promedio_exacta
+        )
+        rng = np.random.default_rng(5)
+        vectores = rng.standard_normal((53, 32)).astype(np.float32) + 0.5
+        vectores[10] = 0
+        pares = list(enumerate(vectores))
+        
+        suma, total = acumular_suma(bloques_normalizados(pares, filas=7))
+        calculados = np.concatenate([
+            similitud_promedio(matriz, suma, total) for _, matriz in bloques_normalizados(pares, filas=7)
+        ])
+        
+        self.assertEqual(total, 52)
+        np.testing.assert_allclose(calculados, self._promedio_ingenuo(vectores), atol=1e-5)
+        self.assertEqual(calculados[10], 0)
+        _, muestra = next(bloques_normalizados(pares[:4], filas=4))
+        np.testing.assert_allclose(
+            similitud_promedio_exacta(muestra, bloques_normalizados(pares, filas=7), total),
+            calculados[:4],
+            atol=1e-5
+        )
+    
+    def test_comando_actualiza_la_columna(self):
+        import io
+        import numpy as np
+        from django.core.management import call_command
+        from .models import EnvioEmbedding
+        from .repositories import embedding_repository
+        comprador = Usuario.objects.create(
+            username='comprador_simprom',
+            correo='comprador_simprom@test.com',
+            cedula='0989123456',
+            nombre='Comprador Similitud Promedio',
+            rol=4,
+            is_active=True
+        )
+        rng = np.random.default_rng(8)
+        vectores = rng.standard_normal((6, 1536)).astype(np.float32) + 0.2
+        for i, vector in enumerate(vectores):
+            envio = Envio.objects.create(
+                hawb=f'SPR{i:03d}',
+                comprador=comprador,
+                peso_total=Decimal('1.0'),
+                cantidad_total=1,
+                valor_total=Decimal('10.0')
+            )
+            embedding_repository.crear_o_actualizar_embedding(
+                envio, f'envio {i}', vector, 'text-embedding-3-small'
+            )
+        
+        salida = io.StringIO()
+        call_command(
+            'calcular_similitud_promedio', '--modelo', 'text-embedding-3-small',
+            '--bloque', '4', '--verificar', '3', stdout=salida
+        )
+        
+        guardados = np.array([
+            EnvioEmbedding.objects.get(envio__hawb=f'SPR{i:03d}').cosine_similarity_avg for i in range(6)
+        ])
+        np.testing.assert_allclose(guardados, self._promedio_ingenuo(vectores), atol=1e-5)
+        self.assertIn('6 embeddings actualizados', salida.getvalue())
+        self.assertIn('Verificado con 3 filas', salida.getvalue())
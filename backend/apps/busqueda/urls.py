@@ -13,6 +13,9 @@ router.register(r'', BusquedaViewSet, basename='busqueda')
 # DELETE /api/busqueda/limpiar_historial/ - Limpiar historial
 # GET /api/busqueda/estadisticas/ - Estadísticas
 # POST /api/busqueda/semantica/ - Búsqueda semántica (principal)
+# POST /api/busqueda/semantica/stream/ - Búsqueda semántica en streaming (NDJSON)
+# POST /api/busqueda/semantica/lote/ - Varias consultas semánticas en una solicitud
+# GET /api/busqueda/semantica/similares/?envioId=|hawb= - Envíos similares a uno dado
 # GET /api/busqueda/semantica/sugerencias/ - Sugerencias semánticas
 # GET /api/busqueda/semantica/historial/ - Historial semántico
 # POST /api/busqueda/semantica/historial/ - Guardar en historial semántico
@@ -24,8 +24,9 @@ def get_openai_client():
 
 def generar_texto_envio(envio) -> str:
     """
-    Genera texto descriptivo del envío para indexación semántica
-    Versión mejorada con más contexto y repetición de información importante
+    Genera texto descriptivo del envío para indexación semántica.
+    Delegado a TextProcessor para que ambos flujos indexen el mismo texto
+    (sin estado, fechas, peso ni valor, que se aplican como filtros).
     
     Args:
         envio: Instancia del modelo Envio
@@ -33,74 +34,8 @@ def generar_texto_envio(envio) -> str:
     Returns:
         str: Texto descriptivo completo del envío
     """
-    # Información principal (ordenada por importancia semántica)
-    estado_display = envio.get_estado_display()
-    partes = [
-        # Estado y código identificador primero (más importante para búsqueda)
-        f"Envió {envio.hawb} con estado {estado_display}",
-        f"Estado del envío: {estado_display}",
-        f"Código HAWB: {envio.hawb}",
-        f"Comprador: {envio.comprador.nombre}",
-    ]
-    
-    # Información de ubicación (importante para búsquedas geográficas)
-    if envio.comprador.ciudad:
-        partes.append(f"Ciudad destino: {envio.comprador.ciudad}")
-        partes.append(f"Ubicación: {envio.comprador.ciudad}")  # Repetir para más peso
-    if envio.comprador.provincia:
-        partes.append(f"Provincia: {envio.comprador.provincia}")
-    if envio.comprador.canton:
-        partes.append(f"Cantón: {envio.comprador.canton}")
-    
-    # Información temporal
-    fecha_str = envio.fecha_emision.strftime('%Y-%m-%d')
-    partes.append(f"Fecha de emisión: {fecha_str}")
-    partes.append(f"Fecha: {fecha_str}")  # Variación para mejor matching
-    
-    # Información de envío
-    partes.extend([
-        f"Peso total: {envio.peso_total} kg",
-        f"Peso: {envio.peso_total} kg",
-        f"Valor total: ${envio.valor_total}",
-        f"Valor: ${envio.valor_total}",
-        f"Costo del servicio: ${envio.costo_servicio}",
-    ])
-    
-    # Información de productos (muy importante para búsquedas de productos)
-    productos = envio.productos.all()
-    if productos.exists():
-        descripciones = []
-        categorias = []
-        nombres_productos = []
-        
-        for producto in productos[:5]:  # Limitar a 5 productos
-            descripciones.append(producto.descripcion)
-            if producto.categoria not in categorias:
-                categorias.append(producto.get_categoria_display())
-            if hasattr(producto, 'nombre') and producto.nombre:
-                nombres_productos.append(producto.nombre)
-        
-        if descripciones:
-            partes.append(f"Productos incluidos: {', '.join(descripciones)}")
-            partes.append(f"Contiene: {', '.join(descripciones[:3])}")  # Versión corta
-        
-        if categorias:
-            partes.append(f"Categorías de productos: {', '.join(categorias)}")
-        
-        partes.append(f"Cantidad total de productos: {envio.cantidad_total}")
-    
-    # Observaciones (pueden contener información relevante)
-    if envio.observaciones:
-        partes.append(f"Observaciones: {envio.observaciones}")
-        partes.append(envio.observaciones)  # También como texto libre
-    
-    # Resumen descriptivo al final
-    resumen = f"Envío {envio.hawb} {estado_display} para {envio.comprador.nombre}"
-    if envio.comprador.ciudad:
-        resumen += f" en {envio.comprador.ciudad}"
-    partes.append(resumen)
-    
-    return " | ".join(partes)
+    from .semantic.text_processor import TextProcessor
+    return TextProcessor.generar_texto_envio(envio)
 
 
 def generar_embedding(texto: str, modelo: str = None) -> Dict[str, Any]:
@@ -143,10 +78,11 @@ def generar_embedding(texto: str, modelo: str = None) -> Dict[str, Any]:
         response = client.embeddings.create(
             model=modelo,
             input=texto,
-            encoding_format="float"
+            encoding_format="base64"
         )
         
-        embedding = response.data[0].embedding
+        from .semantic.embedding_service import EmbeddingService
+        embedding = EmbeddingService.decodificar_embedding(response.data[0].embedding)
         tokens_utilizados = response.usage.total_tokens
         
         # Calcular costo: (tokens / 1000) * precio_por_1k
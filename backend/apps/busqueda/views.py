@@ -5,8 +5,11 @@ Usan la arquitectura en capas (servicios y repositorios)
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action, throttle_classes
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
@@ -100,6 +103,13 @@ class BusquedaViewSet(viewsets.ModelViewSet):
                 description='Tipo de búsqueda: general, usuarios, envios, productos',
                 enum=['general', 'usuarios', 'envios', 'productos'],
             ),
+            OpenApiParameter(
+                name='limite',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description='Máximo de resultados por sección (máx. 100). El total de coincidencias se informa en `totales`',
+            ),
         ],
         tags=['busqueda'],
         responses={
@@ -110,6 +120,8 @@ class BusquedaViewSet(viewsets.ModelViewSet):
                         'query': 'ejemplo',
                         'tipo': 'general',
                         'total_resultados': 5,
+                        'totales': {'usuarios': 0, 'envios': 0, 'productos': 0},
+                        'limite': 20,
                         'resultados': {
                             'usuarios': [],
                             'envios': [],
@@ -135,10 +147,16 @@ class BusquedaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        try:
+            limite = min(max(int(request.query_params.get('limite', 0)), 0), 100) or None
+        except ValueError:
+            limite = None
+        
         resultado = BusquedaTradicionalService.buscar(
             query=query,
             tipo=tipo,
-            usuario=request.user
+            usuario=request.user,
+            limite=limite
         )
         
         return Response(resultado)
@@ -294,6 +312,196 @@ class BusquedaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @extend_schema(
+        summary="Búsqueda semántica en streaming",
+        description=(
+            "Igual que /semantica/ pero responde en NDJSON (una línea JSON por evento): "
+            "primero el ranking (ids y scores), luego cada resultado a medida que se hidrata, "
+            "un evento 'fin' con totales y costo, y por último el id del historial."
+        ),
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'texto': {'type': 'string', 'description': 'Consulta en lenguaje natural'},
+                    'limite': {'type': 'integer', 'default': 20},
+                    'modeloEmbedding': {'type': 'string'},
+                    'metricaOrdenamiento': {'type': 'string', 'default': 'score_combinado'},
+                    'filtrosAdicionales': {'type': 'object'},
+                },
+                'required': ['texto']
+            }
+        },
+        responses={200: OpenApiTypes.STR},
+        tags=['busqueda'],
+    )
+    @action(detail=False, methods=['post'], url_path='semantica/stream', throttle_classes=[BusquedaSemanticaRateThrottle])
+    def busqueda_semantica_stream(self, request):
+        """
+        Búsqueda semántica con respuesta incremental (application/x-ndjson).
+        El embedding y el ranking se calculan antes de responder: sus errores devuelven
+        el código HTTP correspondiente. Solo se transmiten la hidratación y la
+        serialización; los errores posteriores al inicio de la respuesta se emiten como
+        evento {'tipo': 'error'}.
+        """
+        consulta_texto = request.data.get('texto', '').strip()
+        if not consulta_texto:
+            return Response(
+                {'error': 'El campo "texto" es requerido'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            eventos = BusquedaSemanticaService.buscar_streaming(
+                consulta=consulta_texto,
+                usuario=request.user,
+                filtros=request.data.get('filtrosAdicionales', {}),
+                limite=request.data.get('limite', 20),
+                modelo_embedding=request.data.get('modeloEmbedding'),
+                metrica_ordenamiento=request.data.get('metricaOrdenamiento', 'score_combinado')
+            )
+        except Exception as e:
+            return Response(
+                {'error': f'Error procesando búsqueda semántica: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        def lineas():
+            try:
+                for evento in eventos:
+                    yield json.dumps(evento, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            except Exception as e:
+                yield json.dumps(
+                    {'tipo': 'error', 'error': f'Error procesando búsqueda semántica: {str(e)}'},
+                    ensure_ascii=False
+                ) + '\n'
+        
+        respuesta = StreamingHttpResponse(lineas(), content_type='application/x-ndjson')
+        respuesta['Cache-Control'] = 'no-cache'
+        respuesta['X-Accel-Buffering'] = 'no'  # nginx no debe acumular la respuesta
+        return respuesta
+
+    @extend_schema(
+        summary="Búsqueda semántica por lotes",
+        description=(
+            "Ejecuta varias consultas en una sola solicitud: los embeddings se generan en una "
+            "llamada a OpenAI (después de consultar el caché) y, con el índice en memoria, se "
+            "puntúan contra la matriz de candidatos con un solo producto matriz-matriz. "
+            "Pensado para suites de evaluación e integraciones; no escribe historial."
+        ),
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'consultas': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'description': 'Consultas en lenguaje natural (máximo SEMANTIC_LOTE_MAX_CONSULTAS)'
+                    },
+                    'limite': {'type': 'integer', 'default': 10},
+                    'modeloEmbedding': {'type': 'string'},
+                    'metricaOrdenamiento': {'type': 'string', 'default': 'score_combinado'},
+                    'filtrosAdicionales': {'type': 'object'},
+                },
+                'required': ['consultas']
+            }
+        },
+        responses={200: OpenApiTypes.OBJECT},
+        tags=['busqueda'],
+    )
+    @action(detail=False, methods=['post'], url_path='semantica/lote', throttle_classes=[BusquedaSemanticaRateThrottle])
+    def busqueda_semantica_lote(self, request):
+        """Varias consultas semánticas con un embedding por lotes y un ranking matriz-matriz"""
+        consultas = request.data.get('consultas')
+        if not isinstance(consultas, list) or not consultas:
+            return Response(
+                {'error': 'El campo "consultas" debe ser una lista no vacía'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        consultas = [str(consulta).strip() for consulta in consultas]
+        if not all(consultas):
+            return Response(
+                {'error': 'Las consultas no pueden estar vacías'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        maximo = getattr(settings, 'SEMANTIC_LOTE_MAX_CONSULTAS', 100)
+        if len(consultas) > maximo:
+            return Response(
+                {'error': f'Máximo {maximo} consultas por lote'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            resultado = BusquedaSemanticaService.buscar_lote(
+                consultas=consultas,
+                usuario=request.user,
+                filtros=request.data.get('filtrosAdicionales', {}),
+                limite=request.data.get('limite', 10),
+                modelo_embedding=request.data.get('modeloEmbedding'),
+                metrica_ordenamiento=request.data.get('metricaOrdenamiento', 'score_combinado')
+            )
+            return Response(resultado)
+        except Exception as e:
+            return Response(
+                {'error': f'Error procesando búsqueda semántica por lotes: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @extend_schema(
+        summary="Envíos similares a uno dado",
+        description=(
+            "Búsqueda 'más como este': usa el embedding guardado del envío (por envioId o hawb) "
+            "como consulta contra el índice vectorial. No llama a OpenAI ni escribe historial. "
+            "Respeta los permisos del usuario y acepta los filtros de la búsqueda semántica."
+        ),
+        parameters=[
+            OpenApiParameter(name='envioId', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='hawb', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='limite', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY, required=False,
+                             description='Número de envíos similares (default: 10, máximo: 100)'),
+            OpenApiParameter(name='modeloEmbedding', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='estado', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='ciudadDestino', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='fechaDesde', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name='fechaHasta', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+        tags=['busqueda'],
+    )
+    @action(detail=False, methods=['get'], url_path='semantica/similares', throttle_classes=[BusquedaRateThrottle])
+    def envios_similares(self, request):
+        """Envíos similares por vector guardado (sin costo de OpenAI)"""
+        envio_id = request.query_params.get('envioId')
+        hawb = request.query_params.get('hawb', '').strip()
+        if not envio_id and not hawb:
+            return Response(
+                {'error': 'Indique "envioId" o "hawb"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            envio_id = int(envio_id) if envio_id else None
+            limite = min(max(int(request.query_params.get('limite', 10)), 1), 100)
+        except ValueError:
+            return Response(
+                {'error': '"envioId" y "limite" deben ser enteros'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        filtros = {
+            clave: request.query_params[clave]
+            for clave in ('estado', 'ciudadDestino', 'fechaDesde', 'fechaHasta')
+            if request.query_params.get(clave)
+        }
+        resultado = BusquedaSemanticaService.buscar_similares(
+            usuario=request.user,
+            envio_id=envio_id,
+            hawb=hawb or None,
+            filtros=filtros,
+            limite=limite,
+            modelo_embedding=request.query_params.get('modeloEmbedding')
+        )
+        return Response(resultado)
+
     @extend_schema(
         summary="Obtener sugerencias para búsqueda semántica",
         description="Retorna sugerencias predefinidas para mejorar las búsquedas semánticas",
@@ -3,12 +3,37 @@ Base Repository - Clase base para todos los repositorios del sistema
 Implementa el patrón Repository para abstraer el acceso a datos
 """
 from abc import ABC, abstractmethod
-from typing import List, Optional, TypeVar, Generic, Dict, Any
-from django.db.models import Model, QuerySet
+from typing import List, Optional, TypeVar, Generic, Dict, Any, Tuple
+from django.db import connection
+from django.db.models import Model, QuerySet, Q, F, Lookup
+from django.db.models.functions import Greatest
+from django.db.models.lookups import IContains
 
 T = TypeVar('T', bound=Model)
 
 
+class ContieneSinMayusculas(Lookup):
+    """
+    Contiene el término sin distinguir mayúsculas. En PostgreSQL compila a
+    columna ILIKE '%termino%' sobre la columna sin transformar: icontains genera
+    UPPER(columna::text) LIKE UPPER(...), que no puede usar los índices GIN
+    gin_trgm_ops de las migraciones *_indices_trigram. En otros motores equivale a icontains.
+    """
+    lookup_name = 'contiene_sin_mayusculas'
+    prepare_rhs = False  # El término llega como texto y se escapa en get_db_prep_lookup
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [f'%{connection.ops.prep_for_like_query(value)}%']
+
+    def as_sql(self, compiler, connection):
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', [*lhs_params, *rhs_params]
+
+
 class BaseRepository(ABC, Generic[T]):
     """
     Repositorio base con operaciones CRUD comunes.
@@ -264,6 +289,58 @@ class BaseRepository(ABC, Generic[T]):
         count, _ = queryset.delete()
         return count
     
+    # ==================== BÚSQUEDA POR TEXTO ====================
+    
+    @property
+    def campos_busqueda(self) -> List[str]:
+        """
+        Campos de texto para buscar (con índice pg_trgm en PostgreSQL).
+        Sobrescribir en repositorios concretos.
+        """
+        return []
+    
+    def _filtro_busqueda(self, termino: str) -> Q:
+        """OR de ContieneSinMayusculas (ILIKE en PostgreSQL) sobre campos_busqueda"""
+        filtro = Q()
+        for campo in self.campos_busqueda:
+            filtro |= Q(ContieneSinMayusculas(F(campo), termino))
+        return filtro
+    
+    def rankear_por_similitud(
+        self,
+        queryset: QuerySet,
+        termino: str,
+        limite: int = 20
+    ) -> Tuple[List[T], int]:
+        """
+        Ordena y limita los resultados de una búsqueda por texto.
+        
+        En PostgreSQL ordena por similitud de trigramas (pg_trgm) contra el mejor
+        de los campos_busqueda; en otros motores, por id descendente.
+        
+        Args:
+            queryset: QuerySet ya filtrado por término y permisos
+            termino: Término de búsqueda
+            limite: Cantidad máxima de resultados
+            
+        Returns:
+            Tupla (resultados, total de coincidencias)
+        """
+        total = queryset.count()
+        if total == 0:
+            return [], 0
+        
+        if connection.vendor == 'postgresql' and self.campos_busqueda:
+            from django.contrib.postgres.search import TrigramWordSimilarity
+            similitudes = [TrigramWordSimilarity(termino, campo) for campo in self.campos_busqueda]
+            queryset = queryset.annotate(
+                similitud=Greatest(*similitudes) if len(similitudes) > 1 else similitudes[0]
+            ).order_by('-similitud', '-id')
+        else:
+            queryset = queryset.order_by('-id')
+        
+        return list(queryset[:limite]), total
+    
     # ==================== MÉTODOS DE UTILIDAD ====================
     
     def obtener_o_crear(self, defaults: Dict[str, Any] = None, **kwargs) -> tuple:
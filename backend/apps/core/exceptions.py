@@ -130,6 +130,18 @@ class OpenAIServiceError(ExternalServiceError):
         super().__init__("OpenAI", message)
 
 
+class OpenAITransientError(OpenAIServiceError):
+    """Excepción para fallas transitorias de OpenAI (conexión, timeout, 5xx): se puede reintentar"""
+    
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OpenAIRateLimitError(OpenAITransientError):
+    """Excepción cuando OpenAI responde 429 (límite de solicitudes o tokens)"""
+
+
 class ConfigurationError(DomainException):
     """Excepción para errores de configuración"""
     
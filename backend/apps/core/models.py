@@ -37,7 +37,7 @@ class SoftDeleteModel(models.Model):
 
     def delete(self, using=None, keep_parents=False):
         self.deleted_at = timezone.now()
-        self.save(update_fields=['deleted_at'])
+        self.save(update_fields=['deleted_at', *self._campos_auto_now()])
 
     def hard_delete(self):
         """Elimina el registro físicamente de la BD."""
@@ -46,7 +46,14 @@ class SoftDeleteModel(models.Model):
     def restore(self):
         """Restaura un registro eliminado lógicamente."""
         self.deleted_at = None
-        self.save(update_fields=['deleted_at'])
+        self.save(update_fields=['deleted_at', *self._campos_auto_now()])
+
+    def _campos_auto_now(self):
+        """
+        Campos auto_now del modelo: con update_fields Django solo los escribe si se
+        listan, y la sincronización incremental detecta los cambios por esas fechas
+        """
+        return [campo.name for campo in self._meta.concrete_fields if getattr(campo, 'auto_now', False)]
 
     @property
     def esta_eliminado(self):
@@ -2,6 +2,8 @@
 Clases de Rate Limiting (Throttling) personalizadas para UBApp.
 Proporciona control granular sobre las tasas de solicitud por tipo de endpoint.
 """
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
 
 
@@ -11,7 +13,7 @@ class BusquedaRateThrottle(UserRateThrottle):
     Limita a 60 búsquedas por minuto por usuario autenticado.
     """
     scope = 'busqueda'
-    cache = 'throttle' if 'throttle' in __import__('django.conf', fromlist=['settings']).settings.CACHES else 'default'
+    cache = caches['throttle' if 'throttle' in settings.CACHES else 'default']
 
 
 class BusquedaSemanticaRateThrottle(UserRateThrottle):
@@ -23,6 +25,37 @@ class BusquedaSemanticaRateThrottle(UserRateThrottle):
     scope = 'busqueda_semantica'
     rate = '30/minute'
 
+    def allow_request(self, request, view):
+        """
+        Cobra una unidad por consulta: una solicitud a /semantica/lote/ con N consultas
+        cuenta como N búsquedas. Un lote más grande que la tasa agota la ventana completa
+        (de lo contrario nunca se admitiría).
+        """
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.history = self.cache.get(self.key, [])
+        self.now = self.timer()
+        while self.history and self.history[-1] <= self.now - self.duration:
+            self.history.pop()
+
+        costo = min(self.costo(request), self.num_requests)
+        if len(self.history) + costo > self.num_requests:
+            return self.throttle_failure()
+        self.history[:0] = [self.now] * costo
+        self.cache.set(self.key, self.history, self.duration)
+        return True
+
+    @staticmethod
+    def costo(request) -> int:
+        """Cantidad de consultas de la solicitud (1 salvo en búsquedas por lotes)"""
+        consultas = request.data.get('consultas') if hasattr(request.data, 'get') else None
+        return max(1, len(consultas)) if isinstance(consultas, list) else 1
+
 
 class LoginRateThrottle(AnonRateThrottle):
     """
@@ -69,18 +69,23 @@ class Command(BaseCommand):
         if total == 0:
             self.stdout.write(self.style.WARNING('No hay pruebas controladas activas. Cree algunas en el dashboard.'))
             return
-        self.stdout.write(self.style.NOTICE(f'Ejecutando {total} prueba(s) controlada(s)...'))
-        for i, prueba in enumerate(pruebas, 1):
-            try:
-                MetricaSemanticaService.ejecutar_prueba_controlada(
-                    prueba=prueba,
-                    usuario=usuario,
-                    filtros=None,
-                    limite=limite
-                )
+        self.stdout.write(self.style.NOTICE(f'Ejecutando {total} prueba(s) controlada(s) por lotes...'))
+        # Búsquedas por lotes (embeddings y ranking matriz-matriz); un lote que falla
+        # se reintenta de a una prueba, así cada error queda asociado a su prueba
+        ejecuciones = MetricaSemanticaService.ejecutar_pruebas_controladas(
+            pruebas=pruebas,
+            usuario=usuario,
+            filtros=None,
+            limite=limite
+        )
+        for i, ejecucion in enumerate(ejecuciones, 1):
+            prueba = ejecucion['prueba']
+            if ejecucion['error'] is None:
                 self.stdout.write(f'  [{i}/{total}] OK: {prueba.nombre or prueba.consulta[:50]}')
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'  [{i}/{total}] Error: {prueba.nombre or prueba.consulta[:50]} - {e}'))
+            else:
+                self.stdout.write(self.style.ERROR(
+                    f"  [{i}/{total}] Error: {prueba.nombre or prueba.consulta[:50]} - {ejecucion['error']}"
+                ))
         self.stdout.write(self.style.SUCCESS(f'Pruebas ejecutadas: {total}.\n'))
 
     def _imprimir_tabla(self, reporte):
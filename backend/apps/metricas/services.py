@@ -7,6 +7,7 @@ import time
 import logging
 import psutil
 import os
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 
@@ -55,14 +56,31 @@ class MetricaSemanticaService(BaseService):
         Returns:
             MetricaSemantica: Instancia con métricas calculadas
         """
+        return MetricaSemanticaService._crear_metrica(
+            consulta=busqueda_semantica.consulta,
+            resultados=busqueda_semantica.resultados_json or [],
+            resultados_relevantes=resultados_relevantes,
+            modelo_embedding=busqueda_semantica.modelo_utilizado,
+            logs_pipeline=logs_pipeline,
+            busqueda_semantica=busqueda_semantica
+        )
+    
+    @staticmethod
+    def _crear_metrica(
+        consulta: str,
+        resultados: List[Dict],
+        resultados_relevantes: List[int],
+        modelo_embedding: str,
+        logs_pipeline: Dict[str, Any] = None,
+        busqueda_semantica: EmbeddingBusqueda = None,
+        prueba_controlada: PruebaControladaSemantica = None
+    ) -> MetricaSemantica:
+        """Calcula MRR, nDCG@10 y Precision@5 de un ranking y guarda la métrica"""
         tiempo_inicio = time.time()
         
-        # Obtener resultados rankeados de la búsqueda
-        resultados_json = busqueda_semantica.resultados_json or []
-        
         # Calcular métricas
         metricas = calcular_metricas_completas(
-            resultados_rankeados=resultados_json,
+            resultados_rankeados=resultados,
             resultados_relevantes=resultados_relevantes
         )
         
@@ -71,8 +89,9 @@ class MetricaSemanticaService(BaseService):
         # Crear registro de métrica
         metrica = metrica_semantica_repository.crear(
             busqueda_semantica=busqueda_semantica,
-            consulta=busqueda_semantica.consulta,
-            resultados_rankeados=resultados_json,
+            prueba_controlada=prueba_controlada,
+            consulta=consulta,
+            resultados_rankeados=resultados,
             mrr=metricas['mrr'],
             ndcg_10=metricas['ndcg_10'],
             precision_5=metricas['precision_5'],
@@ -80,14 +99,17 @@ class MetricaSemanticaService(BaseService):
             total_relevantes_encontrados=metricas['total_relevantes_encontrados'],
             tiempo_procesamiento_ms=tiempo_procesamiento,
             logs_pipeline=logs_pipeline,
-            modelo_embedding=busqueda_semantica.modelo_utilizado,
+            modelo_embedding=modelo_embedding,
             metrica_ordenamiento='score_combinado'  # Por defecto
         )
         
         BaseService.log_info(
             f"Métricas semánticas calculadas: MRR={metricas['mrr']:.4f}, "
             f"nDCG@10={metricas['ndcg_10']:.4f}, Precision@5={metricas['precision_5']:.4f}",
-            extra={'metrica_id': metrica.id, 'busqueda_id': busqueda_semantica.id}
+            extra={
+                'metrica_id': metrica.id,
+                'busqueda_id': busqueda_semantica.id if busqueda_semantica else None
+            }
         )
         
         return metrica
@@ -111,39 +133,92 @@ class MetricaSemanticaService(BaseService):
         Returns:
             MetricaSemantica: Métricas calculadas
         """
-        tiempo_inicio = time.time()
+        ejecucion = MetricaSemanticaService.ejecutar_pruebas_controladas(
+            [prueba], usuario, filtros=filtros, limite=limite
+        )[0]
+        if ejecucion['error'] is not None:
+            raise ejecucion['error']
+        return ejecucion['metrica']
+    
+    @staticmethod
+    def ejecutar_pruebas_controladas(
+        pruebas: List[PruebaControladaSemantica],
+        usuario,
+        filtros: Dict[str, Any] = None,
+        limite: int = 20
+    ) -> List[Dict[str, Any]]:
+        """
+        Ejecuta varias pruebas controladas con BusquedaSemanticaService.buscar_lote, en
+        lotes de SEMANTIC_LOTE_MAX_CONSULTAS: un embedding por lotes y un ranking
+        matriz-matriz en lugar de una búsqueda completa por prueba. El lote no usa el
+        caché de rankings ni escribe historial (las métricas quedan sin busqueda_semantica).
+        Si un lote falla, sus pruebas se reintentan de a una para aislar el error.
         
-        # Ejecutar búsqueda semántica
-        resultado_busqueda = BusquedaSemanticaService.buscar(
-            consulta=prueba.consulta,
+        Returns:
+            Un dict por prueba, en el orden de pruebas: {'prueba', 'metrica', 'error'}
+            (metrica None y error con la excepción si la prueba falló)
+        """
+        pruebas = list(pruebas)
+        tamano_lote = max(1, getattr(settings, 'SEMANTIC_LOTE_MAX_CONSULTAS', 100))
+        ejecuciones = []
+        for inicio in range(0, len(pruebas), tamano_lote):
+            parte = pruebas[inicio:inicio + tamano_lote]
+            try:
+                ejecuciones.extend(
+                    MetricaSemanticaService._ejecutar_lote_pruebas(parte, usuario, filtros, limite)
+                )
+            except Exception as e:
+                if len(parte) == 1:
+                    ejecuciones.append({'prueba': parte[0], 'metrica': None, 'error': e})
+                    continue
+                BaseService.log_warning(
+                    f"Lote de {len(parte)} pruebas controladas falló ({e}); se ejecutan de a una"
+                )
+                for prueba in parte:
+                    try:
+                        ejecuciones.extend(
+                            MetricaSemanticaService._ejecutar_lote_pruebas([prueba], usuario, filtros, limite)
+                        )
+                    except Exception as error_prueba:
+                        ejecuciones.append({'prueba': prueba, 'metrica': None, 'error': error_prueba})
+        return ejecuciones
+    
+    @staticmethod
+    def _ejecutar_lote_pruebas(
+        pruebas: List[PruebaControladaSemantica],
+        usuario,
+        filtros: Optional[Dict[str, Any]],
+        limite: int
+    ) -> List[Dict[str, Any]]:
+        """Un buscar_lote para las pruebas y una métrica por prueba (en una transacción)"""
+        lote = BusquedaSemanticaService.buscar_lote(
+            consultas=[prueba.consulta for prueba in pruebas],
             usuario=usuario,
             filtros=filtros or {},
             limite=limite
         )
-        
-        # Obtener la búsqueda guardada
-        busqueda_semantica = EmbeddingBusqueda.objects.get(id=resultado_busqueda['busquedaId'])
-        
-        # Calcular métricas
-        metrica = MetricaSemanticaService.calcular_metricas_busqueda(
-            busqueda_semantica=busqueda_semantica,
-            resultados_relevantes=prueba.resultados_relevantes,
-            logs_pipeline={
-                'consulta': prueba.consulta,
-                'filtros_aplicados': filtros,
-                'limite': limite,
-                'tiempo_busqueda_ms': resultado_busqueda['tiempoRespuesta']
-            }
-        )
-        
-        # Asociar con prueba controlada
-        metrica.prueba_controlada = prueba
-        metrica.save()
-        
-        # Marcar prueba como ejecutada
-        prueba_controlada_repository.ejecutar_prueba(prueba.id)
-        
-        return metrica
+        ejecuciones = []
+        # Si falla a mitad del lote no quedan métricas sueltas de las pruebas que se reintentan
+        with transaction.atomic():
+            for prueba, resultado in zip(pruebas, lote['resultados']):
+                metrica = MetricaSemanticaService._crear_metrica(
+                    consulta=prueba.consulta,
+                    resultados=resultado['resultados'],
+                    resultados_relevantes=prueba.resultados_relevantes,
+                    modelo_embedding=lote['modeloUtilizado'],
+                    logs_pipeline={
+                        'consulta': prueba.consulta,
+                        'filtros_aplicados': filtros,
+                        'limite': limite,
+                        'tiempo_busqueda_ms': lote['tiempoRespuesta'],
+                        'consultas_en_lote': len(pruebas)
+                    },
+                    prueba_controlada=prueba
+                )
+                # Marcar prueba como ejecutada
+                prueba_controlada_repository.ejecutar_prueba(prueba.id)
+                ejecuciones.append({'prueba': prueba, 'metrica': metrica, 'error': None})
+        return ejecuciones
     
     @staticmethod
     def obtener_estadisticas(fecha_desde=None, fecha_hasta=None) -> Dict[str, Any]:
@@ -231,6 +306,79 @@ class RegistroEmbeddingService(BaseService):
         
         return registro
     
+    @staticmethod
+    def registrar_generacion_lote(
+        envios: List[Envio],
+        estado: str,
+        tiempo_generacion_ms: int,
+        modelo_usado: str = 'text-embedding-3-small',
+        tipo_proceso: str = 'masivo',
+        mensaje_error: str = None,
+        embeddings: List = None
+    ) -> int:
+        """
+        Registra la generación de un lote de embeddings con bulk_create/bulk_update.
+        Equivale a llamar registrar_generacion por cada envío, sin una consulta por fila.
+        
+        Args:
+            envios: Envíos del lote
+            estado: Estado de la generación ('generado', 'error', 'omitido')
+            tiempo_generacion_ms: Tiempo promedio por envío en milisegundos
+            modelo_usado: Modelo de embedding utilizado
+            tipo_proceso: Tipo de proceso ('automatico', 'manual', 'masivo')
+            mensaje_error: Mensaje de error si hubo fallo
+            embeddings: Embeddings generados, en el mismo orden que envios (opcional)
+        
+        Returns:
+            int: Cantidad de registros creados o actualizados
+        """
+        dimension = 1536  # Por defecto para text-embedding-3-small
+        if modelo_usado == 'text-embedding-3-large':
+            dimension = 3072
+        
+        datos = {
+            'estado': estado,
+            'dimension_embedding': dimension,
+            'tiempo_generacion_ms': tiempo_generacion_ms,
+            'modelo_usado': modelo_usado,
+            'tipo_proceso': tipo_proceso,
+            'mensaje_error': mensaje_error,
+        }
+        
+        existentes = {}
+        if embeddings:
+            existentes = {
+                registro.embedding_id: registro
+                for registro in RegistroGeneracionEmbedding.objects.filter(embedding__in=embeddings)
+            }
+        
+        nuevos = []
+        actualizados = []
+        for i, envio in enumerate(envios):
+            embedding = embeddings[i] if embeddings else None
+            registro = existentes.get(embedding.id) if embedding is not None else None
+            if registro is None:
+                nuevos.append(RegistroGeneracionEmbedding(envio=envio, embedding=embedding, **datos))
+            else:
+                for campo, valor in datos.items():
+                    setattr(registro, campo, valor)
+                registro.envio = envio
+                actualizados.append(registro)
+        
+        with transaction.atomic():
+            RegistroGeneracionEmbedding.objects.bulk_create(nuevos, batch_size=500)
+            if actualizados:
+                RegistroGeneracionEmbedding.objects.bulk_update(
+                    actualizados, ['envio'] + list(datos.keys()), batch_size=500
+                )
+        
+        BaseService.log_info(
+            f"Registro de generación de embeddings en lote: {len(envios)} envíos - {estado}",
+            extra={'creados': len(nuevos), 'actualizados': len(actualizados)}
+        )
+        
+        return len(nuevos) + len(actualizados)
+    
     @staticmethod
     def obtener_estadisticas() -> Dict[str, Any]:
         """Obtiene estadísticas de generación de embeddings"""
@@ -348,7 +496,8 @@ class MetricaRendimientoService(BaseService):
                 resultado = BusquedaSemanticaService.buscar(
                     consulta=consulta,
                     usuario=usuario,
-                    limite=20
+                    limite=20,
+                    usar_cache=False
                 )
                 
                 tiempo_busqueda = int((time.time() - tiempo_inicio_busqueda) * 1000)
@@ -0,0 +1,42 @@
+"""
+Índices GIN con pg_trgm para la búsqueda tradicional de usuarios
+(nombre, correo, cédula y username). Solo PostgreSQL.
+"""
+
+from django.db import migrations
+
+
+INDICES_TRIGRAM = [
+    ('usuarios_nombre_trgm', 'nombre'),
+    ('usuarios_correo_trgm', 'correo'),
+    ('usuarios_cedula_trgm', 'cedula'),
+    ('usuarios_username_trgm', 'username'),
+]
+
+
+def crear_indices_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    for nombre, columna in INDICES_TRIGRAM:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {nombre} ON usuarios USING gin ({columna} gin_trgm_ops);"
+        )
+
+
+def eliminar_indices_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre, _ in INDICES_TRIGRAM:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {nombre};")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0011_fix_rename_tabla_usuarios'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_trigram, eliminar_indices_trigram),
+    ]
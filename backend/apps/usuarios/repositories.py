@@ -22,6 +22,10 @@ class UsuarioRepository(BaseRepository):
     def model(self):
         return Usuario
     
+    @property
+    def campos_busqueda(self) -> List[str]:
+        return ['nombre', 'correo', 'cedula', 'username']
+    
     # ==================== CONSULTAS ESPECÍFICAS ====================
     
     def obtener_por_id(self, id: int) -> Usuario:
@@ -194,12 +198,7 @@ class UsuarioRepository(BaseRepository):
         Args:
             termino: Término de búsqueda
         """
-        return self.model.objects.filter(
-            Q(nombre__icontains=termino) |
-            Q(correo__icontains=termino) |
-            Q(cedula__icontains=termino) |
-            Q(username__icontains=termino)
-        )
+        return self.model.objects.filter(self._filtro_busqueda(termino))
     
     # ==================== ESTADÍSTICAS ====================
     
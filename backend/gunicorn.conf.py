@@ -0,0 +1,20 @@
+"""
+Configuración de gunicorn (se lee automáticamente desde el directorio de trabajo).
+Los parámetros de la línea de comandos (--workers, --bind, --timeout) tienen prioridad.
+
+Con SEMANTIC_PRELOAD=True la aplicación se carga en el maestro (preload_app): el índice
+vectorial y los módulos pesados quedan en páginas compartidas copy-on-write por los
+workers. Medir con: python manage.py memoria_workers
+"""
+import os
+
+preload_app = os.getenv('SEMANTIC_PRELOAD', 'False').lower() == 'true'
+
+
+def post_fork(server, worker):
+    """Cada worker descarta la conexión a la BD y el cliente de OpenAI heredados del maestro"""
+    if not preload_app:
+        return
+    from apps.busqueda.semantic.precarga import verificar_despues_de_fork
+    heredado = verificar_despues_de_fork()
+    server.log.info(f"Worker {worker.pid}: recursos heredados descartados={heredado}")
@@ -483,13 +483,77 @@ else:
 
 # Configuración de caché para búsquedas semánticas
 SEMANTIC_SEARCH_CACHE_TIMEOUT = int(os.getenv('SEMANTIC_CACHE_TIMEOUT', 3600))  # 1 hora
+# Caché del ranking final por alcance de permisos; se invalida al cambiar envíos, productos o embeddings
+SEMANTIC_RESULT_CACHE = os.getenv('SEMANTIC_RESULT_CACHE', 'True').lower() == 'true'
+SEMANTIC_RESULT_CACHE_TIMEOUT = int(os.getenv('SEMANTIC_RESULT_CACHE_TIMEOUT', 300))  # Cota de un ranking obsoleto si falla la invalidación (s)
 EMBEDDING_CACHE_TIMEOUT = int(os.getenv('EMBEDDING_CACHE_TIMEOUT', 604800))  # 7 días
 
+# Búsqueda tradicional: resultados por sección, ordenados por similitud pg_trgm
+BUSQUEDA_TRADICIONAL_LIMITE = int(os.getenv('BUSQUEDA_TRADICIONAL_LIMITE', 20))
+
+# Búsqueda semántica con índice ANN de pgvector (HNSW): el top-k se resuelve en SQL
+SEMANTIC_SEARCH_USE_ANN = os.getenv('SEMANTIC_SEARCH_USE_ANN', 'True').lower() == 'true'
+SEMANTIC_ANN_CANDIDATES = int(os.getenv('SEMANTIC_ANN_CANDIDATES', 200))  # Candidatos a re-rankear en Python
+SEMANTIC_ANN_EF_SEARCH = int(os.getenv('SEMANTIC_ANN_EF_SEARCH', 200))  # hnsw.ef_search (recall vs. latencia)
+SEMANTIC_REGISTRO_TTL = int(os.getenv('SEMANTIC_REGISTRO_TTL', 60))  # Cobertura e índices ANN por modelo cacheados en memoria (s)
+
+# Índice vectorial residente en memoria (matriz float32 por modelo y por worker), opcional:
+# ~6KB por envío con 1536 dimensiones en cada worker. Activado, tiene prioridad sobre el
+# índice ANN de pgvector (SEMANTIC_SEARCH_USE_ANN solo rige con el índice desactivado)
+SEMANTIC_INDEX_EN_MEMORIA = os.getenv('SEMANTIC_INDEX_EN_MEMORIA', 'False').lower() == 'true'
+SEMANTIC_INDEX_SYNC_SEGUNDOS = int(os.getenv('SEMANTIC_INDEX_SYNC_SEGUNDOS', 30))  # Sincronización entre workers
+# Precisión de la matriz residente: float32 | float16 (1/2 de memoria) | int8 (1/4, escala por fila).
+# Con float16/int8 los candidatos se re-puntúan con los vectores float32 de la BD
+SEMANTIC_INDEX_CUANTIZACION = os.getenv('SEMANTIC_INDEX_CUANTIZACION', 'float32')
+# IVF: centroides de k-means (comando entrenar_ivf) persistidos en SEMANTIC_IVF_DIR; cada consulta
+# solo recorre las SEMANTIC_IVF_NPROBE listas más cercanas (más listas: más recall y más latencia)
+SEMANTIC_IVF = os.getenv('SEMANTIC_IVF', 'True').lower() == 'true'
+SEMANTIC_IVF_DIR = os.getenv('SEMANTIC_IVF_DIR', os.path.join(BASE_DIR, 'data', 'ivf'))
+SEMANTIC_IVF_NPROBE = int(os.getenv('SEMANTIC_IVF_NPROBE', 8))
+# Snapshot en disco del índice (comando snapshot_indice): los workers mapean la matriz con
+# np.memmap (páginas compartidas en el page cache) y solo reaplican los cambios posteriores
+SEMANTIC_SNAPSHOT = os.getenv('SEMANTIC_SNAPSHOT', 'True').lower() == 'true'
+SEMANTIC_SNAPSHOT_DIR = os.getenv('SEMANTIC_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'data', 'snapshots'))
+SEMANTIC_SNAPSHOT_HOLGURA = float(os.getenv('SEMANTIC_SNAPSHOT_HOLGURA', 0.1))  # Filas libres para altas (fracción)
+# Precarga en el maestro de gunicorn (preload_app): índices y módulos pesados se cargan antes
+# del fork y los workers comparten esas páginas copy-on-write (ver gunicorn.conf.py)
+SEMANTIC_PRELOAD = os.getenv('SEMANTIC_PRELOAD', 'False').lower() == 'true'
+
+# Búsqueda en dos etapas (Matryoshka, solo text-embedding-3): pasada gruesa con el prefijo
+# renormalizado de cada vector y re-ranking con el vector completo de los mejores candidatos
+SEMANTIC_MATRYOSHKA = os.getenv('SEMANTIC_MATRYOSHKA', 'True').lower() == 'true'
+SEMANTIC_MATRYOSHKA_DIMENSIONES = int(os.getenv('SEMANTIC_MATRYOSHKA_DIMENSIONES', 256))  # Índice en memoria (<= columna de 256 en BD)
+SEMANTIC_MATRYOSHKA_CANDIDATOS = int(os.getenv('SEMANTIC_MATRYOSHKA_CANDIDATOS', 400))  # Candidatos re-rankeados
+
+# Búsqueda híbrida: candidatos de texto completo (tsvector + GIN, solo PostgreSQL)
+# fusionados con el top-k vectorial mediante Reciprocal Rank Fusion
+SEMANTIC_SEARCH_HIBRIDA = os.getenv('SEMANTIC_SEARCH_HIBRIDA', 'True').lower() == 'true'
+SEMANTIC_LEXICO_CANDIDATOS = int(os.getenv('SEMANTIC_LEXICO_CANDIDATOS', 100))  # Candidatos ts_rank_cd
+SEMANTIC_LEXICO_PREFIJO_MINIMO = int(os.getenv('SEMANTIC_LEXICO_PREFIJO_MINIMO', 4))  # Términos más cortos coinciden solo completos (sin :*)
+SEMANTIC_RRF_K = int(os.getenv('SEMANTIC_RRF_K', 60))  # Constante k de RRF
+
+# Single-flight: consultas semánticas idénticas concurrentes (mismo alcance de permisos,
+# filtros, modelo y métrica) comparten un cálculo; entre workers vía lock en el caché
+SEMANTIC_SINGLE_FLIGHT = os.getenv('SEMANTIC_SINGLE_FLIGHT', 'True').lower() == 'true'
+SEMANTIC_SINGLE_FLIGHT_TIMEOUT = int(os.getenv('SEMANTIC_SINGLE_FLIGHT_TIMEOUT', 30))  # Espera máxima (s)
+SEMANTIC_SINGLE_FLIGHT_TTL = int(os.getenv('SEMANTIC_SINGLE_FLIGHT_TTL', 3))  # Resultado publicado a otros workers (s)
+SEMANTIC_STREAM_LOTE = int(os.getenv('SEMANTIC_STREAM_LOTE', 5))  # Filas hidratadas por lote en /semantica/stream/
+SEMANTIC_LOTE_MAX_CONSULTAS = int(os.getenv('SEMANTIC_LOTE_MAX_CONSULTAS', 100))  # Consultas por solicitud en /semantica/lote/
+
 # OpenAI
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
 OPENAI_EMBEDDING_MODEL = config('OPENAI_EMBEDDING_MODEL', default='text-embedding-3-small')
 OPENAI_EMBEDDING_DIMENSIONS = config('OPENAI_EMBEDDING_DIMENSIONS', default=1536, cast=int)
 
+# Generación de embeddings en lote: varios textos por solicitud a OpenAI
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', 100000))  # Presupuesto estimado por solicitud
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv('EMBEDDING_BATCH_MAX_INPUTS', 500))  # OpenAI admite hasta 2048
+EMBEDDING_BATCH_BLOQUE_ENVIOS = int(os.getenv('EMBEDDING_BATCH_BLOQUE_ENVIOS', 2000))  # Envíos cargados por bloque
+EMBEDDING_CONCURRENCIA = int(os.getenv('EMBEDDING_CONCURRENCIA', 4))  # Solicitudes simultáneas
+OPENAI_EMBEDDING_RPM = int(os.getenv('OPENAI_EMBEDDING_RPM', 3000))  # Límite de solicitudes por minuto de la cuenta
+OPENAI_EMBEDDING_TPM = int(os.getenv('OPENAI_EMBEDDING_TPM', 1000000))  # Límite de tokens por minuto de la cuenta
+EMBEDDING_MAX_REINTENTOS = int(os.getenv('EMBEDDING_MAX_REINTENTOS', 5))  # Reintentos ante 429
+
 
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@ubapp.com')
 
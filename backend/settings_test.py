@@ -25,3 +25,7 @@ MIGRATION_MODULES = DisableMigrations()
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.MD5PasswordHasher',
 ]
+
+# La suite cubre el índice vectorial en memoria (opcional en producción); los tests
+# del camino por la BD lo desactivan con override_settings
+SEMANTIC_INDEX_EN_MEMORIA = True
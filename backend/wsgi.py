@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 
 application = get_wsgi_application()
+
+# Con preload_app (gunicorn.conf.py) esto corre una sola vez en el maestro, antes del fork
+from django.conf import settings  # noqa: E402
+
+if settings.SEMANTIC_PRELOAD:
+    from apps.busqueda.semantic.precarga import precargar
+    precargar()